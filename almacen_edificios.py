@@ -0,0 +1,401 @@
+"""
+Almacén compacto de edificios del Catastro con índice espacial
+Guarda los inmuebles en columnas numpy (referencia, lat, lon, año, uso,
+superficie), deduplicados por referencia catastral, con un índice de
+rejilla uniforme para consultas por radio y bbox.
+
+Sobre las columnas se calculan de forma vectorizada la clasificación por
+antigüedad y el score de modernización, de modo que cruces entre zonas,
+mapas de calor o "edificios a menos de X m de nuestras instalaciones" se
+resuelven en milisegundos aunque el almacén tenga datos de toda la isla.
+"""
+
+import logging
+import math
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+METROS_POR_GRADO = 111000
+
+# Lado de la celda del índice espacial (del orden del radio de las consultas)
+TAMANO_CELDA_INDICE_METROS = 100
+
+# Códigos de categoría de antigüedad (columna categorias())
+CATEGORIA_SIN_DATOS = 0
+CATEGORIA_MODERNO = 1
+CATEGORIA_ANTIGUO = 2
+CATEGORIA_MUY_ANTIGUO = 3
+
+
+def _coordenada(valor) -> Optional[float]:
+    """Coordenada de una columna como float (None si es NaN, sin coordenadas)"""
+    return None if np.isnan(valor) else float(valor)
+
+
+class AlmacenEdificios:
+    """
+    Edificios en columnas numpy con índice espacial de rejilla.
+
+    - agregar() deduplica por referencia catastral en O(1) por inmueble
+    - Los inmuebles sin coordenadas se guardan con latitud/longitud NaN:
+      cuentan en la clasificación y el scoring pero no entran en el índice
+      espacial (ni en las consultas por radio, bbox o mapa de calor)
+    - Las columnas y el índice se reconstruyen de forma perezosa solo si
+      hubo inserciones desde la última consulta
+    - Las distancias usan proyección equirectangular sobre una latitud de
+      referencia fija (error despreciable a escala de una isla)
+
+    Seguro entre hilos (un lock protege inserciones y reconstrucción).
+    """
+
+    def __init__(
+        self,
+        tamano_celda_metros: float = TAMANO_CELDA_INDICE_METROS,
+        latitud_referencia: Optional[float] = None
+    ):
+        """
+        Args:
+            tamano_celda_metros: Lado de la celda del índice espacial
+            latitud_referencia: Latitud de la proyección (por defecto la del
+                primer edificio insertado)
+        """
+        self.tamano_celda_metros = tamano_celda_metros
+        self.latitud_referencia = latitud_referencia
+        self._lock = threading.Lock()
+
+        # Filas pendientes de compactar y posición de cada referencia
+        self._filas: Dict[str, int] = {}
+        self._pendientes: List[Tuple] = []
+
+        self.referencias = np.empty(0, dtype=object)
+        self.latitudes = np.empty(0, dtype=np.float64)
+        self.longitudes = np.empty(0, dtype=np.float64)
+        self.anios = np.empty(0, dtype=np.int32)  # 0 = sin datos
+        self.usos = np.empty(0, dtype=object)
+        self.superficies = np.empty(0, dtype=np.float64)
+        self.direcciones = np.empty(0, dtype=object)
+
+        self._x = np.empty(0, dtype=np.float64)
+        self._y = np.empty(0, dtype=np.float64)
+        self._celdas: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._filas)
+
+    # ------------------------------------------------------------------
+    # Inserción
+    # ------------------------------------------------------------------
+
+    def agregar(self, inmuebles: Iterable[Dict]) -> np.ndarray:
+        """
+        Añade inmuebles del Catastro (dicts de CatastroService), ignorando
+        los que no tienen referencia y los ya presentes. Los que no tienen
+        coordenadas se guardan con latitud/longitud NaN.
+
+        Returns:
+            Índices de fila de los inmuebles recibidos (sin repetir, en orden
+            de primera aparición), incluidos los que ya estaban en el almacén
+        """
+        indices = []
+        vistos = set()
+        with self._lock:
+            for datos in inmuebles:
+                ref = datos.get('referencia_catastral')
+                lat = datos.get('latitud')
+                lon = datos.get('longitud')
+                if not ref or ref in vistos:
+                    continue
+                vistos.add(ref)
+
+                if lat is None or lon is None:
+                    lat = lon = math.nan
+
+                fila = self._filas.get(ref)
+                if fila is None:
+                    if self.latitud_referencia is None and not math.isnan(lat):
+                        self.latitud_referencia = float(lat)
+                    fila = len(self._filas)
+                    self._filas[ref] = fila
+                    self._pendientes.append((
+                        ref, float(lat), float(lon),
+                        int(datos.get('anio_construccion') or 0),
+                        datos.get('uso') or '',
+                        float(datos.get('superficie') or 0),
+                        datos.get('direccion') or ''
+                    ))
+                indices.append(fila)
+        return np.array(indices, dtype=np.int64)
+
+    def _compactar(self):
+        """Vuelca las filas pendientes a las columnas y rehace el índice (con lock)"""
+        if not self._pendientes:
+            return
+
+        refs, lats, lons, anios, usos, superficies, direcciones = zip(*self._pendientes)
+        self._pendientes = []
+
+        self.referencias = np.concatenate([self.referencias, np.array(refs, dtype=object)])
+        self.latitudes = np.concatenate([self.latitudes, np.array(lats, dtype=np.float64)])
+        self.longitudes = np.concatenate([self.longitudes, np.array(lons, dtype=np.float64)])
+        self.anios = np.concatenate([self.anios, np.array(anios, dtype=np.int32)])
+        self.usos = np.concatenate([self.usos, np.array(usos, dtype=object)])
+        self.superficies = np.concatenate([self.superficies, np.array(superficies, dtype=np.float64)])
+        self.direcciones = np.concatenate([self.direcciones, np.array(direcciones, dtype=object)])
+
+        self._x, self._y = self._proyectar(self.latitudes, self.longitudes)
+
+        # Índice: filas ordenadas por celda, y por celda el tramo que le toca
+        # (solo las que tienen coordenadas)
+        con_coordenadas = np.flatnonzero(np.isfinite(self._x) & np.isfinite(self._y))
+        if len(con_coordenadas) == 0:
+            self._celdas = {}
+            return
+        cx = np.floor(self._x[con_coordenadas] / self.tamano_celda_metros).astype(np.int64)
+        cy = np.floor(self._y[con_coordenadas] / self.tamano_celda_metros).astype(np.int64)
+        posiciones = np.lexsort((cx, cy))
+        orden = con_coordenadas[posiciones]
+        claves = np.stack([cy[posiciones], cx[posiciones]], axis=1)
+        cambios = np.flatnonzero(np.any(np.diff(claves, axis=0) != 0, axis=1)) + 1
+        inicios = np.concatenate([[0], cambios])
+        finales = np.concatenate([cambios, [len(orden)]])
+        self._celdas = {
+            (int(claves[i][0]), int(claves[i][1])): orden[i:f]
+            for i, f in zip(inicios, finales)
+        }
+
+    def _proyectar(self, latitudes, longitudes) -> Tuple[np.ndarray, np.ndarray]:
+        """Coordenadas en metros (x = este, y = norte)"""
+        cos_ref = math.cos(math.radians(self.latitud_referencia or 0.0))
+        x = np.asarray(longitudes, dtype=np.float64) * METROS_POR_GRADO * cos_ref
+        y = np.asarray(latitudes, dtype=np.float64) * METROS_POR_GRADO
+        return x, y
+
+    # ------------------------------------------------------------------
+    # Consultas espaciales
+    # ------------------------------------------------------------------
+
+    def _candidatos(self, x_min: float, x_max: float, y_min: float, y_max: float) -> np.ndarray:
+        """Filas de las celdas que cortan un rectángulo en metros (con lock)"""
+        celda = self.tamano_celda_metros
+        cx0, cx1 = math.floor(x_min / celda), math.floor(x_max / celda)
+        cy0, cy1 = math.floor(y_min / celda), math.floor(y_max / celda)
+
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._celdas):
+            # Rectángulo mayor que la zona ocupada: recorrer las celdas existentes
+            tramos = [
+                filas for (cy, cx), filas in self._celdas.items()
+                if cy0 <= cy <= cy1 and cx0 <= cx <= cx1
+            ]
+        else:
+            tramos = [
+                self._celdas[(cy, cx)]
+                for cy in range(cy0, cy1 + 1)
+                for cx in range(cx0, cx1 + 1)
+                if (cy, cx) in self._celdas
+            ]
+        return np.concatenate(tramos) if tramos else np.empty(0, dtype=np.int64)
+
+    def en_radio(self, latitud: float, longitud: float, radio_metros: float) -> np.ndarray:
+        """
+        Edificios a menos de radio_metros de un punto.
+
+        Returns:
+            Índices de fila ordenados por distancia
+        """
+        with self._lock:
+            self._compactar()
+            if self.latitud_referencia is None:
+                return np.empty(0, dtype=np.int64)
+            x, y = self._proyectar(latitud, longitud)
+            filas = self._candidatos(x - radio_metros, x + radio_metros, y - radio_metros, y + radio_metros)
+            d2 = (self._x[filas] - x) ** 2 + (self._y[filas] - y) ** 2
+            dentro = d2 <= radio_metros ** 2
+            filas, d2 = filas[dentro], d2[dentro]
+        return filas[np.argsort(d2, kind='stable')]
+
+    def en_bbox(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> np.ndarray:
+        """Índices de fila de los edificios dentro de un bbox (grados)"""
+        with self._lock:
+            self._compactar()
+            if self.latitud_referencia is None:
+                return np.empty(0, dtype=np.int64)
+            x0, y0 = self._proyectar(lat_min, lon_min)
+            x1, y1 = self._proyectar(lat_max, lon_max)
+            filas = self._candidatos(float(x0), float(x1), float(y0), float(y1))
+            lats, lons = self.latitudes[filas], self.longitudes[filas]
+            dentro = (lats >= lat_min) & (lats <= lat_max) & (lons >= lon_min) & (lons <= lon_max)
+        return np.sort(filas[dentro])
+
+    def cerca_de(self, puntos: Sequence[Tuple[float, float]], radio_metros: float) -> np.ndarray:
+        """
+        Edificios a menos de radio_metros de alguno de los puntos
+        (p. ej. "edificios a menos de 300 m de nuestras instalaciones").
+
+        Returns:
+            Índices de fila ordenados
+        """
+        if not puntos:
+            return np.empty(0, dtype=np.int64)
+
+        with self._lock:
+            self._compactar()
+            if self.latitud_referencia is None:
+                return np.empty(0, dtype=np.int64)
+            marcados = np.zeros(len(self._x), dtype=bool)
+            xs, ys = self._proyectar([p[0] for p in puntos], [p[1] for p in puntos])
+            r2 = radio_metros ** 2
+            for x, y in zip(xs, ys):
+                filas = self._candidatos(x - radio_metros, x + radio_metros, y - radio_metros, y + radio_metros)
+                if len(filas):
+                    d2 = (self._x[filas] - x) ** 2 + (self._y[filas] - y) ** 2
+                    marcados[filas[d2 <= r2]] = True
+        return np.flatnonzero(marcados)
+
+    def indices_de(self, referencias: Iterable[str]) -> np.ndarray:
+        """Índices de fila de unas referencias catastrales (omite las desconocidas)"""
+        with self._lock:
+            return np.array([self._filas[r] for r in referencias if r in self._filas], dtype=np.int64)
+
+    def solapamiento(self, indices_a: np.ndarray, indices_b: np.ndarray) -> np.ndarray:
+        """Edificios comunes a dos zonas (índices de fila ordenados)"""
+        return np.intersect1d(indices_a, indices_b)
+
+    # ------------------------------------------------------------------
+    # Clasificación y scoring vectorizados
+    # ------------------------------------------------------------------
+
+    def _columnas(self, indices: Optional[np.ndarray]):
+        with self._lock:
+            self._compactar()
+            if indices is None:
+                return self.anios, self.usos
+            return self.anios[indices], self.usos[indices]
+
+    def antiguedades(self, anio_actual: int, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """Antigüedad en años (float, NaN si no hay año de construcción)"""
+        anios, _ = self._columnas(indices)
+        return np.where(anios > 0, anio_actual - anios, np.nan)
+
+    def categorias(
+        self,
+        anio_actual: int,
+        umbral_muy_antiguo: int,
+        umbral_antiguo: int,
+        indices: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Código de categoría (CATEGORIA_*) de cada edificio"""
+        antiguedad = self.antiguedades(anio_actual, indices)
+        return np.select(
+            [np.isnan(antiguedad), antiguedad >= umbral_muy_antiguo, antiguedad >= umbral_antiguo],
+            [CATEGORIA_SIN_DATOS, CATEGORIA_MUY_ANTIGUO, CATEGORIA_ANTIGUO],
+            default=CATEGORIA_MODERNO
+        ).astype(np.int8)
+
+    @staticmethod
+    def scores(categorias: np.ndarray, pesos: Dict[int, float]) -> np.ndarray:
+        """Score de cada edificio a partir de su categoría ({CATEGORIA_*: peso})"""
+        tabla = np.zeros(CATEGORIA_MUY_ANTIGUO + 1, dtype=np.float64)
+        for categoria, peso in pesos.items():
+            tabla[categoria] = peso
+        return tabla[categorias]
+
+    def mascara_uso(self, palabras_clave: Sequence[str], indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        True en los edificios cuyo uso contiene alguna palabra clave.
+        Se evalúa una vez por valor distinto de uso (hay muy pocos).
+        """
+        _, usos = self._columnas(indices)
+        if len(usos) == 0:
+            return np.zeros(0, dtype=bool)
+        valores, inversa = np.unique(usos.astype(str), return_inverse=True)
+        coincide = np.array([any(kw in v.lower() for kw in palabras_clave) for v in valores], dtype=bool)
+        return coincide[inversa]
+
+    def mapa_calor(
+        self,
+        valores: Optional[np.ndarray] = None,
+        indices: Optional[np.ndarray] = None,
+        tamano_celda_metros: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        Agrega edificios (y opcionalmente un valor por edificio, p. ej. el
+        score) en celdas cuadradas. Los que no tienen coordenadas se omiten.
+
+        Args:
+            valores: Valor por edificio alineado con indices (o con todo el almacén)
+            indices: Edificios a incluir (por defecto todos)
+            tamano_celda_metros: Lado de la celda (por defecto el del índice)
+
+        Returns:
+            Lista de {'latitud', 'longitud', 'edificios', 'valor'} con el centro de cada celda
+        """
+        celda = tamano_celda_metros or self.tamano_celda_metros
+        with self._lock:
+            self._compactar()
+            filas = np.arange(len(self._x)) if indices is None else np.asarray(indices)
+            # Los edificios sin coordenadas no caen en ninguna celda
+            con_coordenadas = np.isfinite(self._x[filas]) & np.isfinite(self._y[filas])
+            filas = filas[con_coordenadas]
+            if valores is not None:
+                valores = np.asarray(valores)[con_coordenadas]
+            if len(filas) == 0:
+                return []
+            cx = np.floor(self._x[filas] / celda).astype(np.int64)
+            cy = np.floor(self._y[filas] / celda).astype(np.int64)
+            cos_ref = math.cos(math.radians(self.latitud_referencia))
+
+        claves, inversa, conteos = np.unique(np.stack([cy, cx], axis=1), axis=0, return_inverse=True, return_counts=True)
+        inversa = inversa.reshape(-1)
+        sumas = np.bincount(inversa, weights=valores, minlength=len(claves)) if valores is not None else conteos.astype(float)
+
+        return [
+            {
+                'latitud': (cy_ + 0.5) * celda / METROS_POR_GRADO,
+                'longitud': (cx_ + 0.5) * celda / (METROS_POR_GRADO * cos_ref),
+                'edificios': int(n),
+                'valor': float(v)
+            }
+            for (cy_, cx_), n, v in zip(claves, conteos, sumas)
+        ]
+
+    def estadisticas_por_decada(self, indices: Optional[np.ndarray] = None) -> Dict[str, int]:
+        """{'1960s': n, ...} ordenado por década"""
+        anios, _ = self._columnas(indices)
+        decadas, conteos = np.unique((anios[anios > 0] // 10) * 10, return_counts=True)
+        return {f"{int(d)}s": int(n) for d, n in zip(decadas, conteos)}
+
+    def columnas(self, indices: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Columnas de unas filas: referencia_catastral, direccion, latitud,
+        longitud (NaN si no hay coordenadas), anio, uso, superficie
+        """
+        with self._lock:
+            self._compactar()
+            return {
+                'referencia_catastral': self.referencias[indices],
+                'direccion': self.direcciones[indices],
+                'latitud': self.latitudes[indices],
+                'longitud': self.longitudes[indices],
+                'anio': self.anios[indices],
+                'uso': self.usos[indices],
+                'superficie': self.superficies[indices]
+            }
+
+    def fila(self, indice: int) -> Dict:
+        """Datos de un edificio con el formato de CatastroService"""
+        with self._lock:
+            self._compactar()
+            return {
+                'referencia_catastral': self.referencias[indice],
+                'direccion': self.direcciones[indice],
+                'latitud': _coordenada(self.latitudes[indice]),
+                'longitud': _coordenada(self.longitudes[indice]),
+                'anio_construccion': int(self.anios[indice]) or None,
+                'uso': self.usos[indice],
+                'superficie': float(self.superficies[indice])
+            }
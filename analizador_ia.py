@@ -25,7 +25,6 @@ import json
 import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Any
-from anthropic import Anthropic
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
@@ -37,8 +36,17 @@ MODELO_IA = "claude-3-5-sonnet-20241022"  # Modelo más reciente
 MAX_TOKENS = 4096
 TEMPERATURA = 0.3  # Baja temperatura para respuestas más técnicas y precisas
 
-# Inicializar cliente de Anthropic
-client = Anthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
+# Cliente de Anthropic: se crea en la primera llamada (el SDK tarda en importarse)
+_client = None
+
+
+def obtener_cliente():
+    """Devuelve el cliente de Anthropic (None si no hay ANTHROPIC_API_KEY)"""
+    global _client
+    if _client is None and ANTHROPIC_API_KEY:
+        from anthropic import Anthropic
+        _client = Anthropic(api_key=ANTHROPIC_API_KEY)
+    return _client
 
 # ============================================================================
 # PROMPTS ESPECIALIZADOS
@@ -190,6 +198,7 @@ def analizar_parte_con_ia(parte: Dict[str, Any], conn) -> Optional[int]:
     Returns:
         ID del análisis creado o None si falla
     """
+    client = obtener_cliente()
     if not client:
         print("⚠️  Cliente de Anthropic no inicializado. Configura ANTHROPIC_API_KEY en .env")
         return None
@@ -308,6 +317,7 @@ def generar_prediccion_maquina(maquina_id: int, conn, dias_historico: int = 180)
     Returns:
         ID de la predicción creada o None si falla
     """
+    client = obtener_cliente()
     if not client:
         print("⚠️  Cliente de Anthropic no inicializado")
         return None
@@ -524,6 +534,7 @@ def generar_alertas_predictivas(prediccion_id: int, conn) -> int:
     Returns:
         Número de alertas generadas
     """
+    client = obtener_cliente()
     if not client:
         return 0
 
@@ -1,3 +1,6 @@
+# NOTA: app.py ya no importa este módulo. Las rutas que seguían vivas aquí
+# (login, logout, home, login_tecnico, test_dropdown_admin) están en
+# routes/auth/auth_bp.py; el resto se migró a sus blueprints.
 from flask import Flask, request, render_template, redirect, session, Response, url_for, flash, send_file, jsonify
 import requests
 import os
@@ -11,7 +14,6 @@ from email.mime.multipart import MIMEMultipart
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill
 import pandas as pd
-import pdfplumber
 import logging
 import sys
 import helpers
@@ -426,210 +428,9 @@ def calcular_color_contrato(fecha_contrato_str):
         return ""
 
 def enviar_avisos_email(config):
-    """Función que revisa fechas y envía emails"""
-    
-    if not RESEND_API_KEY:
-        return "Error: No se ha configurado RESEND_API_KEY"
-    
-    # Procesar múltiples emails
-    emails_raw = config['email_destinatario']
-    emails_destino = [email.strip() for email in emails_raw.split(',')] if ',' in emails_raw else [emails_raw.strip()]
-    primer_aviso_ipo = config['primer_aviso_despues_ipo']
-    segundo_aviso_ipo = config['segundo_aviso_despues_ipo']
-    dias_contrato = config['dias_aviso_antes_contrato']
-    
-    fecha_hoy = datetime.now().date()
-    
-    # Obtener equipos con IPO próxima
-    equipos_response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/equipos?select=*,clientes(nombre_cliente,direccion)&ipo_proxima=not.is.null",
-        headers=HEADERS
-    )
-    
-    alertas_ipo_primer_aviso = []
-    alertas_ipo_segundo_aviso = []
-    alertas_contrato = []
-    
-    if equipos_response.status_code == 200:
-        equipos = equipos_response.json()
-        
-        for equipo in equipos:
-            # Revisar IPOs - SOLO DESPUÉS de la fecha
-            if equipo.get('ipo_proxima'):
-                try:
-                    fecha_ipo = datetime.strptime(equipo['ipo_proxima'], '%Y-%m-%d').date()
-                    dias_desde_ipo = (fecha_hoy - fecha_ipo).days
-                    
-                    cliente = equipo.get('clientes', {})
-                    if isinstance(cliente, list) and cliente:
-                        cliente = cliente[0]
-                    
-                    equipo_data = {
-                        'cliente': cliente.get('nombre_cliente', 'Sin nombre') if cliente else 'Sin nombre',
-                        'direccion': cliente.get('direccion', 'Sin dirección') if cliente else 'Sin dirección',
-                        'identificacion': equipo.get('identificacion', 'N/A'),
-                        'fecha': fecha_ipo.strftime('%d/%m/%Y'),
-                        'dias_desde_ipo': dias_desde_ipo
-                    }
-                    
-                    # Primer aviso (ej: día 15)
-                    if dias_desde_ipo == primer_aviso_ipo:
-                        alertas_ipo_primer_aviso.append(equipo_data)
-                    
-                    # Segundo aviso (ej: día 30)
-                    if dias_desde_ipo == segundo_aviso_ipo:
-                        alertas_ipo_segundo_aviso.append(equipo_data)
-                        
-                except:
-                    pass
-            
-            # Revisar contratos - X días ANTES del vencimiento
-            if equipo.get('fecha_vencimiento_contrato'):
-                try:
-                    fecha_contrato = datetime.strptime(equipo['fecha_vencimiento_contrato'], '%Y-%m-%d').date()
-                    dias_restantes = (fecha_contrato - fecha_hoy).days
-                    
-                    if 0 <= dias_restantes <= dias_contrato:
-                        cliente = equipo.get('clientes', {})
-                        if isinstance(cliente, list) and cliente:
-                            cliente = cliente[0]
-                        
-                        alertas_contrato.append({
-                            'cliente': cliente.get('nombre_cliente', 'Sin nombre') if cliente else 'Sin nombre',
-                            'direccion': cliente.get('direccion', 'Sin dirección') if cliente else 'Sin dirección',
-                            'identificacion': equipo.get('identificacion', 'N/A'),
-                            'fecha': fecha_contrato.strftime('%d/%m/%Y'),
-                            'dias_restantes': dias_restantes
-                        })
-                except:
-                    pass
-    
-    # Si no hay alertas, no enviar email
-    if not alertas_ipo_primer_aviso and not alertas_ipo_segundo_aviso and not alertas_contrato:
-        return "No hay avisos pendientes"
-    
-    # Construir contenido del email
-    html_content = f"""
-    <html>
-    <head>
-        <style>
-            body {{ font-family: 'Montserrat', Arial, sans-serif; background: white; margin: 0; padding: 20px; }}
-            .container {{ max-width: 800px; margin: 0 auto; background: white; }}
-            h1 {{ color: #366092; border-bottom: 3px solid #366092; padding-bottom: 10px; }}
-            h2 {{ color: #366092; margin-top: 30px; }}
-            table {{ width: 100%; border-collapse: collapse; margin-top: 15px; }}
-            th {{ background: #366092; color: white; padding: 12px; text-align: left; }}
-            td {{ padding: 10px; border-bottom: 1px solid #ddd; }}
-            .urgente {{ color: #dc3545; font-weight: bold; }}
-            .proximo {{ color: #ffc107; font-weight: bold; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🔔 Avisos AscensorAlert - Fedes Ascensores</h1>
-            <p><strong>Fecha:</strong> {datetime.now().strftime('%d/%m/%Y')}</p>
-    """
-    
-    if alertas_ipo_primer_aviso:
-        html_content += f"""
-            <h2>🔍 IPOs - Primer Aviso ({primer_aviso_ipo} días después)</h2>
-            <p style="color: #666;">Es momento de visitar para verificar la subsanación de defectos</p>
-            <table>
-                <tr>
-                    <th>Cliente</th>
-                    <th>Dirección</th>
-                    <th>Equipo</th>
-                    <th>Fecha IPO</th>
-                    <th>Días Transcurridos</th>
-                </tr>
-        """
-        for alerta in alertas_ipo_primer_aviso:
-            html_content += f"""
-                <tr>
-                    <td>{alerta['cliente']}</td>
-                    <td>{alerta['direccion']}</td>
-                    <td>{alerta['identificacion']}</td>
-                    <td>{alerta['fecha']}</td>
-                    <td class="proximo">{alerta['dias_desde_ipo']} días</td>
-                </tr>
-            """
-        html_content += "</table>"
-    
-    if alertas_ipo_segundo_aviso:
-        html_content += f"""
-            <h2>⚠️ IPOs - Segundo Aviso ({segundo_aviso_ipo} días después)</h2>
-            <p style="color: #dc3545; font-weight: bold;">¡URGENTE! Últimos días para verificar subsanación</p>
-            <table>
-                <tr>
-                    <th>Cliente</th>
-                    <th>Dirección</th>
-                    <th>Equipo</th>
-                    <th>Fecha IPO</th>
-                    <th>Días Transcurridos</th>
-                </tr>
-        """
-        for alerta in alertas_ipo_segundo_aviso:
-            html_content += f"""
-                <tr>
-                    <td>{alerta['cliente']}</td>
-                    <td>{alerta['direccion']}</td>
-                    <td>{alerta['identificacion']}</td>
-                    <td>{alerta['fecha']}</td>
-                    <td class="urgente">{alerta['dias_desde_ipo']} días</td>
-                </tr>
-            """
-        html_content += "</table>"
-    
-    if alertas_contrato:
-        html_content += """
-            <h2>📋 Contratos por Vencer</h2>
-            <table>
-                <tr>
-                    <th>Cliente</th>
-                    <th>Dirección</th>
-                    <th>Equipo</th>
-                    <th>Vencimiento</th>
-                    <th>Días Restantes</th>
-                </tr>
-        """
-        for alerta in alertas_contrato:
-            clase = 'urgente' if alerta['dias_restantes'] <= 15 else 'proximo'
-            html_content += f"""
-                <tr>
-                    <td>{alerta['cliente']}</td>
-                    <td>{alerta['direccion']}</td>
-                    <td>{alerta['identificacion']}</td>
-                    <td>{alerta['fecha']}</td>
-                    <td class="{clase}">{alerta['dias_restantes']} días</td>
-                </tr>
-            """
-        html_content += "</table>"
-    
-    html_content += """
-            <p style="margin-top: 30px; color: #666; font-size: 14px;">
-                Este es un email automático generado por AscensorAlert.<br>
-                Para gestionar tus alertas, accede a la configuración en la aplicación.
-            </p>
-        </div>
-    </body>
-    </html>
-    """
-    
-    total_ipos = len(alertas_ipo_primer_aviso) + len(alertas_ipo_segundo_aviso)
-    
-    # Enviar email con Resend
-    try:
-        params = {
-            "from": EMAIL_FROM,
-            "to": emails_destino,
-            "subject": f"🔔 Avisos AscensorAlert - {total_ipos} IPOs y {len(alertas_contrato)} Contratos",
-            "html": html_content
-        }
-        
-        email = resend.Emails.send(params)
-        return f"Email enviado correctamente a {len(emails_destino)} destinatario(s): {total_ipos} IPOs, {len(alertas_contrato)} contratos"
-    except Exception as e:
-        return f"Error al enviar email: {str(e)}"
+    """Función que revisa fechas y envía emails (ver services/email_service.py)"""
+    from services.email_service import enviar_avisos_email as _enviar_avisos_email
+    return _enviar_avisos_email(config)
 
 # ============================================
 # RUTAS
@@ -4521,216 +4322,11 @@ def extraer_descripciones_pdf(pdf_content):
     """
     Extrae las descripciones de la tabla del PDF de presupuesto FEDES.
     Retorna una lista de diccionarios con: codigo, descripcion
-    """
-    descripciones = []
 
-    try:
-        # Crear objeto PDF desde bytes
-        pdf_file = io.BytesIO(pdf_content)
-
-        with pdfplumber.open(pdf_file) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                logger.info(f" Procesando página {page_num + 1}")
-
-                # Estrategia 1: Extraer tablas con configuración específica
-                tables = page.extract_tables(table_settings={
-                    "vertical_strategy": "lines",
-                    "horizontal_strategy": "lines",
-                    "snap_tolerance": 3,
-                })
-
-                if tables:
-                    logger.info(f" Encontradas {len(tables)} tablas en página {page_num + 1}")
-
-                    for table_idx, table in enumerate(tables):
-                        logger.info(f" Tabla {table_idx + 1} tiene {len(table)} filas")
-
-                        # Buscar índice de columnas Código y Descripción
-                        codigo_idx = None
-                        descripcion_idx = None
-                        data_start = 0
-
-                        for i, row in enumerate(table):
-                            if not row:
-                                continue
-
-                            # Buscar header
-                            for j, cell in enumerate(row):
-                                cell_str = str(cell).strip().lower() if cell else ""
-                                if 'cód' in cell_str or 'codigo' in cell_str:
-                                    codigo_idx = j
-                                if 'descripción' in cell_str or 'descripcion' in cell_str:
-                                    descripcion_idx = j
-
-                            if codigo_idx is not None and descripcion_idx is not None:
-                                data_start = i + 1
-                                logger.info(f" Header encontrado en fila {i}, Código col={codigo_idx}, Descripción col={descripcion_idx}")
-                                break
-
-                        # Si no encontramos header, asumir primeras 2 columnas
-                        if codigo_idx is None or descripcion_idx is None:
-                            logger.info(" Header no encontrado, asumiendo columnas 0 y 1")
-                            codigo_idx = 0
-                            descripcion_idx = 1
-                            data_start = 1  # Saltar primera fila que probablemente sea header
-
-                        # Extraer datos
-                        for row in table[data_start:]:
-                            if not row or len(row) <= max(codigo_idx, descripcion_idx):
-                                continue
-
-                            codigo = str(row[codigo_idx]).strip() if row[codigo_idx] else ""
-                            descripcion_raw = str(row[descripcion_idx]).strip() if row[descripcion_idx] else ""
-
-                            # Limpiar descripción
-                            # Eliminar líneas que empiezan con "ORDEN:" pero mantener el resto
-                            lineas = descripcion_raw.split('\n')
-                            descripcion_limpia = []
-                            for linea in lineas:
-                                linea = linea.strip()
-                                if not linea.startswith('ORDEN:') and linea:
-                                    descripcion_limpia.append(linea)
-
-                            descripcion = ' '.join(descripcion_limpia)
-
-                            # ===== LIMPIEZA AGRESIVA DE NÚMEROS =====
-                            import re
-
-                            logger.info(f" Antes de limpiar: {descripcion[:100]}")
-
-                            # Estrategia 1: Eliminar TODO después del primer número (con o sin decimales)
-                            # Busca patrones como: "1,00" o "100" o "1.300,00"
-                            match = re.search(r'\s+\d+[,\.]?\d*', descripcion)
-                            if match:
-                                descripcion = descripcion[:match.start()].strip()
-                                logger.info(f" Después de cortar: {descripcion[:100]}")
-
-                            # Estrategia 2: Si aún quedan números al final, eliminarlos
-                            descripcion = re.sub(r'\s+[\d\.,\s]+$', '', descripcion)
-                            descripcion = descripcion.strip()
-
-                            logger.info(f" Final limpio: {descripcion[:100]}")
-
-                            # ===== VALIDACIONES ESTRICTAS =====
-                            # 1. Longitud mínima
-                            if not descripcion or len(descripcion) < 10:
-                                continue
-
-                            # 2. Filtrar headers repetidos
-                            if any(x in descripcion for x in ['Descripción', 'PRESUPUESTO', 'Cód.', 'Cant.', 'Precio', 'Total', '% Igic', 'INSTALACIÓN']):
-                                continue
-
-                            # 3. Filtrar direcciones (empiezan con C/, Calle, Avenida, etc.)
-                            if descripcion.startswith(('C/', 'Calle', 'Avenida', 'Avda', 'c/', 'calle', 'C /')):
-                                continue
-
-                            # 4. Filtrar líneas que son mayormente números (totales, impuestos)
-                            palabras = descripcion.split()
-                            if len(palabras) <= 4:  # Líneas cortas tipo "7% 339,50 5.189,47"
-                                numeros_count = sum(1 for p in palabras if any(c.isdigit() for c in p) or '%' in p)
-                                if numeros_count >= len(palabras) * 0.6:  # 60%+ son números
-                                    continue
-
-                            # 5. Volver a validar longitud después de limpiar
-                            if len(descripcion) < 10:
-                                continue
-
-                            # 6. La descripción debe contener letras (no solo números/símbolos)
-                            if not any(c.isalpha() for c in descripcion):
-                                continue
-
-                            # 7. Filtrar líneas con palabras clave que NO son defectos
-                            palabras_invalidas = ['NIF', 'CIF', 'Tel.', 'Tel', 'Email', '@', 'www', 'http',
-                                                 'GRAN CANARIA', 'LAS PALMAS', 'Municipio', 'Serie']
-                            if any(palabra in descripcion for palabra in palabras_invalidas):
-                                continue
-
-                            # 8. Debe tener al menos 3 palabras (descripciones reales son más largas)
-                            if len(descripcion.split()) < 3:
-                                continue
-
-                            # 9. Filtrar si toda la descripción es MAYÚSCULAS cortas (probablemente headers/títulos)
-                            if descripcion.isupper() and len(descripcion) < 30:
-                                continue
-
-                            # NOTA: No validamos el código ya que no es necesario
-                            # Guardamos código si existe, o vacío si no
-                            logger.info(f" ✓ Añadiendo: {descripcion[:70]}...")
-                            descripciones.append({
-                                'codigo': codigo if codigo else "",
-                                'descripcion': descripcion
-                            })
-
-                # Estrategia 2: Si no encontró tablas, intentar extracción de texto
-                if not tables:
-                    logger.info(" No se encontraron tablas, intentando extracción de texto")
-                    text = page.extract_text()
-                    if text:
-                        lines = text.split('\n')
-                        for line in lines:
-                            line = line.strip()
-
-                            if not line or len(line) < 10:
-                                continue
-
-                            # Buscar líneas que empiezan con código numérico (8-10 dígitos)
-                            parts = line.split(None, 1)
-                            if len(parts) < 2:
-                                continue
-
-                            possible_code = parts[0]
-                            descripcion = parts[1]
-
-                            # Código debe ser numérico de 8-11 dígitos
-                            if not (possible_code.isdigit() and 8 <= len(possible_code) <= 11):
-                                continue
-
-                            # Aplicar MISMA LIMPIEZA que Estrategia 1
-                            import re
-
-                            logger.info(f" Antes de limpiar: {descripcion[:100]}")
-
-                            # Cortar en el primer número decimal
-                            match = re.search(r'\s+\d+[,\.]?\d*', descripcion)
-                            if match:
-                                descripcion = descripcion[:match.start()].strip()
-                                logger.info(f" Después de cortar: {descripcion[:100]}")
-
-                            # Eliminar números al final
-                            descripcion = re.sub(r'\s+[\d\.,\s]+$', '', descripcion)
-                            descripcion = descripcion.strip()
-
-                            # APLICAR MISMAS VALIDACIONES que Estrategia 1
-                            if len(descripcion) < 10:
-                                continue
-
-                            if any(x in descripcion for x in ['Descripción', 'Cód.', 'Cant.', 'Precio', 'Total', 'INSTALACIÓN']):
-                                continue
-
-                            if descripcion.startswith(('C/', 'Calle', 'Avda')):
-                                continue
-
-                            if not any(c.isalpha() for c in descripcion):
-                                continue
-
-                            if len(descripcion.split()) < 3:
-                                continue
-
-                            logger.info(f" ✓ Añadiendo: {descripcion[:70]}...")
-                            descripciones.append({
-                                'codigo': possible_code,
-                                'descripcion': descripcion
-                            })
-
-        logger.info(f" Total descripciones extraídas: {len(descripciones)}")
-
-    except Exception as e:
-        logger.error(f"Error al extraer descripciones del PDF: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise
-
-    return descripciones
+    Delegado en services/extraccion_pdf.py (caché por hash y páginas en paralelo)
+    """
+    from services.extraccion_pdf import extraer_descripciones_pdf as extraer
+    return extraer(pdf_content)
 
 # Extraer defectos de PDF de presupuesto
 # @app.route("/inspecciones/<int:inspeccion_id>/extraer_defectos_pdf", methods=["POST"])
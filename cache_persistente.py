@@ -0,0 +1,178 @@
+"""
+Caché persistente clave -> JSON en SQLite con TTL
+Usada por los servicios de geocodificación y Catastro para no repetir
+consultas a APIs públicas entre ejecuciones de los análisis de zonas
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Directorio por defecto de las cachés (una base SQLite por servicio)
+DIRECTORIO_CACHE = os.environ.get(
+    "ZONAS_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "ascensoralert_zonas")
+)
+
+
+def ruta_cache(nombre: str) -> str:
+    """Ruta de la base SQLite de una caché dentro de DIRECTORIO_CACHE"""
+    return os.path.join(DIRECTORIO_CACHE, f"{nombre}.sqlite3")
+
+
+class CacheSQLite:
+    """
+    Caché clave -> valor JSON persistente en una tabla SQLite.
+
+    - Cada entrada guarda el momento de escritura; al leer se descarta si ha
+      superado el TTL
+    - Caché negativa: guardar None registra que la consulta no dio resultado
+      (con su propio TTL, normalmente más corto)
+    - Estadísticas de aciertos/fallos de la instancia
+
+    Segura entre hilos (una conexión con lock) y entre procesos (modo WAL).
+    """
+
+    def __init__(
+        self,
+        ruta: str,
+        tabla: str = "entradas",
+        ttl_segundos: Optional[float] = 30 * 24 * 3600,
+        ttl_negativo_segundos: Optional[float] = 24 * 3600
+    ):
+        """
+        Args:
+            ruta: Ruta del fichero SQLite (se crea si no existe)
+            tabla: Tabla de la caché (varias cachés pueden compartir fichero)
+            ttl_segundos: Validez de las entradas con valor (None = sin caducidad)
+            ttl_negativo_segundos: Validez de las entradas sin resultado (None = sin caducidad)
+        """
+        if not tabla.isidentifier():
+            raise ValueError(f"Nombre de tabla no válido: {tabla}")
+
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        self.ruta = ruta
+        self.tabla = tabla
+        self.ttl_segundos = ttl_segundos
+        self.ttl_negativo_segundos = ttl_negativo_segundos
+
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, timeout=30, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute(
+            f"CREATE TABLE IF NOT EXISTS {tabla} ("
+            "clave TEXT PRIMARY KEY, valor TEXT, creado REAL NOT NULL)"
+        )
+        self._conexion.commit()
+
+        self.aciertos = 0
+        self.aciertos_negativos = 0
+        self.fallos = 0
+
+    def _vigente(self, valor: Optional[str], creado: float) -> bool:
+        ttl = self.ttl_segundos if valor is not None else self.ttl_negativo_segundos
+        return ttl is None or time.time() - creado <= ttl
+
+    def obtener(self, clave: str) -> Tuple[bool, Any]:
+        """
+        Busca una clave en la caché.
+
+        Returns:
+            (encontrado, valor): valor es None en entradas negativas
+        """
+        with self._lock:
+            fila = self._conexion.execute(
+                f"SELECT valor, creado FROM {self.tabla} WHERE clave = ?", (clave,)
+            ).fetchone()
+
+            if fila is None or not self._vigente(*fila):
+                self.fallos += 1
+                return False, None
+
+            if fila[0] is None:
+                self.aciertos_negativos += 1
+                return True, None
+
+            self.aciertos += 1
+        return True, json.loads(fila[0])
+
+    def guardar(self, clave: str, valor: Any):
+        """Guarda (o reemplaza) una entrada; valor None = consulta sin resultado"""
+        texto = json.dumps(valor, ensure_ascii=False) if valor is not None else None
+        with self._lock:
+            self._conexion.execute(
+                f"INSERT OR REPLACE INTO {self.tabla} (clave, valor, creado) VALUES (?, ?, ?)",
+                (clave, texto, time.time())
+            )
+            self._conexion.commit()
+
+    def guardar_varios(self, entradas: Dict[str, Any]):
+        """Guarda varias entradas en una sola transacción"""
+        ahora = time.time()
+        filas = [
+            (clave, json.dumps(valor, ensure_ascii=False) if valor is not None else None, ahora)
+            for clave, valor in entradas.items()
+        ]
+        with self._lock:
+            self._conexion.executemany(
+                f"INSERT OR REPLACE INTO {self.tabla} (clave, valor, creado) VALUES (?, ?, ?)",
+                filas
+            )
+            self._conexion.commit()
+
+    def limpiar_expirados(self) -> int:
+        """Elimina las entradas caducadas. Returns: número de entradas eliminadas"""
+        ahora = time.time()
+        condiciones = []
+        params = []
+        if self.ttl_segundos is not None:
+            condiciones.append("(valor IS NOT NULL AND creado < ?)")
+            params.append(ahora - self.ttl_segundos)
+        if self.ttl_negativo_segundos is not None:
+            condiciones.append("(valor IS NULL AND creado < ?)")
+            params.append(ahora - self.ttl_negativo_segundos)
+        if not condiciones:
+            return 0
+
+        with self._lock:
+            cursor = self._conexion.execute(
+                f"DELETE FROM {self.tabla} WHERE {' OR '.join(condiciones)}", params
+            )
+            self._conexion.commit()
+        return cursor.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conexion.execute(f"SELECT COUNT(*) FROM {self.tabla}").fetchone()[0]
+
+    def estadisticas(self) -> Dict:
+        """
+        Aciertos y fallos de esta instancia.
+
+        Returns:
+            {'aciertos', 'aciertos_negativos', 'fallos', 'consultas', 'tasa_aciertos', 'entradas'}
+        """
+        consultas = self.aciertos + self.aciertos_negativos + self.fallos
+        return {
+            'aciertos': self.aciertos,
+            'aciertos_negativos': self.aciertos_negativos,
+            'fallos': self.fallos,
+            'consultas': consultas,
+            'tasa_aciertos': (self.aciertos + self.aciertos_negativos) / consultas if consultas else 0.0,
+            'entradas': len(self)
+        }
+
+    def cerrar(self):
+        """Cierra la conexión SQLite"""
+        with self._lock:
+            self._conexion.close()
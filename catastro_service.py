@@ -1,17 +1,58 @@
 """
 Servicio de integración con la API de Catastro español
 Permite consultar datos catastrales por coordenadas y referencia catastral
+
+Caché persistente en dos niveles (SQLite, ver cache_persistente.py):
+- puntos: coordenada ajustada a una rejilla de resolucion_metros -> referencia
+  catastral (o "sin parcela")
+- parcelas: referencia catastral -> datos del inmueble ya parseados
+Los escaneos repetidos o solapados (varias semillas, códigos postales
+vecinos) se sirven casi por completo desde disco, y la caché puede
+precargarse con resultados de análisis anteriores.
+
+obtener_datos_area consulta la cuadrícula en paralelo (pool de workers
+acotado) con un limitador token bucket compartido que mantiene la tasa de
+peticiones a la OVC dentro de peticiones_por_segundo.
+obtener_datos_bbox_adaptativo muestrea con un quadtree: solo subdivide las
+celdas que encontraron parcelas nuevas, con un presupuesto de consultas.
 """
 
+import json
+import math
 import requests
 import xmltodict
 import logging
-from typing import Dict, Optional, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional, List, Tuple
 from time import sleep
 from datetime import datetime
 
+from requests.adapters import HTTPAdapter
+
+from cache_persistente import CacheSQLite, ruta_cache
+from limitador_tasa import LimitadorTasa
+
 logger = logging.getLogger(__name__)
 
+# Resolución de la rejilla de la caché de puntos: dos consultas a menos de
+# esta distancia se consideran la misma (menor que una parcela urbana típica)
+RESOLUCION_CACHE_METROS = 5.0
+# Validez de las entradas de la caché de Catastro (los datos cambian muy poco)
+TTL_CATASTRO_DIAS = 180
+# Validez de los puntos sin parcela (calles, solares)
+TTL_CATASTRO_NEGATIVO_DIAS = 30
+
+METROS_POR_GRADO = 111000
+
+# Límites de uso de la OVC: tasa sostenida, ráfaga y peticiones simultáneas
+PETICIONES_POR_SEGUNDO_CATASTRO = 3.0
+RAFAGA_CATASTRO = 3
+WORKERS_CATASTRO = 4
+
+# Muestreo adaptativo: celda mínima (aprox. un edificio) y cuadrícula inicial
+TAMANO_MINIMO_CELDA_METROS = 25
+GRID_INICIAL_ADAPTATIVO = 3
+
 
 class CatastroService:
     """
@@ -26,20 +67,188 @@ class CatastroService:
     # Sistema de referencia: EPSG:4326 (WGS84) - Lat/Lon estándar GPS
     SRS = "EPSG:4326"
 
-    def __init__(self, max_retries: int = 3, retry_delay: float = 2.0):
+    def __init__(
+        self,
+        max_retries: int = 3,
+        retry_delay: float = 2.0,
+        usar_cache: bool = True,
+        resolucion_metros: float = RESOLUCION_CACHE_METROS,
+        ttl_dias: float = TTL_CATASTRO_DIAS,
+        ttl_negativo_dias: float = TTL_CATASTRO_NEGATIVO_DIAS,
+        ruta_cache_sqlite: Optional[str] = None,
+        peticiones_por_segundo: float = PETICIONES_POR_SEGUNDO_CATASTRO,
+        rafaga: int = RAFAGA_CATASTRO,
+        max_workers: int = WORKERS_CATASTRO,
+        limitador: Optional[LimitadorTasa] = None,
+        transporte: Optional[requests.Session] = None,
+        url_base: Optional[str] = None
+    ):
         """
         Inicializa el servicio de Catastro.
 
         Args:
             max_retries: Número máximo de reintentos en caso de error
             retry_delay: Tiempo de espera entre reintentos (segundos)
+            usar_cache: Si False, todas las consultas van a la OVC
+            resolucion_metros: Lado de la celda de la caché de puntos
+            ttl_dias: Validez de las entradas en caché
+            ttl_negativo_dias: Validez de los puntos sin parcela en caché
+            ruta_cache_sqlite: Fichero de la caché (por defecto en ZONAS_CACHE_DIR)
+            peticiones_por_segundo: Tasa máxima de peticiones a la OVC
+            rafaga: Peticiones seguidas permitidas tras un periodo inactivo
+            max_workers: Consultas simultáneas en obtener_datos_area
+            limitador: Limitador a compartir con otros servicios (sustituye a
+                peticiones_por_segundo/rafaga)
+            transporte: Objeto con get(url, params=, timeout=) compatible con
+                requests.Session (p. ej. un fake para benchmarks)
+            url_base: URL base alternativa de la OVC (p. ej. un servidor local)
         """
         self.max_retries = max_retries
         self.retry_delay = retry_delay
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'AscensorAlert/1.0 (Modernization Analysis System)'
-        })
+        self.max_workers = max(1, max_workers)
+
+        if transporte is None:
+            transporte = requests.Session()
+            transporte.headers.update({
+                'User-Agent': 'AscensorAlert/1.0 (Modernization Analysis System)'
+            })
+            # Una conexión keep-alive por worker
+            adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+            transporte.mount('http://', adaptador)
+            transporte.mount('https://', adaptador)
+        self.session = transporte
+
+        if url_base:
+            self.COORD_ENDPOINT = self.COORD_ENDPOINT.replace(self.BASE_URL, url_base.rstrip('/'))
+            self.DNPRC_ENDPOINT = self.DNPRC_ENDPOINT.replace(self.BASE_URL, url_base.rstrip('/'))
+
+        self.limitador = limitador or LimitadorTasa(peticiones_por_segundo, rafaga)
+
+        self.resolucion_metros = resolucion_metros
+        self.cache_puntos = None
+        self.cache_parcelas = None
+        if usar_cache:
+            ruta = ruta_cache_sqlite or ruta_cache('catastro')
+            self.cache_puntos = CacheSQLite(
+                ruta, tabla='puntos',
+                ttl_segundos=ttl_dias * 24 * 3600,
+                ttl_negativo_segundos=ttl_negativo_dias * 24 * 3600
+            )
+            self.cache_parcelas = CacheSQLite(
+                ruta, tabla='parcelas',
+                ttl_segundos=ttl_dias * 24 * 3600,
+                ttl_negativo_segundos=ttl_negativo_dias * 24 * 3600
+            )
+
+    def clave_punto(self, latitud: float, longitud: float) -> str:
+        """
+        Clave de la caché de puntos: celda de la rejilla de resolucion_metros
+        que contiene la coordenada (índices enteros, estables entre ejecuciones).
+        """
+        paso_lat = self.resolucion_metros / METROS_POR_GRADO
+        celda_lat = math.floor(latitud / paso_lat)
+        # El paso en longitud se calcula con la latitud de la celda, no la del
+        # punto, para que todos los puntos de la fila usen la misma rejilla
+        paso_lon = self.resolucion_metros / (METROS_POR_GRADO * math.cos(math.radians(celda_lat * paso_lat)))
+        celda_lon = math.floor(longitud / paso_lon)
+        return f"{self.resolucion_metros:g}|{celda_lat}|{celda_lon}"
+
+    def _desde_cache(self, latitud: float, longitud: float) -> Tuple[bool, Optional[Dict]]:
+        """
+        Busca un punto en la caché de dos niveles.
+
+        Returns:
+            (encontrado, datos): datos None si el punto está cacheado sin parcela
+        """
+        if self.cache_puntos is None:
+            return False, None
+
+        encontrado, referencia = self.cache_puntos.obtener(self.clave_punto(latitud, longitud))
+        if not encontrado:
+            return False, None
+        if referencia is None:
+            return True, None
+
+        encontrado, datos = self.cache_parcelas.obtener(referencia)
+        if not encontrado or datos is None:
+            # Parcela caducada: se vuelve a consultar el punto
+            return False, None
+        return True, datos
+
+    def _guardar_en_cache(self, latitud: float, longitud: float, datos: Optional[Dict]):
+        """Registra el resultado de una consulta en los dos niveles de la caché"""
+        if self.cache_puntos is None:
+            return
+        referencia = datos.get('referencia_catastral') if datos else None
+        if referencia:
+            self.cache_parcelas.guardar(referencia, datos)
+        self.cache_puntos.guardar(self.clave_punto(latitud, longitud), referencia or None)
+
+    def precargar_cache(self, inmuebles: List[Dict]) -> int:
+        """
+        Precarga la caché con inmuebles de análisis anteriores
+        (resultados de obtener_datos_area o 'edificios' de exportar_zona_json).
+
+        Cada inmueble se guarda en la caché de parcelas y su centroide en la
+        caché de puntos.
+
+        Args:
+            inmuebles: Dicts con al menos referencia_catastral, latitud y longitud
+
+        Returns:
+            Número de parcelas precargadas
+        """
+        if self.cache_puntos is None:
+            return 0
+
+        parcelas = {}
+        puntos = {}
+        for inmueble in inmuebles:
+            referencia = inmueble.get('referencia_catastral')
+            if not referencia:
+                continue
+            datos = dict(inmueble)
+            # Campos calculados por el detector (exportar_zona_json), no del Catastro
+            for campo in ('antiguedad', 'categoria', 'score', 'estado_cartera', 'empresa_mantenedora'):
+                datos.pop(campo, None)
+            datos.setdefault('codigo_postal', '')
+            parcelas[referencia] = datos
+            if datos.get('latitud') is not None and datos.get('longitud') is not None:
+                puntos[self.clave_punto(datos['latitud'], datos['longitud'])] = referencia
+
+        self.cache_parcelas.guardar_varios(parcelas)
+        self.cache_puntos.guardar_varios(puntos)
+        logger.info(f"Caché de Catastro precargada con {len(parcelas)} parcelas")
+        return len(parcelas)
+
+    def precargar_cache_desde_json(self, ruta_archivo: str) -> int:
+        """
+        Precarga la caché desde un JSON exportado por un análisis anterior:
+        una zona (exportar_zona_json), una lista de zonas o una lista de inmuebles.
+
+        Returns:
+            Número de parcelas precargadas
+        """
+        with open(ruta_archivo, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        zonas = data if isinstance(data, list) else [data]
+        inmuebles = []
+        for zona in zonas:
+            if isinstance(zona, dict) and 'edificios' in zona:
+                inmuebles.extend(zona['edificios'])
+            elif isinstance(zona, dict):
+                inmuebles.append(zona)
+        return self.precargar_cache(inmuebles)
+
+    def estadisticas_cache(self) -> Dict:
+        """Aciertos y fallos de los dos niveles de la caché de Catastro"""
+        if self.cache_puntos is None:
+            return {}
+        return {
+            'puntos': self.cache_puntos.estadisticas(),
+            'parcelas': self.cache_parcelas.estadisticas()
+        }
 
     def obtener_datos_por_coordenadas(self, latitud: float, longitud: float) -> Optional[Dict]:
         """
@@ -62,6 +271,11 @@ class CatastroService:
                 'longitud': float
             }
         """
+        encontrado, datos = self._desde_cache(latitud, longitud)
+        if encontrado:
+            logger.debug(f"Catastro desde caché: lat={latitud}, lon={longitud}")
+            return datos
+
         params = {
             'SRS': self.SRS,
             'Coordenada_X': str(longitud),  # OVC usa X=longitud, Y=latitud
@@ -72,6 +286,7 @@ class CatastroService:
             try:
                 logger.info(f"Consultando Catastro: lat={latitud}, lon={longitud} (intento {intento + 1})")
 
+                self.limitador.adquirir()
                 response = self.session.get(
                     self.COORD_ENDPOINT,
                     params=params,
@@ -85,6 +300,9 @@ class CatastroService:
                 # Extraer datos del inmueble
                 resultado = self._parsear_respuesta_coordenadas(data)
 
+                # Sin resultado: entrada negativa en la caché de puntos
+                self._guardar_en_cache(latitud, longitud, resultado)
+
                 if resultado:
                     logger.info(f"Datos obtenidos: {resultado.get('direccion', 'N/A')}, "
                                f"año {resultado.get('anio_construccion', 'N/A')}")
@@ -101,6 +319,7 @@ class CatastroService:
                     logger.error(f"Error final consultando Catastro: {e}")
                     return None
             except Exception as e:
+                # Respuesta inesperada: no se guarda en caché (se reintentará)
                 logger.error(f"Error parseando respuesta de Catastro: {e}")
                 return None
 
@@ -125,6 +344,7 @@ class CatastroService:
         try:
             logger.info(f"Consultando Catastro por referencia: {referencia_catastral}")
 
+            self.limitador.adquirir()
             response = self.session.get(
                 self.DNPRC_ENDPOINT,
                 params=params,
@@ -147,11 +367,17 @@ class CatastroService:
             data: Diccionario con el XML parseado
 
         Returns:
-            Dict con datos normalizados o None
+            Dict con datos normalizados o None si el punto no tiene parcela
+            (respuesta 'err'/'lerr' o sin 'pc'); solo entonces se guarda la
+            entrada negativa en la caché
+
+        Raises:
+            ValueError: Respuesta sin la estructura esperada. No se cachea:
+                puede ser un error transitorio de la OVC
         """
         try:
             # Navegar por la estructura XML del Catastro
-            consulta = data.get('consulta_coordenadas', {})
+            consulta = data['consulta_coordenadas']
 
             # Verificar si hay error
             if 'err' in consulta or 'lerr' in consulta:
@@ -227,8 +453,7 @@ class CatastroService:
             }
 
         except Exception as e:
-            logger.error(f"Error parseando respuesta de coordenadas: {e}")
-            return None
+            raise ValueError(f"Respuesta de coordenadas inesperada: {type(e).__name__}: {e}") from e
 
     def _parsear_respuesta_referencia(self, data: Dict) -> Optional[Dict]:
         """
@@ -289,22 +514,170 @@ class CatastroService:
             logger.error(f"Error parseando respuesta de referencia: {e}")
             return None
 
+    def _consultar_lote(
+        self,
+        puntos: List[Tuple[float, float]],
+        max_workers: Optional[int] = None
+    ) -> List[Optional[Dict]]:
+        """
+        Consulta una lista de puntos en paralelo (pool acotado, limitador compartido).
+
+        Returns:
+            Resultado de cada punto, en el mismo orden (None si no hay parcela o error)
+        """
+        workers = max(1, min(max_workers or self.max_workers, len(puntos) or 1))
+        resultados: List[Optional[Dict]] = [None] * len(puntos)
+
+        if workers == 1:
+            for indice, (lat, lon) in enumerate(puntos):
+                resultados[indice] = self.obtener_datos_por_coordenadas(lat, lon)
+            return resultados
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='catastro') as executor:
+            futuros = {
+                executor.submit(self.obtener_datos_por_coordenadas, lat, lon): indice
+                for indice, (lat, lon) in enumerate(puntos)
+            }
+            for futuro in as_completed(futuros):
+                try:
+                    resultados[futuros[futuro]] = futuro.result()
+                except Exception as e:
+                    logger.error(f"Error consultando punto {futuros[futuro]} del área: {e}")
+        return resultados
+
+    def consultar_puntos(
+        self,
+        puntos: List[Tuple[float, float]],
+        max_workers: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Consulta el Catastro en una lista de puntos en paralelo.
+
+        Los workers comparten el limitador de tasa, así que más workers solo
+        solapan la latencia de las peticiones, no superan peticiones_por_segundo.
+        Los duplicados (varios puntos en la misma parcela) se descartan.
+
+        Args:
+            puntos: Lista de (latitud, longitud)
+            max_workers: Consultas simultáneas (por defecto las del servicio)
+
+        Returns:
+            Inmuebles únicos por referencia catastral, en el orden de los
+            puntos donde se encontraron por primera vez
+        """
+        inmuebles = []
+        inmuebles_unicos = set()
+        for datos in self._consultar_lote(puntos, max_workers=max_workers):
+            if datos and datos.get('referencia_catastral'):
+                ref = datos['referencia_catastral']
+                if ref not in inmuebles_unicos:
+                    inmuebles_unicos.add(ref)
+                    inmuebles.append(datos)
+                    logger.debug(f"Inmueble encontrado: {datos['direccion']} ({datos.get('anio_construccion', 'N/A')})")
+        return inmuebles
+
+    def obtener_datos_bbox_adaptativo(
+        self,
+        lat_min: float,
+        lat_max: float,
+        lon_min: float,
+        lon_max: float,
+        presupuesto_consultas: int = 100,
+        tamano_minimo_metros: float = TAMANO_MINIMO_CELDA_METROS,
+        grid_inicial: int = GRID_INICIAL_ADAPTATIVO,
+        max_workers: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Muestrea un bbox con un quadtree adaptativo.
+
+        Se empieza con una cuadrícula grid_inicial x grid_inicial consultando el
+        centro de cada celda. Una celda se divide en 4 solo si su punto devolvió
+        una parcela nueva (zonas densas); las que caen en el mar, parques o en
+        una parcela ya vista (puerto, grandes equipamientos) no se refinan.
+        Cada nivel se consulta en paralelo y se para al agotar el presupuesto
+        o al llegar a tamano_minimo_metros.
+
+        Args:
+            lat_min, lat_max, lon_min, lon_max: Bbox a muestrear
+            presupuesto_consultas: Máximo de puntos consultados (incluye aciertos de caché)
+            tamano_minimo_metros: Lado mínimo de una celda para poder dividirla
+            grid_inicial: Celdas por lado del primer nivel
+            max_workers: Consultas simultáneas (por defecto las del servicio)
+
+        Returns:
+            Inmuebles únicos por referencia catastral (mismo formato que obtener_datos_area)
+        """
+        cos_lat = math.cos(math.radians((lat_min + lat_max) / 2))
+        paso_lat = (lat_max - lat_min) / grid_inicial
+        paso_lon = (lon_max - lon_min) / grid_inicial
+
+        # Celda: (lat_min, lon_min, alto en grados, ancho en grados)
+        pendientes = [
+            (lat_min + i * paso_lat, lon_min + j * paso_lon, paso_lat, paso_lon)
+            for i in range(grid_inicial)
+            for j in range(grid_inicial)
+        ]
+
+        inmuebles = []
+        inmuebles_unicos = set()
+        consultas = 0
+        nivel = 0
+
+        logger.info(f"Muestreo adaptativo: bbox ({lat_min}, {lon_min}) - ({lat_max}, {lon_max}), "
+                    f"presupuesto {presupuesto_consultas} consultas")
+
+        while pendientes and consultas < presupuesto_consultas:
+            celdas = pendientes[:presupuesto_consultas - consultas]
+            puntos = [(c[0] + c[2] / 2, c[1] + c[3] / 2) for c in celdas]
+            consultas += len(puntos)
+
+            siguientes = []
+            for celda, datos in zip(celdas, self._consultar_lote(puntos, max_workers=max_workers)):
+                ref = datos.get('referencia_catastral') if datos else None
+                if not ref or ref in inmuebles_unicos:
+                    continue
+                inmuebles_unicos.add(ref)
+                inmuebles.append(datos)
+
+                lat0, lon0, alto, ancho = celda
+                lado_metros = max(alto * METROS_POR_GRADO, ancho * METROS_POR_GRADO * cos_lat)
+                if lado_metros / 2 >= tamano_minimo_metros:
+                    alto, ancho = alto / 2, ancho / 2
+                    siguientes.extend([
+                        (lat0, lon0, alto, ancho),
+                        (lat0, lon0 + ancho, alto, ancho),
+                        (lat0 + alto, lon0, alto, ancho),
+                        (lat0 + alto, lon0 + ancho, alto, ancho),
+                    ])
+
+            logger.debug(f"Nivel {nivel}: {len(celdas)} celdas, {len(inmuebles)} inmuebles, "
+                         f"{len(siguientes)} celdas a refinar")
+            pendientes = siguientes
+            nivel += 1
+
+        logger.info(f"Muestreo adaptativo: {len(inmuebles)} inmuebles únicos con {consultas} consultas "
+                    f"({nivel} niveles)")
+        return inmuebles
+
     def obtener_datos_area(
         self,
         lat_centro: float,
         lon_centro: float,
         radio_metros: int = 500,
-        grid_size: int = 5
+        grid_size: int = 5,
+        max_workers: Optional[int] = None
     ) -> List[Dict]:
         """
         Obtiene datos de múltiples inmuebles en un área alrededor de un punto central.
-        Utiliza una cuadrícula para muestrear el área.
+        Utiliza una cuadrícula para muestrear el área, consultada en paralelo
+        (ver consultar_puntos).
 
         Args:
             lat_centro: Latitud del centro
             lon_centro: Longitud del centro
             radio_metros: Radio del área a consultar en metros
             grid_size: Número de puntos por lado de la cuadrícula (total = grid_size²)
+            max_workers: Consultas simultáneas (por defecto las del servicio)
 
         Returns:
             Lista de diccionarios con datos de inmuebles encontrados
@@ -312,38 +685,21 @@ class CatastroService:
         # Conversión aproximada de metros a grados (válido para latitudes medias)
         # 1 grado de latitud ≈ 111 km
         # 1 grado de longitud ≈ 111 km * cos(latitud)
-        import math
-
         delta_lat = (radio_metros / 111000)  # grados de latitud
         delta_lon = (radio_metros / (111000 * math.cos(math.radians(lat_centro))))  # grados de longitud
 
-        inmuebles = []
-        inmuebles_unicos = set()  # Para evitar duplicados por referencia catastral
-
         logger.info(f"Escaneando área: centro ({lat_centro}, {lon_centro}), radio {radio_metros}m, grid {grid_size}x{grid_size}")
 
         # Generar cuadrícula de puntos
+        puntos = []
         for i in range(grid_size):
             for j in range(grid_size):
                 # Calcular coordenadas del punto de la cuadrícula
                 lat_offset = delta_lat * (i - grid_size / 2) * 2 / grid_size
                 lon_offset = delta_lon * (j - grid_size / 2) * 2 / grid_size
+                puntos.append((lat_centro + lat_offset, lon_centro + lon_offset))
 
-                lat_punto = lat_centro + lat_offset
-                lon_punto = lon_centro + lon_offset
-
-                # Consultar Catastro en este punto
-                datos = self.obtener_datos_por_coordenadas(lat_punto, lon_punto)
-
-                if datos and datos.get('referencia_catastral'):
-                    ref = datos['referencia_catastral']
-                    if ref not in inmuebles_unicos:
-                        inmuebles_unicos.add(ref)
-                        inmuebles.append(datos)
-                        logger.debug(f"Inmueble encontrado: {datos['direccion']} ({datos.get('anio_construccion', 'N/A')})")
-
-                # Pequeña pausa para no saturar el servicio
-                sleep(0.5)
+        inmuebles = self.consultar_puntos(puntos, max_workers=max_workers)
 
         logger.info(f"Total de inmuebles únicos encontrados: {len(inmuebles)}")
         return inmuebles
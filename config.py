@@ -61,6 +61,9 @@ class Config:
     RESEND_API_KEY = os.environ.get("RESEND_API_KEY")
     EMAIL_FROM = os.environ.get("EMAIL_FROM", "onboarding@resend.dev")
 
+    # Token del scraper de Prometheus para /metrics (Authorization: Bearer <token>)
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
 
 # Instancia global de configuración
 config = Config()
@@ -73,3 +76,10 @@ CACHE_TTL_METRICAS_HOME = 5
 CACHE_TTL_FILTROS = 30
 CACHE_TTL_INSTALACIONES = 10
 CACHE_TTL_OPORTUNIDADES = 10
+CACHE_TTL_DETALLE_CARTERA = 10
+CACHE_TTL_RESUMEN_INSPECCIONES = 5
+
+# Entradas máximas de las cachés por clave (se descartan las menos usadas)
+CACHE_MAX_DETALLE_CARTERA = 500
+CACHE_MAX_MAQUINAS_INDICE = 5000
+CACHE_MAX_RESUMEN_INSPECCIONES = 200
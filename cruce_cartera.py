@@ -0,0 +1,252 @@
+"""
+Cruce de edificios candidatos (zonas calientes) con nuestra cartera
+Carga una sola vez las instalaciones en cartera y los clientes/leads con
+empresa mantenedora, y construye dos índices:
+- Direcciones normalizadas (tipo de vía, acentos, "nº"... fuera): "CL ACONCAGUA 12"
+  del Catastro y "C/ Aconcagua, nº 12" de la cartera dan la misma clave
+- Índice geográfico (AlmacenEdificios) con las coordenadas ya cacheadas de
+  la geocodificación, para las direcciones que no casan por texto
+
+Cada EdificioCandidato se etiqueta como cliente, competencia (mantenido por
+otra empresa) o desconocido con una búsqueda O(1) por edificio: el cruce es
+O(n) y sirve para listas de candidatos de toda la isla.
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from almacen_edificios import AlmacenEdificios
+from geocoding_service import GeocodingService, normalizar_consulta
+
+logger = logging.getLogger(__name__)
+
+ESTADO_CLIENTE = "cliente"
+ESTADO_COMPETENCIA = "competencia"
+ESTADO_DESCONOCIDO = "desconocido"
+
+# Nombre (o parte) de nuestra empresa en clientes.empresa_mantenedora
+EMPRESA_PROPIA = os.environ.get("EMPRESA_PROPIA", "FEDES")
+
+# Distancia máxima para casar por coordenadas si la dirección no coincide
+RADIO_CRUCE_METROS = 25
+
+# Tipos de vía (Catastro y abreviaturas habituales): no forman parte de la clave
+TIPOS_VIA = {
+    'c', 'cl', 'calle', 'cll', 'av', 'avd', 'avda', 'avenida', 'pz', 'pza', 'plaza',
+    'ps', 'pso', 'paseo', 'ctra', 'cr', 'carretera', 'cm', 'camino', 'ur', 'urb',
+    'urbanizacion', 'bo', 'barrio', 'tr', 'trv', 'travesia', 'gv', 'glorieta', 'rb',
+    'rambla', 'pj', 'pasaje', 'lg', 'lugar', 'rd', 'ronda', 'bl', 'bloque'
+}
+PALABRAS_VACIAS = {'de', 'del', 'la', 'las', 'el', 'los', 'y', 'n', 'no', 'num', 'numero', 'nº', 's/n', 'sn'}
+
+# Prioridad cuando varias fuentes dan la misma dirección (la cartera manda)
+PRIORIDAD_ESTADO = {ESTADO_CLIENTE: 2, ESTADO_COMPETENCIA: 1}
+
+RE_NUMERO = re.compile(r'^(\d+)(?:[a-z]|-\d+)?$')
+
+
+def normalizar_direccion(texto: str) -> Optional[str]:
+    """
+    Clave de dirección: nombre de la vía sin tipo ni palabras vacías + número.
+
+    "C/ Aconcagua, nº 12" -> "aconcagua 12"
+    "CL ACONCAGUA 12 Es:1 Pl:02 35010 LAS PALMAS" -> "aconcagua 12"
+
+    Returns:
+        Clave o None si la dirección no tiene número (una calle entera no
+        identifica un edificio)
+    """
+    normalizado = normalizar_consulta(texto or '').replace('/', ' ').replace(',', ' ')
+    # "nº12" (º queda como "o" al quitar acentos)
+    normalizado = re.sub(r'\bn[o.]?(?=\d)', ' ', normalizado)
+    palabras = normalizado.split()
+
+    # Tipo de vía al principio ("c/", "cl", "avda."...)
+    while palabras and palabras[0].rstrip('.') in TIPOS_VIA:
+        palabras = palabras[1:]
+
+    nombre = []
+    for palabra in palabras:
+        coincidencia = RE_NUMERO.match(palabra)
+        if coincidencia:
+            if not nombre:
+                continue
+            return f"{' '.join(nombre)} {int(coincidencia.group(1))}"
+        if palabra not in PALABRAS_VACIAS:
+            nombre.append(palabra)
+    return None
+
+
+@dataclass
+class EntradaCartera:
+    """Edificio conocido: instalación en cartera o cliente/lead con mantenedora"""
+    origen: str          # 'instalaciones' | 'clientes'
+    id: int
+    direccion: str
+    estado: str          # ESTADO_CLIENTE | ESTADO_COMPETENCIA
+    empresa_mantenedora: Optional[str] = None
+
+
+class IndiceCartera:
+    """
+    Índices de dirección normalizada y geográfico sobre nuestra cartera.
+    Se construye una vez (cargar_indice_cartera) y se reutiliza para cruzar
+    cualquier número de zonas.
+    """
+
+    def __init__(self, radio_metros: float = RADIO_CRUCE_METROS):
+        self.radio_metros = radio_metros
+        self.por_direccion: Dict[str, EntradaCartera] = {}
+        self.geo = AlmacenEdificios(tamano_celda_metros=max(radio_metros * 2, 50))
+        self._por_clave_geo: Dict[str, EntradaCartera] = {}
+        self.total = 0
+
+    def __len__(self) -> int:
+        return self.total
+
+    def agregar(self, entrada: EntradaCartera, latitud: Optional[float] = None, longitud: Optional[float] = None):
+        """Añade un edificio conocido a los dos índices"""
+        self.total += 1
+        clave = normalizar_direccion(entrada.direccion)
+        if clave:
+            actual = self.por_direccion.get(clave)
+            if actual is None or PRIORIDAD_ESTADO[entrada.estado] > PRIORIDAD_ESTADO[actual.estado]:
+                self.por_direccion[clave] = entrada
+
+        if latitud is not None and longitud is not None:
+            clave_geo = f"{entrada.origen}:{entrada.id}"
+            self._por_clave_geo[clave_geo] = entrada
+            self.geo.agregar([{'referencia_catastral': clave_geo, 'latitud': latitud, 'longitud': longitud}])
+
+    def buscar(self, direccion: str, latitud: Optional[float], longitud: Optional[float]) -> Tuple[Optional[EntradaCartera], str]:
+        """
+        Busca un edificio: primero por dirección normalizada, luego por cercanía.
+
+        Returns:
+            (entrada o None, 'direccion' | 'coordenadas' | '')
+        """
+        clave = normalizar_direccion(direccion)
+        if clave and clave in self.por_direccion:
+            return self.por_direccion[clave], 'direccion'
+
+        if latitud and longitud:
+            cercanos = self.geo.en_radio(latitud, longitud, self.radio_metros)
+            if len(cercanos):
+                # Más cercano; a igual distancia no importa el orden
+                return self._por_clave_geo[self.geo.referencias[cercanos[0]]], 'coordenadas'
+
+        return None, ''
+
+    def cruzar(self, edificios: Iterable) -> Dict[str, int]:
+        """
+        Etiqueta una lista de EdificioCandidato (estado_cartera,
+        empresa_mantenedora, cartera_id) en una pasada.
+
+        Returns:
+            Recuento por estado {'cliente', 'competencia', 'desconocido'}
+        """
+        recuento = {ESTADO_CLIENTE: 0, ESTADO_COMPETENCIA: 0, ESTADO_DESCONOCIDO: 0}
+        for edificio in edificios:
+            entrada, _ = self.buscar(edificio.direccion, edificio.latitud, edificio.longitud)
+            if entrada is None:
+                edificio.estado_cartera = ESTADO_DESCONOCIDO
+                edificio.empresa_mantenedora = None
+                edificio.cartera_id = None
+            else:
+                edificio.estado_cartera = entrada.estado
+                edificio.empresa_mantenedora = entrada.empresa_mantenedora
+                edificio.cartera_id = f"{entrada.origen}:{entrada.id}"
+            recuento[edificio.estado_cartera] += 1
+        return recuento
+
+
+def _cargar_tabla(db, tabla: str, select: str, filtros: Optional[Dict] = None, tamano_pagina: int = 1000) -> List[Dict]:
+    """Lee una tabla completa por páginas (PostgREST limita las filas por respuesta)"""
+    filas = []
+    offset = 0
+    while True:
+        pagina = db.get(
+            tabla, select=select, filters={**(filtros or {}), 'offset': offset},
+            order='id.asc', limit=tamano_pagina, timeout=30
+        )
+        if pagina is None:
+            raise RuntimeError(f"No se pudo leer la tabla {tabla}")
+        filas.extend(pagina)
+        if len(pagina) < tamano_pagina:
+            return filas
+        offset += tamano_pagina
+
+
+def es_empresa_propia(empresa: Optional[str]) -> bool:
+    """True si la empresa mantenedora es la nuestra"""
+    return bool(empresa) and EMPRESA_PROPIA.lower() in empresa.lower()
+
+
+def cargar_indice_cartera(
+    db=None,
+    geocoding: Optional[GeocodingService] = None,
+    geocodificar_pendientes: bool = False,
+    ciudad_por_defecto: str = "Las Palmas de Gran Canaria",
+    radio_metros: float = RADIO_CRUCE_METROS
+) -> IndiceCartera:
+    """
+    Construye el índice de cartera desde Supabase (una lectura por tabla).
+
+    - instalaciones en cartera -> cliente
+    - clientes con empresa_mantenedora: la nuestra -> cliente, otra -> competencia
+
+    Las coordenadas salen de la caché de geocodificación; con
+    geocodificar_pendientes=True las direcciones no cacheadas se geocodifican
+    (lento la primera vez: 1 petición/s a Nominatim).
+
+    Args:
+        db: Cliente Supabase (por defecto services.supabase_client.db)
+        geocoding: Servicio de geocodificación (por defecto uno nuevo con caché)
+        geocodificar_pendientes: Si True, geocodifica las direcciones sin caché
+        ciudad_por_defecto: Ciudad para direcciones sin municipio/localidad
+        radio_metros: Distancia máxima del cruce por coordenadas
+
+    Returns:
+        IndiceCartera listo para cruzar zonas
+    """
+    if db is None:
+        from services.supabase_client import db
+    geocoding = geocoding or GeocodingService()
+    indice = IndiceCartera(radio_metros=radio_metros)
+
+    entradas = []
+    for fila in _cargar_tabla(db, 'instalaciones', 'id,nombre,municipio', {'en_cartera': 'eq.true'}):
+        if fila.get('nombre'):
+            entradas.append((
+                EntradaCartera('instalaciones', fila['id'], fila['nombre'], ESTADO_CLIENTE, EMPRESA_PROPIA),
+                fila.get('municipio') or ciudad_por_defecto
+            ))
+
+    for fila in _cargar_tabla(db, 'clientes', 'id,direccion,localidad,empresa_mantenedora',
+                              {'empresa_mantenedora': 'not.is.null'}):
+        empresa = (fila.get('empresa_mantenedora') or '').strip()
+        if not fila.get('direccion') or not empresa:
+            continue
+        estado = ESTADO_CLIENTE if es_empresa_propia(empresa) else ESTADO_COMPETENCIA
+        entradas.append((
+            EntradaCartera('clientes', fila['id'], fila['direccion'], estado, empresa),
+            fila.get('localidad') or ciudad_por_defecto
+        ))
+
+    sin_coordenadas = 0
+    for entrada, ciudad in entradas:
+        coords = geocoding.geocodificar_desde_cache(entrada.direccion, ciudad=ciudad)
+        if coords is None and geocodificar_pendientes:
+            coords = geocoding.geocodificar_direccion(entrada.direccion, ciudad=ciudad)
+        if coords is None:
+            sin_coordenadas += 1
+            indice.agregar(entrada)
+        else:
+            indice.agregar(entrada, coords['latitud'], coords['longitud'])
+
+    logger.info(f"Índice de cartera: {len(entradas)} edificios conocidos, "
+                f"{len(indice.por_direccion)} direcciones, {sin_coordenadas} sin coordenadas")
+    return indice
@@ -0,0 +1,230 @@
+-- ============================================
+-- MIGRACIÓN 015: RPCs de detalle de máquina e instalación (Cartera)
+-- ============================================
+-- Fecha: 2026-10-19
+-- Descripción: Consolida en una sola llamada las consultas de las vistas
+--              /cartera/maquina/<id> y /cartera/instalacion/<id>.
+--              Antes: 7 requests secuenciales por página (máquina, partes,
+--              3 x count, recomendaciones, oportunidades) y agregados por
+--              máquina calculados en Python (O(máquinas x partes)).
+--              Ahora: 1 RPC que devuelve entidad + agregados + historial
+--              paginado en un único JSON.
+--
+-- Uso desde PostgREST:
+--   POST /rest/v1/rpc/fn_detalle_maquina_cartera
+--        {"p_maquina_id": 123, "p_limite": 50, "p_offset": 0}
+--   POST /rest/v1/rpc/fn_detalle_instalacion_cartera
+--        {"p_instalacion_id": 45, "p_limite": 100, "p_offset": 0}
+--
+-- Ambas funciones devuelven NULL si la entidad no existe.
+-- ============================================
+
+-- ============================================
+-- PASO 1: ÍNDICES DE APOYO
+-- ============================================
+
+-- Historial paginado por máquina ordenado por fecha (evita sort en memoria)
+CREATE INDEX IF NOT EXISTS idx_partes_maquina_fecha
+    ON partes_trabajo(maquina_id, fecha_parte DESC);
+
+-- Recomendaciones por máquina
+CREATE INDEX IF NOT EXISTS idx_partes_maquina_recomendacion
+    ON partes_trabajo(maquina_id, fecha_parte DESC)
+    WHERE tiene_recomendacion = true;
+
+-- ============================================
+-- PASO 2: DETALLE DE MÁQUINA
+-- ============================================
+
+CREATE OR REPLACE FUNCTION fn_detalle_maquina_cartera(
+    p_maquina_id INTEGER,
+    p_limite INTEGER DEFAULT 50,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    WITH maq AS (
+        SELECT * FROM maquinas_cartera WHERE id = p_maquina_id
+    ),
+    agg AS (
+        SELECT
+            COUNT(*) AS total_partes,
+            COUNT(*) FILTER (WHERE p.tipo_parte_normalizado = 'AVERIA') AS total_averias,
+            COUNT(*) FILTER (WHERE p.tipo_parte_normalizado = 'MANTENIMIENTO') AS total_mantenimientos,
+            COUNT(*) FILTER (WHERE p.tiene_recomendacion = true) AS total_recomendaciones
+        FROM partes_trabajo p
+        WHERE p.maquina_id = p_maquina_id
+    )
+    SELECT jsonb_build_object(
+        'maquina', to_jsonb(maq) || jsonb_build_object(
+            'instalaciones', (SELECT to_jsonb(i) FROM instalaciones i WHERE i.id = maq.instalacion_id)
+        ),
+        'stats', jsonb_build_object(
+            'total_partes', agg.total_partes,
+            'total_averias', agg.total_averias,
+            'total_mantenimientos', agg.total_mantenimientos,
+            'total_recomendaciones', agg.total_recomendaciones,
+            'total_oportunidades', (
+                SELECT COUNT(*) FROM oportunidades_facturacion o WHERE o.maquina_id = p_maquina_id
+            )
+        ),
+        'tipos_distribucion', COALESCE((
+            SELECT jsonb_object_agg(t.tipo, t.cantidad)
+            FROM (
+                SELECT COALESCE(tipo_parte_normalizado, 'OTRO') AS tipo, COUNT(*) AS cantidad
+                FROM partes_trabajo
+                WHERE maquina_id = p_maquina_id
+                GROUP BY 1
+            ) t
+        ), '{}'::jsonb),
+        'partes', COALESCE((
+            SELECT jsonb_agg(to_jsonb(p) ORDER BY p.fecha_parte DESC)
+            FROM (
+                SELECT * FROM partes_trabajo
+                WHERE maquina_id = p_maquina_id
+                ORDER BY fecha_parte DESC
+                LIMIT p_limite OFFSET p_offset
+            ) p
+        ), '[]'::jsonb),
+        'recomendaciones', COALESCE((
+            SELECT jsonb_agg(to_jsonb(r) ORDER BY r.fecha_parte DESC)
+            FROM partes_trabajo r
+            WHERE r.maquina_id = p_maquina_id
+            AND r.tiene_recomendacion = true
+        ), '[]'::jsonb),
+        'oportunidades', COALESCE((
+            SELECT jsonb_agg(to_jsonb(o) ORDER BY o.created_at DESC)
+            FROM oportunidades_facturacion o
+            WHERE o.maquina_id = p_maquina_id
+        ), '[]'::jsonb)
+    )
+    FROM maq, agg;
+$$;
+
+-- ============================================
+-- PASO 3: DETALLE DE INSTALACIÓN
+-- ============================================
+
+CREATE OR REPLACE FUNCTION fn_detalle_instalacion_cartera(
+    p_instalacion_id INTEGER,
+    p_limite INTEGER DEFAULT 100,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    WITH inst AS (
+        SELECT * FROM instalaciones WHERE id = p_instalacion_id
+    ),
+    maq AS (
+        SELECT * FROM maquinas_cartera WHERE instalacion_id = p_instalacion_id
+    ),
+    -- Agregados por máquina en una sola pasada sobre partes_trabajo
+    agg AS (
+        SELECT
+            p.maquina_id,
+            COUNT(*) AS total_partes,
+            COUNT(*) FILTER (WHERE p.tipo_parte_normalizado = 'AVERIA') AS total_averias,
+            COUNT(*) FILTER (WHERE p.tipo_parte_normalizado = 'MANTENIMIENTO') AS total_mantenimientos,
+            COUNT(*) FILTER (WHERE p.tiene_recomendacion = true) AS total_recomendaciones
+        FROM partes_trabajo p
+        JOIN maq ON maq.id = p.maquina_id
+        GROUP BY p.maquina_id
+    )
+    SELECT jsonb_build_object(
+        'instalacion', to_jsonb(inst),
+        'maquinas', COALESCE((
+            SELECT jsonb_agg(
+                to_jsonb(maq) || jsonb_build_object(
+                    'total_partes', COALESCE(agg.total_partes, 0),
+                    'total_averias', COALESCE(agg.total_averias, 0),
+                    'total_recomendaciones', COALESCE(agg.total_recomendaciones, 0)
+                )
+                ORDER BY maq.identificador
+            )
+            FROM maq
+            LEFT JOIN agg ON agg.maquina_id = maq.id
+        ), '[]'::jsonb),
+        'stats', jsonb_build_object(
+            'total_maquinas', (SELECT COUNT(*) FROM maq),
+            'total_partes', (SELECT COALESCE(SUM(total_partes), 0) FROM agg),
+            'total_averias', (SELECT COALESCE(SUM(total_averias), 0) FROM agg),
+            'total_mantenimientos', (SELECT COALESCE(SUM(total_mantenimientos), 0) FROM agg),
+            'total_recomendaciones', (SELECT COALESCE(SUM(total_recomendaciones), 0) FROM agg),
+            'total_oportunidades', (
+                SELECT COUNT(*) FROM oportunidades_facturacion o JOIN maq ON maq.id = o.maquina_id
+            )
+        ),
+        'tipos_distribucion', COALESCE((
+            SELECT jsonb_object_agg(t.tipo, t.cantidad)
+            FROM (
+                SELECT COALESCE(p.tipo_parte_normalizado, 'OTRO') AS tipo, COUNT(*) AS cantidad
+                FROM partes_trabajo p
+                JOIN maq ON maq.id = p.maquina_id
+                GROUP BY 1
+            ) t
+        ), '{}'::jsonb),
+        'partes', COALESCE((
+            SELECT jsonb_agg(
+                (to_jsonb(p) - 'identificador_maquina')
+                || jsonb_build_object('maquinas_cartera', jsonb_build_object('identificador', p.identificador_maquina))
+                ORDER BY p.fecha_parte DESC
+            )
+            FROM (
+                SELECT pt.*, maq.identificador AS identificador_maquina
+                FROM partes_trabajo pt
+                JOIN maq ON maq.id = pt.maquina_id
+                ORDER BY pt.fecha_parte DESC
+                LIMIT p_limite OFFSET p_offset
+            ) p
+        ), '[]'::jsonb),
+        'recomendaciones', COALESCE((
+            SELECT jsonb_agg(
+                to_jsonb(r) || jsonb_build_object('maquinas_cartera', jsonb_build_object('identificador', maq.identificador))
+                ORDER BY r.fecha_parte DESC
+            )
+            FROM partes_trabajo r
+            JOIN maq ON maq.id = r.maquina_id
+            WHERE r.tiene_recomendacion = true
+        ), '[]'::jsonb),
+        'oportunidades', COALESCE((
+            SELECT jsonb_agg(
+                to_jsonb(o) || jsonb_build_object('maquinas_cartera', jsonb_build_object('identificador', maq.identificador))
+                ORDER BY o.created_at DESC
+            )
+            FROM oportunidades_facturacion o
+            JOIN maq ON maq.id = o.maquina_id
+        ), '[]'::jsonb)
+    )
+    FROM inst;
+$$;
+
+-- Permitir la llamada vía PostgREST
+GRANT EXECUTE ON FUNCTION fn_detalle_maquina_cartera(INTEGER, INTEGER, INTEGER) TO anon, authenticated;
+GRANT EXECUTE ON FUNCTION fn_detalle_instalacion_cartera(INTEGER, INTEGER, INTEGER) TO anon, authenticated;
+
+-- ============================================
+-- VERIFICACIÓN FINAL
+-- ============================================
+
+DO $$
+BEGIN
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '✅ MIGRACIÓN 015 COMPLETADA';
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '📈 FUNCIONES CREADAS:';
+    RAISE NOTICE '   - fn_detalle_maquina_cartera(maquina_id, limite, offset)';
+    RAISE NOTICE '   - fn_detalle_instalacion_cartera(instalacion_id, limite, offset)';
+    RAISE NOTICE '📊 ÍNDICES CREADOS:';
+    RAISE NOTICE '   - idx_partes_maquina_fecha';
+    RAISE NOTICE '   - idx_partes_maquina_recomendacion';
+END
+$$;
+
+-- Registrar esta migración
+INSERT INTO schema_migrations (version, executed_at)
+VALUES ('015', NOW())
+ON CONFLICT (version) DO NOTHING;
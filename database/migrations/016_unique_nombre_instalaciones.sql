@@ -0,0 +1,65 @@
+-- ============================================
+-- MIGRACIÓN 016: Clave única para upsert de instalaciones (Cartera)
+-- ============================================
+-- Fecha: 2026-10-19
+-- Descripción: La importación de equipos pasa a hacer upsert en bloque
+--              (POST ?on_conflict=... con resolution=merge-duplicates).
+--              PostgREST necesita una restricción UNIQUE sobre la columna
+--              de conflicto:
+--                - maquinas_cartera.identificador ya es UNIQUE
+--                - instalaciones.nombre solo tenía un índice normal
+--
+-- Si existen nombres duplicados la migración se detiene y los lista:
+-- hay que fusionarlos (reasignando sus máquinas) antes de volver a ejecutarla.
+-- ============================================
+
+-- ============================================
+-- PASO 1: COMPROBAR DUPLICADOS
+-- ============================================
+
+DO $$
+DECLARE
+    v_duplicados TEXT;
+BEGIN
+    SELECT string_agg(nombre || ' (' || total || ')', ', ')
+    INTO v_duplicados
+    FROM (
+        SELECT nombre, COUNT(*) AS total
+        FROM instalaciones
+        GROUP BY nombre
+        HAVING COUNT(*) > 1
+    ) d;
+
+    IF v_duplicados IS NOT NULL THEN
+        RAISE EXCEPTION 'Instalaciones con nombre duplicado: %', v_duplicados;
+    END IF;
+END
+$$;
+
+-- ============================================
+-- PASO 2: ÍNDICE ÚNICO
+-- ============================================
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_instalaciones_nombre ON instalaciones(nombre);
+
+-- El índice único sustituye al índice normal
+DROP INDEX IF EXISTS idx_instalaciones_nombre;
+
+-- ============================================
+-- VERIFICACIÓN FINAL
+-- ============================================
+
+DO $$
+BEGIN
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '✅ MIGRACIÓN 016 COMPLETADA';
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '📊 ÍNDICES CREADOS:';
+    RAISE NOTICE '   - uq_instalaciones_nombre';
+END
+$$;
+
+-- Registrar esta migración
+INSERT INTO schema_migrations (version, executed_at)
+VALUES ('016', NOW())
+ON CONFLICT (version) DO NOTHING;
@@ -0,0 +1,67 @@
+-- ============================================
+-- MIGRACIÓN 017: Actualización en bloque de recomendaciones (Cartera)
+-- ============================================
+-- Fecha: 2026-10-19
+-- Descripción: El re-análisis de recomendaciones calcula los flags en la
+--              aplicación (mismas palabras clave que la importación) y solo
+--              envía los partes cuyo resultado cambia. Esta función aplica
+--              un lote de cambios con un único UPDATE ... FROM.
+--              Antes: 1 PATCH por parte (hasta 10.000 peticiones).
+--
+--              No se usa upsert de PostgREST porque partes_trabajo tiene
+--              columnas NOT NULL sin default (INSERT ... ON CONFLICT valida
+--              la fila completa antes de detectar el conflicto).
+--
+-- Uso desde PostgREST:
+--   POST /rest/v1/rpc/fn_actualizar_recomendaciones_partes
+--        {"p_cambios": [{"id": 1, "tiene_recomendacion": true,
+--                        "recomendaciones_extraidas": "..."}, ...]}
+--
+-- Devuelve el número de partes actualizados.
+-- ============================================
+
+CREATE OR REPLACE FUNCTION fn_actualizar_recomendaciones_partes(p_cambios JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_actualizados INTEGER;
+BEGIN
+    UPDATE partes_trabajo p
+    SET tiene_recomendacion = c.tiene_recomendacion,
+        recomendaciones_extraidas = c.recomendaciones_extraidas
+    FROM jsonb_to_recordset(p_cambios) AS c(
+        id INTEGER,
+        tiene_recomendacion BOOLEAN,
+        recomendaciones_extraidas TEXT
+    )
+    WHERE p.id = c.id
+    AND (p.tiene_recomendacion IS DISTINCT FROM c.tiene_recomendacion
+         OR p.recomendaciones_extraidas IS DISTINCT FROM c.recomendaciones_extraidas);
+
+    GET DIAGNOSTICS v_actualizados = ROW_COUNT;
+    RETURN v_actualizados;
+END;
+$$;
+
+-- Permitir la llamada vía PostgREST
+GRANT EXECUTE ON FUNCTION fn_actualizar_recomendaciones_partes(JSONB) TO anon, authenticated;
+
+-- ============================================
+-- VERIFICACIÓN FINAL
+-- ============================================
+
+DO $$
+BEGIN
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '✅ MIGRACIÓN 017 COMPLETADA';
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '📈 FUNCIONES CREADAS:';
+    RAISE NOTICE '   - fn_actualizar_recomendaciones_partes(cambios)';
+END
+$$;
+
+-- Registrar esta migración
+INSERT INTO schema_migrations (version, executed_at)
+VALUES ('017', NOW())
+ON CONFLICT (version) DO NOTHING;
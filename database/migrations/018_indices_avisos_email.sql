@@ -0,0 +1,44 @@
+-- ============================================
+-- MIGRACIÓN 018: Índices para los avisos por email
+-- ============================================
+-- Fecha: 2026-10-19
+-- Descripción: enviar_avisos_email ya no descarga todos los equipos con IPO
+--              para filtrarlos en Python: consulta solo las tres ventanas
+--              que generan aviso hoy:
+--                - ipo_proxima = hoy - primer_aviso_despues_ipo
+--                - ipo_proxima = hoy - segundo_aviso_despues_ipo
+--                - fecha_vencimiento_contrato entre hoy y hoy + dias_aviso_antes_contrato
+--              Estos índices parciales (ya recomendados en
+--              SUPABASE_INDICES_RECOMENDADOS.md) permiten resolverlas por
+--              índice en lugar de con un recorrido completo de equipos.
+-- ============================================
+
+CREATE INDEX IF NOT EXISTS idx_equipos_ipo_proxima
+ON equipos(ipo_proxima)
+WHERE ipo_proxima IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_equipos_vencimiento_contrato
+ON equipos(fecha_vencimiento_contrato)
+WHERE fecha_vencimiento_contrato IS NOT NULL;
+
+ANALYZE equipos;
+
+-- ============================================
+-- VERIFICACIÓN FINAL
+-- ============================================
+
+DO $$
+BEGIN
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '✅ MIGRACIÓN 018 COMPLETADA';
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '📈 ÍNDICES CREADOS:';
+    RAISE NOTICE '   - idx_equipos_ipo_proxima';
+    RAISE NOTICE '   - idx_equipos_vencimiento_contrato';
+END
+$$;
+
+-- Registrar esta migración
+INSERT INTO schema_migrations (version, executed_at)
+VALUES ('018', NOW())
+ON CONFLICT (version) DO NOTHING;
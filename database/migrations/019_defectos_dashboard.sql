@@ -0,0 +1,119 @@
+-- ============================================
+-- MIGRACIÓN 019: Dashboard de defectos resuelto en el servidor
+-- ============================================
+-- Fecha: 2026-10-19
+-- Descripción: El dashboard de defectos descargaba todos los defectos de
+--              v_defectos_con_urgencia y todas las inspecciones, filtraba
+--              en Python y unía ambos listados con un diccionario.
+--              Ahora:
+--                - v_defectos_dashboard: defecto + urgencia + datos de la
+--                  inspección y la OCA (sin join en la aplicación)
+--                - fn_resumen_defectos: totales y contadores por urgencia y
+--                  calificación con los filtros operativos aplicados
+--                - Índices para paginar cada sección por (fecha_limite, id)
+--
+-- Uso desde PostgREST:
+--   GET  /rest/v1/v_defectos_dashboard?estado=eq.PENDIENTE&nivel_urgencia=eq.VENCIDO
+--        &order=fecha_limite.asc,id.asc&limit=50
+--   POST /rest/v1/rpc/fn_resumen_defectos
+--        {"p_tecnico": "sergio", "p_material": null, "p_stock": "sin_definir"}
+--
+-- Filtros: NULL o '' = sin filtro; 'sin_asignar' / 'sin_definir' = campo vacío.
+-- ============================================
+
+-- ============================================
+-- PASO 1: ÍNDICES DE APOYO
+-- ============================================
+
+-- Páginas de pendientes y subsanados ordenadas por fecha límite
+CREATE INDEX IF NOT EXISTS idx_defectos_estado_fecha_limite
+    ON defectos_inspeccion(estado, fecha_limite, id);
+
+-- ============================================
+-- PASO 2: VISTA CON DATOS DE INSPECCIÓN
+-- ============================================
+
+CREATE OR REPLACE VIEW v_defectos_dashboard
+WITH (security_invoker=on) AS
+SELECT
+    v.*,
+    i.direccion,
+    i.poblacion,
+    i.fecha_inspeccion,
+    o.nombre AS oca_nombre
+FROM v_defectos_con_urgencia v
+INNER JOIN inspecciones i ON i.id = v.inspeccion_id
+LEFT JOIN ocas o ON o.id = i.oca_id;
+
+-- ============================================
+-- PASO 3: CONTADORES DEL DASHBOARD
+-- ============================================
+
+CREATE OR REPLACE FUNCTION fn_resumen_defectos(
+    p_tecnico TEXT DEFAULT NULL,
+    p_material TEXT DEFAULT NULL,
+    p_stock TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    WITH pendientes AS (
+        SELECT v.nivel_urgencia, v.calificacion
+        FROM v_defectos_con_urgencia v
+        WHERE v.estado = 'PENDIENTE'
+        AND (NULLIF(p_tecnico, '') IS NULL
+             OR (p_tecnico = 'sin_asignar' AND NULLIF(v.tecnico_asignado, '') IS NULL)
+             OR v.tecnico_asignado = p_tecnico)
+        AND (NULLIF(p_material, '') IS NULL
+             OR (p_material = 'sin_definir' AND NULLIF(v.gestion_material, '') IS NULL)
+             OR v.gestion_material = p_material)
+        AND (NULLIF(p_stock, '') IS NULL
+             OR (p_stock = 'sin_definir' AND NULLIF(v.estado_stock, '') IS NULL)
+             OR v.estado_stock = p_stock)
+    )
+    SELECT jsonb_build_object(
+        'total', (SELECT COUNT(*) FROM defectos_inspeccion),
+        'subsanados', (SELECT COUNT(*) FROM defectos_inspeccion WHERE estado = 'SUBSANADO'),
+        'pendientes', COUNT(*),
+        'por_urgencia', jsonb_build_object(
+            'VENCIDO', COUNT(*) FILTER (WHERE nivel_urgencia = 'VENCIDO'),
+            'URGENTE', COUNT(*) FILTER (WHERE nivel_urgencia = 'URGENTE'),
+            'PROXIMO', COUNT(*) FILTER (WHERE nivel_urgencia = 'PROXIMO'),
+            'NORMAL', COUNT(*) FILTER (WHERE nivel_urgencia = 'NORMAL')
+        ),
+        'por_calificacion', jsonb_build_object(
+            'DL', COUNT(*) FILTER (WHERE calificacion = 'DL'),
+            'DG', COUNT(*) FILTER (WHERE calificacion = 'DG'),
+            'DMG', COUNT(*) FILTER (WHERE calificacion = 'DMG')
+        )
+    )
+    FROM pendientes;
+$$;
+
+-- Permitir la llamada vía PostgREST
+GRANT EXECUTE ON FUNCTION fn_resumen_defectos(TEXT, TEXT, TEXT) TO anon, authenticated;
+GRANT SELECT ON v_defectos_dashboard TO anon, authenticated;
+
+-- ============================================
+-- VERIFICACIÓN FINAL
+-- ============================================
+
+DO $$
+BEGIN
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '✅ MIGRACIÓN 019 COMPLETADA';
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '📊 VISTAS CREADAS:';
+    RAISE NOTICE '   - v_defectos_dashboard';
+    RAISE NOTICE '📈 FUNCIONES CREADAS:';
+    RAISE NOTICE '   - fn_resumen_defectos(tecnico, material, stock)';
+    RAISE NOTICE '📇 ÍNDICES CREADOS:';
+    RAISE NOTICE '   - idx_defectos_estado_fecha_limite';
+END
+$$;
+
+-- Registrar esta migración
+INSERT INTO schema_migrations (version, executed_at)
+VALUES ('019', NOW())
+ON CONFLICT (version) DO NOTHING;
@@ -0,0 +1,70 @@
+-- ============================================
+-- MIGRACIÓN 020: Versión de los datos del PDF de defectos
+-- ============================================
+-- Fecha: 2026-10-19
+-- Descripción: La exportación a PDF de defectos pendientes se guarda en
+--              caché por filtros + versión de los datos. Esta función
+--              calcula esa versión en el servidor (hash de las columnas que
+--              salen en el PDF y la fecha, de la que dependen los días
+--              restantes) sin descargar los defectos, y devuelve el total
+--              para decidir si el PDF se genera en segundo plano.
+--
+-- Uso desde PostgREST:
+--   POST /rest/v1/rpc/fn_version_defectos_pendientes
+--        {"p_tecnico": "sergio", "p_material": null, "p_stock": null}
+--   -> {"version": "9f2c...", "total": 1234}
+--
+-- Filtros: mismos criterios que fn_resumen_defectos (migración 019).
+-- ============================================
+
+CREATE OR REPLACE FUNCTION fn_version_defectos_pendientes(
+    p_tecnico TEXT DEFAULT NULL,
+    p_material TEXT DEFAULT NULL,
+    p_stock TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'version', md5(CURRENT_DATE::TEXT || COALESCE(string_agg(
+            concat_ws('|', v.id, v.maquina, v.descripcion, v.calificacion, v.plazo_meses,
+                      v.fecha_limite, v.direccion, v.poblacion),
+            '§' ORDER BY v.fecha_limite, v.id
+        ), '')),
+        'total', COUNT(*)
+    )
+    FROM v_defectos_dashboard v
+    WHERE v.estado = 'PENDIENTE'
+    AND (NULLIF(p_tecnico, '') IS NULL
+         OR (p_tecnico = 'sin_asignar' AND NULLIF(v.tecnico_asignado, '') IS NULL)
+         OR v.tecnico_asignado = p_tecnico)
+    AND (NULLIF(p_material, '') IS NULL
+         OR (p_material = 'sin_definir' AND NULLIF(v.gestion_material, '') IS NULL)
+         OR v.gestion_material = p_material)
+    AND (NULLIF(p_stock, '') IS NULL
+         OR (p_stock = 'sin_definir' AND NULLIF(v.estado_stock, '') IS NULL)
+         OR v.estado_stock = p_stock);
+$$;
+
+-- Permitir la llamada vía PostgREST
+GRANT EXECUTE ON FUNCTION fn_version_defectos_pendientes(TEXT, TEXT, TEXT) TO anon, authenticated;
+
+-- ============================================
+-- VERIFICACIÓN FINAL
+-- ============================================
+
+DO $$
+BEGIN
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '✅ MIGRACIÓN 020 COMPLETADA';
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '📈 FUNCIONES CREADAS:';
+    RAISE NOTICE '   - fn_version_defectos_pendientes(tecnico, material, stock)';
+END
+$$;
+
+-- Registrar esta migración
+INSERT INTO schema_migrations (version, executed_at)
+VALUES ('020', NOW())
+ON CONFLICT (version) DO NOTHING;
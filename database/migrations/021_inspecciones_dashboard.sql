@@ -0,0 +1,148 @@
+-- ============================================
+-- MIGRACIÓN 021: Dashboard de inspecciones resuelto en el servidor
+-- ============================================
+-- Fecha: 2026-10-19
+-- Descripción: El dashboard de inspecciones descargaba todas las
+--              inspecciones (select=*) y todas las filas de
+--              defectos_inspeccion para contar defectos por inspección en
+--              Python, y calculaba la categoría de la segunda inspección
+--              fila a fila en cada petición.
+--              Ahora:
+--                - fn_categoria_segunda: categoría de urgencia de la segunda
+--                  inspección (una sola definición para vista y resumen)
+--                - v_inspecciones_dashboard: inspección + OCA + contadores
+--                  de defectos + categoria_segunda + dias_hasta_segunda
+--                - fn_resumen_inspecciones: totales por categoría con los
+--                  filtros del dashboard (sin tocar defectos)
+--                - Índice para contar defectos de una inspección sin leer
+--                  la tabla
+--
+-- Uso desde PostgREST:
+--   GET  /rest/v1/v_inspecciones_dashboard?categoria_segunda=eq.vencidas
+--        &order=fecha_segunda_inspeccion.asc,id.asc&limit=50
+--   POST /rest/v1/rpc/fn_resumen_inspecciones
+--        {"p_oca_id": 3, "p_busqueda": "ascensor"}
+--
+-- Filtros: NULL o '' = sin filtro.
+-- ============================================
+
+-- ============================================
+-- PASO 1: ÍNDICES DE APOYO
+-- ============================================
+
+-- Contadores de defectos por inspección (index-only scan)
+CREATE INDEX IF NOT EXISTS idx_defectos_inspeccion_estado_plazo
+    ON defectos_inspeccion(inspeccion_id, estado, plazo_meses);
+
+-- Sección "programadas" ordenada por fecha de inspección
+CREATE INDEX IF NOT EXISTS idx_inspecciones_fecha_id
+    ON inspecciones(fecha_inspeccion DESC, id DESC);
+
+-- ============================================
+-- PASO 2: CATEGORÍA DE LA SEGUNDA INSPECCIÓN
+-- ============================================
+
+CREATE OR REPLACE FUNCTION fn_categoria_segunda(
+    p_fecha_segunda DATE,
+    p_fecha_realizada DATE
+)
+RETURNS TEXT
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT CASE
+        WHEN p_fecha_realizada IS NOT NULL THEN 'realizadas'
+        WHEN p_fecha_segunda IS NULL THEN 'sin-fecha'
+        WHEN p_fecha_segunda < CURRENT_DATE THEN 'vencidas'
+        WHEN p_fecha_segunda - CURRENT_DATE <= 30 THEN 'este-mes'
+        WHEN p_fecha_segunda - CURRENT_DATE <= 60 THEN 'proximo-mes'
+        ELSE 'pendiente'
+    END;
+$$;
+
+-- ============================================
+-- PASO 3: VISTA CON CONTADORES
+-- ============================================
+
+CREATE OR REPLACE VIEW v_inspecciones_dashboard
+WITH (security_invoker=on) AS
+SELECT
+    i.*,
+    o.nombre AS oca_nombre,
+    COALESCE(d.total, 0) AS defectos_total,
+    COALESCE(d.pendientes, 0) AS defectos_pendientes,
+    COALESCE(d.plazo_6, 0) AS defectos_plazo_6,
+    COALESCE(d.plazo_12, 0) AS defectos_plazo_12,
+    fn_categoria_segunda(i.fecha_segunda_inspeccion, i.fecha_segunda_realizada) AS categoria_segunda,
+    (i.fecha_segunda_inspeccion - CURRENT_DATE) AS dias_hasta_segunda
+FROM inspecciones i
+LEFT JOIN ocas o ON o.id = i.oca_id
+LEFT JOIN LATERAL (
+    SELECT
+        COUNT(*) AS total,
+        COUNT(*) FILTER (WHERE di.estado = 'PENDIENTE') AS pendientes,
+        COUNT(*) FILTER (WHERE di.estado = 'PENDIENTE' AND di.plazo_meses = 6) AS plazo_6,
+        COUNT(*) FILTER (WHERE di.estado = 'PENDIENTE' AND di.plazo_meses = 12) AS plazo_12
+    FROM defectos_inspeccion di
+    WHERE di.inspeccion_id = i.id
+) d ON TRUE;
+
+-- ============================================
+-- PASO 4: TOTALES POR CATEGORÍA
+-- ============================================
+
+CREATE OR REPLACE FUNCTION fn_resumen_inspecciones(
+    p_oca_id INTEGER DEFAULT NULL,
+    p_busqueda TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    WITH categorias AS (
+        SELECT fn_categoria_segunda(i.fecha_segunda_inspeccion, i.fecha_segunda_realizada) AS categoria
+        FROM inspecciones i
+        WHERE (p_oca_id IS NULL OR i.oca_id = p_oca_id)
+        AND (NULLIF(p_busqueda, '') IS NULL OR i.maquina ILIKE '%' || p_busqueda || '%')
+    )
+    SELECT jsonb_build_object(
+        'total', COUNT(*),
+        'vencidas', COUNT(*) FILTER (WHERE categoria = 'vencidas'),
+        'este-mes', COUNT(*) FILTER (WHERE categoria = 'este-mes'),
+        'proximo-mes', COUNT(*) FILTER (WHERE categoria = 'proximo-mes'),
+        'pendiente', COUNT(*) FILTER (WHERE categoria = 'pendiente'),
+        'realizadas', COUNT(*) FILTER (WHERE categoria = 'realizadas'),
+        'sin-fecha', COUNT(*) FILTER (WHERE categoria = 'sin-fecha')
+    )
+    FROM categorias;
+$$;
+
+-- Permitir la llamada vía PostgREST
+GRANT EXECUTE ON FUNCTION fn_categoria_segunda(DATE, DATE) TO anon, authenticated;
+GRANT EXECUTE ON FUNCTION fn_resumen_inspecciones(INTEGER, TEXT) TO anon, authenticated;
+GRANT SELECT ON v_inspecciones_dashboard TO anon, authenticated;
+
+-- ============================================
+-- VERIFICACIÓN FINAL
+-- ============================================
+
+DO $$
+BEGIN
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '✅ MIGRACIÓN 021 COMPLETADA';
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '📊 VISTAS CREADAS:';
+    RAISE NOTICE '   - v_inspecciones_dashboard';
+    RAISE NOTICE '📈 FUNCIONES CREADAS:';
+    RAISE NOTICE '   - fn_categoria_segunda(fecha_segunda, fecha_realizada)';
+    RAISE NOTICE '   - fn_resumen_inspecciones(oca_id, busqueda)';
+    RAISE NOTICE '📇 ÍNDICES CREADOS:';
+    RAISE NOTICE '   - idx_defectos_inspeccion_estado_plazo';
+    RAISE NOTICE '   - idx_inspecciones_fecha_id';
+END
+$$;
+
+-- Registrar esta migración
+INSERT INTO schema_migrations (version, executed_at)
+VALUES ('021', NOW())
+ON CONFLICT (version) DO NOTHING;
@@ -0,0 +1,54 @@
+-- ============================================
+-- MIGRACIÓN 022: Índices para la paginación por cursor
+-- ============================================
+-- Fecha: 2026-10-19
+-- Descripción: Los listados de leads, visitas a administradores y
+--              recomendaciones de cartera paginan por cursor (keyset,
+--              utils/pagination.CursorPagination) en lugar de
+--              limit/offset + count=exact:
+--                ?order=<columna>.desc,id.desc&limit=26
+--                &or=(<columna>.lt.X,and(<columna>.eq.X,id.lt.Y))
+--              Con un índice sobre (columna, id) cada página es un
+--              recorrido de índice desde el cursor: la página N cuesta lo
+--              mismo que la primera. El total se estima con
+--              Prefer: count=estimated (estadísticas del planificador), por
+--              eso se actualizan con ANALYZE.
+-- ============================================
+
+-- Leads (más recientes primero)
+CREATE INDEX IF NOT EXISTS idx_clientes_created_at_id
+ON clientes(created_at DESC, id DESC);
+
+-- Visitas a administradores (más recientes primero)
+CREATE INDEX IF NOT EXISTS idx_visitas_administradores_fecha_id
+ON visitas_administradores(fecha_visita DESC, id DESC);
+
+-- Recomendaciones pendientes (v_partes_con_recomendaciones)
+CREATE INDEX IF NOT EXISTS idx_partes_trabajo_recomendaciones_fecha_id
+ON partes_trabajo(fecha_parte DESC, id DESC)
+WHERE tiene_recomendacion = true;
+
+ANALYZE clientes;
+ANALYZE visitas_administradores;
+ANALYZE partes_trabajo;
+
+-- ============================================
+-- VERIFICACIÓN FINAL
+-- ============================================
+
+DO $$
+BEGIN
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '✅ MIGRACIÓN 022 COMPLETADA';
+    RAISE NOTICE '═══════════════════════════════════════════';
+    RAISE NOTICE '📈 ÍNDICES CREADOS:';
+    RAISE NOTICE '   - idx_clientes_created_at_id';
+    RAISE NOTICE '   - idx_visitas_administradores_fecha_id';
+    RAISE NOTICE '   - idx_partes_trabajo_recomendaciones_fecha_id';
+END
+$$;
+
+-- Registrar esta migración
+INSERT INTO schema_migrations (version, executed_at)
+VALUES ('022', NOW())
+ON CONFLICT (version) DO NOTHING;
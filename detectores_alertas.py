@@ -16,6 +16,9 @@ import requests
 from datetime import datetime, timedelta
 from collections import defaultdict
 import logging
+import time
+
+from middleware.metricas import registro as metricas
 
 # Configuración de logging
 logging.basicConfig(
@@ -674,6 +677,17 @@ def detectar_instalaciones_criticas():
 # FUNCIÓN PRINCIPAL
 # ============================================
 
+def _ejecutar_detector(nombre, detector):
+    """Ejecuta un detector registrando su duración y las alertas creadas en /metrics"""
+    inicio = time.perf_counter()
+    try:
+        alertas = detector()
+    finally:
+        metricas.observar('detector_ejecucion_segundos', time.perf_counter() - inicio, detector=nombre)
+    metricas.incrementar('detector_alertas_total', alertas, detector=nombre)
+    return alertas
+
+
 def ejecutar_todos_los_detectores():
     """Ejecuta todos los detectores de alertas"""
     logger.info("="*70)
@@ -686,20 +700,20 @@ def ejecutar_todos_los_detectores():
 
     try:
         # Detector 1: Fallas repetidas
-        total_alertas += detectar_fallas_repetidas()
+        total_alertas += _ejecutar_detector('fallas_repetidas', detectar_fallas_repetidas)
         logger.info("")
 
         # Detector 2: Recomendaciones ignoradas
-        total_alertas += detectar_recomendaciones_ignoradas()
+        total_alertas += _ejecutar_detector('recomendaciones_ignoradas', detectar_recomendaciones_ignoradas)
         logger.info("")
 
         # Detector 3: Mantenimientos omitidos - DESACTIVADO
         # El seguimiento de mantenimientos faltantes lo gestiona otro departamento
-        # total_alertas += detectar_mantenimientos_omitidos()
+        # total_alertas += _ejecutar_detector('mantenimientos_omitidos', detectar_mantenimientos_omitidos)
         # logger.info("")
 
         # Detector 4: Instalaciones críticas
-        total_alertas += detectar_instalaciones_criticas()
+        total_alertas += _ejecutar_detector('instalaciones_criticas', detectar_instalaciones_criticas)
         logger.info("")
 
     except Exception as e:
@@ -1,15 +1,41 @@
 """
 Servicio de geocodificación de direcciones
 Convierte direcciones a coordenadas geográficas usando Nominatim (OpenStreetMap)
+
+Las respuestas se guardan en una caché persistente (SQLite, ver
+cache_persistente.py) por consulta normalizada: repetir un análisis de zonas
+no vuelve a llamar a Nominatim ni espera el rate limit.
 """
 
 import requests
 import logging
+import re
+import unicodedata
 from typing import Optional, Dict, List
-from time import sleep
+
+from cache_persistente import CacheSQLite, ruta_cache
+from limitador_tasa import LimitadorTasa
 
 logger = logging.getLogger(__name__)
 
+# Validez de las entradas de la caché de geocodificación
+TTL_GEOCODIFICACION_DIAS = 90
+# Validez de las consultas sin resultado (la dirección puede corregirse en OSM)
+TTL_GEOCODIFICACION_NEGATIVA_DIAS = 7
+
+
+def normalizar_consulta(texto: str) -> str:
+    """
+    Normaliza una consulta de geocodificación para usarla como clave de caché.
+    Minúsculas, sin acentos, sin puntuación repetida ni espacios extra:
+    "Calle  Aconcagua , Las Palmas" == "calle aconcagua, las palmas"
+    """
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = re.sub(r'\s*,\s*', ', ', texto)
+    texto = re.sub(r'[^\w,/ºª-]+', ' ', texto)
+    return re.sub(r'\s+', ' ', texto).strip(' ,')
+
 
 class GeocodingService:
     """
@@ -20,19 +46,121 @@ class GeocodingService:
     BASE_URL = "https://nominatim.openstreetmap.org/search"
     REVERSE_URL = "https://nominatim.openstreetmap.org/reverse"
 
-    def __init__(self, user_agent: str = "AscensorAlert/1.0"):
+    def __init__(
+        self,
+        user_agent: str = "AscensorAlert/1.0",
+        cache: Optional[CacheSQLite] = None,
+        usar_cache: bool = True,
+        ttl_dias: float = TTL_GEOCODIFICACION_DIAS,
+        ttl_negativo_dias: float = TTL_GEOCODIFICACION_NEGATIVA_DIAS,
+        limitador: Optional[LimitadorTasa] = None
+    ):
         """
         Inicializa el servicio de geocodificación.
 
         Args:
             user_agent: Identificador de la aplicación (requerido por Nominatim)
+            cache: Caché a usar (por defecto una SQLite en ZONAS_CACHE_DIR)
+            usar_cache: Si False, todas las consultas van a Nominatim
+            ttl_dias: Validez de las geocodificaciones en caché
+            ttl_negativo_dias: Validez de las consultas sin resultado en caché
+            limitador: Limitador de tasa (por defecto 1 petición/s, el máximo de
+                Nominatim); pasar uno compartido si hay varias instancias o hilos
         """
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': user_agent
         })
         # Nominatim requiere máximo 1 petición por segundo
-        self.min_delay = 1.0
+        self.limitador = limitador or LimitadorTasa(peticiones_por_segundo=1.0, rafaga=1)
+
+        if cache is None and usar_cache:
+            cache = CacheSQLite(
+                ruta_cache('geocodificacion'),
+                tabla='nominatim',
+                ttl_segundos=ttl_dias * 24 * 3600,
+                ttl_negativo_segundos=ttl_negativo_dias * 24 * 3600
+            )
+        self.cache = cache
+
+    def _consultar(self, url: str, params: Dict, clave: str):
+        """
+        Consulta Nominatim con caché persistente.
+
+        Args:
+            url: Endpoint (BASE_URL o REVERSE_URL)
+            params: Parámetros de la petición
+            clave: Clave de caché (consulta normalizada)
+
+        Returns:
+            JSON de la respuesta (lista vacía / dict vacío si no hubo resultado).
+            Lanza requests.exceptions.RequestException en errores de red (no se cachean).
+        """
+        if self.cache is not None:
+            encontrado, valor = self.cache.obtener(clave)
+            if encontrado:
+                logger.debug(f"Geocodificación desde caché: {clave}")
+                return valor if valor is not None else ([] if url == self.BASE_URL else {})
+
+        # Rate limit solo antes de peticiones reales: los aciertos de caché no esperan
+        self.limitador.adquirir()
+        response = self.session.get(url, params=params, timeout=10)
+        response.raise_for_status()
+        resultado = response.json()
+
+        if self.cache is not None:
+            if url == self.BASE_URL:
+                # Solo el primer resultado (limit=1) con los campos que se usan
+                resultado = [
+                    {k: r[k] for k in ('lat', 'lon', 'display_name', 'type', 'importance', 'boundingbox') if k in r}
+                    for r in resultado[:1]
+                ]
+            else:
+                resultado = {'display_name': resultado['display_name']} if resultado.get('display_name') else {}
+            # Sin resultado: entrada negativa
+            self.cache.guardar(clave, resultado or None)
+
+        return resultado
+
+    def _buscar(self, query: str) -> List[Dict]:
+        """Búsqueda directa (search) de Nominatim con caché"""
+        params = {
+            'q': query,
+            'format': 'json',
+            'limit': 1,
+            'addressdetails': 1
+        }
+        return self._consultar(self.BASE_URL, params, f"search|{normalizar_consulta(query)}")
+
+    def geocodificar_desde_cache(
+        self,
+        direccion: str,
+        ciudad: str = "Las Palmas de Gran Canaria",
+        pais: str = "España"
+    ) -> Optional[Dict]:
+        """
+        Coordenadas de una dirección solo si ya están en la caché (sin llamar
+        a Nominatim ni esperar el rate limit). Misma consulta que geocodificar_direccion.
+
+        Returns:
+            {'latitud', 'longitud', 'direccion_completa'} o None si no está en caché
+            o se cacheó sin resultado
+        """
+        if self.cache is None:
+            return None
+        query = f"{direccion}, {ciudad}, {pais}"
+        encontrado, results = self.cache.obtener(f"search|{normalizar_consulta(query)}")
+        if not encontrado or not results:
+            return None
+        return {
+            'latitud': float(results[0]['lat']),
+            'longitud': float(results[0]['lon']),
+            'direccion_completa': results[0].get('display_name', query)
+        }
+
+    def estadisticas_cache(self) -> Dict:
+        """Aciertos, fallos y tasa de aciertos de la caché de geocodificación"""
+        return self.cache.estadisticas() if self.cache is not None else {}
 
     def geocodificar_direccion(
         self,
@@ -61,24 +189,10 @@ class GeocodingService:
         # Construir query completa
         query = f"{direccion}, {ciudad}, {pais}"
 
-        params = {
-            'q': query,
-            'format': 'json',
-            'limit': 1,
-            'addressdetails': 1
-        }
-
         try:
             logger.info(f"Geocodificando: {query}")
 
-            response = self.session.get(
-                self.BASE_URL,
-                params=params,
-                timeout=10
-            )
-            response.raise_for_status()
-
-            results = response.json()
+            results = self._buscar(query)
 
             if not results or len(results) == 0:
                 logger.warning(f"No se encontraron resultados para: {query}")
@@ -98,9 +212,6 @@ class GeocodingService:
 
             logger.info(f"Geocodificado: {direccion} -> ({coords['latitud']}, {coords['longitud']})")
 
-            # Respetar rate limit
-            sleep(self.min_delay)
-
             return coords
 
         except requests.exceptions.RequestException as e:
@@ -161,24 +272,10 @@ class GeocodingService:
         """
         query = f"{zona}, {ciudad}, España"
 
-        params = {
-            'q': query,
-            'format': 'json',
-            'limit': 1,
-            'addressdetails': 1
-        }
-
         try:
             logger.info(f"Geocodificando zona: {query}")
 
-            response = self.session.get(
-                self.BASE_URL,
-                params=params,
-                timeout=10
-            )
-            response.raise_for_status()
-
-            results = response.json()
+            results = self._buscar(query)
 
             if not results:
                 logger.warning(f"No se encontró la zona: {query}")
@@ -217,7 +314,6 @@ class GeocodingService:
 
             logger.info(f"Zona geocodificada: {zona} -> centro ({lat_centro}, {lon_centro}), área {area_km2:.2f} km²")
 
-            sleep(self.min_delay)
             return zona_data
 
         except Exception as e:
@@ -247,17 +343,10 @@ class GeocodingService:
         }
 
         try:
-            response = self.session.get(
-                self.REVERSE_URL,
-                params=params,
-                timeout=10
-            )
-            response.raise_for_status()
-
-            result = response.json()
+            # ~10 cm de precisión en la clave
+            result = self._consultar(self.REVERSE_URL, params, f"reverse|{latitud:.6f},{longitud:.6f}")
             direccion = result.get('display_name', '')
 
-            sleep(self.min_delay)
             return direccion
 
         except Exception as e:
@@ -22,46 +22,6 @@ HEADERS = {
     "Prefer": "return=representation"
 }
 
-# ============================================
-# FUNCIONES AUXILIARES
-# ============================================
-
-def validar_fecha(fecha_str):
-    """Convierte fecha a formato correcto o devuelve None"""
-    if pd.isna(fecha_str) or fecha_str == "" or fecha_str == "-":
-        return None
-    
-    try:
-        if isinstance(fecha_str, datetime):
-            return fecha_str.strftime('%Y-%m-%d')
-        
-        fecha_str = str(fecha_str).strip()
-        formatos = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y']
-        
-        for formato in formatos:
-            try:
-                fecha_obj = datetime.strptime(fecha_str, formato)
-                return fecha_obj.strftime('%Y-%m-%d')
-            except:
-                continue
-        
-        return None
-    except:
-        return None
-
-
-def verificar_comunidad_existe(cliente_id):
-    """Verifica si existe la comunidad en la base de datos"""
-    response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/clientes?id=eq.{cliente_id}&select=id,nombre_cliente",
-        headers=HEADERS
-    )
-    
-    if response.status_code == 200 and response.json():
-        return True, response.json()[0].get('nombre_cliente', 'Sin nombre')
-    return False, None
-
-
 # ============================================
 # EXPORTAR EQUIPOS
 # ============================================
@@ -156,7 +116,14 @@ def exportar_equipos():
 # ============================================
 
 def importar_equipos(archivo_excel):
-    """Lee el Excel e importa/actualiza los equipos en Supabase"""
+    """
+    Lee el Excel e importa/actualiza los equipos en Supabase
+
+    La importación la hace services/equipos_service.py (la misma que el
+    trabajo en segundo plano de /equipos/importar), que usa la configuración
+    de la aplicación: requiere también SECRET_KEY en el entorno.
+    """
+    from services import equipos_service
     
     print("=" * 60)
     print("📤 IMPORTANDO EQUIPOS A SUPABASE")
@@ -165,145 +132,34 @@ def importar_equipos(archivo_excel):
     
     # Leer Excel
     try:
-        df = pd.read_excel(archivo_excel)
+        df = equipos_service.leer_excel_equipos(archivo_excel)
         print(f"✅ Archivo Excel leído correctamente")
         print(f"📊 Total de filas encontradas: {len(df)}")
         print()
     except FileNotFoundError:
         print(f"❌ ERROR: No se encuentra el archivo '{archivo_excel}'")
         return
+    except ValueError as e:
+        print(f"❌ ERROR: {e}")
+        return
     except Exception as e:
         print(f"❌ ERROR al leer Excel: {e}")
         return
     
-    # Validar columnas requeridas
-    columnas_requeridas = ['id_comunidad', 'tipo_equipo']
-    columnas_faltantes = [col for col in columnas_requeridas if col not in df.columns]
-    
-    if columnas_faltantes:
-        print(f"❌ ERROR: Faltan columnas requeridas: {', '.join(columnas_faltantes)}")
-        return
-    
-    # Procesar cada fila
-    insertados = 0
-    actualizados = 0
-    errores = 0
-    errores_detalle = []
-    
-    for idx, row in df.iterrows():
-        fila_num = idx + 2  # +2 porque Excel empieza en 1 y tiene encabezado
-        
-        # Determinar si es actualización o inserción
-        id_equipo = row.get('id_equipo')
-        es_actualizacion = not pd.isna(id_equipo) and str(id_equipo).strip() != ''
-        
-        # Validar cliente_id
-        cliente_id = row.get('id_comunidad')
-        
-        if pd.isna(cliente_id):
-            errores += 1
-            errores_detalle.append(f"Fila {fila_num}: ID de comunidad vacío")
-            continue
-        
-        try:
-            cliente_id = int(cliente_id)
-        except:
-            errores += 1
-            errores_detalle.append(f"Fila {fila_num}: ID de comunidad inválido ({cliente_id})")
-            continue
-        
-        # Verificar que la comunidad existe
-        existe, nombre_comunidad = verificar_comunidad_existe(cliente_id)
-        if not existe:
-            errores += 1
-            errores_detalle.append(f"Fila {fila_num}: Comunidad ID {cliente_id} no existe")
-            continue
-        
-        # Validar tipo_equipo
-        tipo_equipo = row.get('tipo_equipo')
-        if pd.isna(tipo_equipo) or str(tipo_equipo).strip() == "":
-            errores += 1
-            errores_detalle.append(f"Fila {fila_num}: Tipo de equipo vacío")
-            continue
-        
-        # Preparar datos del equipo
-        equipo_data = {
-            "cliente_id": cliente_id,
-            "tipo_equipo": str(tipo_equipo).strip(),
-            "identificacion": str(row.get('identificacion', '')).strip() if not pd.isna(row.get('identificacion')) else None,
-            "rae": str(row.get('rae', '')).strip() if not pd.isna(row.get('rae')) else None,
-            "descripcion": str(row.get('observaciones', '')).strip() if not pd.isna(row.get('observaciones')) else None,
-            "ipo_proxima": validar_fecha(row.get('ipo_proxima')),
-            "fecha_vencimiento_contrato": validar_fecha(row.get('fecha_vencimiento_contrato'))
-        }
-        
-        # Limpiar valores vacíos pero mantener None explícitos para fechas
-        equipo_data_limpio = {}
-        for k, v in equipo_data.items():
-            if k in ['ipo_proxima', 'fecha_vencimiento_contrato']:
-                # Para fechas, siempre incluir (puede ser None para borrar)
-                equipo_data_limpio[k] = v
-            elif v not in ['', 'nan']:
-                # Para otros campos, solo incluir si tienen valor
-                equipo_data_limpio[k] = v
-        
-        # Insertar o actualizar en Supabase
-        try:
-            if es_actualizacion:
-                # ACTUALIZAR equipo existente
-                try:
-                    id_equipo_int = int(id_equipo)
-                except:
-                    errores += 1
-                    errores_detalle.append(f"Fila {fila_num}: ID de equipo inválido ({id_equipo})")
-                    continue
-                
-                response = requests.patch(
-                    f"{SUPABASE_URL}/rest/v1/equipos?id=eq.{id_equipo_int}",
-                    json=equipo_data_limpio,
-                    headers=HEADERS
-                )
-                
-                if response.status_code in [200, 204]:
-                    actualizados += 1
-                    print(f"🔄 Fila {fila_num}: Equipo ID {id_equipo_int} actualizado en '{nombre_comunidad}'")
-                else:
-                    errores += 1
-                    errores_detalle.append(f"Fila {fila_num}: Error API UPDATE - {response.text[:100]}")
-                    print(f"❌ Fila {fila_num}: Error al actualizar equipo ID {id_equipo_int}")
-            
-            else:
-                # INSERTAR equipo nuevo
-                response = requests.post(
-                    f"{SUPABASE_URL}/rest/v1/equipos",
-                    json=equipo_data_limpio,
-                    headers=HEADERS
-                )
-                
-                if response.status_code in [200, 201]:
-                    insertados += 1
-                    print(f"✅ Fila {fila_num}: Equipo nuevo añadido a '{nombre_comunidad}'")
-                else:
-                    errores += 1
-                    errores_detalle.append(f"Fila {fila_num}: Error API INSERT - {response.text[:100]}")
-                    print(f"❌ Fila {fila_num}: Error al insertar equipo")
-        
-        except Exception as e:
-            errores += 1
-            errores_detalle.append(f"Fila {fila_num}: Excepción - {str(e)}")
-            print(f"❌ Fila {fila_num}: Error de conexión")
+    stats = equipos_service.procesar_equipos(df)
+    errores_detalle = stats['errores_detalle']
     
     # Resumen final
     print()
     print("=" * 60)
     print("📊 RESUMEN DE IMPORTACIÓN")
     print("=" * 60)
-    print(f"✅ Equipos nuevos insertados: {insertados}")
-    print(f"🔄 Equipos actualizados: {actualizados}")
-    print(f"❌ Errores: {errores}")
+    print(f"✅ Equipos nuevos insertados: {stats['insertados']}")
+    print(f"🔄 Equipos actualizados: {stats['actualizados']}")
+    print(f"❌ Errores: {stats['errores']}")
     print()
     
-    if errores > 0:
+    if stats['errores'] > 0:
         print("⚠️  DETALLE DE ERRORES:")
         print("-" * 60)
         for error in errores_detalle[:10]:  # Mostrar máximo 10 errores
@@ -314,6 +170,7 @@ def importar_equipos(archivo_excel):
     
     print("✨ Importación completada")
     print("=" * 60)
+    return stats
 
 
 # ============================================
@@ -0,0 +1,80 @@
+"""
+Limitador de tasa (token bucket) compartido entre hilos
+Usado por los servicios que consultan APIs públicas (Nominatim, Catastro)
+para respetar sus límites de uso aunque las consultas se hagan en paralelo
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+
+class LimitadorTasa:
+    """
+    Token bucket: se reponen peticiones_por_segundo fichas por segundo hasta
+    un máximo de rafaga; cada petición consume una ficha y, si no hay, espera.
+
+    Con rafaga=1 equivale a una pausa fija de 1/peticiones_por_segundo entre
+    peticiones. Seguro entre hilos: todos los workers comparten el mismo cubo.
+
+    Con padre, cada petición consume además una ficha del limitador padre:
+    límites por servicio bajo un límite global común.
+    """
+
+    def __init__(
+        self,
+        peticiones_por_segundo: float,
+        rafaga: int = 1,
+        padre: Optional['LimitadorTasa'] = None
+    ):
+        """
+        Args:
+            peticiones_por_segundo: Tasa sostenida máxima
+            rafaga: Peticiones que pueden salir seguidas tras un periodo inactivo
+            padre: Limitador global que se aplica además de este
+        """
+        if peticiones_por_segundo <= 0:
+            raise ValueError("peticiones_por_segundo debe ser mayor que 0")
+        if rafaga < 1:
+            raise ValueError("rafaga debe ser al menos 1")
+
+        self.peticiones_por_segundo = peticiones_por_segundo
+        self.rafaga = rafaga
+        self.padre = padre
+        self._fichas = float(rafaga)
+        self._actualizado = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.peticiones = 0
+        self.segundos_esperados = 0.0
+
+    def _reponer(self, ahora: float):
+        transcurrido = ahora - self._actualizado
+        self._fichas = min(self.rafaga, self._fichas + transcurrido * self.peticiones_por_segundo)
+        self._actualizado = ahora
+
+    def adquirir(self):
+        """Bloquea hasta que haya una ficha disponible y la consume"""
+        with self._lock:
+            self._reponer(time.monotonic())
+            self._fichas -= 1
+            self.peticiones += 1
+            # Fichas negativas = peticiones ya reservadas por otros hilos
+            espera = -self._fichas / self.peticiones_por_segundo if self._fichas < 0 else 0.0
+            self.segundos_esperados += espera
+
+        # Se duerme fuera del lock: la ficha ya está reservada, el orden se respeta
+        if espera > 0:
+            time.sleep(espera)
+
+        if self.padre is not None:
+            self.padre.adquirir()
+
+    def estadisticas(self) -> Dict:
+        """Peticiones autorizadas y tiempo total esperado por el limitador"""
+        return {
+            'peticiones': self.peticiones,
+            'segundos_esperados': round(self.segundos_esperados, 2),
+            'peticiones_por_segundo': self.peticiones_por_segundo,
+            'rafaga': self.rafaga
+        }
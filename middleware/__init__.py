@@ -0,0 +1,12 @@
+"""
+Middleware de la aplicación
+
+- tiempos: tiempo por petición, trazado de llamadas a Supabase,
+  cabecera Server-Timing y log estructurado
+- metricas: registro de contadores e histogramas agregado entre workers
+  (expuesto en /metrics)
+
+Los submódulos se importan directamente (from middleware import tiempos):
+metricas no depende de Flask ni de config, así que también lo usan scripts
+sueltos como detectores_alertas.py.
+"""
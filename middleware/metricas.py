@@ -0,0 +1,377 @@
+"""
+Registro de métricas en proceso, agregadas entre workers de gunicorn
+
+Contadores, histogramas y gauges al estilo Prometheus:
+- Cada worker acumula en memoria (un lock y un par de sumas por observación,
+  sin E/S en la petición) y vuelca sus valores cada INTERVALO_VOLCADO
+  segundos a un fichero propio (<pid>.json) en DIRECTORIO_METRICAS
+  (escritura atómica: temporal + rename)
+- /metrics (routes/metricas) vuelca el worker que atiende la petición, lee
+  los ficheros de todos y los agrega: contadores e histogramas se suman
+  (incluidos workers ya terminados, para que no retrocedan en cada reinicio),
+  los gauges por worker solo de los procesos vivos
+- Los gauges globales (p. ej. la bandeja de emails, que ya está en disco) se
+  calculan en el momento del scrape
+
+Los datos de otros workers pueden llevar hasta INTERVALO_VOLCADO segundos de
+retraso. Tras un fork (gunicorn --preload) el hijo empieza con valores vacíos.
+"""
+from bisect import bisect_left
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+DIRECTORIO_METRICAS = os.environ.get(
+    "METRICS_DIR",
+    os.path.join(tempfile.gettempdir(), "ascensoralert_metricas")
+)
+
+# Frecuencia de volcado a disco de cada worker (segundos)
+INTERVALO_VOLCADO = 10
+
+# Ficheros de workers terminados que no se actualizan en este tiempo se eliminan
+RETENCION_FICHEROS = 24 * 3600
+
+# Buckets (segundos) de latencia de peticiones y llamadas a Supabase
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Buckets (segundos) de trabajos largos: detectores, importaciones, refrescos de caché
+BUCKETS_TRABAJOS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+CONTADOR = 'counter'
+HISTOGRAMA = 'histogram'
+GAUGE = 'gauge'
+
+
+def _clave_etiquetas(etiquetas):
+    return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+def _escapar(valor):
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatear_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{k}="{_escapar(v)}"' for k, v in pares) + '}'
+
+
+def _formatear_numero(valor):
+    if valor == math.inf:
+        return '+Inf'
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RegistroMetricas:
+    """
+    Métricas de un proceso con volcado periódico a disco.
+
+    Las métricas se declaran una vez (contador, histograma, gauge) y se
+    actualizan con incrementar / observar. Los gauges se calculan con una
+    función: por_trabajador=True se evalúa en cada worker al volcar y se suma
+    entre workers vivos; False se evalúa solo al exponer (valores globales).
+    """
+
+    def __init__(self, directorio=DIRECTORIO_METRICAS, intervalo_volcado=INTERVALO_VOLCADO):
+        self.directorio = directorio
+        self.intervalo_volcado = intervalo_volcado
+        self._definiciones = {}
+        self._lock = threading.Lock()
+        self._reiniciar_proceso()
+
+    def _reiniciar_proceso(self):
+        self._pid = os.getpid()
+        self._contadores = {}
+        self._histogramas = {}
+        self._cambios = False
+        self._hilo = None
+
+    def _comprobar_proceso(self):
+        """Tras un fork el hijo no hereda los valores ni el hilo de volcado del padre"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._lock = threading.Lock()
+                    self._reiniciar_proceso()
+
+    # ============================================
+    # DECLARACIÓN
+    # ============================================
+
+    def contador(self, nombre, ayuda):
+        self._definiciones[nombre] = {'tipo': CONTADOR, 'ayuda': ayuda}
+
+    def histograma(self, nombre, ayuda, buckets=BUCKETS_LATENCIA):
+        self._definiciones[nombre] = {'tipo': HISTOGRAMA, 'ayuda': ayuda, 'buckets': tuple(buckets)}
+
+    def gauge(self, nombre, ayuda, funcion, por_trabajador=False):
+        """
+        Args:
+            funcion: Callable sin argumentos que devuelve un número o una
+                lista de (etiquetas dict, valor)
+            por_trabajador: True si el valor es propio de cada worker (colas
+                en memoria); se suma entre los workers vivos
+        """
+        self._definiciones[nombre] = {'tipo': GAUGE, 'ayuda': ayuda, 'funcion': funcion,
+                                      'por_trabajador': por_trabajador}
+
+    # ============================================
+    # ACTUALIZACIÓN
+    # ============================================
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        """Suma valor a un contador"""
+        self._comprobar_proceso()
+        clave = (nombre, _clave_etiquetas(etiquetas))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+            self._cambios = True
+        self._asegurar_volcado()
+
+    def observar(self, nombre, valor, **etiquetas):
+        """Registra una observación (segundos, bytes...) en un histograma"""
+        self._comprobar_proceso()
+        buckets = self._definiciones[nombre]['buckets']
+        # Bucket con el primer límite >= valor (el último es +Inf)
+        indice = bisect_left(buckets, valor)
+        clave = (nombre, _clave_etiquetas(etiquetas))
+        with self._lock:
+            datos = self._histogramas.get(clave)
+            if datos is None:
+                datos = self._histogramas[clave] = [[0] * (len(buckets) + 1), 0.0, 0]
+            datos[0][indice] += 1
+            datos[1] += valor
+            datos[2] += 1
+            self._cambios = True
+        self._asegurar_volcado()
+
+    def cronometrar(self, nombre, **etiquetas):
+        """Context manager que observa la duración del bloque en un histograma"""
+        return _Cronometro(self, nombre, etiquetas)
+
+    # ============================================
+    # VOLCADO A DISCO
+    # ============================================
+
+    def _asegurar_volcado(self):
+        if self._hilo is not None:
+            return
+        with self._lock:
+            if self._hilo is not None:
+                return
+            self._hilo = threading.Thread(target=self._bucle_volcado, name="volcado-metricas", daemon=True)
+            self._hilo.start()
+
+    def _bucle_volcado(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.intervalo_volcado)
+            try:
+                self.volcar()
+            except Exception as e:
+                logger.warning(f"No se pudieron volcar las métricas: {type(e).__name__}: {str(e)}")
+
+    def _gauges_trabajador(self):
+        valores = []
+        for nombre, definicion in self._definiciones.items():
+            if definicion['tipo'] == GAUGE and definicion['por_trabajador']:
+                for etiquetas, valor in self._evaluar_gauge(nombre, definicion):
+                    valores.append([nombre, dict(etiquetas), valor])
+        return valores
+
+    def volcar(self):
+        """Escribe los valores de este proceso en <pid>.json"""
+        self._comprobar_proceso()
+        gauges = self._gauges_trabajador()
+        with self._lock:
+            if not self._cambios and not gauges:
+                return
+            contenido = {
+                'pid': self._pid,
+                'actualizado': time.time(),
+                'contadores': [[n, dict(e), v] for (n, e), v in self._contadores.items()],
+                'histogramas': [[n, dict(e), list(d[0]), d[1], d[2]] for (n, e), d in self._histogramas.items()],
+                'gauges': gauges,
+            }
+            self._cambios = False
+
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta = os.path.join(self.directorio, f"{self._pid}.json")
+        tmp = f"{ruta}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(contenido, f)
+        os.replace(tmp, ruta)
+
+    def _leer_ficheros(self):
+        """Contenido de los ficheros de todos los workers (elimina los caducados)"""
+        if not os.path.isdir(self.directorio):
+            return []
+        limite = time.time() - RETENCION_FICHEROS
+        ficheros = []
+        for nombre in os.listdir(self.directorio):
+            if not nombre.endswith('.json'):
+                continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                with open(ruta, encoding='utf-8') as f:
+                    contenido = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            vivo = _proceso_vivo(contenido.get('pid', 0))
+            if not vivo and contenido.get('actualizado', 0) < limite:
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+                continue
+            contenido['vivo'] = vivo
+            ficheros.append(contenido)
+        return ficheros
+
+    # ============================================
+    # EXPOSICIÓN
+    # ============================================
+
+    def _evaluar_gauge(self, nombre, definicion):
+        try:
+            resultado = definicion['funcion']()
+        except Exception as e:
+            logger.warning(f"Gauge {nombre} no disponible: {type(e).__name__}: {str(e)}")
+            return []
+        if resultado is None:
+            return []
+        if isinstance(resultado, (int, float)):
+            return [((), resultado)]
+        return [(_clave_etiquetas(etiquetas), valor) for etiquetas, valor in resultado]
+
+    def exposicion(self):
+        """Métricas agregadas de todos los workers en formato de texto de Prometheus"""
+        self.volcar()
+
+        contadores = {}
+        histogramas = {}
+        gauges = {}
+        for contenido in self._leer_ficheros():
+            for nombre, etiquetas, valor in contenido.get('contadores', []):
+                clave = (nombre, _clave_etiquetas(etiquetas))
+                contadores[clave] = contadores.get(clave, 0) + valor
+            for nombre, etiquetas, buckets, suma, cuenta in contenido.get('histogramas', []):
+                definicion = self._definiciones.get(nombre)
+                # Buckets cambiados entre versiones: se descarta el fichero antiguo
+                if definicion is None or len(buckets) != len(definicion['buckets']) + 1:
+                    continue
+                clave = (nombre, _clave_etiquetas(etiquetas))
+                datos = histogramas.setdefault(clave, [[0] * len(buckets), 0.0, 0])
+                datos[0] = [a + b for a, b in zip(datos[0], buckets)]
+                datos[1] += suma
+                datos[2] += cuenta
+            if contenido['vivo']:
+                for nombre, etiquetas, valor in contenido.get('gauges', []):
+                    clave = (nombre, _clave_etiquetas(etiquetas))
+                    gauges[clave] = gauges.get(clave, 0) + valor
+
+        for nombre, definicion in self._definiciones.items():
+            if definicion['tipo'] == GAUGE and not definicion['por_trabajador']:
+                for etiquetas, valor in self._evaluar_gauge(nombre, definicion):
+                    gauges[(nombre, etiquetas)] = valor
+
+        lineas = []
+        for nombre, definicion in sorted(self._definiciones.items()):
+            tipo = definicion['tipo']
+            lineas.append(f"# HELP {nombre} {definicion['ayuda']}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            if tipo == CONTADOR:
+                for (n, etiquetas), valor in sorted(contadores.items()):
+                    if n == nombre:
+                        lineas.append(f"{nombre}{_formatear_etiquetas(etiquetas)} {_formatear_numero(valor)}")
+            elif tipo == GAUGE:
+                for (n, etiquetas), valor in sorted(gauges.items()):
+                    if n == nombre:
+                        lineas.append(f"{nombre}{_formatear_etiquetas(etiquetas)} {_formatear_numero(valor)}")
+            else:
+                limites = list(definicion['buckets']) + [math.inf]
+                for (n, etiquetas), (buckets, suma, cuenta) in sorted(histogramas.items()):
+                    if n != nombre:
+                        continue
+                    acumulado = 0
+                    for limite, valor in zip(limites, buckets):
+                        acumulado += valor
+                        le = (('le', _formatear_numero(limite)),)
+                        lineas.append(f"{nombre}_bucket{_formatear_etiquetas(etiquetas, le)} {acumulado}")
+                    lineas.append(f"{nombre}_sum{_formatear_etiquetas(etiquetas)} {_formatear_numero(suma)}")
+                    lineas.append(f"{nombre}_count{_formatear_etiquetas(etiquetas)} {cuenta}")
+        return '\n'.join(lineas) + '\n'
+
+
+class _Cronometro:
+    def __init__(self, registro, nombre, etiquetas):
+        self.registro = registro
+        self.nombre = nombre
+        self.etiquetas = etiquetas
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.registro.observar(self.nombre, time.perf_counter() - self.inicio, **self.etiquetas)
+        return False
+
+
+# ============================================
+# REGISTRO GLOBAL Y MÉTRICAS DE LA APLICACIÓN
+# ============================================
+
+registro = RegistroMetricas()
+
+# Peticiones HTTP (middleware/tiempos.py)
+registro.histograma('http_peticion_segundos', "Duración de las peticiones HTTP por ruta", BUCKETS_LATENCIA)
+
+# Llamadas salientes (middleware/tiempos.py)
+registro.histograma('upstream_llamada_segundos', "Duración de las llamadas a Supabase y APIs externas por recurso",
+                    BUCKETS_LATENCIA)
+registro.contador('upstream_bytes_recibidos_total', "Bytes recibidos de Supabase y APIs externas por recurso")
+registro.contador('upstream_errores_total', "Llamadas salientes con excepción o respuesta 5xx por recurso")
+
+# Cachés en memoria (services/cache_service.py)
+registro.contador('cache_operaciones_total', "Consultas a las cachés por resultado (hit, miss, refresco, error)")
+registro.histograma('cache_refresco_segundos', "Duración de la recarga de una caché desde Supabase", BUCKETS_TRABAJOS)
+
+# Detectores de alertas (detectores_alertas.py)
+registro.histograma('detector_ejecucion_segundos', "Duración de cada detector de alertas", BUCKETS_TRABAJOS)
+registro.contador('detector_alertas_total', "Alertas nuevas generadas por detector")
+
+# Trabajos en segundo plano (services/importacion_jobs.py)
+registro.contador('trabajos_total', "Trabajos en segundo plano terminados por tipo y estado")
+registro.histograma('trabajo_segundos', "Duración de los trabajos en segundo plano por tipo", BUCKETS_TRABAJOS)
+
+# Análisis de partes con IA (routes/cartera/cartera_bp.py)
+registro.contador('ia_partes_analizados_total', "Partes analizados por la IA por resultado")
+registro.histograma('ia_analisis_parte_segundos', "Duración del análisis de un parte con la IA", BUCKETS_LATENCIA)
+
+# Emails (services/email_outbox.py)
+registro.contador('emails_procesados_total', "Emails de la bandeja procesados por tipo y resultado")
@@ -0,0 +1,293 @@
+"""
+Tiempos por petición y trazado de llamadas a Supabase
+
+Para cada petición HTTP se registra:
+- Tiempo total, código de estado, endpoint y regla de la ruta
+- Llamadas salientes (Supabase y APIs externas): número, bytes y tiempo,
+  agrupadas por tabla/recurso para localizar consultas N+1
+
+Al terminar la petición se añade la cabecera Server-Timing (visible en la
+pestaña Network del navegador) y se escribe una línea de log en JSON.
+
+Las llamadas se capturan en requests.Session.send, por donde pasan tanto
+services/supabase_client.py como los requests.get/post directos de los
+blueprints. La traza de la petición vive en un ContextVar; los pools de
+hilos que consultan Supabase en paralelo deben envolver sus funciones con
+propagar_traza para que sus llamadas cuenten en la petición.
+
+Las duraciones de peticiones y llamadas salientes (también las de trabajos en
+segundo plano, fuera de una petición) alimentan además los histogramas de
+middleware/metricas.py que expone /metrics.
+"""
+from contextvars import ContextVar
+from functools import wraps
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from flask import g, request, session
+
+from config import config
+from middleware.metricas import registro as metricas
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# Peticiones más lentas que esto se registran como WARNING
+UMBRAL_PETICION_LENTA_MS = float(os.environ.get("UMBRAL_PETICION_LENTA_MS", "1000"))
+
+# Llamadas al mismo recurso en una petición a partir de las cuales se avisa de un posible N+1
+UMBRAL_LLAMADAS_REPETIDAS = int(os.environ.get("UMBRAL_LLAMADAS_REPETIDAS", "10"))
+
+# Desglose por tabla en Server-Timing (expone nombres de tablas al navegador)
+SERVER_TIMING_POR_RECURSO = os.environ.get("SERVER_TIMING_POR_RECURSO", "0") == "1"
+
+# Recursos (los más lentos) incluidos en el desglose de Server-Timing
+MAX_RECURSOS_SERVER_TIMING = 5
+
+SERVICIO_SUPABASE = "supabase"
+
+_traza_actual = ContextVar("traza_peticion", default=None)
+
+
+# ============================================
+# TRAZA DE UNA PETICIÓN
+# ============================================
+
+class TrazaPeticion:
+    """Acumulador de llamadas salientes de una petición (seguro entre hilos)"""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.llamadas = 0
+        self.errores = 0
+        self.bytes_enviados = 0
+        self.bytes_recibidos = 0
+        self.segundos = 0.0
+        # recurso -> [llamadas, segundos, bytes recibidos]
+        self.por_recurso = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, recurso, segundos, bytes_enviados, bytes_recibidos, error=False):
+        with self._lock:
+            self.llamadas += 1
+            self.errores += int(error)
+            self.bytes_enviados += bytes_enviados
+            self.bytes_recibidos += bytes_recibidos
+            self.segundos += segundos
+            acumulado = self.por_recurso.setdefault(recurso, [0, 0.0, 0])
+            acumulado[0] += 1
+            acumulado[1] += segundos
+            acumulado[2] += bytes_recibidos
+
+    def recursos_repetidos(self):
+        """Recursos consultados al menos UMBRAL_LLAMADAS_REPETIDAS veces"""
+        with self._lock:
+            return {r: v[0] for r, v in self.por_recurso.items() if v[0] >= UMBRAL_LLAMADAS_REPETIDAS}
+
+
+def traza_actual():
+    """Traza de la petición en curso (None fuera de una petición)"""
+    return _traza_actual.get()
+
+
+def propagar_traza(funcion):
+    """
+    Envuelve una función que se va a ejecutar en otro hilo para que sus
+    llamadas salientes cuenten en la petición actual.
+
+    Uso: pool.submit(propagar_traza(obtener_pagina), ...)
+    """
+    traza = _traza_actual.get()
+    if traza is None:
+        return funcion
+
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        token = _traza_actual.set(traza)
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            _traza_actual.reset(token)
+    return envoltura
+
+
+# ============================================
+# CAPTURA DE LLAMADAS SALIENTES
+# ============================================
+
+def clasificar_url(url):
+    """
+    Recurso al que va una llamada saliente
+
+    Returns:
+        tuple: (servicio, recurso). Para Supabase el recurso es la tabla,
+        "rpc/<función>", "storage" o "auth"; para el resto, el host.
+    """
+    partes = urlsplit(url)
+    if url.startswith(config.SUPABASE_URL):
+        segmentos = [s for s in partes.path.split('/') if s]
+        # /rest/v1/<tabla> | /rest/v1/rpc/<función> | /storage/v1/... | /auth/v1/...
+        if len(segmentos) >= 3 and segmentos[0] == 'rest':
+            if segmentos[2] == 'rpc' and len(segmentos) >= 4:
+                return SERVICIO_SUPABASE, f"rpc/{segmentos[3]}"
+            return SERVICIO_SUPABASE, segmentos[2]
+        return SERVICIO_SUPABASE, segmentos[0] if segmentos else 'raiz'
+    return partes.netloc, partes.netloc
+
+
+def _tamano_cuerpo(cuerpo):
+    if isinstance(cuerpo, (bytes, bytearray)):
+        return len(cuerpo)
+    if isinstance(cuerpo, str):
+        return len(cuerpo.encode('utf-8'))
+    return 0
+
+
+def _registrar_metricas_llamada(servicio, recurso, segundos, bytes_recibidos, error):
+    metricas.observar('upstream_llamada_segundos', segundos, servicio=servicio, recurso=recurso)
+    metricas.incrementar('upstream_bytes_recibidos_total', bytes_recibidos, servicio=servicio, recurso=recurso)
+    if error:
+        metricas.incrementar('upstream_errores_total', servicio=servicio, recurso=recurso)
+
+
+_send_original = None
+_lock_instalacion = threading.Lock()
+
+
+def instalar_trazado_http():
+    """Intercepta requests.Session.send (idempotente)"""
+    global _send_original
+    with _lock_instalacion:
+        if _send_original is not None:
+            return
+        _send_original = requests.Session.send
+
+    def send(self, peticion, **kwargs):
+        traza = _traza_actual.get()
+        servicio, recurso = clasificar_url(peticion.url)
+        enviados = _tamano_cuerpo(peticion.body)
+        inicio = time.perf_counter()
+        try:
+            respuesta = _send_original(self, peticion, **kwargs)
+        except Exception:
+            segundos = time.perf_counter() - inicio
+            _registrar_metricas_llamada(servicio, recurso, segundos, 0, error=True)
+            if traza is not None:
+                traza.registrar(recurso, segundos, enviados, 0, error=True)
+            raise
+
+        segundos = time.perf_counter() - inicio
+        # Sin stream el cuerpo ya está leído; con stream no se fuerza la lectura
+        if kwargs.get('stream'):
+            recibidos = int(respuesta.headers.get('Content-Length') or 0)
+        else:
+            recibidos = len(respuesta.content or b'')
+        error = respuesta.status_code >= 500
+        _registrar_metricas_llamada(servicio, recurso, segundos, recibidos, error)
+        if traza is not None:
+            traza.registrar(recurso, segundos, enviados, recibidos, error=error)
+        return respuesta
+
+    requests.Session.send = send
+
+
+# ============================================
+# INTEGRACIÓN CON FLASK
+# ============================================
+
+def _server_timing(total_ms, traza):
+    """Valor de la cabecera Server-Timing"""
+    kb = traza.bytes_recibidos / 1024
+    entradas = [
+        f'app;dur={total_ms:.1f}',
+        f'upstream;dur={traza.segundos * 1000:.1f};desc="{traza.llamadas} llamadas, {kb:.1f} KB"',
+    ]
+    if SERVER_TIMING_POR_RECURSO:
+        with traza._lock:
+            recursos = sorted(traza.por_recurso.items(), key=lambda item: item[1][1], reverse=True)
+        for recurso, (llamadas, segundos, _) in recursos[:MAX_RECURSOS_SERVER_TIMING]:
+            nombre = recurso.replace('/', '-').replace('.', '-')
+            entradas.append(f'{nombre};dur={segundos * 1000:.1f};desc="{llamadas}"')
+    return ', '.join(entradas)
+
+
+def _inicio_peticion():
+    g._token_traza = _traza_actual.set(TrazaPeticion())
+
+
+def _fin_peticion(respuesta):
+    traza = _traza_actual.get()
+    if traza is not None:
+        g._duracion_ms = (time.perf_counter() - traza.inicio) * 1000
+        g._estado = respuesta.status_code
+        respuesta.headers['Server-Timing'] = _server_timing(g._duracion_ms, traza)
+    return respuesta
+
+
+def _cierre_peticion(error=None):
+    token = g.pop('_token_traza', None)
+    if token is None:
+        return
+    traza = _traza_actual.get()
+    try:
+        _traza_actual.reset(token)
+    except ValueError:
+        # Token creado en otro contexto (servidores que cambian de contexto entre hooks)
+        _traza_actual.set(None)
+    if traza is None:
+        return
+
+    duracion_ms = g.pop('_duracion_ms', None)
+    if duracion_ms is None:
+        # Excepción no gestionada: after_request no llegó a ejecutarse
+        duracion_ms = (time.perf_counter() - traza.inicio) * 1000
+    estado = g.pop('_estado', 500)
+
+    if request.endpoint == 'static':
+        return
+
+    ruta = request.url_rule.rule if request.url_rule else None
+    # Las URLs sin regla (404) se agrupan para no crear una serie por URL
+    metricas.observar('http_peticion_segundos', duracion_ms / 1000, metodo=request.method,
+                      ruta=ruta or 'sin_ruta', estado=estado)
+
+    registro = {
+        'evento': 'peticion',
+        'metodo': request.method,
+        'ruta': ruta,
+        'endpoint': request.endpoint,
+        'estado': estado,
+        'ms': round(duracion_ms, 1),
+        'upstream_llamadas': traza.llamadas,
+        'upstream_ms': round(traza.segundos * 1000, 1),
+        'upstream_bytes': traza.bytes_recibidos,
+        'upstream_bytes_enviados': traza.bytes_enviados,
+        'upstream_errores': traza.errores,
+        'por_recurso': {r: v[0] for r, v in traza.por_recurso.items()},
+        'usuario_id': session.get('usuario_id'),
+    }
+    repetidos = traza.recursos_repetidos()
+    if repetidos:
+        registro['posible_n_mas_1'] = repetidos
+    if error is not None:
+        registro['error'] = type(error).__name__
+
+    lenta = duracion_ms >= UMBRAL_PETICION_LENTA_MS
+    nivel = logging.WARNING if lenta or repetidos or estado >= 500 else logging.INFO
+    logger.log(nivel, json.dumps(registro, ensure_ascii=False))
+
+
+def init_app(app):
+    """Registra la medición de tiempos y el trazado en la aplicación"""
+    instalar_trazado_http()
+    app.before_request(_inicio_peticion)
+    app.after_request(_fin_peticion)
+    app.teardown_request(_cierre_peticion)
@@ -13,6 +13,7 @@ import helpers
 from config import config
 from utils.formatters import limpiar_none
 from utils.messages import flash_success, flash_error
+from utils.pagination import get_cursor_pagination
 from services.cache_service import get_administradores_cached, cache_administradores
 
 # Crear Blueprint sin prefijo (las rutas mantienen su estructura original)
@@ -262,21 +263,18 @@ def dashboard():
     # TAB: VISITAS
     # ============================================
     elif tab == "visitas":
-        # Paginación
-        try:
-            page = int(request.args.get("page", 1))
-        except (ValueError, TypeError):
-            page = 1
-
-        per_page = 25
-        offset = (page - 1) * per_page
+        # Paginación por cursor (fecha_visita, id): sin offset ni count=exact
+        pagination = get_cursor_pagination('fecha_visita', per_page_default=25)
 
-        # Obtener registros paginados con JOIN a administradores y conteo
-        data_url = f"{SUPABASE_URL}/rest/v1/visitas_administradores?select=*,administradores(nombre_empresa)&order=fecha_visita.desc&limit={per_page}&offset={offset}"
+        # Obtener registros paginados con JOIN a administradores
+        data_url = f"{SUPABASE_URL}/rest/v1/visitas_administradores?select=*,administradores(nombre_empresa)&order={pagination.order}&limit={pagination.limit}"
+        for key, value in pagination.filters().items():
+            data_url += f"&{key}={value}"
 
-        # Headers para obtener el conteo total
+        # El total se estima solo en la primera página; después viaja en el cursor
         headers_with_count = HEADERS.copy()
-        headers_with_count["Prefer"] = "count=exact"
+        if pagination.total is None:
+            headers_with_count["Prefer"] = "count=estimated"
 
         try:
             response = requests.get(data_url, headers=headers_with_count, timeout=10)
@@ -295,17 +293,14 @@ def dashboard():
                     total_registros=0
                 )
 
-            # Obtener total de registros del header Content-Range
-            try:
-                content_range = response.headers.get("Content-Range", "*/0")
-                total_registros = int(content_range.split("/")[-1])
-            except Exception as e:
-                print(f"Error al parsear Content-Range: {e}")
-                total_registros = 0
+            # Obtener total estimado del header Content-Range ("*" si no hay estimación)
+            if pagination.total is None:
+                total_str = response.headers.get("Content-Range", "*/*").split("/")[-1]
+                pagination.total = int(total_str) if total_str.isdigit() else None
 
             # Parsear respuesta JSON
             try:
-                visitas = response.json()
+                visitas = pagination.process(response.json())
             except Exception as e:
                 print(f"Error al parsear JSON: {e}")
                 flash_error(f"Error al procesar datos de visitas")
@@ -318,9 +313,6 @@ def dashboard():
                     total_registros=0
                 )
 
-            # Calcular páginas
-            total_pages = max(1, (total_registros + per_page - 1) // per_page)
-
             # Limpiar None
             try:
                 visitas = [limpiar_none(v) for v in visitas]
@@ -332,9 +324,10 @@ def dashboard():
                 "administradores_dashboard.html",
                 tab=tab,
                 visitas=visitas,
-                page=page,
-                total_pages=total_pages,
-                total_registros=total_registros
+                pagination=pagination,
+                page=pagination.page,
+                total_pages=pagination.total_pages,
+                total_registros=pagination.total
             )
 
         except requests.exceptions.Timeout:
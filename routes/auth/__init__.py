@@ -0,0 +1,9 @@
+"""
+Blueprint de Autenticación y Home
+
+Login (gestores y técnicos), logout y dashboard de inicio
+"""
+
+from routes.auth.auth_bp import auth_bp
+
+__all__ = ['auth_bp']
@@ -0,0 +1,346 @@
+"""
+Blueprint de Autenticación y Home
+=================================
+Rutas que seguían vivas en app_legacy.py. Módulo ligero a propósito: solo
+depende de Flask, requests y la caché de servicios, para que el arranque de
+cada worker no cargue las 8.500 líneas del legacy (ni pandas, reportlab,
+openpyxl o el cliente de IA).
+
+RUTAS:
+- GET/POST /                     → Login
+- GET/POST /tecnico              → Login de técnicos (landing móvil)
+- GET      /logout               → Cerrar sesión
+- GET      /home                 → Dashboard de inicio
+- GET      /test_dropdown_admin  → Diagnóstico de administradores
+"""
+from flask import Blueprint, render_template, request, redirect, session
+from datetime import date, datetime, timedelta
+import urllib.parse
+import requests
+
+import helpers
+from config import config
+from services.cache_service import (
+    cache_administradores,
+    get_administradores_cached,
+    get_metricas_home_cached,
+    get_ultimas_instalaciones_cached,
+    get_ultimas_oportunidades_cached,
+)
+
+# Configuración de Supabase
+SUPABASE_URL = config.SUPABASE_URL
+HEADERS = config.HEADERS
+
+# Crear Blueprint sin prefijo (las rutas mantienen su estructura original)
+auth_bp = Blueprint('auth', __name__)
+
+
+def _buscar_usuario(usuario, contrasena):
+    """Devuelve el usuario si las credenciales son correctas, None en otro caso"""
+    encoded_user = urllib.parse.quote(usuario, safe="")
+    query = f"?nombre_usuario=eq.{encoded_user}"
+    response = requests.get(f"{SUPABASE_URL}/rest/v1/usuarios{query}", headers=HEADERS)
+
+    if response.status_code == 200 and len(response.json()) == 1:
+        user = response.json()[0]
+        if user.get("contrasena", "") == contrasena:
+            return user
+    return None
+
+
+def _iniciar_sesion(usuario, user):
+    session["usuario"] = usuario
+    session["usuario_id"] = user.get("id")
+    session["email"] = user.get("email", "")
+    # Perfil del usuario (por defecto 'visualizador' si no existe)
+    session["perfil"] = user.get("perfil", "visualizador")
+
+
+# ============================================
+# LOGIN / LOGOUT
+# ============================================
+
+@auth_bp.route('/', methods=['GET', 'POST'])
+def login():
+    if request.method == "POST":
+        usuario = request.form.get("usuario")
+        contrasena = request.form.get("contrasena")
+        if not usuario or not contrasena:
+            return render_template("login.html", error="Usuario y contraseña requeridos")
+
+        user = _buscar_usuario(usuario, contrasena)
+        if user:
+            _iniciar_sesion(usuario, user)
+            return redirect("/home")
+        return render_template("login.html", error="Usuario o contraseña incorrectos")
+    return render_template("login.html", error=None)
+
+
+@auth_bp.route('/logout')
+def logout():
+    session.clear()
+    return redirect("/")
+
+
+@auth_bp.route('/tecnico', methods=['GET', 'POST'])
+def login_tecnico():
+    """Landing page para técnicos - acceso directo desde móvil"""
+
+    # Si ya está logueado como técnico, ir directo a avisos
+    if "usuario" in session:
+        if session.get('perfil') == 'tecnico':
+            return redirect('/avisos-cliente')
+        else:
+            # Si no es técnico, ir al home normal
+            return redirect('/home')
+
+    if request.method == "POST":
+        usuario = request.form.get("usuario")
+        contrasena = request.form.get("contrasena")
+
+        if not usuario or not contrasena:
+            return render_template("login_tecnico.html", error="Usuario y contraseña requeridos")
+
+        user = _buscar_usuario(usuario, contrasena)
+        if user:
+            _iniciar_sesion(usuario, user)
+            # Siempre ir a avisos desde esta landing
+            return redirect('/avisos-cliente')
+
+        return render_template("login_tecnico.html", error="Usuario o contraseña incorrectos")
+
+    return render_template("login_tecnico.html", error=None)
+
+
+# ============================================
+# HOME
+# ============================================
+
+@auth_bp.route('/home')
+@helpers.login_required
+def home():
+    """Homepage - Dashboard responsive para todos los dispositivos"""
+
+    # Redirección para técnicos: van directamente a avisos a cliente
+    if session.get('perfil') == 'tecnico':
+        return redirect('/avisos-cliente')
+
+    # Variables de fecha usadas en varias secciones
+    hoy = date.today().isoformat()
+    fin_semana = (date.today() + timedelta(days=7)).isoformat()
+
+    # ========== MÉTRICAS Y ALERTAS (caché, TTL: 5 minutos) ==========
+    metricas_cached = get_metricas_home_cached()
+
+    if metricas_cached:
+        metricas = {
+            'total_comunidades': metricas_cached.get('total_clientes', 0),
+            'total_equipos': metricas_cached.get('total_equipos', 0),
+            'total_oportunidades': metricas_cached.get('total_oportunidades', 0),
+            'ipos_hoy': metricas_cached.get('ipos_hoy', 0)
+        }
+
+        alertas = {
+            'contratos_criticos': metricas_cached.get('contratos_vencer', 0),
+            'ipos_semana': metricas_cached.get('ipos_semana', 0),
+            'oportunidades_pendientes': metricas_cached.get('oportunidades_pendientes', 0)
+        }
+    else:
+        # Fallback si el caché falla (no debería pasar)
+        metricas = {'total_comunidades': 0, 'total_equipos': 0, 'total_oportunidades': 0, 'ipos_hoy': 0}
+        alertas = {'contratos_criticos': 0, 'ipos_semana': 0, 'oportunidades_pendientes': 0}
+
+    # ========== ÚLTIMAS INSTALACIONES (caché, TTL: 10 minutos) ==========
+    ultimas_instalaciones = get_ultimas_instalaciones_cached()
+
+    # ========== ÚLTIMAS OPORTUNIDADES (caché, TTL: 10 minutos) ==========
+    ultimas_oportunidades = []
+    for op in get_ultimas_oportunidades_cached() or []:
+        # Obtener nombre y dirección del cliente de la relación
+        cliente_info = op.get('clientes', {})
+        if isinstance(cliente_info, list) and len(cliente_info) > 0:
+            cliente_info = cliente_info[0]
+
+        nombre_cliente = cliente_info.get('nombre_cliente', 'Sin nombre') if cliente_info else 'Sin nombre'
+        direccion_cliente = cliente_info.get('direccion', 'Sin dirección') if cliente_info else 'Sin dirección'
+
+        ultimas_oportunidades.append({
+            'id': op['id'],
+            'nombre_cliente': nombre_cliente,
+            'direccion': direccion_cliente,
+            'tipo': op.get('tipo', '-'),
+            'estado': op.get('estado', '-')
+        })
+
+    # ========== PRÓXIMAS IPOs ESTA SEMANA ==========
+    response_ipos = requests.get(
+        f"{SUPABASE_URL}/rest/v1/equipos?select=cliente_id,ipo_proxima,clientes(direccion,localidad)&ipo_proxima=gte.{hoy}&ipo_proxima=lte.{fin_semana}&order=ipo_proxima.asc",
+        headers=HEADERS
+    )
+
+    proximas_ipos = []
+    if response_ipos.ok:
+        for equipo in response_ipos.json():
+            fecha_ipo_str = equipo.get('ipo_proxima', '')
+            if fecha_ipo_str:
+                try:
+                    fecha_ipo = datetime.strptime(fecha_ipo_str, '%Y-%m-%d').date()
+                    dias_restantes = (fecha_ipo - date.today()).days
+
+                    # Obtener dirección del lead
+                    lead_info = equipo.get('clientes', {})
+                    if isinstance(lead_info, list) and len(lead_info) > 0:
+                        lead_info = lead_info[0]
+
+                    proximas_ipos.append({
+                        'lead_id': equipo.get('cliente_id'),
+                        'direccion': lead_info.get('direccion', 'Sin dirección') if lead_info else 'Sin dirección',
+                        'localidad': lead_info.get('localidad', '-') if lead_info else '-',
+                        'fecha_ipo': fecha_ipo.strftime('%d/%m/%Y'),
+                        'dias_restantes': dias_restantes
+                    })
+                except Exception as e:
+                    print(f"Error procesando IPO: {e}")
+                    continue
+
+    return render_template(
+        'home.html',
+        metricas=metricas,
+        alertas=alertas,
+        ultimas_instalaciones=ultimas_instalaciones,
+        ultimas_oportunidades=ultimas_oportunidades,
+        proximas_ipos=proximas_ipos
+    )
+
+
+# ============================================
+# RUTA DE PRUEBA - DROPDOWN ADMINISTRADORES
+# ============================================
+
+@auth_bp.route('/test_dropdown_admin')
+@helpers.login_required
+def test_dropdown_admin():
+    # Test 1: Consulta directa (sin caché)
+    test_direct = {"success": False, "status": 0, "count": 0, "error": ""}
+    try:
+        response = requests.get(
+            f"{config.SUPABASE_URL}/rest/v1/administradores?select=id,nombre_empresa&order=nombre_empresa.asc",
+            headers=config.HEADERS,
+            timeout=10
+        )
+        test_direct["status"] = response.status_code
+        if response.status_code == 200:
+            test_direct["success"] = True
+            test_direct["data"] = response.json()
+            test_direct["count"] = len(test_direct["data"])
+        else:
+            test_direct["error"] = response.text[:500]
+    except Exception as e:
+        test_direct["error"] = f"{type(e).__name__}: {str(e)}"
+
+    # Test 2: Obtener desde caché
+    administradores_cached = get_administradores_cached()
+
+    # HTML de prueba mejorado
+    html = f"""
+    <!DOCTYPE html>
+    <html lang="es">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Test Dropdown Administradores - Diagnóstico</title>
+        <style>
+            body {{ font-family: Arial, sans-serif; padding: 20px; max-width: 900px; margin: 0 auto; background: #f5f5f5; }}
+            .debug-info {{ background: white; padding: 20px; margin: 20px 0; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }}
+            .success {{ color: #28a745; font-weight: bold; }}
+            .error {{ color: #dc3545; font-weight: bold; }}
+            .warning {{ color: #ffc107; font-weight: bold; }}
+            h1 {{ color: #333; }}
+            h3 {{ color: #666; margin-top: 0; }}
+            pre {{ background: #f8f9fa; padding: 15px; border-radius: 5px; overflow-x: auto; border: 1px solid #dee2e6; }}
+            .status-badge {{ display: inline-block; padding: 5px 10px; border-radius: 5px; font-size: 14px; }}
+            .badge-success {{ background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }}
+            .badge-error {{ background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }}
+            table {{ width: 100%; border-collapse: collapse; margin-top: 10px; }}
+            td {{ padding: 8px; border-bottom: 1px solid #dee2e6; }}
+            td:first-child {{ font-weight: bold; width: 200px; }}
+            .back-link {{ display: inline-block; margin-top: 20px; padding: 10px 20px; background: #366092; color: white; text-decoration: none; border-radius: 5px; }}
+            .back-link:hover {{ background: #2a4a70; }}
+        </style>
+    </head>
+    <body>
+        <h1>🧪 Test Dropdown Administradores - Diagnóstico Completo</h1>
+
+        <div class="debug-info">
+            <h3>🔍 Test 1: Consulta Directa a Supabase (sin caché)</h3>
+            <table>
+                <tr>
+                    <td>Estado:</td>
+                    <td>
+                        {'<span class="status-badge badge-success">✅ Éxito</span>' if test_direct['success'] else '<span class="status-badge badge-error">❌ Error</span>'}
+                    </td>
+                </tr>
+                <tr>
+                    <td>Status Code:</td>
+                    <td><strong>{test_direct['status']}</strong></td>
+                </tr>
+                <tr>
+                    <td>Administradores encontrados:</td>
+                    <td><strong class="{'success' if test_direct['count'] > 0 else 'error'}">{test_direct['count']}</strong></td>
+                </tr>
+                {'<tr><td>Error:</td><td><pre>' + test_direct['error'] + '</pre></td></tr>' if test_direct['error'] else ''}
+            </table>
+
+            {f"<h4>📋 Datos obtenidos:</h4><pre>{test_direct.get('data', [])}</pre>" if test_direct['success'] and test_direct['count'] > 0 else ''}
+        </div>
+
+        <div class="debug-info">
+            <h3>💾 Test 2: Sistema de Caché</h3>
+            <table>
+                <tr>
+                    <td>Administradores en caché:</td>
+                    <td><strong class="{'success' if len(administradores_cached) > 0 else 'error'}">{len(administradores_cached)}</strong></td>
+                </tr>
+                <tr>
+                    <td>Timestamp del caché:</td>
+                    <td>{cache_administradores['timestamp'] or 'Sin inicializar'}</td>
+                </tr>
+            </table>
+
+            {f"<h4>📋 Datos en caché:</h4><pre>{administradores_cached}</pre>" if len(administradores_cached) > 0 else ''}
+        </div>
+
+        <div class="debug-info">
+            <h3>🔧 Configuración de Supabase</h3>
+            <table>
+                <tr>
+                    <td>URL:</td>
+                    <td><code>{config.SUPABASE_URL}</code></td>
+                </tr>
+                <tr>
+                    <td>API Key configurada:</td>
+                    <td>{'✅ Sí' if config.SUPABASE_KEY else '❌ No'}</td>
+                </tr>
+            </table>
+        </div>
+
+        <div class="debug-info">
+            <h3>💡 Diagnóstico</h3>
+            {'<p class="success">✅ Todo funciona correctamente. Hay ' + str(test_direct['count']) + ' administradores en la base de datos.</p>' if test_direct['success'] and test_direct['count'] > 0 else ''}
+            {'<p class="warning">⚠️ La conexión a Supabase funciona pero <strong>NO HAY ADMINISTRADORES</strong> en la base de datos. Necesitas crear administradores primero en <a href="/nuevo_administrador">/nuevo_administrador</a></p>' if test_direct['success'] and test_direct['count'] == 0 else ''}
+            {'<p class="error">❌ Error al conectar con Supabase. Verifica:<br>1. Que la URL de Supabase sea correcta<br>2. Que el API Key esté configurado<br>3. Que la tabla "administradores" exista<br>4. Que tengas permisos de lectura</p>' if not test_direct['success'] else ''}
+        </div>
+
+        <a href="/home" class="back-link">← Volver al inicio</a>
+
+        <script>
+            console.log('📊 Diagnóstico completo:');
+            console.log('Test directo:', {test_direct});
+            console.log('Caché:', {administradores_cached});
+        </script>
+    </body>
+    </html>
+    """
+
+    return html
@@ -8,7 +8,8 @@ un ascensor queda fuera de servicio.
 Funcionalidades:
 - Buscar máquina por identificador o dirección
 - Seleccionar motivo de parada predefinido
-- Enviar email al cliente con copia a configuración
+- Enviar email al cliente con copia a configuración (en segundo plano,
+  vía la bandeja de salida de services/email_outbox.py)
 - Registro de todas las notificaciones enviadas
 - Histórico de avisos por instalación
 """
@@ -16,10 +17,10 @@ Funcionalidades:
 from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify
 from datetime import datetime
 import requests
-import resend
 
 from config import config
 from helpers import login_required, requiere_permiso, tiene_permiso
+from services import email_outbox
 from utils.messages import flash_success, flash_error
 
 # Configuración de Supabase
@@ -112,7 +113,7 @@ def buscar_maquinas():
 @login_required
 @requiere_permiso('notificaciones_cliente', 'write')
 def enviar_aviso():
-    """Envía el aviso por email y registra en base de datos"""
+    """Registra el aviso en base de datos y encola el email (se envía en segundo plano)"""
 
     # Obtener datos del formulario
     maquina_id = request.form.get('maquina_id')
@@ -176,34 +177,19 @@ def enviar_aviso():
     if email_copia:
         cc_emails = [e.strip() for e in email_copia.split(',') if e.strip()]
 
-    # Enviar email
-    email_enviado = False
-    error_envio = None
-
-    try:
-        params = {
-            "from": f"{nombre_remitente} <{email_remitente}>",
-            "to": destinatarios,
-            "subject": f"Aviso - Ascensor fuera de servicio en {instalacion_nombre}",
-            "html": mensaje_html,
-            "text": mensaje_texto,
-            "reply_to": email_remitente
-        }
-
-        if cc_emails:
-            params["cc"] = cc_emails
-
-        email_response = resend.Emails.send(params)
-
-        if email_response and email_response.get('id'):
-            email_enviado = True
-        else:
-            error_envio = "No se recibió confirmación del servidor de email"
+    params = {
+        "from": f"{nombre_remitente} <{email_remitente}>",
+        "to": destinatarios,
+        "subject": f"Aviso - Ascensor fuera de servicio en {instalacion_nombre}",
+        "html": mensaje_html,
+        "text": mensaje_texto,
+        "reply_to": email_remitente
+    }
 
-    except Exception as e:
-        error_envio = str(e)
+    if cc_emails:
+        params["cc"] = cc_emails
 
-    # Registrar en base de datos
+    # Registrar en base de datos (el estado final lo actualiza el envío en segundo plano)
     registro = {
         "maquina_id": int(maquina_id) if maquina_id else None,
         "instalacion_id": int(instalacion_id) if instalacion_id else None,
@@ -214,22 +200,34 @@ def enviar_aviso():
         "nombre_destino": nombre_destino or instalacion_nombre,
         "enviado_por_id": session.get('usuario_id'),
         "enviado_por_nombre": session.get('usuario', 'Sistema'),
-        "estado": "ENVIADO" if email_enviado else "ERROR",
-        "email_enviado": email_enviado,
-        "error_envio": error_envio
+        "estado": "PENDIENTE",
+        "email_enviado": False,
+        "error_envio": None
     }
 
-    requests.post(
+    registro_response = requests.post(
         f"{SUPABASE_URL}/rest/v1/notificaciones_cliente",
         json=registro,
         headers=HEADERS
     )
 
-    # Mostrar resultado
-    if email_enviado:
-        flash_success(f'Aviso enviado correctamente a {email_destino}')
-    else:
-        flash_error(f'Error al enviar el aviso: {error_envio}')
+    registro_id = None
+    if registro_response.status_code in [200, 201] and registro_response.json():
+        registro_id = registro_response.json()[0].get('id')
+
+    # Encolar email (la clave evita duplicados si se reintenta)
+    try:
+        email_outbox.encolar_email(
+            params,
+            tipo='aviso_cliente',
+            clave=f"notificaciones_cliente:{registro_id}" if registro_id else None,
+            registro=('notificaciones_cliente', registro_id) if registro_id else None
+        )
+    except Exception as e:
+        flash_error(f'Error al encolar el aviso: {str(e)}')
+        return redirect(url_for('avisos_cliente.index'))
+
+    flash_success(f'Aviso en cola para {email_destino}. Se enviará en unos segundos.')
 
     return redirect(url_for('avisos_cliente.index'))
 
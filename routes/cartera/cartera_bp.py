@@ -17,14 +17,13 @@ import logging
 import sys
 import io
 import os
-import urllib.parse
-import pandas as pd
-import pdfplumber
 import threading
 
 from config import config
 import helpers
-import analizador_ia
+from services import cache_service, importacion_jobs
+from middleware.metricas import registro as registro_metricas
+from utils.pagination import get_pagination, paginate_query_cursor
 
 # Configurar logging
 logging.basicConfig(
@@ -140,37 +139,14 @@ def cartera_dashboard():
     )
     maquinas_problematicas = response.json() if response.status_code == 200 else []
 
-    # Recomendaciones pendientes con paginación
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 20))
-    offset = (page - 1) * per_page
-
-    # Obtener total de recomendaciones para calcular páginas
-    response_count = requests.get(
-        f"{SUPABASE_URL}/rest/v1/v_partes_con_recomendaciones?select=count",
-        headers={**HEADERS, "Prefer": "count=exact"}
+    # Recomendaciones pendientes con paginación por cursor (fecha_parte, id):
+    # sin offset ni count=exact, la página N cuesta lo mismo que la primera
+    pagination, recomendaciones = paginate_query_cursor(
+        f"{SUPABASE_URL}/rest/v1/v_partes_con_recomendaciones?select=*",
+        HEADERS,
+        order_column='fecha_parte',
+        per_page_default=20
     )
-    total_recomendaciones = int(response_count.headers.get('Content-Range', '0').split('/')[-1])
-    total_pages = (total_recomendaciones + per_page - 1) // per_page  # Ceiling division
-
-    # Obtener recomendaciones de la página actual
-    response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/v_partes_con_recomendaciones?select=*&order=fecha_parte.desc&limit={per_page}&offset={offset}",
-        headers=HEADERS
-    )
-    recomendaciones = response.json() if response.status_code == 200 else []
-
-    # Información de paginación
-    pagination = {
-        'page': page,
-        'per_page': per_page,
-        'total': total_recomendaciones,
-        'total_pages': total_pages,
-        'has_prev': page > 1,
-        'has_next': page < total_pages,
-        'prev_page': page - 1 if page > 1 else None,
-        'next_page': page + 1 if page < total_pages else None
-    }
 
     # Distribución de tipos de parte (último año, solo de máquinas en cartera)
     if maquina_ids_cartera:
@@ -204,486 +180,136 @@ def cartera_dashboard():
 @helpers.login_required
 def cartera_importar():
     """Interfaz de importación de datos"""
-    return render_template("cartera/importar.html")
+    return render_template("cartera/importar.html", trabajo_id=request.args.get('trabajo'))
 
 
-# @app.route("/cartera/importar_equipos", methods=["POST"])
-@cartera_bp.route('/importar_equipos', methods=['POST'])
-@helpers.login_required
-def cartera_importar_equipos():
-    """Importar instalaciones y máquinas desde Excel"""
+def _validar_archivo_excel(campo):
+    """
+    Valida el Excel subido en el formulario
 
-    if 'archivo_equipos' not in request.files:
-        flash("No se seleccionó ningún archivo", "error")
-        return redirect(url_for('cartera.cartera_importar'))
+    Returns:
+        tuple: (FileStorage o None, mensaje de error o None)
+    """
+    if campo not in request.files or request.files[campo].filename == '':
+        return None, "No se seleccionó ningún archivo"
 
-    file = request.files['archivo_equipos']
+    file = request.files[campo]
+    if not file.filename.endswith(('.xlsx', '.xls')):
+        return None, "El archivo debe ser formato Excel (.xlsx o .xls)"
 
-    if file.filename == '':
-        flash("No se seleccionó ningún archivo", "error")
-        return redirect(url_for('cartera.cartera_importar'))
+    return file, None
 
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        flash("El archivo debe ser formato Excel (.xlsx o .xls)", "error")
-        return redirect(url_for('cartera.cartera_importar'))
 
-    try:
-        # Leer Excel
-        df = pd.read_excel(file)
-
-        # Log de columnas encontradas
-        logger.info(f"Columnas en Excel: {list(df.columns)}")
-        logger.info(f"Total de filas: {len(df)}")
-
-        # Mapeo de columnas (flexible con mayúsculas/minúsculas y acentos)
-        column_mapping = {}
-        for col in df.columns:
-            col_lower = col.lower().strip()
-            if 'instalación' in col_lower or 'instalacion' in col_lower:
-                if 'cód' in col_lower or 'cod' in col_lower:
-                    column_mapping[col] = 'cod_instalacion'
-                else:
-                    column_mapping[col] = 'instalacion'
-            elif 'máquina' in col_lower or 'maquina' in col_lower:
-                if 'cód' in col_lower or 'cod' in col_lower:
-                    column_mapping[col] = 'cod_maquina'
-                else:
-                    column_mapping[col] = 'maquina'
-            elif 'tecnico' in col_lower or 'técnico' in col_lower:
-                column_mapping[col] = 'tecnico'
-
-        df.rename(columns=column_mapping, inplace=True)
-        logger.info(f"Columnas después de mapeo: {list(df.columns)}")
-
-        # Verificar columnas requeridas
-        required = ['cod_instalacion', 'instalacion', 'cod_maquina', 'maquina']
-        missing = [col for col in required if col not in df.columns]
-
-        if missing:
-            logger.error(f"Faltan columnas: {missing}. Columnas después de mapeo: {list(df.columns)}")
-            flash(f"Faltan columnas requeridas: {', '.join(missing)}", "error")
-            flash(f"Columnas encontradas en Excel: {', '.join(df.columns)}", "info")
-            return redirect(url_for('cartera.cartera_importar'))
-
-        # Procesar instalaciones únicas
-        instalaciones_unicas = df[['cod_instalacion', 'instalacion']].drop_duplicates('cod_instalacion')
-        instalaciones_map = {}
-        stats = {
-            'instalaciones_nuevas': 0,
-            'instalaciones_existentes': 0,
-            'maquinas_nuevas': 0,
-            'maquinas_existentes': 0,
-            'errores': 0
-        }
+def _respuesta_trabajo(trabajo_id=None, error=None):
+    """
+    Respuesta de una subida: JSON (202 + ID de trabajo) si el cliente lo pide,
+    redirección a la pantalla de importación con el panel de progreso si no.
+    """
+    quiere_json = request.accept_mimetypes.best == 'application/json'
 
-        # Municipios de Gran Canaria
-        municipios_gc = [
-            'LAS PALMAS', 'TELDE', 'SANTA LUCIA', 'AGÜIMES', 'INGENIO',
-            'MOGAN', 'SAN BARTOLOME', 'SANTA BRIGIDA', 'ARUCAS', 'TEROR',
-            'GALDAR', 'AGAETE', 'VALLESECO', 'FIRGAS', 'MOYA',
-            'SANTA MARIA DE GUIA', 'VALSEQUILLO', 'VEGA DE SAN MATEO',
-            'TEJEDA', 'ALDEA DE SAN NICOLAS'
-        ]
-
-        for idx, row in instalaciones_unicas.iterrows():
-            # Limpiar nombre (quitar dirección después del guion)
-            nombre = row['instalacion'].split(' - ')[0].strip() if ' - ' in row['instalacion'] else row['instalacion'].strip()
-
-            # Extraer municipio
-            texto_upper = row['instalacion'].upper()
-            municipio = "Las Palmas de Gran Canaria"  # Default
-            for mun in municipios_gc:
-                if mun in texto_upper:
-                    municipio = mun.title()
-                    break
-
-            # Verificar si ya existe
-            response = requests.get(
-                f"{SUPABASE_URL}/rest/v1/instalaciones?nombre=eq.{urllib.parse.quote(nombre)}",
-                headers=HEADERS
-            )
+    if error:
+        if quiere_json:
+            return jsonify({'success': False, 'error': error}), 400
+        flash(error, "error")
+        return redirect(url_for('cartera.cartera_importar'))
 
-            if response.status_code == 200 and len(response.json()) > 0:
-                instalacion_id = response.json()[0]['id']
-                stats['instalaciones_existentes'] += 1
-            else:
-                # Crear nueva
-                data = {"nombre": nombre, "municipio": municipio}
-                response = requests.post(
-                    f"{SUPABASE_URL}/rest/v1/instalaciones",
-                    json=data,
-                    headers=HEADERS
-                )
+    if quiere_json:
+        return jsonify({
+            'success': True,
+            'trabajo_id': trabajo_id,
+            'estado_url': url_for('cartera.cartera_estado_importacion', trabajo_id=trabajo_id)
+        }), 202
 
-                if response.status_code == 201:
-                    instalacion_id = response.json()[0]['id']
-                    stats['instalaciones_nuevas'] += 1
-                else:
-                    logger.error(f"Error creando instalación '{nombre}': {response.status_code} - {response.text}")
-                    stats['errores'] += 1
-                    continue
-
-            instalaciones_map[row['cod_instalacion']] = instalacion_id
-
-        # Procesar máquinas
-        for idx, row in df.iterrows():
-            cod_instalacion = row['cod_instalacion']
-            identificador = row['maquina'].strip()
-            codigo_maquina = row['cod_maquina'].strip() if pd.notna(row['cod_maquina']) else None
-
-            instalacion_id = instalaciones_map.get(cod_instalacion)
-            if not instalacion_id:
-                stats['errores'] += 1
-                continue
+    flash("Proceso iniciado. Se está ejecutando en segundo plano.", "info")
+    return redirect(url_for('cartera.cartera_importar', trabajo=trabajo_id))
 
-            # Verificar si la máquina ya existe
-            response = requests.get(
-                f"{SUPABASE_URL}/rest/v1/maquinas_cartera?identificador=eq.{urllib.parse.quote(identificador)}",
-                headers=HEADERS
-            )
 
-            if response.status_code == 200 and len(response.json()) > 0:
-                stats['maquinas_existentes'] += 1
-                continue
+def _trabajo_importar_equipos(ruta_archivo, nombre_archivo, progreso):
+    """Trabajo en segundo plano: importación de instalaciones y máquinas"""
+    # pandas/openpyxl solo se cargan al importar, no al arrancar la aplicación
+    from services import importacion_service
 
-            # Crear nueva máquina
-            data = {
-                "instalacion_id": instalacion_id,
-                "identificador": identificador,
-                "codigo_maquina": codigo_maquina
-            }
+    stats = importacion_service.importar_equipos_excel(ruta_archivo, nombre_archivo, progreso=progreso)
+    cache_service.invalidar_detalles_cartera()
+    return stats
 
-            response = requests.post(
-                f"{SUPABASE_URL}/rest/v1/maquinas_cartera",
-                json=data,
-                headers=HEADERS
-            )
 
-            if response.status_code == 201:
-                stats['maquinas_nuevas'] += 1
-            else:
-                logger.error(f"Error creando máquina '{identificador}': {response.status_code} - {response.text}")
-                stats['errores'] += 1
+def _trabajo_importar_partes(ruta_archivo, nombre_archivo, progreso):
+    """Trabajo en segundo plano: importación de partes de trabajo"""
+    # Pipeline en streaming: lectura por bloques, transformación vectorizada
+    # y escritura concurrente en lotes grandes (ver services/importacion_service.py)
+    from services import importacion_service
 
-        # Mostrar resumen
-        flash(f"Importación completada: {stats['instalaciones_nuevas']} instalaciones nuevas, "
-              f"{stats['maquinas_nuevas']} máquinas nuevas", "success")
+    stats = importacion_service.importar_partes_excel(ruta_archivo, nombre_archivo, progreso=progreso)
 
-        if stats['instalaciones_existentes'] > 0:
-            flash(f"{stats['instalaciones_existentes']} instalaciones ya existían", "info")
+    maquinas_afectadas = stats.pop('maquinas_afectadas')
+    for maquina_id in maquinas_afectadas:
+        cache_service.invalidar_detalle_maquina(maquina_id)
+    stats['maquinas_afectadas'] = len(maquinas_afectadas)
 
-        if stats['maquinas_existentes'] > 0:
-            flash(f"{stats['maquinas_existentes']} máquinas ya existían", "info")
+    return stats
 
-        if stats['errores'] > 0:
-            flash(f"{stats['errores']} registros con errores", "warning")
 
-    except Exception as e:
-        flash(f"Error al procesar archivo: {str(e)}", "error")
-        logger.error(f"Error importando equipos: {str(e)}")
+# @app.route("/cartera/importar_equipos", methods=["POST"])
+@cartera_bp.route('/importar_equipos', methods=['POST'])
+@helpers.login_required
+def cartera_importar_equipos():
+    """Importar instalaciones y máquinas desde Excel (en segundo plano)"""
+    file, error = _validar_archivo_excel('archivo_equipos')
+    if error:
+        return _respuesta_trabajo(error=error)
 
-    return redirect(url_for('cartera.cartera_importar'))
+    trabajo_id = importacion_jobs.crear_trabajo('cartera_equipos', file)
+    importacion_jobs.lanzar_trabajo(trabajo_id, _trabajo_importar_equipos)
+    return _respuesta_trabajo(trabajo_id)
 
 
 # @app.route("/cartera/importar_partes", methods=["POST"])
 @cartera_bp.route('/importar_partes', methods=['POST'])
 @helpers.login_required
 def cartera_importar_partes():
-    """Importar partes de trabajo desde Excel"""
-
-    if 'archivo_partes' not in request.files:
-        flash("No se seleccionó ningún archivo", "error")
-        return redirect(url_for('cartera.cartera_importar'))
-
-    file = request.files['archivo_partes']
+    """Importar partes de trabajo desde Excel (en segundo plano)"""
+    file, error = _validar_archivo_excel('archivo_partes')
+    if error:
+        return _respuesta_trabajo(error=error)
 
-    if file.filename == '':
-        flash("No se seleccionó ningún archivo", "error")
-        return redirect(url_for('cartera.cartera_importar'))
+    trabajo_id = importacion_jobs.crear_trabajo('cartera_partes', file)
+    importacion_jobs.lanzar_trabajo(trabajo_id, _trabajo_importar_partes)
+    return _respuesta_trabajo(trabajo_id)
 
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        flash("El archivo debe ser formato Excel (.xlsx o .xls)", "error")
-        return redirect(url_for('cartera.cartera_importar'))
 
-    try:
-        # Leer Excel
-        df = pd.read_excel(file)
-
-        # Palabras clave para detectar recomendaciones
-        palabras_clave_recomendacion = [
-            # Recomendaciones explícitas
-            'RECOMENDACIÓN', 'RECOMENDACION', 'RECOMIENDO', 'RECOMENDAMOS',
-            'CONVENDRÍA', 'CONVIENE', 'SERÍA CONVENIENTE', 'SE RECOMIENDA',
-            'ACONSEJABLE', 'ACONSEJO', 'SUGERENCIA', 'SUGIERO',
-
-            # Indicadores de urgencia/importancia
-            'IMPORTANTE', 'URGENTE', 'NECESARIO', 'IMPRESCINDIBLE', 'CRÍTICO',
-            'PRIORITARIO', 'INMEDIATO',
-
-            # Acciones de mantenimiento/reparación
-            'CAMBIAR', 'SUSTITUIR', 'REEMPLAZAR', 'MODERNIZAR', 'ACTUALIZAR',
-            'REVISAR', 'REPARAR', 'ARREGLAR', 'RENOVAR', 'MEJORAR',
-
-            # Temporalidad
-            'PRÓXIMAMENTE', 'PROXIMAMENTE', 'PRONTO', 'EN BREVE',
-            'PRÓXIMA REVISIÓN', 'PROXIMA REVISION',
-
-            # Estados problemáticos
-            'NO FUNCIONA', 'NO OPERA', 'INOPERATIVO', 'INOPERANTE',
-            'FALLA', 'FALLO', 'DEFECTUOSO', 'AVERIADO', 'DETERIORADO',
-            'MAL ESTADO', 'DESGASTADO', 'ROTO', 'DAÑADO',
-
-            # Componentes críticos (cuando no funcionan = oportunidad)
-            'DISPOSITIVO NO', 'COMUNICACIÓN NO', 'BIDIRECCIONAL NO',
-            'CABINA NO', 'PUERTA NO', 'BOTONERA NO',
-
-            # Oportunidades de facturación
-            'FUERA DE CONTRATO', 'NO INCLUIDO', 'ADICIONAL',
-            'PRESUPUESTO', 'COTIZAR', 'COTIZACIÓN'
-        ]
-
-        # Cargar mapeo de tipos
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/tipos_parte_mapeo?select=*",
-            headers=HEADERS
-        )
-        mapeo_tipos = {}
-        if response.status_code == 200:
-            for row in response.json():
-                mapeo_tipos[row['tipo_original'].upper()] = row['tipo_normalizado']
-
-        # Cargar máquinas
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/maquinas_cartera?select=id,identificador",
-            headers=HEADERS
-        )
-        maquinas_map = {}
-        if response.status_code == 200:
-            for row in response.json():
-                maquinas_map[row['identificador']] = row['id']
-
-        stats = {
-            'total': len(df),
-            'insertados': 0,
-            'duplicados': 0,
-            'sin_maquina': 0,
-            'errores': 0,
-            'recomendaciones_detectadas': 0
-        }
-
-        partes_batch = []
-        batch_size = 100
-
-        for idx, row in df.iterrows():
-            # Validar columnas requeridas
-            if pd.isna(row.get('PARTE')) or pd.isna(row.get('MÁQUINA')):
-                stats['errores'] += 1
-                continue
-
-            # Mapear máquina
-            identificador_maquina = str(row['MÁQUINA']).strip()
-            maquina_id = maquinas_map.get(identificador_maquina)
-
-            if not maquina_id:
-                stats['sin_maquina'] += 1
-
-            # Mapear tipo de parte
-            tipo_original = str(row.get('TIPO PARTE', '')).strip().upper()
-            tipo_normalizado = mapeo_tipos.get(tipo_original, 'OTRO')
-
-            # Parsear fecha
-            fecha_parte = row.get('FECHA')
-            if pd.isna(fecha_parte):
-                stats['errores'] += 1
-                continue
-
-            if isinstance(fecha_parte, datetime):
-                fecha_parte_iso = fecha_parte.isoformat()
-            else:
-                try:
-                    fecha_parte_iso = pd.to_datetime(str(fecha_parte)).isoformat()
-                except:
-                    stats['errores'] += 1
-                    continue
-
-            # Detectar recomendaciones
-            resolucion = row.get('RESOLUCIÓN', '')
-            tiene_recomendacion = False
-            recomendacion_extraida = None
-
-            if pd.notna(resolucion):
-                texto_upper = str(resolucion).upper()
-                for palabra in palabras_clave_recomendacion:
-                    if palabra in texto_upper:
-                        tiene_recomendacion = True
-                        recomendacion_extraida = str(resolucion)
-                        stats['recomendaciones_detectadas'] += 1
-                        break
-
-            # Preparar datos para inserción
-            parte_data = {
-                "numero_parte": str(row['PARTE']),
-                "tipo_parte_original": str(row.get('TIPO PARTE', '')).strip(),
-                "codigo_maquina": str(row.get('CÓD. MÁQUINA', '')) if pd.notna(row.get('CÓD. MÁQUINA')) else None,
-                "maquina_texto": identificador_maquina,
-                "fecha_parte": fecha_parte_iso,
-                "codificacion_adicional": str(row.get('CODIFICACIÓN ADICIONAL', '')) if pd.notna(row.get('CODIFICACIÓN ADICIONAL')) else None,
-                "resolucion": str(resolucion) if pd.notna(resolucion) else None,
-                "maquina_id": maquina_id,
-                "tipo_parte_normalizado": tipo_normalizado,
-                "tiene_recomendacion": tiene_recomendacion,
-                "recomendaciones_extraidas": recomendacion_extraida if tiene_recomendacion else None,
-                "estado": "COMPLETADO",
-                "importado": True
-            }
-
-            partes_batch.append(parte_data)
-
-            # Insertar por lotes
-            if len(partes_batch) >= batch_size:
-                response = requests.post(
-                    f"{SUPABASE_URL}/rest/v1/partes_trabajo",
-                    json=partes_batch,
-                    headers={**HEADERS, "Prefer": "return=representation,resolution=ignore-duplicates"}
-                )
-
-                if response.status_code in [200, 201]:
-                    stats['insertados'] += len(partes_batch)
-                else:
-                    stats['errores'] += len(partes_batch)
-
-                partes_batch = []
-
-        # Insertar lote final
-        if partes_batch:
-            response = requests.post(
-                f"{SUPABASE_URL}/rest/v1/partes_trabajo",
-                json=partes_batch,
-                headers={**HEADERS, "Prefer": "return=representation,resolution=ignore-duplicates"}
-            )
-
-            if response.status_code in [200, 201]:
-                stats['insertados'] += len(partes_batch)
-            else:
-                stats['errores'] += len(partes_batch)
-
-        # Mostrar resumen
-        flash(f"Importación completada: {stats['insertados']} partes insertados de {stats['total']} procesados", "success")
+@cartera_bp.route('/importaciones/<trabajo_id>')
+@helpers.login_required
+def cartera_estado_importacion(trabajo_id):
+    """Estado de un trabajo de importación: progreso, errores por fila y stats finales"""
+    estado = importacion_jobs.obtener_estado_publico(trabajo_id)
+    if estado is None or not estado['tipo'].startswith('cartera_'):
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify(estado)
 
-        if stats['recomendaciones_detectadas'] > 0:
-            flash(f"{stats['recomendaciones_detectadas']} recomendaciones detectadas automáticamente", "success")
 
-        if stats['sin_maquina'] > 0:
-            flash(f"{stats['sin_maquina']} partes sin máquina asignada (revisar identificadores)", "warning")
+def _trabajo_reanalizar_recomendaciones(ruta_archivo, nombre_archivo, progreso):
+    """Trabajo en segundo plano: re-análisis de recomendaciones (solo escribe los cambios)"""
+    from services import recomendaciones_service
 
-        if stats['errores'] > 0:
-            flash(f"{stats['errores']} registros con errores", "warning")
+    stats = recomendaciones_service.reanalizar_recomendaciones(progreso=progreso)
 
-    except Exception as e:
-        flash(f"Error al procesar archivo: {str(e)}", "error")
-        logger.error(f"Error importando partes: {str(e)}")
+    maquinas_afectadas = stats.pop('maquinas_afectadas')
+    for maquina_id in maquinas_afectadas:
+        cache_service.invalidar_detalle_maquina(maquina_id)
+    stats['maquinas_afectadas'] = len(maquinas_afectadas)
 
-    return redirect(url_for('cartera.cartera_importar'))
+    return stats
 
 
 # @app.route("/cartera/reanalizar-recomendaciones", methods=["POST"])
 @cartera_bp.route('/reanalizar-recomendaciones', methods=['POST'])
 @helpers.login_required
 def cartera_reanalizar_recomendaciones():
-    """Re-analizar todos los partes existentes con las nuevas palabras clave"""
-
-    try:
-        # Palabras clave actualizadas (mismo array que en importación)
-        palabras_clave_recomendacion = [
-            # Recomendaciones explícitas
-            'RECOMENDACIÓN', 'RECOMENDACION', 'RECOMIENDO', 'RECOMENDAMOS',
-            'CONVENDRÍA', 'CONVIENE', 'SERÍA CONVENIENTE', 'SE RECOMIENDA',
-            'ACONSEJABLE', 'ACONSEJO', 'SUGERENCIA', 'SUGIERO',
-
-            # Indicadores de urgencia/importancia
-            'IMPORTANTE', 'URGENTE', 'NECESARIO', 'IMPRESCINDIBLE', 'CRÍTICO',
-            'PRIORITARIO', 'INMEDIATO',
-
-            # Acciones de mantenimiento/reparación
-            'CAMBIAR', 'SUSTITUIR', 'REEMPLAZAR', 'MODERNIZAR', 'ACTUALIZAR',
-            'REVISAR', 'REPARAR', 'ARREGLAR', 'RENOVAR', 'MEJORAR',
-
-            # Temporalidad
-            'PRÓXIMAMENTE', 'PROXIMAMENTE', 'PRONTO', 'EN BREVE',
-            'PRÓXIMA REVISIÓN', 'PROXIMA REVISION',
-
-            # Estados problemáticos
-            'NO FUNCIONA', 'NO OPERA', 'INOPERATIVO', 'INOPERANTE',
-            'FALLA', 'FALLO', 'DEFECTUOSO', 'AVERIADO', 'DETERIORADO',
-            'MAL ESTADO', 'DESGASTADO', 'ROTO', 'DAÑADO',
-
-            # Componentes críticos (cuando no funcionan = oportunidad)
-            'DISPOSITIVO NO', 'COMUNICACIÓN NO', 'BIDIRECCIONAL NO',
-            'CABINA NO', 'PUERTA NO', 'BOTONERA NO',
-
-            # Oportunidades de facturación
-            'FUERA DE CONTRATO', 'NO INCLUIDO', 'ADICIONAL',
-            'PRESUPUESTO', 'COTIZAR', 'COTIZACIÓN'
-        ]
-
-        # Obtener todos los partes de trabajo
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/partes_trabajo?select=id,resolucion&limit=10000",
-            headers=HEADERS
-        )
-
-        if response.status_code != 200:
-            flash("Error al obtener partes de trabajo", "error")
-            return redirect(url_for('cartera.cartera_dashboard'))
-
-        partes = response.json()
-
-        nuevas_recomendaciones = 0
-        partes_actualizados = 0
-
-        # Analizar cada parte
-        for parte in partes:
-            resolucion = parte.get('resolucion', '')
-
-            if not resolucion:
-                continue
-
-            tiene_recomendacion = False
-            recomendacion_extraida = None
-
-            texto_upper = str(resolucion).upper()
-            for palabra in palabras_clave_recomendacion:
-                if palabra in texto_upper:
-                    tiene_recomendacion = True
-                    recomendacion_extraida = str(resolucion)
-                    break
-
-            # Actualizar parte si cambió el estado de recomendación
-            update_data = {
-                "tiene_recomendacion": tiene_recomendacion,
-                "recomendaciones_extraidas": recomendacion_extraida if tiene_recomendacion else None
-            }
-
-            # Solo actualizar si hay cambio
-            response_update = requests.patch(
-                f"{SUPABASE_URL}/rest/v1/partes_trabajo?id=eq.{parte['id']}",
-                json=update_data,
-                headers=HEADERS
-            )
-
-            if response_update.status_code in [200, 204]:
-                partes_actualizados += 1
-                if tiene_recomendacion:
-                    nuevas_recomendaciones += 1
-
-        flash(f"Re-análisis completado: {partes_actualizados} partes actualizados", "success")
-        flash(f"{nuevas_recomendaciones} recomendaciones detectadas en total", "info")
-
-    except Exception as e:
-        flash(f"Error al re-analizar: {str(e)}", "error")
-        logger.error(f"Error en re-análisis: {str(e)}")
-
-    return redirect(url_for('cartera.cartera_dashboard'))
+    """Re-analizar todos los partes existentes con las nuevas palabras clave (en segundo plano)"""
+    trabajo_id = importacion_jobs.crear_trabajo('cartera_reanalisis')
+    importacion_jobs.lanzar_trabajo(trabajo_id, _trabajo_reanalizar_recomendaciones)
+    return _respuesta_trabajo(trabajo_id)
 
 
 # ============================================
@@ -817,6 +443,7 @@ def cartera_crear_oportunidad(parte_id):
                 json={"oportunidad_creada": True, "oportunidad_id": oportunidad_id, "recomendacion_revisada": True},
                 headers=HEADERS
             )
+            cache_service.invalidar_detalle_maquina(maquina_id)
 
             flash("Oportunidad creada exitosamente", "success")
             return redirect(url_for('cartera.cartera_ver_oportunidad', oportunidad_id=oportunidad_id))
@@ -844,6 +471,8 @@ def cartera_descartar_recomendacion(parte_id):
     )
 
     if response.status_code in [200, 204]:
+        if response.status_code == 200 and response.json():
+            cache_service.invalidar_detalle_maquina(response.json()[0].get('maquina_id'))
         flash("Recomendación descartada", "success")
     else:
         logger.error(f"Error descartando recomendación: {response.status_code} - {response.text}")
@@ -934,6 +563,8 @@ def cartera_actualizar_oportunidad(oportunidad_id):
     )
 
     if response.status_code == 200:
+        if response.json():
+            cache_service.invalidar_detalle_maquina(response.json()[0].get('maquina_id'))
         flash("Oportunidad actualizada correctamente", "success")
     else:
         logger.error(f"Error actualizando oportunidad: {response.status_code} - {response.text}")
@@ -942,59 +573,51 @@ def cartera_actualizar_oportunidad(oportunidad_id):
     return redirect(url_for('cartera.cartera_ver_oportunidad', oportunidad_id=oportunidad_id))
 
 
-# @app.route("/cartera/maquina/<int:maquina_id>")
-@cartera_bp.route('/maquina/<int:maquina_id>')
-@helpers.login_required
-def cartera_ver_maquina(maquina_id):
-    """Vista detallada de una máquina"""
-
-    # Obtener información de la máquina con instalación
+def _detalle_maquina_rest(maquina_id, limite, offset):
+    """
+    Detalle de máquina mediante consultas REST individuales.
+    Solo se usa si la RPC fn_detalle_maquina_cartera no está disponible
+    (migración 015 sin aplicar). Devuelve la misma estructura que la RPC.
+    """
     response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/maquinas_cartera?id=eq.{maquina_id}&select=*,instalaciones(id,nombre,municipio)",
+        f"{SUPABASE_URL}/rest/v1/maquinas_cartera?id=eq.{maquina_id}&select=*,instalaciones(*)",
         headers=HEADERS
     )
 
     if response.status_code != 200 or not response.json():
         logger.error(f"Error al obtener máquina {maquina_id}: status={response.status_code}, response={response.text}")
-        flash("Máquina no encontrada", "error")
-        return redirect(url_for('cartera.cartera_dashboard'))
+        return None
 
     maquina = response.json()[0]
 
-    # Obtener historial de partes de trabajo
+    # Historial paginado con el total en Content-Range (evita el count aparte)
     response_partes = requests.get(
-        f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=eq.{maquina_id}&select=*&order=fecha_parte.desc&limit=50",
-        headers=HEADERS
-    )
-    partes = response_partes.json() if response_partes.status_code == 200 else []
-
-    # Estadísticas
-    stats = {}
-
-    # Total de partes
-    response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=eq.{maquina_id}&select=count",
+        f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=eq.{maquina_id}&select=*&order=fecha_parte.desc&limit={limite}&offset={offset}",
         headers={**HEADERS, "Prefer": "count=exact"}
     )
-    stats['total_partes'] = int(response.headers.get('Content-Range', '0').split('/')[-1])
+    partes = response_partes.json() if response_partes.status_code in [200, 206] else []
 
-    # Averías
-    response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=eq.{maquina_id}&tipo_parte_normalizado=eq.AVERIA&select=count",
-        headers={**HEADERS, "Prefer": "count=exact"}
-    )
-    stats['total_averias'] = int(response.headers.get('Content-Range', '0').split('/')[-1])
+    stats = {}
+    try:
+        stats['total_partes'] = int(response_partes.headers.get('Content-Range', '0').split('/')[-1])
+    except ValueError:
+        stats['total_partes'] = len(partes)
 
-    # Mantenimientos
+    # Tipos de todos los partes para averías, mantenimientos y distribución
     response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=eq.{maquina_id}&tipo_parte_normalizado=eq.MANTENIMIENTO&select=count",
-        headers={**HEADERS, "Prefer": "count=exact"}
+        f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=eq.{maquina_id}&select=tipo_parte_normalizado",
+        headers=HEADERS
     )
-    stats['total_mantenimientos'] = int(response.headers.get('Content-Range', '0').split('/')[-1])
+    tipos_distribucion = {}
+    for parte in (response.json() if response.status_code == 200 else []):
+        tipo = parte.get('tipo_parte_normalizado') or 'OTRO'
+        tipos_distribucion[tipo] = tipos_distribucion.get(tipo, 0) + 1
+    stats['total_averias'] = tipos_distribucion.get('AVERIA', 0)
+    stats['total_mantenimientos'] = tipos_distribucion.get('MANTENIMIENTO', 0)
 
     # Recomendaciones
     response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=eq.{maquina_id}&tiene_recomendacion=eq.true&select=*&order=fecha_parte.desc",
+        f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=eq.{maquina_id}&tiene_recomendacion=eq.true&select=id,fecha_parte,numero_parte,recomendaciones_extraidas&order=fecha_parte.desc",
         headers=HEADERS
     )
     recomendaciones = response.json() if response.status_code == 200 else []
@@ -1008,39 +631,61 @@ def cartera_ver_maquina(maquina_id):
     oportunidades = response.json() if response.status_code == 200 else []
     stats['total_oportunidades'] = len(oportunidades)
 
-    # Distribución de tipos de parte
-    tipos_distribucion = {}
-    for parte in partes:
-        tipo = parte.get('tipo_parte_normalizado', 'OTRO')
-        tipos_distribucion[tipo] = tipos_distribucion.get(tipo, 0) + 1
+    return {
+        'maquina': maquina,
+        'stats': stats,
+        'tipos_distribucion': tipos_distribucion,
+        'partes': partes,
+        'recomendaciones': recomendaciones,
+        'oportunidades': oportunidades
+    }
+
+
+# @app.route("/cartera/maquina/<int:maquina_id>")
+@cartera_bp.route('/maquina/<int:maquina_id>')
+@helpers.login_required
+def cartera_ver_maquina(maquina_id):
+    """Vista detallada de una máquina"""
+
+    pagination = get_pagination(per_page_default=50)
+
+    # Una sola RPC con máquina, agregados e historial paginado (cacheada)
+    detalle = cache_service.get_detalle_maquina_cached(maquina_id, pagination.limit, pagination.offset)
+    if detalle is None:
+        detalle = _detalle_maquina_rest(maquina_id, pagination.limit, pagination.offset)
+
+    if not detalle:
+        flash("Máquina no encontrada", "error")
+        return redirect(url_for('cartera.cartera_dashboard'))
+
+    pagination.total = detalle['stats']['total_partes']
 
     return render_template(
         "cartera/ver_maquina.html",
-        maquina=maquina,
-        stats=stats,
-        partes=partes,
-        recomendaciones=recomendaciones,
-        oportunidades=oportunidades,
-        tipos_distribucion=tipos_distribucion
+        maquina=detalle['maquina'],
+        stats=detalle['stats'],
+        partes=detalle['partes'],
+        recomendaciones=detalle['recomendaciones'],
+        oportunidades=detalle['oportunidades'],
+        tipos_distribucion=detalle['tipos_distribucion'],
+        pagination=pagination
     )
 
 
-# @app.route("/cartera/instalacion/<int:instalacion_id>")
-@cartera_bp.route('/instalacion/<int:instalacion_id>')
-@helpers.login_required
-def cartera_ver_instalacion(instalacion_id):
-    """Vista detallada de una instalación"""
-
-    # Obtener información de la instalación
+def _detalle_instalacion_rest(instalacion_id, limite, offset):
+    """
+    Detalle de instalación mediante consultas REST individuales.
+    Solo se usa si la RPC fn_detalle_instalacion_cartera no está disponible
+    (migración 015 sin aplicar). Devuelve la misma estructura que la RPC.
+    """
     response = requests.get(
         f"{SUPABASE_URL}/rest/v1/instalaciones?id=eq.{instalacion_id}&select=*",
         headers=HEADERS
     )
 
-    if not response.json():
+    if response.status_code != 200 or not response.json():
         logger.error(f"Error al obtener instalación {instalacion_id}: status={response.status_code}, response={response.text}")
-        flash("Instalación no encontrada", "error")
-        return redirect(url_for('cartera.cartera_dashboard'))
+        return None
 
     instalacion = response.json()[0]
 
@@ -1049,12 +694,9 @@ def cartera_ver_instalacion(instalacion_id):
         f"{SUPABASE_URL}/rest/v1/maquinas_cartera?instalacion_id=eq.{instalacion_id}&select=*&order=identificador.asc",
         headers=HEADERS
     )
-    maquinas = response_maquinas.json()
-
-    # Obtener IDs de máquinas para consultas agregadas
+    maquinas = response_maquinas.json() if response_maquinas.status_code == 200 else []
     maquina_ids = [m['id'] for m in maquinas]
 
-    # Calcular estadísticas agregadas de todas las máquinas
     stats = {
         'total_maquinas': len(maquinas),
         'total_partes': 0,
@@ -1063,28 +705,52 @@ def cartera_ver_instalacion(instalacion_id):
         'total_recomendaciones': 0,
         'total_oportunidades': 0
     }
-
-    # Obtener todos los partes de todas las máquinas (últimos 100 de toda la instalación)
+    tipos_distribucion = {}
     partes = []
+    recomendaciones = []
+    oportunidades = []
+
+    # Agregados por máquina en una sola pasada (dict en lugar de filtrar
+    # la lista de partes para cada máquina)
+    por_maquina = {
+        mid: {'total_partes': 0, 'total_averias': 0, 'total_recomendaciones': 0}
+        for mid in maquina_ids
+    }
+
     if maquina_ids:
         maquina_ids_str = ','.join(map(str, maquina_ids))
-        response_partes = requests.get(
-            f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=in.({maquina_ids_str})&select=*,maquinas_cartera(identificador)&order=fecha_parte.desc&limit=100",
+
+        response_resumen = requests.get(
+            f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=in.({maquina_ids_str})&select=maquina_id,tipo_parte_normalizado,tiene_recomendacion",
             headers=HEADERS
         )
-        partes = response_partes.json()
+        for parte in (response_resumen.json() if response_resumen.status_code == 200 else []):
+            tipo = parte.get('tipo_parte_normalizado') or 'OTRO'
+            tipos_distribucion[tipo] = tipos_distribucion.get(tipo, 0) + 1
+            contador = por_maquina.get(parte['maquina_id'])
+            if contador is not None:
+                contador['total_partes'] += 1
+                if tipo == 'AVERIA':
+                    contador['total_averias'] += 1
+                if parte.get('tiene_recomendacion'):
+                    contador['total_recomendaciones'] += 1
+
+        stats['total_partes'] = sum(tipos_distribucion.values())
+        stats['total_averias'] = tipos_distribucion.get('AVERIA', 0)
+        stats['total_mantenimientos'] = tipos_distribucion.get('MANTENIMIENTO', 0)
 
-        # Calcular estadísticas
-        stats['total_partes'] = len(partes)
-        stats['total_averias'] = sum(1 for p in partes if p.get('tipo_parte_normalizado') == 'AVERÍA')
-        stats['total_mantenimientos'] = sum(1 for p in partes if p.get('tipo_parte_normalizado') == 'CONSERVACIÓN')
+        response_partes = requests.get(
+            f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=in.({maquina_ids_str})&select=*,maquinas_cartera(identificador)&order=fecha_parte.desc&limit={limite}&offset={offset}",
+            headers=HEADERS
+        )
+        partes = response_partes.json() if response_partes.status_code == 200 else []
 
         # Obtener recomendaciones
         response_rec = requests.get(
             f"{SUPABASE_URL}/rest/v1/partes_trabajo?maquina_id=in.({maquina_ids_str})&tiene_recomendacion=eq.true&select=*,maquinas_cartera(identificador)&order=fecha_parte.desc",
             headers=HEADERS
         )
-        recomendaciones = response_rec.json()
+        recomendaciones = response_rec.json() if response_rec.status_code == 200 else []
         stats['total_recomendaciones'] = len(recomendaciones)
 
         # Obtener oportunidades
@@ -1092,34 +758,52 @@ def cartera_ver_instalacion(instalacion_id):
             f"{SUPABASE_URL}/rest/v1/oportunidades_facturacion?maquina_id=in.({maquina_ids_str})&select=*,maquinas_cartera(identificador)&order=created_at.desc",
             headers=HEADERS
         )
-        oportunidades = response_op.json()
+        oportunidades = response_op.json() if response_op.status_code == 200 else []
         stats['total_oportunidades'] = len(oportunidades)
-    else:
-        recomendaciones = []
-        oportunidades = []
-
-    # Calcular distribución de tipos de partes
-    tipos_distribucion = {}
-    for parte in partes:
-        tipo = parte.get('tipo_parte_normalizado', 'OTRO')
-        tipos_distribucion[tipo] = tipos_distribucion.get(tipo, 0) + 1
 
-    # Calcular estadísticas por máquina para tabla
     for maquina in maquinas:
-        maquina_partes = [p for p in partes if p['maquina_id'] == maquina['id']]
-        maquina['total_partes'] = len(maquina_partes)
-        maquina['total_averias'] = sum(1 for p in maquina_partes if p.get('tipo_parte_normalizado') == 'AVERÍA')
-        maquina['total_recomendaciones'] = sum(1 for p in maquina_partes if p.get('tiene_recomendacion') == True)
+        maquina.update(por_maquina[maquina['id']])
+
+    return {
+        'instalacion': instalacion,
+        'maquinas': maquinas,
+        'stats': stats,
+        'tipos_distribucion': tipos_distribucion,
+        'partes': partes,
+        'recomendaciones': recomendaciones,
+        'oportunidades': oportunidades
+    }
+
+
+# @app.route("/cartera/instalacion/<int:instalacion_id>")
+@cartera_bp.route('/instalacion/<int:instalacion_id>')
+@helpers.login_required
+def cartera_ver_instalacion(instalacion_id):
+    """Vista detallada de una instalación"""
+
+    pagination = get_pagination(per_page_default=100)
+
+    # Una sola RPC con instalación, máquinas agregadas e historial (cacheada)
+    detalle = cache_service.get_detalle_instalacion_cached(instalacion_id, pagination.limit, pagination.offset)
+    if detalle is None:
+        detalle = _detalle_instalacion_rest(instalacion_id, pagination.limit, pagination.offset)
+
+    if not detalle:
+        flash("Instalación no encontrada", "error")
+        return redirect(url_for('cartera.cartera_dashboard'))
+
+    pagination.total = detalle['stats']['total_partes']
 
     return render_template(
         "cartera/ver_instalacion.html",
-        instalacion=instalacion,
-        maquinas=maquinas,
-        stats=stats,
-        partes=partes,
-        recomendaciones=recomendaciones,
-        oportunidades=oportunidades,
-        tipos_distribucion=tipos_distribucion
+        instalacion=detalle['instalacion'],
+        maquinas=detalle['maquinas'],
+        stats=detalle['stats'],
+        partes=detalle['partes'],
+        recomendaciones=detalle['recomendaciones'],
+        oportunidades=detalle['oportunidades'],
+        tipos_distribucion=detalle['tipos_distribucion'],
+        pagination=pagination
     )
 
 
@@ -1159,6 +843,7 @@ def cartera_dar_baja_instalacion(instalacion_id):
             },
             headers=HEADERS
         )
+        cache_service.invalidar_detalle_instalacion(instalacion_id)
         flash("Instalación dada de baja correctamente", "success")
     else:
         logger.error(f"Error al dar de baja instalación: {response.status_code} - {response.text}")
@@ -1185,6 +870,7 @@ def cartera_reactivar_instalacion(instalacion_id):
     )
 
     if response.status_code in [200, 204]:
+        cache_service.invalidar_detalle_instalacion(instalacion_id)
         flash("Instalación reactivada correctamente", "success")
     else:
         logger.error(f"Error al reactivar instalación: {response.status_code} - {response.text}")
@@ -2804,6 +2490,17 @@ estado_analisis_global = {
     'errores_detallados': []  # Lista de errores específicos
 }
 
+
+def _partes_pendientes_analisis():
+    """Partes que le quedan al análisis en curso de este worker (gauge de /metrics)"""
+    if not estado_analisis_global['en_progreso']:
+        return 0
+    return max(0, estado_analisis_global['total'] - estado_analisis_global['procesados'])
+
+
+registro_metricas.gauge('ia_partes_pendientes', "Partes pendientes del análisis con IA en curso",
+                        _partes_pendientes_analisis, por_trabajador=True)
+
 # @app.route("/cartera/ia/ejecutar")
 @cartera_bp.route('/ia/ejecutar')
 @helpers.login_required
@@ -2892,6 +2589,8 @@ def ejecutar_analisis_web():
 
             # Procesar TODOS los partes
             for parte in partes:
+                inicio_parte = time.perf_counter()
+                resultado = 'error'
                 try:
                     prompt = f"""Analiza este parte de ascensor y responde SOLO con JSON:
 
@@ -2940,9 +2639,11 @@ JSON esperado:
                     )
 
                     if save_response.status_code in [200, 201]:
+                        resultado = 'exito'
                         estado_analisis_global['exitosos'] += 1
                         logger.info(f"✅ [{estado_analisis_global['procesados']+1}/{estado_analisis_global['total']}] {parte.get('numero_parte')}")
                     else:
+                        resultado = 'error_guardado'
                         estado_analisis_global['errores'] += 1
                         error_msg = f"Error guardando {parte.get('numero_parte')}: {save_response.status_code} - {save_response.text[:200]}"
                         estado_analisis_global['ultimo_error'] = error_msg
@@ -2959,6 +2660,8 @@ JSON esperado:
                     logger.error(f"❌ {error_msg}")
 
                 estado_analisis_global['procesados'] += 1
+                registro_metricas.incrementar('ia_partes_analizados_total', resultado=resultado)
+                registro_metricas.observar('ia_analisis_parte_segundos', time.perf_counter() - inicio_parte)
 
                 # Pausa cada 10 para rate limits
                 if estado_analisis_global['procesados'] % 10 == 0:
@@ -2,27 +2,23 @@
 Blueprint de Defectos
 
 Gestión de defectos de inspecciones con funcionalidades de:
-- Dashboard con estadísticas y filtros operativos
-- Exportación a PDF agrupado por máquina
+- Dashboard con estadísticas y filtros operativos (resueltos en el servidor,
+  listados paginados por cursor: services/defectos_service.py)
+- Exportación a PDF agrupado por máquina (con caché y en segundo plano
+  para informes grandes: services/exportacion_defectos.py)
 - CRUD completo de defectos
 - Subsanación y reversión de estado
 - Gestión operativa (técnicos, materiales, stock)
 - Actualización AJAX para campos de gestión
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, make_response, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify, send_file
 from datetime import datetime, date
-import os
 import requests
-import io
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
 
 import helpers
 from config import config
+from services import defectos_service, exportacion_defectos, importacion_jobs
 from utils.messages import flash_success, flash_error
 
 # Crear Blueprint
@@ -39,246 +35,136 @@ SUPABASE_KEY = config.SUPABASE_KEY
 @helpers.requiere_permiso('inspecciones', 'read')
 def dashboard():
     """Dashboard principal de defectos con estadísticas y filtros"""
-    
-    # Obtener todos los defectos con información de urgencia usando la vista
-    response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/v_defectos_con_urgencia?select=*&order=fecha_limite.asc",
-        headers=HEADERS
-    )
-    
-    todos_defectos = []
-    if response.status_code == 200:
-        todos_defectos = response.json()
-    
-    # Calcular estadísticas generales
-    total_defectos = len(todos_defectos)
-    defectos_pendientes = [d for d in todos_defectos if d.get('estado') == 'PENDIENTE']
-    defectos_subsanados = [d for d in todos_defectos if d.get('estado') == 'SUBSANADO']
-    
-    # Aplicar filtros
-    filtro_tecnico = request.args.get('tecnico', '')
-    filtro_material = request.args.get('material', '')
-    filtro_stock = request.args.get('stock', '')
-    
-    if filtro_tecnico:
-        if filtro_tecnico == 'sin_asignar':
-            defectos_pendientes = [d for d in defectos_pendientes if not d.get('tecnico_asignado')]
-        else:
-            defectos_pendientes = [d for d in defectos_pendientes if d.get('tecnico_asignado') == filtro_tecnico]
-    
-    if filtro_material:
-        if filtro_material == 'sin_definir':
-            defectos_pendientes = [d for d in defectos_pendientes if not d.get('gestion_material')]
-        else:
-            defectos_pendientes = [d for d in defectos_pendientes if d.get('gestion_material') == filtro_material]
-    
-    if filtro_stock:
-        if filtro_stock == 'sin_definir':
-            defectos_pendientes = [d for d in defectos_pendientes if not d.get('estado_stock')]
-        else:
-            defectos_pendientes = [d for d in defectos_pendientes if d.get('estado_stock') == filtro_stock]
-    
-    # Clasificar por urgencia
-    defectos_vencidos = [d for d in defectos_pendientes if d.get('nivel_urgencia') == 'VENCIDO']
-    defectos_urgentes = [d for d in defectos_pendientes if d.get('nivel_urgencia') == 'URGENTE']
-    defectos_proximos = [d for d in defectos_pendientes if d.get('nivel_urgencia') == 'PROXIMO']
-    defectos_normales = [d for d in defectos_pendientes if d.get('nivel_urgencia') == 'NORMAL']
-    
-    # Estadísticas por calificación (solo pendientes)
-    defectos_dl = [d for d in defectos_pendientes if d.get('calificacion') == 'DL']  # Defecto Leve
-    defectos_dg = [d for d in defectos_pendientes if d.get('calificacion') == 'DG']  # Defecto Grave
-    defectos_dmg = [d for d in defectos_pendientes if d.get('calificacion') == 'DMG']  # Defecto Muy Grave
-    
-    # Obtener información adicional de inspecciones para enriquecer datos
-    response_insp = requests.get(
-        f"{SUPABASE_URL}/rest/v1/inspecciones?select=id,maquina,direccion,poblacion,fecha_inspeccion,oca_id,oca:ocas(nombre)",
-        headers=HEADERS
-    )
-    
-    inspecciones_dict = {}
-    if response_insp.status_code == 200:
-        inspecciones = response_insp.json()
-        for insp in inspecciones:
-            inspecciones_dict[insp['id']] = insp
-    
-    # Enriquecer defectos con información de inspección
-    for defecto in todos_defectos:
-        insp_id = defecto.get('inspeccion_id')
-        if insp_id and insp_id in inspecciones_dict:
-            insp = inspecciones_dict[insp_id]
-            defecto['direccion'] = insp.get('direccion')
-            defecto['poblacion'] = insp.get('poblacion')
-            defecto['fecha_inspeccion'] = insp.get('fecha_inspeccion')
-            defecto['oca_nombre'] = insp.get('oca', {}).get('nombre') if insp.get('oca') else None
-    
+
+    # Filtros, contadores y join con inspecciones se resuelven en el servidor
+    filtros = defectos_service.leer_filtros(request.args)
+    resumen, secciones = defectos_service.obtener_dashboard_defectos(filtros)
+
     return render_template(
         "defectos_dashboard.html",
-        total_defectos=total_defectos,
-        total_pendientes=len(defectos_pendientes),
-        total_subsanados=len(defectos_subsanados),
-        defectos_vencidos=defectos_vencidos,
-        defectos_urgentes=defectos_urgentes,
-        defectos_proximos=defectos_proximos,
-        defectos_normales=defectos_normales,
-        defectos_subsanados=defectos_subsanados,
-        defectos_dl=len(defectos_dl),
-        defectos_dg=len(defectos_dg),
-        defectos_dmg=len(defectos_dmg),
-        todos_defectos=todos_defectos
+        total_defectos=resumen['total'],
+        total_pendientes=resumen['pendientes'],
+        total_subsanados=resumen['subsanados'],
+        por_urgencia=resumen['por_urgencia'],
+        secciones=secciones,
+        defectos_dl=resumen['por_calificacion'].get('DL', 0),
+        defectos_dg=resumen['por_calificacion'].get('DG', 0),
+        defectos_dmg=resumen['por_calificacion'].get('DMG', 0)
     )
 
 
-@defectos_bp.route('/exportar_pdf')
+@defectos_bp.route('/filas')
 @helpers.login_required
 @helpers.requiere_permiso('inspecciones', 'read')
-def exportar_pdf():
-    """Exporta defectos a PDF en formato horizontal, agrupados por máquina"""
-    
-    # Obtener todos los defectos con información de urgencia usando la vista
-    response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/v_defectos_con_urgencia?select=*&order=fecha_limite.asc",
-        headers=HEADERS
-    )
-    
-    todos_defectos = []
-    if response.status_code == 200:
-        todos_defectos = response.json()
-    
-    # Aplicar filtros (mismo código que el dashboard)
-    defectos_pendientes = [d for d in todos_defectos if d.get('estado') == 'PENDIENTE']
-    
-    filtro_tecnico = request.args.get('tecnico', '')
-    filtro_material = request.args.get('material', '')
-    filtro_stock = request.args.get('stock', '')
-    
-    if filtro_tecnico:
-        if filtro_tecnico == 'sin_asignar':
-            defectos_pendientes = [d for d in defectos_pendientes if not d.get('tecnico_asignado')]
-        else:
-            defectos_pendientes = [d for d in defectos_pendientes if d.get('tecnico_asignado') == filtro_tecnico]
-    
-    if filtro_material:
-        if filtro_material == 'sin_definir':
-            defectos_pendientes = [d for d in defectos_pendientes if not d.get('gestion_material')]
-        else:
-            defectos_pendientes = [d for d in defectos_pendientes if d.get('gestion_material') == filtro_material]
-    
-    if filtro_stock:
-        if filtro_stock == 'sin_definir':
-            defectos_pendientes = [d for d in defectos_pendientes if not d.get('estado_stock')]
-        else:
-            defectos_pendientes = [d for d in defectos_pendientes if d.get('estado_stock') == filtro_stock]
-    
-    # Obtener información adicional de inspecciones para enriquecer datos
-    response_insp = requests.get(
-        f"{SUPABASE_URL}/rest/v1/inspecciones?select=id,maquina,direccion,poblacion,fecha_inspeccion,oca_id,oca:ocas(nombre)",
-        headers=HEADERS
+def filas():
+    """Siguiente página de una sección del dashboard (HTML de las filas + cursor)"""
+
+    seccion = request.args.get('seccion', '')
+    if seccion not in defectos_service.SECCIONES_DEFECTOS:
+        return jsonify({'error': 'Sección no válida'}), 400
+
+    desde = None
+    if request.args.get('desde'):
+        desde = defectos_service.leer_cursor(request.args.get('desde'))
+        if desde is None:
+            return jsonify({'error': 'Cursor no válido'}), 400
+
+    defectos, siguiente = defectos_service.obtener_pagina_defectos(
+        seccion,
+        defectos_service.leer_filtros(request.args),
+        desde
     )
-    
-    inspecciones_dict = {}
-    if response_insp.status_code == 200:
-        inspecciones = response_insp.json()
-        for insp in inspecciones:
-            inspecciones_dict[insp['id']] = insp
-    
-    # Enriquecer defectos con información de inspección
-    for defecto in defectos_pendientes:
-        insp_id = defecto.get('inspeccion_id')
-        if insp_id and insp_id in inspecciones_dict:
-            insp = inspecciones_dict[insp_id]
-            defecto['direccion'] = insp.get('direccion')
-            defecto['poblacion'] = insp.get('poblacion')
-            defecto['fecha_inspeccion'] = insp.get('fecha_inspeccion')
-            defecto['oca_nombre'] = insp.get('oca', {}).get('nombre') if insp.get('oca') else None
-    
-    # Agrupar defectos por máquina
-    defectos_por_maquina = {}
-    for defecto in defectos_pendientes:
-        maquina = defecto.get('maquina', 'Sin especificar')
-        if maquina not in defectos_por_maquina:
-            defectos_por_maquina[maquina] = []
-        defectos_por_maquina[maquina].append(defecto)
-    
-    # Generar PDF
-    pdf_buffer = io.BytesIO()
-    doc = SimpleDocTemplate(
-        pdf_buffer,
-        pagesize=landscape(A4),
-        rightMargin=1*cm,
-        leftMargin=1*cm,
-        topMargin=1*cm,
-        bottomMargin=1*cm
+
+    return jsonify({
+        'html': render_template('defectos/filas.html', defectos=defectos, seccion=seccion),
+        'siguiente': siguiente
+    })
+
+
+def _enviar_pdf(ruta):
+    """Sirve el PDF desde disco (send_file, sin copiarlo en memoria)"""
+    return send_file(
+        ruta,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=f'defectos_pendientes_{datetime.now().strftime("%Y%m%d")}.pdf',
+        max_age=0
     )
-    
-    # Elementos del PDF
-    elementos = []
-    
-    # Logo
-    logo_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'logo-fedes-ascensores.png')
-    if os.path.exists(logo_path):
-        logo = Image(logo_path, width=4*cm, height=1.6*cm)
-        elementos.append(logo)
-        elementos.append(Spacer(1, 0.3*cm))
-    
-    # Título
-    styles = getSampleStyleSheet()
-    titulo = Paragraph("<b>LISTADO DE DEFECTOS PENDIENTES</b>", styles['Title'])
-    elementos.append(titulo)
-    
-    # Fecha de generación
-    fecha_hoy = datetime.now().strftime('%d/%m/%Y %H:%M')
-    fecha_texto = Paragraph(f"<i>Generado el: {fecha_hoy}</i>", styles['Normal'])
-    elementos.append(fecha_texto)
-    elementos.append(Spacer(1, 0.5*cm))
-    
-    # Crear tabla para cada máquina
-    for maquina, defectos in defectos_por_maquina.items():
-        # Título de la máquina
-        maquina_titulo = Paragraph(f"<b>MÁQUINA: {maquina}</b>", styles['Heading2'])
-        elementos.append(maquina_titulo)
-        elementos.append(Spacer(1, 0.2*cm))
-        
-        # Datos de la tabla
-        datos_tabla = [['Defecto', 'Calif.', 'Plazo', 'Límite', 'Días', 'Dirección', 'Población']]
-        
-        for defecto in defectos:
-            datos_tabla.append([
-                Paragraph(defecto.get('descripcion', ''), styles['Normal']),
-                defecto.get('calificacion', ''),
-                f"{defecto.get('plazo_meses', '')}m",
-                defecto.get('fecha_limite', '')[:10] if defecto.get('fecha_limite') else '',
-                str(defecto.get('dias_restantes', '')),
-                Paragraph(defecto.get('direccion', ''), styles['Normal']),
-                defecto.get('poblacion', '')
-            ])
-        
-        # Crear tabla
-        tabla = Table(datos_tabla, colWidths=[7*cm, 1.5*cm, 1.5*cm, 2*cm, 1.5*cm, 5*cm, 3*cm])
-        tabla.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#003366')),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0,0), (-1,0), 10),
-            ('BOTTOMPADDING', (0,0), (-1,0), 12),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ]))
-        
-        elementos.append(tabla)
-        elementos.append(Spacer(1, 0.5*cm))
-    
-    # Construir PDF
-    doc.build(elementos)
-    
-    # Preparar respuesta
-    pdf_buffer.seek(0)
-    response = make_response(pdf_buffer.read())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=defectos_pendientes_{datetime.now().strftime("%Y%m%d")}.pdf'
-    
-    return response
+
+
+def _trabajo_exportar_pdf(filtros, clave, total):
+    """Trabajo en segundo plano: generación del PDF de defectos"""
+    def ejecutar(ruta_archivo, nombre_archivo, progreso):
+        progreso.total(total)
+        exportacion_defectos.generar_pdf_defectos(filtros, clave, progreso=progreso)
+        return {'defectos': total}
+    return ejecutar
+
+
+@defectos_bp.route('/exportar_pdf')
+@helpers.login_required
+@helpers.requiere_permiso('inspecciones', 'read')
+def exportar_pdf():
+    """
+    Exporta defectos a PDF en formato horizontal, agrupados por máquina
+
+    Si el PDF de estos filtros y datos ya se generó hoy se sirve desde caché.
+    Con JSON (botón del dashboard) responde con la URL de descarga, o con un
+    trabajo en segundo plano si el informe es grande.
+    """
+    filtros = defectos_service.leer_filtros(request.args)
+    clave, total = exportacion_defectos.preparar_exportacion(filtros)
+    quiere_json = request.accept_mimetypes.best == 'application/json'
+    descarga_url = url_for('defectos.descargar_pdf', clave=clave)
+
+    ruta = exportacion_defectos.pdf_en_cache(clave)
+
+    if ruta is None and quiere_json and total and total > exportacion_defectos.UMBRAL_SEGUNDO_PLANO:
+        trabajo_id = importacion_jobs.crear_trabajo('defectos_pdf')
+        importacion_jobs.lanzar_trabajo(trabajo_id, _trabajo_exportar_pdf(filtros, clave, total))
+        return jsonify({
+            'success': True,
+            'trabajo_id': trabajo_id,
+            'estado_url': url_for('defectos.estado_exportacion', trabajo_id=trabajo_id),
+            'descarga_url': descarga_url
+        }), 202
+
+    if ruta is None:
+        try:
+            ruta = exportacion_defectos.generar_pdf_defectos(filtros, clave)
+        except Exception as e:
+            if quiere_json:
+                return jsonify({'success': False, 'error': str(e)}), 500
+            flash_error(f'Error al generar el PDF: {str(e)}')
+            return redirect(url_for('defectos.dashboard', **filtros))
+
+    if quiere_json:
+        return jsonify({'success': True, 'descarga_url': descarga_url})
+
+    return _enviar_pdf(ruta)
+
+
+@defectos_bp.route('/exportar_pdf/<clave>')
+@helpers.login_required
+@helpers.requiere_permiso('inspecciones', 'read')
+def descargar_pdf(clave):
+    """Descarga un PDF de defectos ya generado"""
+    ruta = exportacion_defectos.pdf_en_cache(clave)
+    if ruta is None:
+        flash_error('El PDF ya no está disponible, vuelve a exportarlo')
+        return redirect(url_for('defectos.dashboard'))
+    return _enviar_pdf(ruta)
+
+
+@defectos_bp.route('/exportaciones/<trabajo_id>')
+@helpers.login_required
+@helpers.requiere_permiso('inspecciones', 'read')
+def estado_exportacion(trabajo_id):
+    """Estado de una exportación a PDF en segundo plano"""
+    estado = importacion_jobs.obtener_estado_publico(trabajo_id)
+    if estado is None or estado['tipo'] != 'defectos_pdf':
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify(estado)
 
 
 @defectos_bp.route('/<int:defecto_id>')
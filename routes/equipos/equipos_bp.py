@@ -6,9 +6,10 @@ Gestión de equipos de clientes con funcionalidades de:
 - CRUD completo de equipos
 - Visualización de detalles
 - Sistema de acciones/tareas para seguimiento
+- Importación masiva desde Excel en segundo plano
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify
 from datetime import date
 import requests
 
@@ -16,6 +17,7 @@ import helpers
 from config import config
 from utils.formatters import limpiar_none
 from utils.messages import flash_success, flash_error
+from services import importacion_jobs, seguimiento_service
 
 # Configuración de Supabase
 SUPABASE_URL = config.SUPABASE_URL
@@ -69,6 +71,8 @@ def nuevo():
 
         res = requests.post(f"{SUPABASE_URL}/rest/v1/equipos", json=equipo_data, headers=HEADERS)
         if res.status_code in [200, 201]:
+            if equipo_data["ipo_proxima"]:
+                seguimiento_service.lanzar_reconciliacion()
             flash_success("Equipo añadido correctamente")
             return redirect(url_for('leads.ver', lead_id=lead_id))
         else:
@@ -133,6 +137,8 @@ def editar(equipo_id):
         update_url = f"{SUPABASE_URL}/rest/v1/equipos?id=eq.{equipo_id}"
         res = requests.patch(update_url, json=data, headers=HEADERS)
         if res.status_code in [200, 204]:
+            if data["ipo_proxima"]:
+                seguimiento_service.lanzar_reconciliacion()
             # Obtener el cliente_id del equipo para volver a su vista
             cliente_id = equipo.get("cliente_id")
             return redirect(url_for('leads.ver', lead_id=cliente_id))
@@ -210,3 +216,50 @@ def delete_accion(equipo_id, index):
         index=index,
         redirect_to=url_for('equipos.ver', equipo_id=equipo_id)
     )
+
+
+def _trabajo_importar_equipos(ruta_archivo, nombre_archivo, progreso):
+    """Trabajo en segundo plano: alta/actualización de equipos desde Excel"""
+    # Import diferido: pandas solo se carga al importar
+    from services import equipos_service
+
+    df = equipos_service.leer_excel_equipos(ruta_archivo)
+    stats = equipos_service.procesar_equipos(df, progreso=progreso)
+    if stats['insertados'] or stats['actualizados']:
+        seguimiento_service.lanzar_reconciliacion()
+    # El detalle ya está en los errores por fila del trabajo
+    stats.pop('errores_detalle', None)
+    return stats
+
+
+@equipos_bp.route('/importar', methods=['POST'])
+@helpers.login_required
+@helpers.requiere_permiso('clientes', 'write')
+def importar():
+    """Importar/actualizar equipos desde Excel (devuelve un ID de trabajo)"""
+    file = request.files.get('archivo_equipos')
+    if not file or file.filename == '':
+        return jsonify({'success': False, 'error': 'No se seleccionó ningún archivo'}), 400
+
+    if not file.filename.endswith(('.xlsx', '.xls')):
+        return jsonify({'success': False, 'error': 'El archivo debe ser formato Excel (.xlsx o .xls)'}), 400
+
+    trabajo_id = importacion_jobs.crear_trabajo('equipos', file)
+    importacion_jobs.lanzar_trabajo(trabajo_id, _trabajo_importar_equipos)
+
+    return jsonify({
+        'success': True,
+        'trabajo_id': trabajo_id,
+        'estado_url': url_for('equipos.estado_importacion', trabajo_id=trabajo_id)
+    }), 202
+
+
+@equipos_bp.route('/importaciones/<trabajo_id>')
+@helpers.login_required
+@helpers.requiere_permiso('clientes', 'read')
+def estado_importacion(trabajo_id):
+    """Estado de un trabajo de importación de equipos"""
+    estado = importacion_jobs.obtener_estado_publico(trabajo_id)
+    if estado is None or estado['tipo'] != 'equipos':
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify(estado)
@@ -2,21 +2,25 @@
 Blueprint para gestión de Inspecciones e IPOs
 
 Este módulo incluye:
-- Dashboard con alertas y categorización de inspecciones
+- Dashboard con alertas y categorización de inspecciones (resueltas en el
+  servidor, listados paginados por cursor: services/inspecciones_service.py)
 - Creación y edición de inspecciones
 - Gestión de actas y presupuestos (PDFs)
-- Extracción de defectos desde PDFs
+- Extracción de defectos desde PDFs (services/extraccion_pdf.py)
 - Marcado de segunda inspección realizada
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, session
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify
+import calendar
 import requests
 import helpers
 from config import config
 from datetime import datetime, date
+from services import extraccion_pdf, inspecciones_service, storage_service
+from services.supabase_client import db
+from services.cache_service import invalidar_resumen_inspecciones
 from utils.formatters import limpiar_none
-from utils.messages import flash_success, flash_error
-import os
+from utils.messages import flash_success, flash_error, flash_info
 
 # Crear Blueprint con prefijo /inspecciones
 inspecciones_bp = Blueprint('inspecciones', __name__, url_prefix='/inspecciones')
@@ -26,13 +30,37 @@ SUPABASE_URL = config.SUPABASE_URL
 HEADERS = config.HEADERS
 SUPABASE_KEY = config.SUPABASE_KEY
 
-# Storage key para Supabase Storage
-SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")
-STORAGE_KEY = SUPABASE_SERVICE_KEY if SUPABASE_SERVICE_KEY else SUPABASE_KEY
-STORAGE_HEADERS = {
-    "apikey": STORAGE_KEY,
-    "Authorization": f"Bearer {STORAGE_KEY}",
-}
+# Secciones del dashboard en orden de urgencia: (sección, título)
+SECCIONES_TITULOS = [
+    ('vencidas', '⚠️ Plazo Vencido - Defectos Pendientes'),
+    ('este-mes', '🔔 Urgentes - Defectos Este Mes'),
+    ('proximo-mes', '📋 Próximos - Defectos Próximo Mes'),
+    ('programadas', '✅ Sin Urgencia / Defectos OK')
+]
+
+
+def calcular_fecha_limite(fecha_inspeccion, plazo_meses):
+    """
+    Fecha límite de un defecto: fecha de inspección + plazo en meses
+
+    Si el día no existe en el mes destino se usa el último día del mes
+    (31/08 + 6 meses = 28/02).
+
+    Returns:
+        str YYYY-MM-DD o None si no hay fecha o no es válida
+    """
+    if not fecha_inspeccion:
+        return None
+    try:
+        fecha = datetime.strptime(fecha_inspeccion.split('T')[0], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+    mes = fecha.month - 1 + plazo_meses
+    anio = fecha.year + mes // 12
+    mes = mes % 12 + 1
+    dia = min(fecha.day, calendar.monthrange(anio, mes)[1])
+    return date(anio, mes, dia).isoformat()
 
 
 # ============================================
@@ -45,56 +73,9 @@ STORAGE_HEADERS = {
 def dashboard():
     """Dashboard principal de inspecciones con alertas y estados"""
 
-    # Obtener todas las inspecciones con información del OCA
-    response = requests.get(
-        f"{SUPABASE_URL}/rest/v1/inspecciones?select=*,oca:ocas(nombre)&order=fecha_inspeccion.desc",
-        headers=HEADERS
-    )
-
-    inspecciones = []
-    if response.status_code == 200:
-        inspecciones = response.json()
-
-    # Calcular alertas y estadísticas basadas en inspecciones
-    hoy = date.today()
-    alertas_criticas = []
-    alertas_urgentes = []
-    alertas_proximas = []
-    alertas_normales = []  # Inspecciones sin urgencia
-
-    # Procesar inspecciones - categorizar según urgencia de segunda inspección
-    for inspeccion in inspecciones:
-        # Categorizar según urgencia para solucionar defectos antes de la fecha límite
-        if inspeccion.get('fecha_segunda_realizada'):
-            inspeccion['categoria_segunda'] = 'realizadas'
-            alertas_normales.append(('defectos', inspeccion))
-        elif inspeccion.get('fecha_segunda_inspeccion'):
-            try:
-                fecha_limite = datetime.strptime(inspeccion['fecha_segunda_inspeccion'].split('T')[0], '%Y-%m-%d').date()
-                dias_restantes = (fecha_limite - hoy).days
-                inspeccion['dias_hasta_segunda'] = dias_restantes
-
-                if fecha_limite < hoy:
-                    inspeccion['categoria_segunda'] = 'vencidas'
-                    alertas_criticas.append(('defectos', inspeccion))
-                elif dias_restantes <= 30:
-                    inspeccion['categoria_segunda'] = 'este-mes'
-                    alertas_urgentes.append(('defectos', inspeccion))
-                elif dias_restantes <= 60:
-                    inspeccion['categoria_segunda'] = 'proximo-mes'
-                    alertas_proximas.append(('defectos', inspeccion))
-                else:
-                    inspeccion['categoria_segunda'] = 'pendiente'
-                    alertas_normales.append(('defectos', inspeccion))
-            except:
-                inspeccion['categoria_segunda'] = 'sin-fecha'
-                alertas_normales.append(('defectos', inspeccion))
-        else:
-            inspeccion['categoria_segunda'] = 'sin-fecha'
-            alertas_normales.append(('defectos', inspeccion))
-
-    # Ordenar alertas críticas: más antiguas primero
-    alertas_criticas.sort(key=lambda x: x[1].get('dias_hasta_segunda', 0))
+    # Contadores de defectos, categorías y totales se resuelven en el servidor
+    filtros = inspecciones_service.leer_filtros(request.args)
+    totales, secciones = inspecciones_service.obtener_dashboard_inspecciones(filtros)
 
     # Obtener lista de OCAs para filtros
     response_ocas = requests.get(
@@ -105,60 +86,47 @@ def dashboard():
     if response_ocas.status_code == 200:
         ocas = response_ocas.json()
 
-    # Obtener defectos de todas las inspecciones para contar pendientes por plazo
-    response_defectos = requests.get(
-        f"{SUPABASE_URL}/rest/v1/defectos_inspeccion?select=inspeccion_id,estado,plazo_meses",
-        headers=HEADERS
-    )
-
-    defectos_por_inspeccion = {}
-    if response_defectos.status_code == 200:
-        defectos = response_defectos.json()
-        for defecto in defectos:
-            insp_id = defecto.get('inspeccion_id')
-            if insp_id not in defectos_por_inspeccion:
-                defectos_por_inspeccion[insp_id] = {
-                    'total': 0,
-                    'pendientes': 0,
-                    'plazo_6_pendientes': 0,
-                    'plazo_12_pendientes': 0
-                }
-
-            defectos_por_inspeccion[insp_id]['total'] += 1
-
-            if defecto.get('estado') == 'PENDIENTE':
-                defectos_por_inspeccion[insp_id]['pendientes'] += 1
-                plazo = defecto.get('plazo_meses')
-                if plazo == 6:
-                    defectos_por_inspeccion[insp_id]['plazo_6_pendientes'] += 1
-                elif plazo == 12:
-                    defectos_por_inspeccion[insp_id]['plazo_12_pendientes'] += 1
-
-    # Agregar contador de defectos a cada inspección
-    for inspeccion in inspecciones:
-        insp_id = inspeccion.get('id')
-        if insp_id in defectos_por_inspeccion:
-            inspeccion['defectos_total'] = defectos_por_inspeccion[insp_id]['total']
-            inspeccion['defectos_pendientes'] = defectos_por_inspeccion[insp_id]['pendientes']
-            inspeccion['defectos_plazo_6'] = defectos_por_inspeccion[insp_id]['plazo_6_pendientes']
-            inspeccion['defectos_plazo_12'] = defectos_por_inspeccion[insp_id]['plazo_12_pendientes']
-        else:
-            inspeccion['defectos_total'] = 0
-            inspeccion['defectos_pendientes'] = 0
-            inspeccion['defectos_plazo_6'] = 0
-            inspeccion['defectos_plazo_12'] = 0
-
     return render_template(
         "inspecciones_dashboard.html",
-        inspecciones=inspecciones,
-        alertas_criticas=alertas_criticas,
-        alertas_urgentes=alertas_urgentes,
-        alertas_proximas=alertas_proximas,
-        alertas_normales=alertas_normales,
+        secciones=secciones,
+        secciones_titulos=SECCIONES_TITULOS,
+        totales=totales,
+        filtros=filtros,
         ocas=ocas
     )
 
 
+@inspecciones_bp.route('/filas')
+@helpers.login_required
+@helpers.requiere_permiso('inspecciones', 'read')
+def filas():
+    """Siguiente página de una sección del dashboard (HTML de las tarjetas + cursor)"""
+
+    seccion = request.args.get('seccion', '')
+    if seccion not in inspecciones_service.SECCIONES_INSPECCIONES:
+        return jsonify({'error': 'Sección no válida'}), 400
+
+    desde = inspecciones_service.leer_cursor(request.args.get('desde'))
+    if desde is None:
+        return jsonify({'error': 'Cursor no válido'}), 400
+
+    inspecciones, siguiente = inspecciones_service.obtener_pagina_inspecciones(
+        seccion,
+        inspecciones_service.leer_filtros(request.args),
+        desde
+    )
+
+    return jsonify({
+        'html': render_template(
+            'inspecciones/filas.html',
+            inspecciones=inspecciones,
+            seccion=seccion,
+            vista='lista' if request.args.get('vista') == 'lista' else 'grid'
+        ),
+        'siguiente': siguiente
+    })
+
+
 # ============================================
 # NUEVA INSPECCIÓN
 # ============================================
@@ -200,6 +168,7 @@ def nueva():
 
         if response.status_code in [200, 201]:
             inspeccion_id = response.json()[0]["id"]
+            invalidar_resumen_inspecciones()
             flash_success("Inspección creada correctamente")
             return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
         else:
@@ -301,6 +270,7 @@ def editar(inspeccion_id):
         )
 
         if response.status_code in [200, 204]:
+            invalidar_resumen_inspecciones()
             flash_success("Inspección actualizada correctamente")
             return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
         else:
@@ -354,6 +324,7 @@ def eliminar(inspeccion_id):
     )
 
     if response.status_code in [200, 204]:
+        invalidar_resumen_inspecciones()
         flash_success("Inspección eliminada correctamente")
         return redirect(url_for('inspecciones.dashboard'))
     else:
@@ -418,6 +389,7 @@ def marcar_segunda_realizada(inspeccion_id):
     )
 
     if response.status_code in [200, 204]:
+        invalidar_resumen_inspecciones()
         flash_success("Segunda inspección marcada como realizada")
     else:
         flash_error(f"Error al marcar segunda inspección: {response.text}")
@@ -426,22 +398,27 @@ def marcar_segunda_realizada(inspeccion_id):
 
 
 # ============================================
-# SUBIR ACTA PDF
+# SUBIR ACTAS Y PRESUPUESTOS PDF
 # ============================================
+# Los PDFs se guardan por contenido (services/storage_service.py). El
+# navegador los sube directamente a Storage con una URL firmada (firmar_pdf +
+# confirmar_pdf); los formularios de subida quedan como fallback y envían el
+# fichero a Storage en streaming.
+
+# Tipo de PDF -> (campo del formulario, columna de inspecciones, mensaje de éxito)
+TIPOS_PDF = {
+    'acta': ('acta_pdf', 'acta_pdf_url', "Acta PDF subida correctamente"),
+    'presupuesto': ('presupuesto_pdf', 'presupuesto_pdf_url', "Presupuesto PDF subido correctamente"),
+}
 
-@inspecciones_bp.route('/<int:inspeccion_id>/subir_acta', methods=["POST"])
-@helpers.login_required
-@helpers.requiere_permiso('inspecciones', 'write')
-def subir_acta_pdf(inspeccion_id):
-    """Subir PDF del acta de inspección a Supabase Storage"""
 
-    if 'acta_pdf' not in request.files:
-        flash_error("No se seleccionó ningún archivo")
-        return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
+def _subir_pdf_formulario(inspeccion_id, tipo):
+    """Sube el PDF recibido en el formulario y guarda su URL en la inspección"""
+    campo, columna, mensaje = TIPOS_PDF[tipo]
 
-    file = request.files['acta_pdf']
+    file = request.files.get(campo)
 
-    if file.filename == '':
+    if not file or file.filename == '':
         flash_error("No se seleccionó ningún archivo")
         return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
 
@@ -451,52 +428,17 @@ def subir_acta_pdf(inspeccion_id):
         return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
 
     try:
-        # Generar nombre de archivo único
-        file_name = f"inspeccion_{inspeccion_id}_acta.pdf"
-        file_path = f"inspecciones/{file_name}"
-
-        # Leer contenido del archivo
-        file_content = file.read()
-
-        # Headers para operaciones de storage con Content-Type
-        storage_headers = {
-            **STORAGE_HEADERS,
-            "Content-Type": "application/pdf",
-        }
+        # Se sube desde el fichero temporal de la petición, sin leerlo en memoria
+        subida, error = storage_service.subir_pdf_inspeccion(file.stream)
 
-        # Primero intentar eliminar el archivo existente (si existe)
-        requests.delete(
-            f"{SUPABASE_URL}/storage/v1/object/inspecciones-pdfs/{file_path}",
-            headers=storage_headers
-        )
-
-        # Subir nuevo archivo
-        upload_response = requests.post(
-            f"{SUPABASE_URL}/storage/v1/object/inspecciones-pdfs/{file_path}",
-            data=file_content,
-            headers=storage_headers
-        )
-
-        if upload_response.status_code not in [200, 201]:
-            flash_error(f"Error al subir archivo: {upload_response.text}")
+        if error:
+            flash_error(f"Error al subir archivo: {error}")
             return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
 
-        # Obtener URL pública del archivo
-        public_url = f"{SUPABASE_URL}/storage/v1/object/public/inspecciones-pdfs/{file_path}"
-
-        # Actualizar base de datos con la URL
-        data = {"acta_pdf_url": public_url}
-
-        db_response = requests.patch(
-            f"{SUPABASE_URL}/rest/v1/inspecciones?id=eq.{inspeccion_id}",
-            json=data,
-            headers=HEADERS
-        )
-
-        if db_response.status_code in [200, 204]:
-            flash_success("Acta PDF subida correctamente")
+        if db.patch('inspecciones', inspeccion_id, {columna: subida['url']}) is not None:
+            flash_success(mensaje)
         else:
-            flash_error(f"Archivo subido pero error al guardar en base de datos: {db_response.text}")
+            flash_error("Archivo subido pero error al guardar en base de datos")
 
     except Exception as e:
         flash_error(f"Error al procesar archivo: {str(e)}")
@@ -504,83 +446,72 @@ def subir_acta_pdf(inspeccion_id):
     return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
 
 
-# ============================================
-# SUBIR PRESUPUESTO PDF
-# ============================================
+@inspecciones_bp.route('/<int:inspeccion_id>/subir_acta', methods=["POST"])
+@helpers.login_required
+@helpers.requiere_permiso('inspecciones', 'write')
+def subir_acta_pdf(inspeccion_id):
+    """Subir PDF del acta de inspección a Supabase Storage"""
+    return _subir_pdf_formulario(inspeccion_id, 'acta')
+
 
 @inspecciones_bp.route('/<int:inspeccion_id>/subir_presupuesto', methods=["POST"])
 @helpers.login_required
 @helpers.requiere_permiso('inspecciones', 'write')
 def subir_presupuesto_pdf(inspeccion_id):
     """Subir PDF del presupuesto de inspección a Supabase Storage"""
+    return _subir_pdf_formulario(inspeccion_id, 'presupuesto')
 
-    if 'presupuesto_pdf' not in request.files:
-        flash_error("No se seleccionó ningún archivo")
-        return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
-
-    file = request.files['presupuesto_pdf']
 
-    if file.filename == '':
-        flash_error("No se seleccionó ningún archivo")
-        return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
-
-    # Validar que sea PDF
-    if not file.filename.lower().endswith('.pdf'):
-        flash_error("Solo se permiten archivos PDF")
-        return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
-
-    try:
-        # Generar nombre de archivo único
-        file_name = f"inspeccion_{inspeccion_id}_presupuesto.pdf"
-        file_path = f"inspecciones/{file_name}"
-
-        # Leer contenido del archivo
-        file_content = file.read()
+@inspecciones_bp.route('/<int:inspeccion_id>/pdf/<tipo>/firmar', methods=["POST"])
+@helpers.login_required
+@helpers.requiere_permiso('inspecciones', 'write')
+def firmar_pdf(inspeccion_id, tipo):
+    """
+    URL firmada para subir un PDF directamente desde el navegador (JSON)
 
-        # Headers para operaciones de storage con Content-Type
-        storage_headers = {
-            **STORAGE_HEADERS,
-            "Content-Type": "application/pdf",
-        }
+    Recibe {"hash": sha256 del PDF}. Si el PDF ya está en Storage no hace
+    falta subirlo: basta con confirmar.
+    """
+    hash_pdf = (request.get_json(silent=True) or {}).get('hash', '')
+    if tipo not in TIPOS_PDF or not storage_service.hash_valido(hash_pdf):
+        return jsonify({'error': 'Petición no válida'}), 400
 
-        # Primero intentar eliminar el archivo existente (si existe)
-        requests.delete(
-            f"{SUPABASE_URL}/storage/v1/object/inspecciones-pdfs/{file_path}",
-            headers=storage_headers
-        )
+    ruta = storage_service.ruta_pdf_inspeccion(hash_pdf)
+    if storage_service.existe_objeto(ruta):
+        return jsonify({'existe': True})
 
-        # Subir nuevo archivo
-        upload_response = requests.post(
-            f"{SUPABASE_URL}/storage/v1/object/inspecciones-pdfs/{file_path}",
-            data=file_content,
-            headers=storage_headers
-        )
+    url, error = storage_service.crear_url_subida(ruta)
+    if error:
+        return jsonify({'error': error}), 502
+    return jsonify({'existe': False, 'url': url})
 
-        if upload_response.status_code not in [200, 201]:
-            flash_error(f"Error al subir archivo: {upload_response.text}")
-            return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
 
-        # Obtener URL pública del archivo
-        public_url = f"{SUPABASE_URL}/storage/v1/object/public/inspecciones-pdfs/{file_path}"
+@inspecciones_bp.route('/<int:inspeccion_id>/pdf/<tipo>/confirmar', methods=["POST"])
+@helpers.login_required
+@helpers.requiere_permiso('inspecciones', 'write')
+def confirmar_pdf(inspeccion_id, tipo):
+    """
+    Guarda en la inspección la URL de un PDF ya subido a Storage (JSON)
 
-        # Actualizar base de datos con la URL
-        data = {"presupuesto_pdf_url": public_url}
+    El hash lo declara el navegador: antes de guardar la URL se comprueba
+    que el contenido del objeto coincide. Si no, se responde 409 y el
+    navegador recurre al formulario clásico (el servidor calcula el hash).
+    """
+    hash_pdf = (request.get_json(silent=True) or {}).get('hash', '')
+    if tipo not in TIPOS_PDF or not storage_service.hash_valido(hash_pdf):
+        return jsonify({'error': 'Petición no válida'}), 400
 
-        db_response = requests.patch(
-            f"{SUPABASE_URL}/rest/v1/inspecciones?id=eq.{inspeccion_id}",
-            json=data,
-            headers=HEADERS
-        )
+    _, columna, mensaje = TIPOS_PDF[tipo]
+    ruta = storage_service.ruta_pdf_inspeccion(hash_pdf)
+    ok, error = storage_service.verificar_objeto(hash_pdf)
+    if not ok:
+        return jsonify({'error': error}), 409
 
-        if db_response.status_code in [200, 204]:
-            flash_success("Presupuesto PDF subido correctamente")
-        else:
-            flash_error(f"Archivo subido pero error al guardar en base de datos: {db_response.text}")
+    if db.patch('inspecciones', inspeccion_id, {columna: storage_service.url_publica(ruta)}) is None:
+        return jsonify({'error': 'Error al guardar en base de datos'}), 502
 
-    except Exception as e:
-        flash_error(f"Error al procesar archivo: {str(e)}")
-
-    return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
+    flash_success(mensaje)
+    return jsonify({'ok': True})
 
 
 # ============================================
@@ -591,9 +522,8 @@ def subir_presupuesto_pdf(inspeccion_id):
 @helpers.login_required
 @helpers.requiere_permiso('inspecciones', 'write')
 def extraer_defectos_pdf(inspeccion_id):
-    """Extraer defectos desde PDF del acta usando IA"""
+    """Extraer defectos del PDF de presupuesto y mostrar preview para clasificación"""
 
-    # Obtener inspección para verificar que existe acta PDF
     response = requests.get(
         f"{SUPABASE_URL}/rest/v1/inspecciones?id=eq.{inspeccion_id}",
         headers=HEADERS
@@ -604,17 +534,47 @@ def extraer_defectos_pdf(inspeccion_id):
         return redirect(url_for('inspecciones.dashboard'))
 
     inspeccion = response.json()[0]
-    acta_pdf_url = inspeccion.get('acta_pdf_url')
+    presupuesto_pdf_url = inspeccion.get('presupuesto_pdf_url')
 
-    if not acta_pdf_url:
-        flash_error("Primero debe subir el PDF del acta de inspección")
+    if not presupuesto_pdf_url:
+        flash_error("No hay PDF de presupuesto subido. Por favor, sube el PDF primero.")
         return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
 
-    # Aquí iría la lógica de extracción con IA
-    # Por ahora solo mostramos mensaje
-    flash_success("Función de extracción de defectos en desarrollo")
+    try:
+        # PDFs guardados por contenido: si ya se extrajo, ni siquiera se descarga
+        hash_pdf = storage_service.hash_desde_url(presupuesto_pdf_url)
+        descripciones = extraccion_pdf.obtener_descripciones_extraidas(hash_pdf) if hash_pdf else None
 
-    return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
+        if descripciones is None:
+            pdf_response = requests.get(presupuesto_pdf_url, timeout=60)
+
+            if pdf_response.status_code != 200:
+                flash_error("Error al descargar el PDF de presupuesto")
+                return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
+
+            # Caché por hash del contenido: el mismo PDF no se vuelve a parsear
+            extraccion = extraccion_pdf.extraer_descripciones_detalle(pdf_response.content)
+            descripciones = extraccion['descripciones']
+            hash_pdf = extraccion['hash']
+
+        if not descripciones:
+            flash_error("No se encontraron descripciones en el PDF. Verifica el formato del archivo.")
+            return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
+
+        # En sesión solo el hash (la cookie no admite listas largas);
+        # las descripciones se recuperan de la caché al guardar.
+        # pendientes: índices aún por guardar (None = todos)
+        session[f'defectos_extraidos_{inspeccion_id}'] = {'hash': hash_pdf, 'pendientes': None}
+
+        return render_template(
+            "importar_defectos_preview.html",
+            inspeccion=inspeccion,
+            descripciones=descripciones
+        )
+
+    except Exception as e:
+        flash_error(f"Error al procesar PDF: {str(e)}")
+        return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
 
 
 # ============================================
@@ -625,38 +585,90 @@ def extraer_defectos_pdf(inspeccion_id):
 @helpers.login_required
 @helpers.requiere_permiso('inspecciones', 'write')
 def guardar_defectos_importados(inspeccion_id):
-    """Guardar defectos que fueron importados desde PDF"""
+    """
+    Guardar defectos clasificados manualmente después de la extracción del PDF
+
+    Si parte de los defectos falla, en sesión quedan solo los fallidos: al
+    reenviar el formulario se reintentan esos, sin duplicar los ya guardados.
+    """
+
+    # Las descripciones se recuperan de la caché de extracción (en sesión el hash
+    # y los índices pendientes)
+    extraccion = session.get(f'defectos_extraidos_{inspeccion_id}') or {}
+    if isinstance(extraccion, str):
+        extraccion = {'hash': extraccion, 'pendientes': None}  # Sesiones anteriores: solo el hash
+    descripciones = extraccion_pdf.obtener_descripciones_extraidas(extraccion.get('hash'))
+    pendientes = None if extraccion.get('pendientes') is None else set(extraccion['pendientes'])
+
+    if not descripciones:
+        flash_error("No hay defectos pendientes de importar")
+        return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
 
-    # Obtener JSON de defectos importados
-    defectos_json = request.form.get('defectos_json')
+    response_insp = requests.get(
+        f"{SUPABASE_URL}/rest/v1/inspecciones?id=eq.{inspeccion_id}&select=fecha_inspeccion",
+        headers=HEADERS
+    )
 
-    if not defectos_json:
-        flash_error("No hay defectos para importar")
-        return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
+    if response_insp.status_code != 200 or not response_insp.json():
+        flash_error("Inspección no encontrada")
+        return redirect(url_for('inspecciones.dashboard'))
 
-    try:
-        import json
-        defectos = json.loads(defectos_json)
-
-        # Guardar cada defecto en la base de datos
-        for defecto in defectos:
-            data = {
-                "inspeccion_id": inspeccion_id,
-                "descripcion": defecto.get('descripcion', ''),
-                "plazo_meses": defecto.get('plazo_meses', 6),
-                "estado": "PENDIENTE"
-            }
-
-            requests.post(
-                f"{SUPABASE_URL}/rest/v1/defectos_inspeccion",
-                json=data,
-                headers=HEADERS
-            )
-
-        flash_success(f"{len(defectos)} defectos importados correctamente")
+    fecha_inspeccion = response_insp.json()[0].get('fecha_inspeccion')
 
-    except Exception as e:
-        flash_error(f"Error al importar defectos: {str(e)}")
+    # Construir todos los defectos seleccionados y enviarlos en un solo POST
+    defectos = []
+    indices = []  # Índice de la descripción de cada defecto
+    defectos_omitidos = 0
+
+    for i, descripcion_data in enumerate(descripciones):
+        if pendientes is not None and i not in pendientes:
+            continue  # Ya guardado en un envío anterior
+
+        calificacion = request.form.get(f'calificacion_{i}')
+        if request.form.get(f'seleccionar_{i}') != 'on' or not calificacion:
+            defectos_omitidos += 1
+            continue
+
+        try:
+            plazo_meses = int(request.form.get(f'plazo_{i}', 6))
+        except ValueError:
+            plazo_meses = 6
+
+        defectos.append({
+            "inspeccion_id": inspeccion_id,
+            "descripcion": descripcion_data.get('descripcion'),
+            "calificacion": calificacion,
+            "plazo_meses": plazo_meses,
+            "fecha_limite": calcular_fecha_limite(fecha_inspeccion, plazo_meses),
+            "estado": "PENDIENTE",
+            "es_cortina": request.form.get(f'es_cortina_{i}') == 'on',
+            "es_pesacarga": request.form.get(f'es_pesacarga_{i}') == 'on',
+            "observaciones": "Importado desde PDF de presupuesto"
+        })
+        indices.append(i)
+
+    _, errores = db.insert_many('defectos_inspeccion', defectos, returning=False)
+    defectos_guardados = len(defectos) - len(errores)
+
+    if defectos_guardados > 0:
+        flash_success(f"Se importaron {defectos_guardados} defecto(s) correctamente")
+
+    if errores:
+        # Conservar solo los fallidos para poder reintentarlos
+        session[f'defectos_extraidos_{inspeccion_id}'] = {
+            'hash': extraccion['hash'],
+            'pendientes': [indices[indice] for indice, _ in errores]
+        }
+        for indice, error in errores[:5]:
+            flash_error(f"No se pudo importar \"{defectos[indice]['descripcion'][:60]}\": {error}")
+        if len(errores) > 5:
+            flash_error(f"... y {len(errores) - 5} defecto(s) más con error")
+        flash_info(f"Al volver a enviar el formulario solo se reintentarán los {len(errores)} defecto(s) con error")
+    else:
+        session.pop(f'defectos_extraidos_{inspeccion_id}', None)
+
+    if defectos_omitidos > 0:
+        flash_info(f"Se omitieron {defectos_omitidos} defecto(s)")
 
     return redirect(url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
 
@@ -686,21 +698,10 @@ def nuevo_defecto(inspeccion_id):
         plazo_meses = int(request.form.get("plazo_meses", 6))
 
         # Calcular fecha límite
-        fecha_limite = None
-        if fecha_inspeccion:
-            try:
-                from datetime import datetime
-                fecha_insp_dt = datetime.strptime(fecha_inspeccion.split('T')[0], '%Y-%m-%d')
-                # Sumar plazo en meses
-                mes_limite = fecha_insp_dt.month + plazo_meses
-                anio_limite = fecha_insp_dt.year + (mes_limite - 1) // 12
-                mes_limite = ((mes_limite - 1) % 12) + 1
-
-                fecha_limite_dt = fecha_insp_dt.replace(year=anio_limite, month=mes_limite)
-                fecha_limite = fecha_limite_dt.strftime('%Y-%m-%d')
-            except:
-                flash_error("Error al calcular fecha límite")
-                return redirect(request.referrer or url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
+        fecha_limite = calcular_fecha_limite(fecha_inspeccion, plazo_meses)
+        if fecha_inspeccion and fecha_limite is None:
+            flash_error("Error al calcular fecha límite")
+            return redirect(request.referrer or url_for('inspecciones.ver', inspeccion_id=inspeccion_id))
 
         # Crear defecto
         data = {
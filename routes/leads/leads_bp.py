@@ -15,11 +15,10 @@ import helpers
 from config import config
 from datetime import datetime, date
 from utils.formatters import limpiar_none, calcular_color_ipo, calcular_color_contrato
-from utils.pagination import get_pagination
+from utils.pagination import get_pagination, paginate_query_cursor
 from services.cache_service import get_administradores_cached, get_filtros_cached
+from services import seguimiento_service
 from utils.messages import flash_success, flash_error
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font, Alignment
 import io
 
 # Crear Blueprint sin prefijo (las rutas mantienen su estructura original)
@@ -77,6 +76,8 @@ def formulario():
         response = requests.post(f"{SUPABASE_URL}/rest/v1/clientes?select=id", json=data, headers=HEADERS)
         if response.status_code in [200, 201]:
             cliente_id = response.json()[0]["id"]
+            if data["fecha_fin_contrato"]:
+                seguimiento_service.lanzar_reconciliacion()
             return redirect(f"/nuevo_equipo?lead_id={cliente_id}")
         else:
             return f"<h3 style='color:red;'>Error al registrar lead</h3><pre>{response.text}</pre><a href='/home'>Volver</a>"
@@ -102,19 +103,18 @@ def leads_redirect():
 def dashboard():
     """Dashboard principal de leads con filtros y búsqueda"""
 
-    # Usar helper de paginación
-    pagination = get_pagination(per_page_default=25)
-    page = pagination.page
-    per_page = pagination.per_page
-    offset = pagination.offset
-
     filtro_localidad = request.args.get("localidad", "")
     filtro_empresa = request.args.get("empresa", "")
     # Aceptar tanto 'search' (desde home) como 'buscar_direccion' (desde dashboard)
     buscar_direccion = request.args.get("search", "") or request.args.get("buscar_direccion", "")
 
     # Si hay búsqueda de texto, usar RPC para búsqueda sin acentos
+    # (paginada por offset: la RPC recibe limite/desplazamiento)
     if buscar_direccion:
+        pagination = get_pagination(per_page_default=25)
+        per_page = pagination.per_page
+        offset = pagination.offset
+
         # Usar función RPC para búsqueda sin acentos
         rpc_url = f"{SUPABASE_URL}/rest/v1/rpc/buscar_clientes_sin_acentos"
 
@@ -134,41 +134,26 @@ def dashboard():
         leads_base = response.json()
 
         # Obtener total_count del primer resultado si existe
-        total_registros = leads_base[0].get('total_count', 0) if leads_base else 0
-        total_pages = max(1, (total_registros + per_page - 1) // per_page)
+        pagination.total = leads_base[0].get('total_count', 0) if leads_base else 0
 
     else:
         # Búsqueda normal con filtros (sin texto de búsqueda)
-        query_params = []
+        filtros = {}
 
         if filtro_localidad:
-            query_params.append(f"localidad=eq.{filtro_localidad}")
+            filtros["localidad"] = f"eq.{filtro_localidad}"
 
         if filtro_empresa:
-            query_params.append(f"empresa_mantenedora=eq.{filtro_empresa}")
-
-        query_string = "&".join(query_params) if query_params else ""
-
-        # OPTIMIZACIÓN: Para count solo necesitamos id, no todos los campos
-        count_url = f"{SUPABASE_URL}/rest/v1/clientes?select=id"
-        if query_string:
-            count_url += f"&{query_string}"
-
-        count_response = requests.get(count_url, headers={**HEADERS, "Prefer": "count=exact"})
-        total_registros = int(count_response.headers.get("Content-Range", "0").split("/")[-1])
-        total_pages = max(1, (total_registros + per_page - 1) // per_page)
-
-        # OPTIMIZACIÓN: Usar join de Supabase + selección específica de campos
-        data_url = f"{SUPABASE_URL}/rest/v1/clientes?select=id,direccion,nombre_cliente,localidad,empresa_mantenedora,numero_ascensores,created_at&limit={per_page}&offset={offset}"
-        if query_string:
-            data_url += f"&{query_string}"
-
-        response = requests.get(data_url, headers=HEADERS)
-
-        if response.status_code != 200:
-            return f"<h3 style='color:red;'>Error al obtener leads</h3><pre>{response.text}</pre><a href='/home'>Volver</a>"
-
-        leads_base = response.json()
+            filtros["empresa_mantenedora"] = f"eq.{filtro_empresa}"
+
+        # Paginación por cursor (más recientes primero): sin offset ni count=exact
+        pagination, leads_base = paginate_query_cursor(
+            f"{SUPABASE_URL}/rest/v1/clientes?select=id,direccion,nombre_cliente,localidad,empresa_mantenedora,numero_ascensores,created_at",
+            HEADERS,
+            order_column='created_at',
+            per_page_default=25,
+            filters=filtros
+        )
 
     # Ahora obtener equipos para cada cliente encontrado
     # Esto es necesario porque RPC no devuelve relaciones anidadas
@@ -271,10 +256,11 @@ def dashboard():
         filtro_localidad=filtro_localidad,
         filtro_empresa=filtro_empresa,
         buscar_direccion=buscar_direccion,
-        page=page,
-        total_pages=total_pages,
-        total_registros=total_registros,
-        per_page=per_page
+        pagination=pagination,
+        page=pagination.page,
+        total_pages=pagination.total_pages,
+        total_registros=pagination.total,
+        per_page=pagination.per_page
     )
 
 
@@ -339,7 +325,10 @@ def exportar():
                     equipos_por_cliente[cliente_id] = []
                 equipos_por_cliente[cliente_id].append(equipo)
 
-    # Crear Excel
+    # Crear Excel (openpyxl solo se carga al exportar)
+    from openpyxl import Workbook
+    from openpyxl.styles import PatternFill, Font, Alignment
+
     wb = Workbook()
     ws = wb.active
     ws.title = "Instalaciones"
@@ -580,6 +569,8 @@ def editar(lead_id):
             headers=HEADERS
         )
         if res.status_code in [200, 204]:
+            if data["fecha_fin_contrato"]:
+                seguimiento_service.lanzar_reconciliacion()
             return redirect(url_for('leads.ver', lead_id=lead_id))
         else:
             return f"<h3 style='color:red;'>Error al actualizar Lead</h3><pre>{res.text}</pre><a href='{url_for('leads.dashboard')}'>Volver</a>"
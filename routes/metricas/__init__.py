@@ -0,0 +1,9 @@
+"""
+Blueprint de Métricas
+
+Endpoint /metrics en formato de texto de Prometheus
+"""
+
+from routes.metricas.metricas_bp import metricas_bp
+
+__all__ = ['metricas_bp']
@@ -0,0 +1,45 @@
+"""
+Blueprint de Métricas
+
+Expone en /metrics, en el formato de texto de Prometheus, las métricas
+agregadas de todos los workers (middleware/metricas.py):
+- Latencia de peticiones por ruta y de llamadas a Supabase por tabla
+- Aciertos, fallos y recargas de las cachés de services/cache_service.py
+- Duración de los detectores de alertas
+- Trabajos en segundo plano y análisis con IA: terminados, duración y cola
+- Bandeja de emails por estado
+
+Acceso: el scraper envía Authorization: Bearer <METRICS_TOKEN>; desde el
+navegador basta con una sesión de administrador. Sin ninguna de las dos
+se responde 404 para no revelar el endpoint.
+"""
+
+import hmac
+
+from flask import Blueprint, Response, abort, request, session
+
+from config import config
+from helpers import obtener_perfil_usuario
+from middleware.metricas import registro
+
+TIPO_CONTENIDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Crear Blueprint
+metricas_bp = Blueprint('metricas', __name__)
+
+
+def _autorizado():
+    """Token del scraper o sesión de administrador"""
+    cabecera = request.headers.get('Authorization', '')
+    if config.METRICS_TOKEN and cabecera.startswith('Bearer '):
+        return hmac.compare_digest(cabecera[len('Bearer '):], config.METRICS_TOKEN)
+    return "usuario" in session and obtener_perfil_usuario() == 'admin'
+
+
+@metricas_bp.route('/metrics')
+def metrics():
+    """Métricas de la aplicación en formato de texto de Prometheus"""
+    if not _autorizado():
+        abort(404)
+    return Response(registro.exposicion(), content_type=TIPO_CONTENIDO,
+                    headers={'Cache-Control': 'no-store'})
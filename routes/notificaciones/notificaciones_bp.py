@@ -27,7 +27,7 @@ notificaciones_bp = Blueprint('notificaciones', __name__)
 def configuracion_avisos():
     """Configurar sistema de avisos automáticos por email"""
     if 'usuario_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('auth.login'))
 
     user_id = session.get('usuario_id')
 
@@ -112,7 +112,7 @@ def configuracion_avisos():
 def enviar_avisos_manual():
     """Enviar avisos por email manualmente (ejecución inmediata)"""
     if "usuario" not in session:
-        return redirect(url_for("login"))
+        return redirect(url_for("auth.login"))
 
     usuario_id = session.get("usuario_id")
 
@@ -130,8 +130,7 @@ def enviar_avisos_manual():
     if not config_data.get('sistema_activo'):
         return "Las notificaciones están desactivadas", 400
 
-    # Importar función de envío de avisos desde app_legacy
-    from app_legacy import enviar_avisos_email
+    from services.email_service import enviar_avisos_email
 
     # Enviar avisos
     resultado = enviar_avisos_email(config_data)
@@ -18,6 +18,7 @@ import requests
 import helpers
 from config import config
 from utils.messages import flash_success, flash_error
+from services import seguimiento_service
 
 # Configuración de Supabase
 SUPABASE_URL = config.SUPABASE_URL
@@ -35,7 +36,7 @@ oportunidades_bp = Blueprint('oportunidades', __name__)
 def oportunidades():
     """Dashboard principal de oportunidades con contadores por estado"""
     if "usuario" not in session:
-        return redirect(url_for("login"))
+        return redirect(url_for("auth.login"))
 
     try:
         response = requests.get(
@@ -64,18 +65,18 @@ def oportunidades():
                                         perdidas=perdidas)
         else:
             flash_error("Error al cargar oportunidades")
-            return redirect(url_for("home"))
+            return redirect(url_for("auth.home"))
 
     except Exception as e:
         flash_error(f"Error: {str(e)}")
-        return redirect(url_for("home"))
+        return redirect(url_for("auth.home"))
 
 
 @oportunidades_bp.route('/mi_agenda')
 def mi_agenda():
     """Dashboard personal - Mi Agenda Comercial con pipeline de oportunidades"""
     if "usuario" not in session:
-        return redirect(url_for("login"))
+        return redirect(url_for("auth.login"))
 
     try:
         # Obtener TODAS las oportunidades que NO estén ganadas ni perdidas
@@ -115,156 +116,40 @@ def mi_agenda():
                                  total_activas=total_activas)
         else:
             flash_error(f"Error al cargar oportunidades: {response.status_code} - {response.text}")
-            return redirect(url_for("home"))
+            return redirect(url_for("auth.home"))
 
     except Exception as e:
         flash_error(f"Error: {str(e)}")
-        return redirect(url_for("home"))
+        return redirect(url_for("auth.home"))
 
 
 @oportunidades_bp.route('/oportunidades_post_ipo')
 def oportunidades_post_ipo():
     """Seguimiento Comercial - Sistema de tareas automáticas"""
     if "usuario" not in session:
-        return redirect(url_for("login"))
+        return redirect(url_for("auth.login"))
 
     # Determinar pestaña activa (abiertas o futuras)
     tab = request.args.get("tab", "abiertas")
     hoy = datetime.now().date()
 
     try:
-        # === 1. OBTENER EQUIPOS CON IPO ===
-        equipos_response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/equipos?select=id,ipo_proxima,rae,cliente_id,clientes(direccion,localidad,telefono,persona_contacto,empresa_mantenedora)&ipo_proxima=not.is.null",
-            headers=HEADERS,
-            timeout=10
-        )
-        equipos_data = equipos_response.json() if equipos_response.status_code == 200 else []
-
-        # === 2. PROCESAR IPOs Y CREAR TAREAS AUTOMÁTICAS ===
-        # Agrupar equipos por cliente (solo el más próximo)
-        clientes_con_ipo = {}
-        for equipo in equipos_data:
-            if not equipo.get('ipo_proxima'):
-                continue
-
-            try:
-                ipo_date = datetime.strptime(equipo['ipo_proxima'], '%Y-%m-%d').date()
-            except:
-                continue
-
-            dias_desde_ipo = (hoy - ipo_date).days
-            cliente_id = equipo['cliente_id']
-
-            # Solo guardar el equipo con IPO más reciente por cliente
-            if cliente_id not in clientes_con_ipo or dias_desde_ipo < clientes_con_ipo[cliente_id]['dias_desde_ipo']:
-                clientes_con_ipo[cliente_id] = {
-                    'cliente_id': cliente_id,
-                    'equipo_id': equipo['id'],
-                    'ipo_date': ipo_date,
-                    'dias_desde_ipo': dias_desde_ipo,
-                    'dias_hasta_ipo': abs(dias_desde_ipo) if dias_desde_ipo < 0 else 0,
-                    'rae': equipo.get('rae'),
-                    'cliente': equipo.get('clientes', {})
-                }
-
-        # === 3. CREAR TAREAS AUTOMÁTICAS (IPO >= 15 días) ===
-        for cliente_id, data in clientes_con_ipo.items():
-            if data['dias_desde_ipo'] >= 15:
-                # Verificar si ya existe tarea abierta para este cliente
-                tarea_existe = requests.get(
-                    f"{SUPABASE_URL}/rest/v1/seguimiento_comercial_tareas?cliente_id=eq.{cliente_id}&estado=eq.abierta",
-                    headers=HEADERS
-                ).json()
-
-                # Verificar si el cliente tiene tareas descartadas (para no crear nuevas)
-                tarea_descartada = requests.get(
-                    f"{SUPABASE_URL}/rest/v1/seguimiento_comercial_tareas?cliente_id=eq.{cliente_id}&estado=eq.cerrada&tipo_cierre=not.is.null",
-                    headers=HEADERS
-                ).json()
-
-                if not tarea_existe and not tarea_descartada:
-                    # Crear tarea automáticamente solo si no hay tareas abiertas ni descartadas
-                    nueva_tarea = {
-                        'cliente_id': cliente_id,
-                        'equipo_id': data['equipo_id'],
-                        'estado': 'abierta',
-                        'motivo_creacion': 'ipo_15_dias',
-                        'dias_desde_ipo': data['dias_desde_ipo'],
-                        'creado_por': 'sistema'
-                    }
-                    requests.post(
-                        f"{SUPABASE_URL}/rest/v1/seguimiento_comercial_tareas",
-                        headers=HEADERS,
-                        json=nueva_tarea
-                    )
-
-        # === 3B. OBTENER CLIENTES CON FECHA_FIN_CONTRATO Y CREAR TAREAS AUTOMÁTICAS ===
-        clientes_fin_contrato_response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/clientes?select=id,fecha_fin_contrato,direccion,localidad,telefono,persona_contacto,empresa_mantenedora&fecha_fin_contrato=not.is.null",
-            headers=HEADERS,
-            timeout=10
-        )
-        clientes_fin_contrato_data = clientes_fin_contrato_response.json() if clientes_fin_contrato_response.status_code == 200 else []
-
-        clientes_con_fin_contrato = {}
-        for cliente in clientes_fin_contrato_data:
-            if not cliente.get('fecha_fin_contrato'):
-                continue
+        # Las tareas automáticas las crea el reconciliador (services/seguimiento_service.py);
+        # esta vista solo lee. Si la última reconciliación es antigua se relanza en segundo plano.
+        seguimiento_service.reconciliar_si_caducada()
 
-            try:
-                fecha_fin = datetime.strptime(cliente['fecha_fin_contrato'], '%Y-%m-%d').date()
-            except:
-                continue
+        # === 1. CLIENTES CON IPO (equipo más próximo) Y CON FIN DE CONTRATO ===
+        clientes_con_ipo = seguimiento_service.obtener_clientes_con_ipo(hoy)
+        clientes_con_fin_contrato = seguimiento_service.obtener_clientes_con_fin_contrato(hoy)
 
-            dias_hasta_fin = (fecha_fin - hoy).days
-            cliente_id = cliente['id']
-
-            clientes_con_fin_contrato[cliente_id] = {
-                'cliente_id': cliente_id,
-                'fecha_fin_contrato': fecha_fin,
-                'dias_hasta_fin': dias_hasta_fin,
-                'cliente': cliente
-            }
-
-            # Crear tarea automática si faltan 120 días o menos
-            if dias_hasta_fin <= 120 and dias_hasta_fin >= 0:
-                # Verificar si ya existe tarea abierta para este cliente
-                tarea_existe = requests.get(
-                    f"{SUPABASE_URL}/rest/v1/seguimiento_comercial_tareas?cliente_id=eq.{cliente_id}&estado=eq.abierta",
-                    headers=HEADERS
-                ).json()
-
-                # Verificar si el cliente tiene tareas descartadas (para no crear nuevas)
-                tarea_descartada = requests.get(
-                    f"{SUPABASE_URL}/rest/v1/seguimiento_comercial_tareas?cliente_id=eq.{cliente_id}&estado=eq.cerrada&tipo_cierre=not.is.null",
-                    headers=HEADERS
-                ).json()
-
-                if not tarea_existe and not tarea_descartada:
-                    # Crear tarea automáticamente solo si no hay tareas abiertas ni descartadas
-                    nueva_tarea = {
-                        'cliente_id': cliente_id,
-                        'equipo_id': None,
-                        'estado': 'abierta',
-                        'motivo_creacion': 'fin_contrato_120_dias',
-                        'dias_desde_ipo': None,
-                        'creado_por': 'sistema'
-                    }
-                    requests.post(
-                        f"{SUPABASE_URL}/rest/v1/seguimiento_comercial_tareas",
-                        headers=HEADERS,
-                        json=nueva_tarea
-                    )
-
-        # === 4. OBTENER TAREAS EXISTENTES CON DATOS DEL CLIENTE ===
+        # === 2. OBTENER TAREAS EXISTENTES CON DATOS DEL CLIENTE ===
         tareas_response = requests.get(
             f"{SUPABASE_URL}/rest/v1/seguimiento_comercial_tareas?select=*,clientes(direccion,localidad,telefono,persona_contacto,empresa_mantenedora)&estado=eq.abierta&order=fecha_creacion.asc",
             headers=HEADERS
         )
         tareas_data = tareas_response.json() if tareas_response.status_code == 200 else []
 
-        # === 5. CLASIFICAR TAREAS ===
+        # === 3. CLASIFICAR TAREAS ===
         tareas_abiertas = []
         tareas_aplazadas = []
 
@@ -307,14 +192,15 @@ def oportunidades_post_ipo():
             else:
                 tareas_abiertas.append(tarea_enriched)
 
-        # === 6. FUTURAS - PRÓXIMAS AUTOMÁTICAS (IPO próximos 30 días + hace 0-14 días) ===
+        clientes_con_tarea = {t['cliente_id'] for t in tareas_abiertas + tareas_aplazadas}
+
+        # === 4. FUTURAS - PRÓXIMAS AUTOMÁTICAS (IPO próximos 30 días + hace 0-14 días) ===
         proximas_automaticas = []
         for cliente_id, data in clientes_con_ipo.items():
             # IPO en próximos 30 días O ya ocurrió hace 0-14 días (antes de crear tarea)
             if -30 <= data['dias_desde_ipo'] < 15:
                 # Verificar que no tenga tarea
-                tiene_tarea = any(t['cliente_id'] == cliente_id for t in tareas_abiertas + tareas_aplazadas)
-                if not tiene_tarea:
+                if cliente_id not in clientes_con_tarea:
                     # Determinar si es futura o pasada
                     es_futura = data['dias_desde_ipo'] < 0
 
@@ -341,13 +227,12 @@ def oportunidades_post_ipo():
                         'motivo': 'IPO'
                     })
 
-        # === 6B. FUTURAS - PRÓXIMAS POR FIN DE CONTRATO (121-150 días) ===
+        # === 4B. FUTURAS - PRÓXIMAS POR FIN DE CONTRATO (121-150 días) ===
         for cliente_id, data in clientes_con_fin_contrato.items():
             # Fin de contrato entre 121 y 150 días
             if 121 <= data['dias_hasta_fin'] <= 150:
                 # Verificar que no tenga tarea
-                tiene_tarea = any(t['cliente_id'] == cliente_id for t in tareas_abiertas + tareas_aplazadas)
-                if not tiene_tarea:
+                if cliente_id not in clientes_con_tarea:
                     proximas_automaticas.append({
                         'cliente_id': cliente_id,
                         'direccion': data['cliente'].get('direccion', 'Sin dirección'),
@@ -380,7 +265,7 @@ def oportunidades_post_ipo():
     except Exception as e:
         print(f"Error en seguimiento comercial: {str(e)}")
         flash_error(f"Error al cargar seguimiento comercial: {str(e)}")
-        return redirect(url_for("home"))
+        return redirect(url_for("auth.home"))
 
 
 # ============================================
@@ -436,7 +321,7 @@ def crear_oportunidad(cliente_id):
 def ver_oportunidad(oportunidad_id):
     """Ver detalle de una oportunidad con visitas relacionadas"""
     if "usuario" not in session:
-        return redirect(url_for("login"))
+        return redirect(url_for("auth.login"))
 
     try:
         # Obtener oportunidad con datos del cliente
@@ -745,7 +630,7 @@ def tarea_comercial_descartar(tarea_id):
 def tarea_comercial_convertir(tarea_id):
     """Marcar tarea como convertida (redirecciona a crear oportunidad)"""
     if "usuario" not in session:
-        return redirect(url_for("login"))
+        return redirect(url_for("auth.login"))
 
     try:
         # Obtener datos de la tarea
@@ -12,8 +12,6 @@ from datetime import datetime
 import calendar
 import io
 import requests
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 
 from config import config
 
@@ -79,6 +77,10 @@ def reporte_mensual():
             except:
                 return fecha_str
 
+        # openpyxl solo se carga al generar el reporte
+        from openpyxl import Workbook
+        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+
         wb = Workbook()
 
         ws1 = wb.active
@@ -115,25 +115,15 @@ def visita_administrador():
 @helpers.requiere_permiso('visitas', 'read')
 def visitas_administradores_dashboard():
     """Dashboard de visitas a administradores con paginación"""
-    from utils.pagination import get_pagination
-
-    # Usar helper de paginación
-    pagination = get_pagination(per_page_default=25)
-
-    # OPTIMIZACIÓN: Para count solo necesitamos id, no todos los campos
-    count_url = f"{SUPABASE_URL}/rest/v1/visitas_administradores?select=id"
-    count_response = requests.get(count_url, headers={**HEADERS, "Prefer": "count=exact"})
-    total_registros = int(count_response.headers.get("Content-Range", "0").split("/")[-1])
-    pagination.total = total_registros
-
-    # OPTIMIZACIÓN: Seleccionar campos específicos con JOIN a administradores
-    data_url = f"{SUPABASE_URL}/rest/v1/visitas_administradores?select=id,fecha_visita,administrador_id,administradores(nombre_empresa),persona_contacto,observaciones,oportunidad_id&order=fecha_visita.desc&limit={pagination.limit}&offset={pagination.offset}"
-    response = requests.get(data_url, headers=HEADERS)
-
-    if response.status_code != 200:
-        return f"<h3 style='color:red;'>Error al obtener visitas</h3><pre>{response.text}</pre><a href='/home'>Volver</a>"
-
-    visitas = response.json()
+    from utils.pagination import paginate_query_cursor
+
+    # Paginación por cursor (fecha_visita, id): sin offset ni count=exact
+    pagination, visitas = paginate_query_cursor(
+        f"{SUPABASE_URL}/rest/v1/visitas_administradores?select=id,fecha_visita,administrador_id,administradores(nombre_empresa),persona_contacto,observaciones,oportunidad_id",
+        HEADERS,
+        order_column='fecha_visita',
+        per_page_default=25
+    )
 
     return render_template("visitas_admin_dashboard.html",
         visitas=visitas,
@@ -8,22 +8,42 @@ ADVERTENCIA: Este script puede tardar 30-60 minutos en completarse debido a:
 - Análisis de 19 códigos postales diferentes
 - Consultas extensivas a servicios externos
 
+Cada código postal terminado se guarda en resultados/checkpoint_cps/: si el
+análisis se interrumpe, al relanzarlo se continúa por los pendientes. Varios
+códigos postales se analizan a la vez bajo un limitador de tasa global que
+comparten Nominatim y Catastro, y el ranking se actualiza con cada zona.
+
 Uso:
     python scripts/analisis_masivo_codigos_postales.py
 
     # Para análisis más rápido (menor precisión):
     python scripts/analisis_masivo_codigos_postales.py --rapido
+
+    # Desatendido (sin confirmación), 4 CPs a la vez, p. ej. de noche:
+    python scripts/analisis_masivo_codigos_postales.py --si --paralelo 4
+
+    # Ignorar los checkpoints y repetir todo:
+    python scripts/analisis_masivo_codigos_postales.py --reiniciar
+
+    # Marcar cada edificio como cliente / competencia / desconocido:
+    python scripts/analisis_masivo_codigos_postales.py --cruzar-cartera
 """
 
 import sys
 import os
 import argparse
+import bisect
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict
 from datetime import datetime
 import json
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from zonas_calientes import DetectorZonasCalientes
+from catastro_service import CatastroService, PETICIONES_POR_SEGUNDO_CATASTRO, RAFAGA_CATASTRO
+from geocoding_service import GeocodingService
+from limitador_tasa import LimitadorTasa
+from zonas_calientes import DetectorZonasCalientes, ZonaCaliente, EdificioCandidato
 import logging
 
 # Configurar logging
@@ -56,13 +76,145 @@ CODIGOS_POSTALES_LPGC = {
     "35019": "Siete Palmas"
 }
 
+DIRECTORIO_CHECKPOINTS = 'resultados/checkpoint_cps'
+RUTA_RANKING_PARCIAL = 'resultados/ranking_parcial_cps.json'
+
+# Límite global de peticiones/s a APIs externas (Nominatim + Catastro) para
+# todos los códigos postales en paralelo
+PETICIONES_POR_SEGUNDO_GLOBAL = 4.0
+
+
+def _guardar_json_atomico(ruta: str, data):
+    """Escribe un JSON vía fichero temporal + os.replace (nunca queda a medias)"""
+    tmp = f"{ruta}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, ruta)
+
+
+def guardar_checkpoint(cp: str, zona: ZonaCaliente, grid_size: int):
+    """Guarda una zona terminada en el directorio de checkpoints"""
+    os.makedirs(DIRECTORIO_CHECKPOINTS, exist_ok=True)
+    _guardar_json_atomico(
+        os.path.join(DIRECTORIO_CHECKPOINTS, f'cp_{cp}.json'),
+        {'codigo_postal': cp, 'grid_size': grid_size, 'zona': asdict(zona)}
+    )
+
+
+def cargar_checkpoints(grid_size: int) -> dict:
+    """
+    Zonas ya terminadas en ejecuciones anteriores con el mismo grid_size.
+
+    Returns:
+        dict {codigo_postal: ZonaCaliente}
+    """
+    zonas = {}
+    if not os.path.isdir(DIRECTORIO_CHECKPOINTS):
+        return zonas
+
+    for archivo in sorted(os.listdir(DIRECTORIO_CHECKPOINTS)):
+        if not (archivo.startswith('cp_') and archivo.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(DIRECTORIO_CHECKPOINTS, archivo), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('grid_size') != grid_size:
+                continue
+            zona = dict(data['zona'])
+            zona['edificios'] = [EdificioCandidato(**e) for e in zona.get('edificios', [])]
+            zonas[data['codigo_postal']] = ZonaCaliente(**zona)
+        except Exception as e:
+            logger.warning(f"Checkpoint {archivo} ilegible, se repetirá el CP: {e}")
+    return zonas
+
+
+def _entrada_ranking(posicion: int, z: ZonaCaliente) -> dict:
+    """Fila del ranking (JSON completo y ranking parcial)"""
+    return {
+        'posicion': posicion,
+        'codigo_postal': z.nombre.replace("CP ", ""),
+        'nombre_zona': CODIGOS_POSTALES_LPGC.get(z.nombre.replace("CP ", ""), "Desconocida"),
+        'metricas': {
+            'score_total': round(z.score_total, 2),
+            'densidad_oportunidades': round(z.densidad_oportunidades, 2),
+            'total_edificios': z.total_edificios,
+            'edificios_muy_antiguos': z.edificios_muy_antiguos,
+            'edificios_antiguos': z.edificios_antiguos,
+            'edificios_modernos': z.edificios_modernos,
+            'porcentaje_muy_antiguos': round(z.edificios_muy_antiguos/z.total_edificios*100 if z.total_edificios > 0 else 0, 1),
+            'porcentaje_antiguos': round(z.edificios_antiguos/z.total_edificios*100 if z.total_edificios > 0 else 0, 1)
+        },
+        'ubicacion': {
+            'latitud': z.latitud_centro,
+            'longitud': z.longitud_centro,
+            'radio_metros': z.radio_metros
+        },
+        'estadisticas_decada': z.stats_por_decada
+    }
+
+
+class RankingIncremental:
+    """Ranking de zonas por score_total que se actualiza al terminar cada CP"""
+
+    def __init__(self):
+        self._claves = []  # -score_total, en orden ascendente
+        self.zonas = []
+
+    def agregar(self, zona: ZonaCaliente) -> int:
+        """Inserta la zona en su posición. Returns: posición (1 = mejor)"""
+        indice = bisect.bisect_right(self._claves, -zona.score_total)
+        self._claves.insert(indice, -zona.score_total)
+        self.zonas.insert(indice, zona)
+        return indice + 1
+
+    def guardar(self, total_cps: int):
+        """Escribe el ranking parcial (se puede consultar mientras corre el análisis)"""
+        os.makedirs(os.path.dirname(RUTA_RANKING_PARCIAL), exist_ok=True)
+        _guardar_json_atomico(RUTA_RANKING_PARCIAL, {
+            'actualizado': datetime.now().isoformat(),
+            'cps_completados': len(self.zonas),
+            'cps_totales': total_cps,
+            'ranking': [_entrada_ranking(i, z) for i, z in enumerate(self.zonas, 1)]
+        })
+
+
+def crear_detector(peticiones_por_segundo_global: float = PETICIONES_POR_SEGUNDO_GLOBAL):
+    """
+    Detector con servicios compartidos por todos los hilos: una caché por
+    servicio y un limitador global, con los límites propios de cada API debajo
 
-def analisis_masivo(modo_rapido: bool = False):
+    Returns:
+        tuple: (DetectorZonasCalientes, limitador global)
+    """
+    limitador_global = LimitadorTasa(peticiones_por_segundo_global, rafaga=max(1, int(peticiones_por_segundo_global)))
+    geocoding = GeocodingService(
+        limitador=LimitadorTasa(peticiones_por_segundo=1.0, rafaga=1, padre=limitador_global)
+    )
+    catastro = CatastroService(
+        limitador=LimitadorTasa(PETICIONES_POR_SEGUNDO_CATASTRO, RAFAGA_CATASTRO, padre=limitador_global)
+    )
+    detector = DetectorZonasCalientes(catastro_service=catastro, geocoding_service=geocoding)
+    return detector, limitador_global
+
+
+def analisis_masivo(
+    modo_rapido: bool = False,
+    confirmar: bool = True,
+    paralelo: int = 3,
+    reiniciar: bool = False,
+    peticiones_por_segundo: float = PETICIONES_POR_SEGUNDO_GLOBAL,
+    cruzar_cartera: bool = False
+):
     """
     Ejecuta análisis de todos los códigos postales de Las Palmas.
 
     Args:
         modo_rapido: Si True, usa grid_size menor para análisis más rápido
+        confirmar: Si False, no pide confirmación (ejecución desatendida)
+        paralelo: Códigos postales analizados a la vez
+        reiniciar: Si True, ignora los checkpoints de ejecuciones anteriores
+        peticiones_por_segundo: Límite global de peticiones a APIs externas
+        cruzar_cartera: Si True, etiqueta los edificios con cruce_cartera antes de exportar
     """
     print("\n" + "="*80)
     print("ANÁLISIS MASIVO DE CÓDIGOS POSTALES - LAS PALMAS DE GRAN CANARIA")
@@ -76,49 +228,88 @@ def analisis_masivo(modo_rapido: bool = False):
     print(f"Códigos postales a analizar: {len(CODIGOS_POSTALES_LPGC)}")
     print(f"Tiempo estimado: {'15-25 minutos' if modo_rapido else '30-60 minutos'}")
 
+    completadas = {} if reiniciar else cargar_checkpoints(grid_size)
+    pendientes = [
+        (cp, nombre) for cp, nombre in sorted(CODIGOS_POSTALES_LPGC.items())
+        if cp not in completadas
+    ]
+    if completadas:
+        print(f"Reanudando: {len(completadas)} CPs ya analizados, {len(pendientes)} pendientes")
+    print(f"CPs en paralelo: {paralelo} | Límite global: {peticiones_por_segundo} peticiones/s")
+
     # Confirmar ejecución
     print("\n⚠️  Este proceso realizará múltiples consultas a APIs públicas.")
     print("    Por favor, respeta los términos de uso de los servicios.")
 
-    respuesta = input("\n¿Desea continuar? (s/n): ").strip().lower()
-    if respuesta != 's':
-        print("\nAnálisis cancelado.")
-        return
+    if confirmar:
+        respuesta = input("\n¿Desea continuar? (s/n): ").strip().lower()
+        if respuesta != 's':
+            print("\nAnálisis cancelado.")
+            return
 
     print("\n" + "="*80)
     print("INICIANDO ANÁLISIS...")
     print("="*80 + "\n")
 
     inicio = datetime.now()
-    detector = DetectorZonasCalientes()
+    detector, limitador_global = crear_detector(peticiones_por_segundo)
 
-    zonas = []
-    errores = []
+    ranking = RankingIncremental()
+    for zona in completadas.values():
+        ranking.agregar(zona)
 
-    for i, (cp, nombre) in enumerate(sorted(CODIGOS_POSTALES_LPGC.items()), 1):
-        print(f"\n[{i}/{len(CODIGOS_POSTALES_LPGC)}] Analizando CP {cp} - {nombre}")
-        print("-" * 80)
+    zonas = list(completadas.values())
+    errores = []
+    total = len(CODIGOS_POSTALES_LPGC)
+
+    def analizar(cp: str) -> ZonaCaliente:
+        zona = detector.analizar_zona_por_codigo_postal(
+            codigo_postal=cp,
+            ciudad="Las Palmas de Gran Canaria",
+            grid_size=grid_size,
+            solo_residencial=True
+        )
+        # El checkpoint se guarda en el propio hilo: un CP terminado queda en
+        # disco aunque el bucle principal ya haya salido por Ctrl-C
+        guardar_checkpoint(cp, zona, grid_size)
+        return zona
+
+    with ThreadPoolExecutor(max_workers=max(1, paralelo), thread_name_prefix='cp') as executor:
+        futuros = {executor.submit(analizar, cp): (cp, nombre) for cp, nombre in pendientes}
 
         try:
-            zona = detector.analizar_zona_por_codigo_postal(
-                codigo_postal=cp,
-                ciudad="Las Palmas de Gran Canaria",
-                grid_size=grid_size,
-                solo_residencial=True
-            )
-
-            zonas.append(zona)
-
-            # Mostrar resumen
-            print(f"    ✓ Edificios encontrados: {zona.total_edificios}")
-            print(f"    ✓ Muy antiguos (>50 años): {zona.edificios_muy_antiguos}")
-            print(f"    ✓ Score total: {zona.score_total:.2f}")
-            print(f"    ✓ Densidad: {zona.densidad_oportunidades:.2f}")
-
-        except Exception as e:
-            logger.error(f"Error analizando CP {cp}: {e}")
-            errores.append({'cp': cp, 'nombre': nombre, 'error': str(e)})
-            print(f"    ✗ ERROR: {e}")
+            for futuro in as_completed(futuros):
+                cp, nombre = futuros[futuro]
+                print(f"\n[{len(zonas) + len(errores) + 1}/{total}] CP {cp} - {nombre}")
+                print("-" * 80)
+
+                try:
+                    zona = futuro.result()
+                except Exception as e:
+                    logger.error(f"Error analizando CP {cp}: {e}")
+                    errores.append({'cp': cp, 'nombre': nombre, 'error': str(e)})
+                    print(f"    ✗ ERROR: {e}")
+                    continue
+
+                zonas.append(zona)
+                posicion = ranking.agregar(zona)
+                ranking.guardar(total)
+
+                # Mostrar resumen
+                print(f"    ✓ Edificios encontrados: {zona.total_edificios}")
+                print(f"    ✓ Muy antiguos (>50 años): {zona.edificios_muy_antiguos}")
+                print(f"    ✓ Score total: {zona.score_total:.2f}")
+                print(f"    ✓ Densidad: {zona.densidad_oportunidades:.2f}")
+                print(f"    ✓ Posición provisional: {posicion}/{len(ranking.zonas)} "
+                      f"(líder: {ranking.zonas[0].nombre}, score {ranking.zonas[0].score_total:.2f})")
+        except KeyboardInterrupt:
+            # Los CPs en cola no llegan a empezar; los que están en curso
+            # terminan y guardan su checkpoint antes de salir
+            en_curso = sum(1 for f in futuros if f.running())
+            executor.shutdown(wait=False, cancel_futures=True)
+            if en_curso:
+                print(f"\n\n⚠️  Interrumpido: esperando a {en_curso} CPs en curso (se guardan al terminar)...")
+            raise
 
     fin = datetime.now()
     duracion = (fin - inicio).total_seconds() / 60
@@ -130,6 +321,22 @@ def analisis_masivo(modo_rapido: bool = False):
     print(f"Zonas analizadas: {len(zonas)}/{len(CODIGOS_POSTALES_LPGC)}")
     print(f"Errores: {len(errores)}")
 
+    stats_geo = detector.geocoding.estadisticas_cache()
+    if stats_geo:
+        print(f"Caché de geocodificación: {stats_geo['aciertos'] + stats_geo['aciertos_negativos']}/"
+              f"{stats_geo['consultas']} aciertos ({stats_geo['tasa_aciertos'] * 100:.0f}%)")
+
+    stats_catastro = detector.catastro.estadisticas_cache()
+    if stats_catastro:
+        puntos = stats_catastro['puntos']
+        print(f"Caché de Catastro: {puntos['aciertos'] + puntos['aciertos_negativos']}/"
+              f"{puntos['consultas']} puntos sin consultar la OVC ({puntos['tasa_aciertos'] * 100:.0f}%), "
+              f"{stats_catastro['parcelas']['entradas']} parcelas en disco")
+
+    stats_limitador = limitador_global.estadisticas()
+    print(f"Peticiones externas: {stats_limitador['peticiones']} "
+          f"({stats_limitador['segundos_esperados']:.0f} s de espera por el límite global)")
+
     if errores:
         print("\n⚠️  Códigos postales con errores:")
         for error in errores:
@@ -140,7 +347,7 @@ def analisis_masivo(modo_rapido: bool = False):
     print("🏆 RANKING DE CÓDIGOS POSTALES")
     print("="*80 + "\n")
 
-    zonas_ordenadas = detector.comparar_zonas(zonas)
+    zonas_ordenadas = ranking.zonas
 
     # Mostrar top 10
     print("TOP 10 ZONAS CON MAYOR POTENCIAL:\n")
@@ -161,6 +368,14 @@ def analisis_masivo(modo_rapido: bool = False):
 
     os.makedirs('resultados', exist_ok=True)
 
+    if cruzar_cartera:
+        from cruce_cartera import cargar_indice_cartera
+
+        indice = cargar_indice_cartera(geocoding=detector.geocoding)
+        recuento = indice.cruzar(e for zona in zonas for e in zona.edificios)
+        print(f"✓ Cruce con cartera: {recuento['cliente']} clientes, "
+              f"{recuento['competencia']} de la competencia, {recuento['desconocido']} desconocidos")
+
     # Generar JSON completo
     resultado_completo = {
         'metadata': {
@@ -170,32 +385,10 @@ def analisis_masivo(modo_rapido: bool = False):
             'grid_size': grid_size,
             'ciudad': 'Las Palmas de Gran Canaria',
             'total_cps_analizados': len(zonas),
+            'total_cps_reanudados': len(completadas),
             'total_cps_errores': len(errores)
         },
-        'ranking': [
-            {
-                'posicion': i,
-                'codigo_postal': z.nombre.replace("CP ", ""),
-                'nombre_zona': CODIGOS_POSTALES_LPGC.get(z.nombre.replace("CP ", ""), "Desconocida"),
-                'metricas': {
-                    'score_total': round(z.score_total, 2),
-                    'densidad_oportunidades': round(z.densidad_oportunidades, 2),
-                    'total_edificios': z.total_edificios,
-                    'edificios_muy_antiguos': z.edificios_muy_antiguos,
-                    'edificios_antiguos': z.edificios_antiguos,
-                    'edificios_modernos': z.edificios_modernos,
-                    'porcentaje_muy_antiguos': round(z.edificios_muy_antiguos/z.total_edificios*100 if z.total_edificios > 0 else 0, 1),
-                    'porcentaje_antiguos': round(z.edificios_antiguos/z.total_edificios*100 if z.total_edificios > 0 else 0, 1)
-                },
-                'ubicacion': {
-                    'latitud': z.latitud_centro,
-                    'longitud': z.longitud_centro,
-                    'radio_metros': z.radio_metros
-                },
-                'estadisticas_decada': z.stats_por_decada
-            }
-            for i, z in enumerate(zonas_ordenadas, 1)
-        ],
+        'ranking': [_entrada_ranking(i, z) for i, z in enumerate(zonas_ordenadas, 1)],
         'errores': errores if errores else []
     }
 
@@ -304,11 +497,47 @@ if __name__ == "__main__":
         action='store_true',
         help='Modo rápido (menor precisión, grid_size=3)'
     )
+    parser.add_argument(
+        '--si', '-y',
+        action='store_true',
+        help='No pedir confirmación (ejecución desatendida)'
+    )
+    parser.add_argument(
+        '--paralelo',
+        type=int,
+        default=3,
+        help='Códigos postales analizados a la vez (por defecto 3)'
+    )
+    parser.add_argument(
+        '--reiniciar',
+        action='store_true',
+        help='Ignorar los checkpoints y analizar todos los códigos postales'
+    )
+    parser.add_argument(
+        '--peticiones-por-segundo',
+        type=float,
+        default=PETICIONES_POR_SEGUNDO_GLOBAL,
+        help=f'Límite global de peticiones a Nominatim + Catastro (por defecto {PETICIONES_POR_SEGUNDO_GLOBAL})'
+    )
+
+    parser.add_argument(
+        '--cruzar-cartera',
+        action='store_true',
+        help='Cruzar los edificios con instalaciones y clientes (requiere Supabase)'
+    )
 
     args = parser.parse_args()
 
     try:
-        analisis_masivo(modo_rapido=args.rapido)
+        analisis_masivo(
+            modo_rapido=args.rapido,
+            confirmar=not args.si and sys.stdin.isatty(),
+            paralelo=args.paralelo,
+            reiniciar=args.reiniciar,
+            peticiones_por_segundo=args.peticiones_por_segundo,
+            cruzar_cartera=args.cruzar_cartera
+        )
     except KeyboardInterrupt:
-        print("\n\n⚠️  Análisis interrumpido por el usuario.\n")
+        print("\n\n⚠️  Análisis interrumpido por el usuario. "
+              "Vuelve a lanzarlo para continuar por los CPs pendientes.\n")
         sys.exit(1)
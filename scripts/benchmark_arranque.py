@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark de arranque en frío de la aplicación
+
+Cada repetición lanza un intérprete nuevo (como un worker de gunicorn o un
+cold start de Render) y mide:
+- Tiempo de `import app` (create_app incluido)
+- Tiempo de la primera petición a / (login, sin llamadas a Supabase)
+- Memoria residente máxima del proceso (RSS)
+- Número de módulos cargados y qué librerías pesadas se han importado
+
+Con --legacy se mide además `import app_legacy` como referencia de lo que
+costaba el arranque cuando app.py lo importaba entero.
+
+Uso:
+    python scripts/benchmark_arranque.py
+    python scripts/benchmark_arranque.py --repeticiones 10 --legacy
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DIRECTORIO_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LIBRERIAS_PESADAS = ['pandas', 'numpy', 'openpyxl', 'pdfplumber', 'reportlab', 'anthropic', 'app_legacy']
+
+# Código que ejecuta cada proceso hijo: imprime una línea JSON con las medidas
+CODIGO_MEDICION = """
+import json, resource, sys, time
+inicio = time.perf_counter()
+import {modulo}
+segundos_import = time.perf_counter() - inicio
+
+segundos_peticion = None
+if {primera_peticion}:
+    inicio = time.perf_counter()
+    {modulo}.app.test_client().get('/')
+    segundos_peticion = time.perf_counter() - inicio
+
+print(json.dumps({{
+    'segundos_import': segundos_import,
+    'segundos_primera_peticion': segundos_peticion,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modulos': len(sys.modules),
+    'pesadas': [m for m in {pesadas!r} if m in sys.modules],
+}}))
+"""
+
+
+def medir(modulo, primera_peticion=True):
+    """Arranca un intérprete nuevo, importa el módulo y devuelve las medidas"""
+    entorno = dict(os.environ)
+    # config.py exige las variables aunque el benchmark no llegue a usarlas
+    entorno.setdefault('SECRET_KEY', 'benchmark')
+    entorno.setdefault('SUPABASE_KEY', 'benchmark')
+    entorno['PYTHONPATH'] = DIRECTORIO_RAIZ + os.pathsep + entorno.get('PYTHONPATH', '')
+
+    codigo = CODIGO_MEDICION.format(modulo=modulo, primera_peticion=primera_peticion, pesadas=LIBRERIAS_PESADAS)
+    salida = subprocess.run(
+        [sys.executable, '-c', codigo],
+        cwd=DIRECTORIO_RAIZ, env=entorno, capture_output=True, text=True, check=True
+    )
+    # La última línea es la medición (la aplicación puede escribir logs antes)
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def resumir(nombre, medidas):
+    """Imprime mediana y mínimo de cada métrica"""
+    def fila(titulo, valores, unidad, factor=1):
+        valores = [v * factor for v in valores if v is not None]
+        if valores:
+            print(f"   {titulo:<22} mediana {statistics.median(valores):8.1f} {unidad}   "
+                  f"mín {min(valores):8.1f} {unidad}")
+
+    print(f"\n📊 {nombre} ({len(medidas)} arranques)")
+    fila('import', [m['segundos_import'] for m in medidas], 'ms', 1000)
+    fila('primera petición /', [m['segundos_primera_peticion'] for m in medidas], 'ms', 1000)
+    fila('RSS máximo', [m['rss_mb'] for m in medidas], 'MB')
+    print(f"   {'módulos cargados':<22} {medidas[-1]['modulos']}")
+    print(f"   {'librerías pesadas':<22} {', '.join(medidas[-1]['pesadas']) or 'ninguna'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de arranque en frío de la aplicación")
+    parser.add_argument('--repeticiones', '-n', type=int, default=5, help="Arranques por medición (default: 5)")
+    parser.add_argument('--legacy', action='store_true', help="Medir también import app_legacy como referencia")
+    args = parser.parse_args()
+
+    resumir('app (create_app)', [medir('app') for _ in range(args.repeticiones)])
+    if args.legacy:
+        resumir('app_legacy (referencia)', [medir('app_legacy', primera_peticion=False) for _ in range(args.repeticiones)])
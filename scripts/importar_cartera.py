@@ -10,31 +10,34 @@ Columnas esperadas en el Excel:
 - Técnico (opcional)
 
 Proceso:
-1. Agrupar por instalación → crear instalaciones únicas
-2. Crear máquinas para cada instalación
+1. Agrupar por instalación → alta en bloque de las instalaciones nuevas
+   (por nombre; las existentes no se modifican)
+2. Upsert en bloque de máquinas (por identificador; las existentes se actualizan)
 3. Extraer municipio del campo "Instalación"
 """
 
 import os
 import sys
+import urllib.parse
 import pandas as pd
-import requests
 from datetime import datetime
 
-# Configuración
-SUPABASE_URL = "https://hvkifqguxsgegzaxwcmj.supabase.co"
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+# El cliente de Supabase usa la configuración de la aplicación (config.py)
+for variable in ("SUPABASE_KEY", "SECRET_KEY"):
+    if not os.environ.get(variable):
+        print(f"❌ ERROR: Variable de entorno {variable} no está configurada")
+        sys.exit(1)
 
-if not SUPABASE_KEY:
-    print("❌ ERROR: Variable de entorno SUPABASE_KEY no está configurada")
-    sys.exit(1)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-HEADERS = {
-    "apikey": SUPABASE_KEY,
-    "Authorization": f"Bearer {SUPABASE_KEY}",
-    "Content-Type": "application/json",
-    "Prefer": "return=representation"
-}
+from services.supabase_client import db
+
+# Registros por petición y lotes en paralelo
+TAMANO_LOTE = 500
+LOTES_PARALELOS = 4
+
+# Nombres por consulta al recuperar los ids de las instalaciones (longitud de URL)
+TAMANO_LOTE_NOMBRES = 50
 
 # Mapeo de nombres de columnas (por si vienen diferentes)
 COLUMN_MAPPING = {
@@ -85,6 +88,27 @@ def limpiar_nombre_instalacion(instalacion_texto):
         return instalacion_texto.split(' - ')[0].strip()
     return instalacion_texto.strip()
 
+def cargar_ids_instalaciones(nombres):
+    """Carga nombre → id de las instalaciones indicadas (filtro in.() por lotes)"""
+    instalaciones_map = {}
+    for inicio in range(0, len(nombres), TAMANO_LOTE_NOMBRES):
+        # Nombres entre comillas: pueden llevar comas y paréntesis
+        valores = ','.join(
+            '"' + nombre.replace('\\', '\\\\').replace('"', '\\"') + '"'
+            for nombre in nombres[inicio:inicio + TAMANO_LOTE_NOMBRES]
+        )
+        filas = db.get('instalaciones', select='id,nombre',
+                       filters={'nombre': urllib.parse.quote(f"in.({valores})")}, timeout=30)
+
+        if filas is None:
+            print(f"   ✗ ERROR cargando ids de instalaciones (lote desde {inicio})")
+            continue
+
+        for row in filas:
+            instalaciones_map[row['nombre']] = row['id']
+
+    return instalaciones_map
+
 def importar_cartera(excel_path):
     """Importa cartera desde Excel"""
 
@@ -121,110 +145,72 @@ def importar_cartera(excel_path):
     # 3. Procesar instalaciones únicas
     print("\n🏢 Procesando instalaciones...")
 
-    instalaciones_unicas = df[['cod_instalacion', 'instalacion']].drop_duplicates('cod_instalacion')
-    instalaciones_creadas = []
-    instalaciones_map = {}  # cod_instalacion → id
+    df = df[df['instalacion'].notna()]
+    df = df.assign(
+        nombre_instalacion=df['instalacion'].map(limpiar_nombre_instalacion),
+        municipio=df['instalacion'].map(extraer_municipio)
+    )
+    instalaciones_unicas = df.drop_duplicates('nombre_instalacion')
 
     print(f"   Instalaciones únicas: {len(instalaciones_unicas)}")
 
-    for idx, row in instalaciones_unicas.iterrows():
-        nombre = limpiar_nombre_instalacion(row['instalacion'])
-        municipio = extraer_municipio(row['instalacion'])
+    instalaciones = [
+        {"nombre": row['nombre_instalacion'], "municipio": row['municipio']}
+        for _, row in instalaciones_unicas.iterrows()
+    ]
 
-        # Verificar si ya existe
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/instalaciones?nombre=eq.{nombre}",
-            headers=HEADERS
-        )
+    # Las existentes (mismo nombre) no se tocan; el upsert devuelve solo las creadas
+    creadas, errores = db.upsert('instalaciones', instalaciones, on_conflict='nombre',
+                                 batch_size=TAMANO_LOTE, ignore_duplicates=True)
+    for inicio, error in errores:
+        print(f"   ✗ ERROR en lote de instalaciones {inicio}-{inicio + TAMANO_LOTE - 1}: {error}")
 
-        if response.status_code == 200 and len(response.json()) > 0:
-            # Ya existe
-            instalacion_id = response.json()[0]['id']
-            print(f"   ↻ Ya existe: {nombre[:50]}...")
-        else:
-            # Crear nueva
-            data = {
-                "nombre": nombre,
-                "municipio": municipio
-            }
-
-            response = requests.post(
-                f"{SUPABASE_URL}/rest/v1/instalaciones",
-                json=data,
-                headers=HEADERS
-            )
-
-            if response.status_code == 201:
-                instalacion_id = response.json()[0]['id']
-                instalaciones_creadas.append(nombre)
-                print(f"   ✓ Creada: {nombre[:50]}... ({municipio})")
-            else:
-                print(f"   ✗ ERROR creando instalación: {response.text}")
-                continue
-
-        # Guardar mapping
-        instalaciones_map[row['cod_instalacion']] = instalacion_id
+    instalaciones_map = cargar_ids_instalaciones([i['nombre'] for i in instalaciones])  # nombre → id
 
     print(f"\n   📊 Resumen instalaciones:")
     print(f"      Total procesadas: {len(instalaciones_unicas)}")
-    print(f"      Nuevas creadas: {len(instalaciones_creadas)}")
-    print(f"      Ya existían: {len(instalaciones_unicas) - len(instalaciones_creadas)}")
+    print(f"      Creadas: {len(creadas)}")
+    print(f"      Ya existían: {len(instalaciones_map) - len(creadas)}")
 
     # 4. Procesar máquinas
     print("\n🛗 Procesando máquinas...")
 
-    maquinas_creadas = []
-    maquinas_existentes = []
+    maquinas = {}
     maquinas_error = []
 
     for idx, row in df.iterrows():
-        cod_instalacion = row['cod_instalacion']
-        identificador = row['maquina'].strip()
-        codigo_maquina = row['cod_maquina'].strip() if pd.notna(row['cod_maquina']) else None
+        identificador = str(row['maquina']).strip()
+        codigo_maquina = str(row['cod_maquina']).strip() if pd.notna(row['cod_maquina']) else None
 
         # Obtener instalacion_id
-        instalacion_id = instalaciones_map.get(cod_instalacion)
+        instalacion_id = instalaciones_map.get(row['nombre_instalacion'])
 
-        if not instalacion_id:
+        if not instalacion_id or pd.isna(row['maquina']):
             print(f"   ⚠️  Instalación no encontrada para máquina: {identificador}")
             maquinas_error.append(identificador)
             continue
 
-        # Verificar si la máquina ya existe
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/maquinas_cartera?identificador=eq.{identificador}",
-            headers=HEADERS
-        )
-
-        if response.status_code == 200 and len(response.json()) > 0:
-            maquinas_existentes.append(identificador)
-            print(f"   ↻ Ya existe: {identificador[:50]}...")
-            continue
-
-        # Crear nueva máquina
-        data = {
+        # Una por identificador (si se repite, gana la última fila)
+        maquinas[identificador] = {
             "instalacion_id": instalacion_id,
             "identificador": identificador,
             "codigo_maquina": codigo_maquina
         }
 
-        response = requests.post(
-            f"{SUPABASE_URL}/rest/v1/maquinas_cartera",
-            json=data,
-            headers=HEADERS
-        )
+    registros = list(maquinas.values())
+    _, errores = db.upsert('maquinas_cartera', registros, on_conflict='identificador',
+                           batch_size=TAMANO_LOTE, parallel=LOTES_PARALELOS, returning=False)
 
-        if response.status_code == 201:
-            maquinas_creadas.append(identificador)
-            print(f"   ✓ Creada: {identificador[:50]}...")
-        else:
-            print(f"   ✗ ERROR creando máquina: {response.text}")
-            maquinas_error.append(identificador)
+    maquinas_ok = len(registros)
+    for inicio, error in errores:
+        lote = registros[inicio:inicio + TAMANO_LOTE]
+        maquinas_ok -= len(lote)
+        maquinas_error.extend(m['identificador'] for m in lote)
+        print(f"   ✗ ERROR en lote de máquinas {inicio}-{inicio + len(lote) - 1}: {error}")
 
     print(f"\n   📊 Resumen máquinas:")
     print(f"      Total procesadas: {len(df)}")
-    print(f"      Nuevas creadas: {len(maquinas_creadas)}")
-    print(f"      Ya existían: {len(maquinas_existentes)}")
+    print(f"      Creadas o actualizadas: {maquinas_ok}")
     print(f"      Errores: {len(maquinas_error)}")
 
     # 5. Resumen final
@@ -232,8 +218,9 @@ def importar_cartera(excel_path):
     print("✅ IMPORTACIÓN COMPLETADA")
     print("="*70)
     print(f"\n📊 RESUMEN GENERAL:")
-    print(f"   Instalaciones creadas:  {len(instalaciones_creadas)}")
-    print(f"   Máquinas creadas:      {len(maquinas_creadas)}")
+    print(f"   Instalaciones creadas:    {len(creadas)}")
+    print(f"   Instalaciones existentes: {len(instalaciones_map) - len(creadas)}")
+    print(f"   Máquinas importadas:      {maquinas_ok}")
     print(f"   Total filas procesadas: {len(df)}")
 
     if maquinas_error:
@@ -248,8 +235,9 @@ def importar_cartera(excel_path):
     print(f"   Comando: python scripts/importar_partes.py <archivo_partes.xlsx>")
 
     return {
-        "instalaciones_creadas": len(instalaciones_creadas),
-        "maquinas_creadas": len(maquinas_creadas),
+        "instalaciones_creadas": len(creadas),
+        "instalaciones_existentes": len(instalaciones_map) - len(creadas),
+        "maquinas_importadas": maquinas_ok,
         "errores": len(maquinas_error)
     }
 
@@ -13,6 +13,9 @@ USO:
 
 REQUISITOS:
     pip install openpyxl requests python-dateutil
+
+Cada hoja se inserta en bloque (un POST por cada 500 filas); las filas
+rechazadas se reportan una a una sin bloquear el resto.
 """
 
 import sys
@@ -30,6 +33,16 @@ if not SUPABASE_KEY:
     print("❌ ERROR: Variable de entorno SUPABASE_KEY no configurada")
     sys.exit(1)
 
+# config.py exige SECRET_KEY aunque este script no use Flask
+os.environ.setdefault("SECRET_KEY", "importar-inspecciones-cli")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.supabase_client import db
+
+# Registros por petición en las inserciones en bloque
+TAMANO_LOTE = 500
+
 HEADERS = {
     "apikey": SUPABASE_KEY,
     "Authorization": f"Bearer {SUPABASE_KEY}",
@@ -69,6 +82,10 @@ def limpiar_texto(valor):
     return str(valor).strip() if valor else None
 
 
+# OCAs ya resueltas en esta ejecución: nombre -> id
+_ocas_por_nombre = {}
+
+
 def get_or_create_oca(nombre_oca):
     """Obtiene o crea un OCA y devuelve su ID"""
     if not nombre_oca:
@@ -78,6 +95,13 @@ def get_or_create_oca(nombre_oca):
     if not nombre_limpio:
         return None
 
+    if nombre_limpio not in _ocas_por_nombre:
+        _ocas_por_nombre[nombre_limpio] = _buscar_o_crear_oca(nombre_limpio)
+    return _ocas_por_nombre[nombre_limpio]
+
+
+def _buscar_o_crear_oca(nombre_limpio):
+    """Busca un OCA por nombre y lo crea si no existe"""
     # Buscar OCA existente
     response = requests.get(
         f"{SUPABASE_URL}/rest/v1/ocas?nombre=eq.{nombre_limpio}",
@@ -106,6 +130,33 @@ def get_or_create_oca(nombre_oca):
     return None
 
 
+def insertar_filas(tabla, registros):
+    """
+    Inserta en bloque los registros leídos de una hoja
+
+    Args:
+        tabla: Tabla de destino
+        registros: Lista de (fila del Excel, datos, etiqueta para el log)
+
+    Returns:
+        tuple: (insertados, errores)
+    """
+    if not registros:
+        return 0, 0
+
+    _, errores = db.insert_many(tabla, [datos for _, datos, _ in registros],
+                                batch_size=TAMANO_LOTE, returning=False)
+    errores_por_indice = dict(errores)
+
+    for indice, (fila, _, etiqueta) in enumerate(registros):
+        if indice in errores_por_indice:
+            print(f"❌ Fila {fila}: Error al importar - {errores_por_indice[indice]}")
+        else:
+            print(f"✅ Fila {fila}: {etiqueta}")
+
+    return len(registros) - len(errores_por_indice), len(errores_por_indice)
+
+
 def importar_hoja_principal(wb):
     """
     Importa inspecciones de la hoja principal
@@ -130,7 +181,7 @@ def importar_hoja_principal(wb):
     headers = [cell.value for cell in ws[1]]
     print(f"Encabezados encontrados: {headers}")
 
-    inspecciones_importadas = 0
+    registros = []
     errores = 0
 
     for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
@@ -183,23 +234,15 @@ def importar_hoja_principal(wb):
                 "created_by": "IMPORT_SCRIPT"
             }
 
-            response = requests.post(
-                f"{SUPABASE_URL}/rest/v1/inspecciones",
-                json=data,
-                headers=HEADERS
-            )
-
-            if response.status_code in [200, 201]:
-                inspecciones_importadas += 1
-                print(f"✅ Fila {idx}: {cliente} - {instalacion}")
-            else:
-                errores += 1
-                print(f"❌ Fila {idx}: Error al importar - {response.text}")
+            registros.append((idx, data, f"{cliente} - {instalacion}"))
 
         except Exception as e:
             errores += 1
             print(f"❌ Fila {idx}: Excepción - {str(e)}")
 
+    inspecciones_importadas, errores_insercion = insertar_filas('inspecciones', registros)
+    errores += errores_insercion
+
     print(f"\n📊 Resumen Hoja Principal:")
     print(f"   ✅ Inspecciones importadas: {inspecciones_importadas}")
     print(f"   ❌ Errores: {errores}")
@@ -226,7 +269,7 @@ def importar_cortinas(wb):
         print("⚠️  Hoja 'CORTINAS' no encontrada en el Excel")
         return 0
 
-    materiales_importados = 0
+    registros = []
     errores = 0
 
     for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
@@ -260,23 +303,15 @@ def importar_cortinas(wb):
                 "observaciones": f"Importado desde Excel hoja CORTINAS. Fila: {idx}"
             }
 
-            response = requests.post(
-                f"{SUPABASE_URL}/rest/v1/materiales_especiales",
-                json=data,
-                headers=HEADERS
-            )
-
-            if response.status_code in [200, 201]:
-                materiales_importados += 1
-                print(f"✅ Fila {idx}: CORTINA - {cliente} (x{cantidad_int})")
-            else:
-                errores += 1
-                print(f"❌ Fila {idx}: Error - {response.text}")
+            registros.append((idx, data, f"CORTINA - {cliente} (x{cantidad_int})"))
 
         except Exception as e:
             errores += 1
             print(f"❌ Fila {idx}: Excepción - {str(e)}")
 
+    materiales_importados, errores_insercion = insertar_filas('materiales_especiales', registros)
+    errores += errores_insercion
+
     print(f"\n📊 Resumen CORTINAS:")
     print(f"   ✅ Materiales importados: {materiales_importados}")
     print(f"   ❌ Errores: {errores}")
@@ -303,7 +338,7 @@ def importar_pesacargas(wb):
         print("⚠️  Hoja 'PESACARGAS' no encontrada en el Excel")
         return 0
 
-    materiales_importados = 0
+    registros = []
     errores = 0
 
     for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
@@ -337,23 +372,15 @@ def importar_pesacargas(wb):
                 "observaciones": f"Importado desde Excel hoja PESACARGAS. Fila: {idx}"
             }
 
-            response = requests.post(
-                f"{SUPABASE_URL}/rest/v1/materiales_especiales",
-                json=data,
-                headers=HEADERS
-            )
-
-            if response.status_code in [200, 201]:
-                materiales_importados += 1
-                print(f"✅ Fila {idx}: PESACARGA - {cliente} (x{cantidad_int})")
-            else:
-                errores += 1
-                print(f"❌ Fila {idx}: Error - {response.text}")
+            registros.append((idx, data, f"PESACARGA - {cliente} (x{cantidad_int})"))
 
         except Exception as e:
             errores += 1
             print(f"❌ Fila {idx}: Excepción - {str(e)}")
 
+    materiales_importados, errores_insercion = insertar_filas('materiales_especiales', registros)
+    errores += errores_insercion
+
     print(f"\n📊 Resumen PESACARGAS:")
     print(f"   ✅ Materiales importados: {materiales_importados}")
     print(f"   ❌ Errores: {errores}")
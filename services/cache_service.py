@@ -1,9 +1,22 @@
 """
 Servicio centralizado de caché para optimizar consultas a Supabase
+
+Las cachés por clave (detalle de cartera, resumen de inspecciones) tienen
+un tamaño máximo: al llenarse se descartan las entradas caducadas y, si no
+basta, las menos usadas (LRU).
+
+Aciertos, fallos, errores y duración de las recargas se publican en /metrics
+(cache_operaciones_total y cache_refresco_segundos, etiqueta cache).
 """
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+import threading
+import time
 import requests
-from config import config, CACHE_TTL_ADMINISTRADORES, CACHE_TTL_METRICAS_HOME, CACHE_TTL_FILTROS, CACHE_TTL_INSTALACIONES, CACHE_TTL_OPORTUNIDADES
+from config import config, CACHE_TTL_ADMINISTRADORES, CACHE_TTL_METRICAS_HOME, CACHE_TTL_FILTROS, CACHE_TTL_INSTALACIONES, CACHE_TTL_OPORTUNIDADES, CACHE_TTL_DETALLE_CARTERA, CACHE_TTL_RESUMEN_INSPECCIONES
+from config import CACHE_MAX_DETALLE_CARTERA, CACHE_MAX_MAQUINAS_INDICE, CACHE_MAX_RESUMEN_INSPECCIONES
+from services.supabase_client import db
+from middleware.metricas import registro as metricas
 
 # ============================================
 # ESTRUCTURAS DE CACHÉ
@@ -40,6 +53,38 @@ cache_ultimas_oportunidades = {
     'timestamp': None
 }
 
+# Caché por entidad para el detalle de cartera (10 min, LRU)
+# Clave: (id, limite, offset) -> {'data': ..., 'timestamp': ...}
+cache_detalle_maquinas = OrderedDict()
+cache_detalle_instalaciones = OrderedDict()
+
+# Índice inverso máquina -> instalación para invalidar ambos detalles
+# cuando se escriben partes de una máquina (LRU; si se descarta una máquina,
+# su detalle caduca por TTL en lugar de invalidarse con la instalación)
+instalacion_por_maquina = OrderedDict()
+
+# Caché de totales por categoría del dashboard de inspecciones (5 min, LRU)
+# Clave: (oca_id, busqueda, fecha) -> {'data': ..., 'timestamp': ...}
+cache_resumen_inspecciones = OrderedDict()
+
+# Protege las cachés por clave (lecturas LRU, escrituras e invalidaciones)
+_lock_caches = threading.Lock()
+
+
+# ============================================
+# MÉTRICAS
+# ============================================
+
+def _registrar_consulta(cache, resultado):
+    """Cuenta una consulta a una caché (hit o error)"""
+    metricas.incrementar('cache_operaciones_total', cache=cache, resultado=resultado)
+
+
+def _registrar_refresco(cache, inicio):
+    """Cuenta un fallo de caché y la duración de su recarga desde Supabase"""
+    metricas.incrementar('cache_operaciones_total', cache=cache, resultado='miss')
+    metricas.observar('cache_refresco_segundos', time.perf_counter() - inicio, cache=cache)
+
 
 # ============================================
 # FUNCIONES DE CACHÉ
@@ -57,6 +102,7 @@ def get_administradores_cached():
     if not cache_administradores['timestamp'] or \
        (now - cache_administradores['timestamp']) > timedelta(minutes=CACHE_TTL_ADMINISTRADORES):
 
+        inicio = time.perf_counter()
         try:
             print(f"🔄 Consultando administradores desde Supabase...")
             response = requests.get(
@@ -74,6 +120,7 @@ def get_administradores_cached():
                 print(f"✅ Caché de administradores actualizado: {len(data)} registros")
             else:
                 print(f"⚠️ Error al actualizar caché de administradores: {response.status_code}")
+                _registrar_consulta('administradores', 'error')
                 print(f"📄 Respuesta: {response.text[:200]}")
                 # Si falla pero hay caché previo, usarlo
                 if cache_administradores['data']:
@@ -81,10 +128,16 @@ def get_administradores_cached():
 
         except requests.exceptions.Timeout:
             print(f"⏱️ Timeout al consultar Supabase (>10s)")
+            _registrar_consulta('administradores', 'error')
         except Exception as e:
             print(f"❌ Excepción al actualizar caché de administradores: {type(e).__name__}: {str(e)}")
+            _registrar_consulta('administradores', 'error')
             # Si falla, devolver lo que haya en caché (aunque esté desactualizado)
 
+        _registrar_refresco('administradores', inicio)
+    else:
+        _registrar_consulta('administradores', 'hit')
+
     return cache_administradores['data']
 
 
@@ -98,6 +151,7 @@ def get_metricas_home_cached():
     if not cache_metricas_home['timestamp'] or \
        (now - cache_metricas_home['timestamp']) > timedelta(minutes=CACHE_TTL_METRICAS_HOME):
 
+        inicio = time.perf_counter()
         try:
             print(f"🔄 Consultando métricas del home desde Supabase...")
 
@@ -150,8 +204,13 @@ def get_metricas_home_cached():
 
         except Exception as e:
             print(f"❌ Error al actualizar caché de métricas: {type(e).__name__}: {str(e)}")
+            _registrar_consulta('metricas_home', 'error')
             # Si falla, devolver lo que haya en caché
 
+        _registrar_refresco('metricas_home', inicio)
+    else:
+        _registrar_consulta('metricas_home', 'hit')
+
     return cache_metricas_home['data']
 
 
@@ -165,6 +224,7 @@ def get_filtros_cached():
     if not cache_filtros['timestamp'] or \
        (now - cache_filtros['timestamp']) > timedelta(minutes=CACHE_TTL_FILTROS):
 
+        inicio = time.perf_counter()
         try:
             print(f"🔄 Consultando filtros desde Supabase...")
 
@@ -192,6 +252,11 @@ def get_filtros_cached():
 
         except Exception as e:
             print(f"❌ Error al actualizar caché de filtros: {type(e).__name__}: {str(e)}")
+            _registrar_consulta('filtros', 'error')
+
+        _registrar_refresco('filtros', inicio)
+    else:
+        _registrar_consulta('filtros', 'hit')
 
     return cache_filtros['localidades'], cache_filtros['empresas']
 
@@ -206,6 +271,7 @@ def get_ultimas_instalaciones_cached():
     if not cache_ultimas_instalaciones['timestamp'] or \
        (now - cache_ultimas_instalaciones['timestamp']) > timedelta(minutes=CACHE_TTL_INSTALACIONES):
 
+        inicio = time.perf_counter()
         try:
             print(f"🔄 Consultando últimas instalaciones desde Supabase...")
 
@@ -240,6 +306,11 @@ def get_ultimas_instalaciones_cached():
 
         except Exception as e:
             print(f"❌ Error al actualizar caché de instalaciones: {type(e).__name__}: {str(e)}")
+            _registrar_consulta('ultimas_instalaciones', 'error')
+
+        _registrar_refresco('ultimas_instalaciones', inicio)
+    else:
+        _registrar_consulta('ultimas_instalaciones', 'hit')
 
     return cache_ultimas_instalaciones['data']
 
@@ -254,6 +325,7 @@ def get_ultimas_oportunidades_cached():
     if not cache_ultimas_oportunidades['timestamp'] or \
        (now - cache_ultimas_oportunidades['timestamp']) > timedelta(minutes=CACHE_TTL_OPORTUNIDADES):
 
+        inicio = time.perf_counter()
         try:
             print(f"🔄 Consultando últimas oportunidades desde Supabase...")
 
@@ -271,10 +343,204 @@ def get_ultimas_oportunidades_cached():
 
         except Exception as e:
             print(f"❌ Error al actualizar caché de oportunidades: {type(e).__name__}: {str(e)}")
+            _registrar_consulta('ultimas_oportunidades', 'error')
+
+        _registrar_refresco('ultimas_oportunidades', inicio)
+    else:
+        _registrar_consulta('ultimas_oportunidades', 'hit')
 
     return cache_ultimas_oportunidades['data']
 
 
+def _leer_entrada(cache, clave, ttl_minutos, now):
+    """
+    Datos de una entrada de caché por clave si sigue dentro del TTL (None si no).
+    Un acierto la marca como la más reciente.
+    """
+    with _lock_caches:
+        entrada = cache.get(clave)
+        if entrada is None or (now - entrada['timestamp']) > timedelta(minutes=ttl_minutos):
+            return None
+        cache.move_to_end(clave)
+        return entrada['data']
+
+
+def _guardar_lru(cache, clave, valor, maximo):
+    """Guarda un valor como el más reciente y descarta los menos usados por encima de maximo (con lock)"""
+    cache[clave] = valor
+    cache.move_to_end(clave)
+    while len(cache) > maximo:
+        cache.popitem(last=False)
+
+
+def _guardar_entrada(cache, clave, data, now, ttl_minutos, maximo):
+    """
+    Guarda una entrada de caché por clave. Si la caché está llena, primero
+    se descartan las caducadas y después las menos usadas.
+    """
+    with _lock_caches:
+        if len(cache) >= maximo:
+            limite = now - timedelta(minutes=ttl_minutos)
+            for c in [c for c, e in cache.items() if e['timestamp'] < limite]:
+                del cache[c]
+        _guardar_lru(cache, clave, {'data': data, 'timestamp': now}, maximo)
+
+
+def get_detalle_maquina_cached(maquina_id, limite=50, offset=0):
+    """
+    Obtiene el detalle completo de una máquina de cartera usando caché.
+    Una sola llamada RPC (fn_detalle_maquina_cartera) devuelve la máquina con
+    su instalación, los agregados, la distribución de tipos y el historial
+    paginado. Se renueva cada 10 minutos o al invalidar la máquina.
+
+    Returns:
+        Diccionario con maquina, stats, tipos_distribucion, partes,
+        recomendaciones y oportunidades; None si la máquina no existe o la
+        RPC no está disponible (migración 015 sin aplicar).
+    """
+    now = datetime.now()
+    clave = (maquina_id, limite, offset)
+
+    data = _leer_entrada(cache_detalle_maquinas, clave, CACHE_TTL_DETALLE_CARTERA, now)
+    if data is not None:
+        _registrar_consulta('detalle_maquina', 'hit')
+        return data
+
+    inicio = time.perf_counter()
+    data = db.rpc('fn_detalle_maquina_cartera', {
+        'p_maquina_id': maquina_id,
+        'p_limite': limite,
+        'p_offset': offset
+    })
+    _registrar_refresco('detalle_maquina', inicio)
+
+    if data:
+        _guardar_entrada(cache_detalle_maquinas, clave, data, now,
+                         CACHE_TTL_DETALLE_CARTERA, CACHE_MAX_DETALLE_CARTERA)
+        instalacion_id = (data.get('maquina') or {}).get('instalacion_id')
+        if instalacion_id:
+            with _lock_caches:
+                _guardar_lru(instalacion_por_maquina, maquina_id, instalacion_id, CACHE_MAX_MAQUINAS_INDICE)
+
+    return data
+
+
+def get_detalle_instalacion_cached(instalacion_id, limite=100, offset=0):
+    """
+    Obtiene el detalle completo de una instalación de cartera usando caché.
+    Una sola llamada RPC (fn_detalle_instalacion_cartera) devuelve la
+    instalación, sus máquinas con agregados por máquina, los totales y el
+    historial paginado. Se renueva cada 10 minutos o al invalidar.
+
+    Returns:
+        Diccionario con instalacion, maquinas, stats, tipos_distribucion,
+        partes, recomendaciones y oportunidades; None si no existe o la RPC
+        no está disponible.
+    """
+    now = datetime.now()
+    clave = (instalacion_id, limite, offset)
+
+    data = _leer_entrada(cache_detalle_instalaciones, clave, CACHE_TTL_DETALLE_CARTERA, now)
+    if data is not None:
+        _registrar_consulta('detalle_instalacion', 'hit')
+        return data
+
+    inicio = time.perf_counter()
+    data = db.rpc('fn_detalle_instalacion_cartera', {
+        'p_instalacion_id': instalacion_id,
+        'p_limite': limite,
+        'p_offset': offset
+    })
+    _registrar_refresco('detalle_instalacion', inicio)
+
+    if data:
+        _guardar_entrada(cache_detalle_instalaciones, clave, data, now,
+                         CACHE_TTL_DETALLE_CARTERA, CACHE_MAX_DETALLE_CARTERA)
+        with _lock_caches:
+            for maquina in data.get('maquinas') or []:
+                _guardar_lru(instalacion_por_maquina, maquina['id'], instalacion_id, CACHE_MAX_MAQUINAS_INDICE)
+
+    return data
+
+
+def invalidar_detalle_instalacion(instalacion_id):
+    """
+    Elimina de la caché todas las páginas del detalle de una instalación
+    y el detalle de sus máquinas conocidas (muestran datos de la instalación).
+    """
+    with _lock_caches:
+        for clave in [c for c in cache_detalle_instalaciones if c[0] == instalacion_id]:
+            cache_detalle_instalaciones.pop(clave, None)
+
+        maquinas = {mid for mid, iid in instalacion_por_maquina.items() if iid == instalacion_id}
+        for clave in [c for c in cache_detalle_maquinas if c[0] in maquinas]:
+            cache_detalle_maquinas.pop(clave, None)
+
+
+def invalidar_detalle_maquina(maquina_id):
+    """
+    Elimina de la caché el detalle de una máquina y el de su instalación.
+    Llamar tras escribir partes u oportunidades de la máquina.
+    """
+    if not maquina_id:
+        return
+
+    with _lock_caches:
+        for clave in [c for c in cache_detalle_maquinas if c[0] == maquina_id]:
+            cache_detalle_maquinas.pop(clave, None)
+
+        instalacion_id = instalacion_por_maquina.get(maquina_id)
+    if instalacion_id:
+        invalidar_detalle_instalacion(instalacion_id)
+
+
+def invalidar_detalles_cartera():
+    """Vacía la caché de detalle de cartera (importaciones y re-análisis masivos)"""
+    with _lock_caches:
+        cache_detalle_maquinas.clear()
+        cache_detalle_instalaciones.clear()
+        instalacion_por_maquina.clear()
+
+
+def get_resumen_inspecciones_cached(oca_id=None, busqueda=None):
+    """
+    Obtiene los totales por categoría de segunda inspección usando caché.
+    Una sola llamada RPC (fn_resumen_inspecciones). La fecha forma parte
+    de la clave porque las categorías dependen del día.
+    Se renueva cada 5 minutos o al invalidar.
+
+    Returns:
+        Diccionario {categoria: total} (incluye 'total'); None si la RPC
+        no está disponible (migración 021 sin aplicar).
+    """
+    now = datetime.now()
+    clave = (oca_id, busqueda or None, date.today())
+
+    data = _leer_entrada(cache_resumen_inspecciones, clave, CACHE_TTL_RESUMEN_INSPECCIONES, now)
+    if data is not None:
+        _registrar_consulta('resumen_inspecciones', 'hit')
+        return data
+
+    inicio = time.perf_counter()
+    data = db.rpc('fn_resumen_inspecciones', {
+        'p_oca_id': oca_id,
+        'p_busqueda': busqueda or None
+    })
+    _registrar_refresco('resumen_inspecciones', inicio)
+
+    if data:
+        _guardar_entrada(cache_resumen_inspecciones, clave, data, now,
+                         CACHE_TTL_RESUMEN_INSPECCIONES, CACHE_MAX_RESUMEN_INSPECCIONES)
+
+    return data
+
+
+def invalidar_resumen_inspecciones():
+    """Vacía la caché de totales de inspecciones (altas, bajas y cambios de fechas)"""
+    with _lock_caches:
+        cache_resumen_inspecciones.clear()
+
+
 def clear_all_caches():
     """Limpia todas las cachés"""
     global cache_administradores, cache_metricas_home, cache_filtros, cache_ultimas_instalaciones, cache_ultimas_oportunidades
@@ -284,5 +550,7 @@ def clear_all_caches():
     cache_filtros = {'localidades': [], 'empresas': [], 'timestamp': None}
     cache_ultimas_instalaciones = {'data': [], 'timestamp': None}
     cache_ultimas_oportunidades = {'data': [], 'timestamp': None}
+    invalidar_detalles_cartera()
+    invalidar_resumen_inspecciones()
 
     return "Todas las cachés han sido limpiadas"
@@ -0,0 +1,206 @@
+"""
+Servicio de Defectos - consultas del dashboard
+
+El filtrado, los contadores y el join con inspecciones se resuelven en el
+servidor (migración 019):
+- Filtros operativos (técnico, material, stock) como filtros de PostgREST
+- Contadores por urgencia y calificación agregados en SQL (fn_resumen_defectos)
+- Listados por sección desde v_defectos_dashboard (defecto + inspección + OCA)
+  paginados por keyset sobre (fecha_limite, id)
+
+El tamaño de la respuesta depende del tamaño de página, no del histórico
+de defectos.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from middleware.tiempos import propagar_traza
+from services.supabase_client import db
+
+# Defectos por página en cada sección del dashboard
+TAMANO_PAGINA_DEFECTOS = 50
+
+# Defectos por petición al recorrer todos los pendientes (Supabase limita a 1000 filas)
+TAMANO_LOTE_LECTURA = 1000
+
+# Filtros del dashboard: parámetro -> (columna, valor que significa "vacío")
+FILTROS_DEFECTOS = {
+    'tecnico': ('tecnico_asignado', 'sin_asignar'),
+    'material': ('gestion_material', 'sin_definir'),
+    'stock': ('estado_stock', 'sin_definir')
+}
+
+# Secciones del dashboard: nombre -> filtros de la vista
+SECCIONES_DEFECTOS = {
+    'vencidos': {'estado': 'eq.PENDIENTE', 'nivel_urgencia': 'eq.VENCIDO'},
+    'urgentes': {'estado': 'eq.PENDIENTE', 'nivel_urgencia': 'eq.URGENTE'},
+    'proximos': {'estado': 'eq.PENDIENTE', 'nivel_urgencia': 'eq.PROXIMO'},
+    'normales': {'estado': 'eq.PENDIENTE', 'nivel_urgencia': 'eq.NORMAL'},
+    'subsanados': {'estado': 'eq.SUBSANADO'}
+}
+
+# Columnas que usan el dashboard y la exportación
+SELECT_DEFECTOS = (
+    "id,inspeccion_id,maquina,descripcion,calificacion,plazo_meses,fecha_limite,"
+    "dias_restantes,nivel_urgencia,estado,fecha_subsanacion,es_cortina,es_pesacarga,"
+    "tecnico_asignado,gestion_material,estado_stock,direccion,poblacion,"
+    "fecha_inspeccion,oca_nombre"
+)
+
+
+def leer_filtros(args):
+    """Filtros operativos presentes en los parámetros de la petición"""
+    return {nombre: args.get(nombre, '').strip() for nombre in FILTROS_DEFECTOS if args.get(nombre, '').strip()}
+
+
+def _literal(valor):
+    """Valor entre comillas para los operadores lógicos de PostgREST"""
+    return '"' + str(valor).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _condiciones(filtros, desde=None):
+    """Condiciones de filtro y de cursor combinadas en un único and=(...)"""
+    condiciones = []
+    for nombre, valor in filtros.items():
+        columna, vacio = FILTROS_DEFECTOS[nombre]
+        if valor == vacio:
+            condiciones.append(f'or({columna}.is.null,{columna}.eq."")')
+        else:
+            condiciones.append(f'{columna}.eq.{_literal(valor)}')
+
+    if desde:
+        fecha, ultimo_id = desde
+        condiciones.append(
+            f'or(fecha_limite.gt.{fecha},and(fecha_limite.eq.{fecha},id.gt.{ultimo_id}))'
+        )
+
+    return {'and': quote(f"({','.join(condiciones)})", safe='')} if condiciones else {}
+
+
+def cursor_defecto(defecto):
+    """Cursor de paginación (fecha_limite_id) a partir del último defecto de una página"""
+    return f"{defecto['fecha_limite'][:10]}_{defecto['id']}"
+
+
+def leer_cursor(cursor):
+    """
+    Interpreta un cursor generado por cursor_defecto
+
+    Returns:
+        tuple (fecha_limite, id) o None si no es válido
+    """
+    try:
+        fecha, ultimo_id = (cursor or '').rsplit('_', 1)
+        if len(fecha) != 10 or fecha[4] != '-' or fecha[7] != '-':
+            return None
+        return fecha, int(ultimo_id)
+    except ValueError:
+        return None
+
+
+def obtener_pagina_defectos(seccion, filtros, desde=None, tamano=TAMANO_PAGINA_DEFECTOS):
+    """
+    Página de defectos de una sección del dashboard
+
+    Args:
+        seccion: Clave de SECCIONES_DEFECTOS
+        filtros: Filtros de leer_filtros (solo se aplican a pendientes)
+        desde: Cursor (fecha_limite, id) del último defecto ya mostrado
+        tamano: Defectos por página
+
+    Returns:
+        tuple: (lista de defectos, cursor de la página siguiente o None)
+    """
+    # Se pide uno más para saber si hay página siguiente
+    defectos = _leer_pagina(
+        SECCIONES_DEFECTOS[seccion], {} if seccion == 'subsanados' else filtros, desde, tamano + 1
+    ) or []
+
+    siguiente = cursor_defecto(defectos[tamano - 1]) if len(defectos) > tamano else None
+    return defectos[:tamano], siguiente
+
+
+def _leer_pagina(condiciones_base, filtros, desde, limite, timeout=15):
+    condiciones = dict(condiciones_base)
+    condiciones.update(_condiciones(filtros, desde))
+    return db.get(
+        'v_defectos_dashboard',
+        select=SELECT_DEFECTOS,
+        filters=condiciones,
+        order='fecha_limite.asc,id.asc',
+        limit=limite,
+        timeout=timeout
+    )
+
+
+def iterar_defectos_pendientes(filtros, tamano=TAMANO_LOTE_LECTURA):
+    """
+    Recorre todos los defectos pendientes filtrados, por lotes (keyset)
+
+    Yields:
+        Listas de defectos ordenadas por (fecha_limite, id)
+    """
+    desde = None
+    while True:
+        lote = _leer_pagina({'estado': 'eq.PENDIENTE'}, filtros, desde, tamano, timeout=30)
+        if lote is None:
+            raise RuntimeError("Error al obtener defectos pendientes")
+        if not lote:
+            return
+        yield lote
+        # Sin cortar en páginas incompletas: PostgREST puede limitar filas (max-rows)
+        desde = leer_cursor(cursor_defecto(lote[-1]))
+
+
+def obtener_version_pendientes(filtros):
+    """
+    Versión de los datos de los pendientes filtrados (fn_version_defectos_pendientes)
+
+    Returns:
+        dict {version, total} o None si hay error
+    """
+    return db.rpc('fn_version_defectos_pendientes', {
+        'p_tecnico': filtros.get('tecnico'),
+        'p_material': filtros.get('material'),
+        'p_stock': filtros.get('stock')
+    }, timeout=15)
+
+
+def obtener_resumen_defectos(filtros):
+    """
+    Totales y contadores por urgencia y calificación (pendientes filtrados)
+
+    Returns:
+        dict: total, subsanados, pendientes, por_urgencia, por_calificacion
+    """
+    resumen = db.rpc('fn_resumen_defectos', {
+        'p_tecnico': filtros.get('tecnico'),
+        'p_material': filtros.get('material'),
+        'p_stock': filtros.get('stock')
+    }, timeout=15) or {}
+
+    return {
+        'total': resumen.get('total', 0),
+        'subsanados': resumen.get('subsanados', 0),
+        'pendientes': resumen.get('pendientes', 0),
+        'por_urgencia': resumen.get('por_urgencia') or {},
+        'por_calificacion': resumen.get('por_calificacion') or {}
+    }
+
+
+def obtener_dashboard_defectos(filtros, tamano=TAMANO_PAGINA_DEFECTOS):
+    """
+    Resumen y primera página de cada sección de pendientes, en paralelo
+
+    Los subsanados no se cargan aquí: se piden al desplegar su sección.
+
+    Returns:
+        tuple: (resumen, {seccion: (defectos, cursor siguiente)})
+    """
+    secciones = [s for s in SECCIONES_DEFECTOS if s != 'subsanados']
+
+    with ThreadPoolExecutor(max_workers=len(secciones) + 1) as pool:
+        futuro_resumen = pool.submit(propagar_traza(obtener_resumen_defectos), filtros)
+        futuros = {s: pool.submit(propagar_traza(obtener_pagina_defectos), s, filtros, None, tamano) for s in secciones}
+
+    return futuro_resumen.result(), {s: f.result() for s, f in futuros.items()}
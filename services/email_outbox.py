@@ -0,0 +1,497 @@
+"""
+Bandeja de salida de emails (outbox)
+
+Las rutas no llaman al proveedor de email: guardan el mensaje en una bandeja
+persistente y responden al momento. Un hilo de envío por proceso la vacía en
+segundo plano:
+- Lotes de hasta TAMANO_LOTE mensajes por llamada al proveedor
+- Reintentos con espera exponencial hasta MAX_INTENTOS
+- Clave de idempotencia por mensaje (un mismo aviso no se encola dos veces
+  y el proveedor descarta reenvíos de un mensaje ya aceptado)
+- Límite de envíos por dirección de destino (to, cc y bcc, cada una por
+  separado) en una ventana de tiempo
+
+La bandeja es un SQLite en disco compartido por todos los workers de gunicorn
+(como el estado de services/importacion_jobs.py): un mensaje se reclama con
+una transacción exclusiva, así que solo lo envía un worker.
+
+El proveedor es intercambiable (EMAIL_PROVEEDOR=resend|memoria o
+configurar_proveedor) para desarrollo y pruebas sin enviar emails reales.
+
+Los mensajes por estado (emails_en_bandeja) y los envíos y fallos
+(emails_procesados_total) se publican en /metrics.
+
+Vaciar la bandeja manualmente o con cron:
+    python -m services.email_outbox
+"""
+from contextlib import closing
+from email.utils import getaddresses
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+import resend
+
+from config import config
+from middleware.metricas import registro as metricas
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+RUTA_BANDEJA = os.environ.get(
+    "EMAIL_OUTBOX_DB",
+    os.path.join(tempfile.gettempdir(), "ascensoralert_email_outbox.sqlite3")
+)
+
+# Mensajes por llamada al proveedor (Resend admite hasta 100 por lote)
+TAMANO_LOTE = 50
+
+# Intentos antes de dar un mensaje por fallido
+MAX_INTENTOS = 6
+
+# Espera antes del reintento n: ESPERA_BASE_REINTENTO * 2^(n-1), con tope
+ESPERA_BASE_REINTENTO = 30
+ESPERA_MAX_REINTENTO = 3600
+
+# Envíos máximos a una misma dirección dentro de VENTANA_LIMITE (segundos)
+LIMITE_POR_DESTINATARIO = 10
+VENTANA_LIMITE = 3600
+
+# Espera del hilo de envío cuando la bandeja está vacía (segundos)
+INTERVALO_SONDEO = 5
+
+# Mensajes reclamados por un worker que no ha terminado (caído) se liberan tras este tiempo
+BLOQUEO_CADUCADO = 300
+
+# Antigüedad a partir de la cual se eliminan los mensajes terminados
+RETENCION_MENSAJES = 7 * 24 * 3600
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS mensajes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    clave TEXT NOT NULL UNIQUE,
+    tipo TEXT NOT NULL,
+    destinatario TEXT NOT NULL,
+    params TEXT NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento REAL NOT NULL,
+    reclamado REAL,
+    id_proveedor TEXT,
+    ultimo_error TEXT,
+    registro_tabla TEXT,
+    registro_id INTEGER,
+    creado REAL NOT NULL,
+    enviado REAL
+);
+CREATE INDEX IF NOT EXISTS idx_mensajes_pendientes ON mensajes(estado, proximo_intento);
+CREATE TABLE IF NOT EXISTS destinatarios (
+    mensaje_id INTEGER NOT NULL,
+    direccion TEXT NOT NULL,
+    PRIMARY KEY (mensaje_id, direccion)
+);
+CREATE INDEX IF NOT EXISTS idx_destinatarios_direccion ON destinatarios(direccion, mensaje_id);
+"""
+
+_esquema_creado = set()
+
+
+def _conectar():
+    """Conexión en modo autocommit (las transacciones se abren explícitamente)"""
+    directorio = os.path.dirname(RUTA_BANDEJA)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    conexion = sqlite3.connect(RUTA_BANDEJA, timeout=30, isolation_level=None)
+    conexion.row_factory = sqlite3.Row
+    if RUTA_BANDEJA not in _esquema_creado:
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.executescript(_ESQUEMA)
+        _esquema_creado.add(RUTA_BANDEJA)
+    return conexion
+
+
+# ============================================
+# PROVEEDORES
+# ============================================
+
+class ProveedorResend:
+    """Envío real con la API de Resend"""
+
+    def _configurar(self):
+        if not config.RESEND_API_KEY:
+            raise RuntimeError("No se ha configurado RESEND_API_KEY")
+        resend.api_key = config.RESEND_API_KEY
+
+    def enviar(self, params, clave):
+        """Envía un mensaje. Devuelve el ID asignado por el proveedor"""
+        self._configurar()
+        respuesta = resend.Emails.send(params, {"idempotency_key": clave})
+        if not respuesta or not respuesta.get('id'):
+            raise RuntimeError("No se recibió confirmación del servidor de email")
+        return respuesta['id']
+
+    def enviar_lote(self, lista_params, clave):
+        """Envía varios mensajes en una llamada. Devuelve los IDs en el mismo orden"""
+        self._configurar()
+        respuesta = resend.Batch.send(lista_params, {"idempotency_key": clave})
+        datos = (respuesta or {}).get('data') or []
+        if len(datos) != len(lista_params):
+            raise RuntimeError("Respuesta incompleta del servidor de email para el lote")
+        return [d.get('id') for d in datos]
+
+
+class ProveedorMemoria:
+    """Proveedor local: guarda los mensajes en memoria sin enviarlos (desarrollo y pruebas)"""
+
+    def __init__(self):
+        self.enviados = []
+
+    def enviar(self, params, clave):
+        self.enviados.append({'clave': clave, 'params': params})
+        return f"memoria-{len(self.enviados)}"
+
+    def enviar_lote(self, lista_params, clave):
+        return [self.enviar(params, f"{clave}:{i}") for i, params in enumerate(lista_params)]
+
+
+_PROVEEDORES = {
+    'resend': ProveedorResend,
+    'memoria': ProveedorMemoria
+}
+
+_proveedor = None
+
+
+def configurar_proveedor(proveedor):
+    """Sustituye el proveedor de envío (objeto con enviar y, opcionalmente, enviar_lote)"""
+    global _proveedor
+    _proveedor = proveedor
+
+
+def obtener_proveedor():
+    global _proveedor
+    if _proveedor is None:
+        nombre = os.environ.get("EMAIL_PROVEEDOR", "resend").lower()
+        _proveedor = _PROVEEDORES.get(nombre, ProveedorResend)()
+    return _proveedor
+
+
+# ============================================
+# ENCOLAR
+# ============================================
+
+def _direcciones(params):
+    """Direcciones de destino (to, cc y bcc) normalizadas y sin repetir"""
+    valores = []
+    for campo in ('to', 'cc', 'bcc'):
+        valor = params.get(campo) or []
+        valores.extend([valor] if isinstance(valor, str) else valor)
+    # getaddresses separa "a@x.com, b@y.com" y quita los nombres ("Nombre <a@x.com>")
+    return sorted({direccion.strip().lower() for _, direccion in getaddresses(valores) if direccion.strip()})
+
+
+def clave_contenido(prefijo, params):
+    """Clave de idempotencia derivada del contenido (mismo mensaje = misma clave)"""
+    contenido = json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return f"{prefijo}:{hashlib.sha256(contenido).hexdigest()[:32]}"
+
+
+def encolar_email(params, tipo='general', clave=None, registro=None):
+    """
+    Guarda un email en la bandeja de salida y despierta al hilo de envío
+
+    Args:
+        params: Parámetros del email en formato Resend (from, to, subject, html...)
+        tipo: Tipo de mensaje (para logs y resumen)
+        clave: Clave de idempotencia. Si ya existe un mensaje con la misma
+               clave no se encola otro. None = mensaje siempre nuevo
+        registro: (tabla, id) opcional de una tabla de registro de envíos
+                  (ej: notificaciones_cliente) que se actualiza al terminar
+                  con estado, email_enviado y error_envio
+
+    Returns:
+        tuple: (id del mensaje en la bandeja, True si se ha encolado ahora)
+    """
+    clave = clave or uuid.uuid4().hex
+    registro_tabla, registro_id = registro if registro else (None, None)
+    direcciones = _direcciones(params)
+    ahora = time.time()
+
+    with closing(_conectar()) as conexion:
+        # Mensaje y direcciones en la misma transacción: ningún worker reclama
+        # el mensaje sin ver sus direcciones
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conexion.execute(
+                "INSERT OR IGNORE INTO mensajes "
+                "(clave, tipo, destinatario, params, proximo_intento, registro_tabla, registro_id, creado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (clave, tipo, ','.join(direcciones), json.dumps(params, ensure_ascii=False),
+                 ahora, registro_tabla, registro_id, ahora)
+            )
+            nuevo = cursor.rowcount == 1
+            if nuevo:
+                mensaje_id = cursor.lastrowid
+                conexion.executemany(
+                    "INSERT OR IGNORE INTO destinatarios (mensaje_id, direccion) VALUES (?, ?)",
+                    [(mensaje_id, direccion) for direccion in direcciones]
+                )
+            else:
+                mensaje_id = conexion.execute(
+                    "SELECT id FROM mensajes WHERE clave = ?", (clave,)
+                ).fetchone()['id']
+            conexion.execute("COMMIT")
+        except Exception:
+            conexion.execute("ROLLBACK")
+            raise
+
+    if nuevo:
+        iniciar_envio()
+        _despertador.set()
+    return mensaje_id, nuevo
+
+
+# ============================================
+# ENVÍO
+# ============================================
+
+def _reclamar_lote(tamano):
+    """
+    Marca como 'enviando' un lote de mensajes listos, respetando el límite por dirección
+
+    Un mensaje solo se envía si ninguna de sus direcciones ha llegado al
+    límite; si alguna lo ha hecho, se aplaza hasta que se libera su ventana.
+    """
+    ahora = time.time()
+    conexion = _conectar()
+    try:
+        conexion.execute("BEGIN IMMEDIATE")
+        conexion.execute(
+            "UPDATE mensajes SET estado = 'pendiente' WHERE estado = 'enviando' AND reclamado < ?",
+            (ahora - BLOQUEO_CADUCADO,)
+        )
+        candidatos = conexion.execute(
+            "SELECT * FROM mensajes WHERE estado = 'pendiente' AND proximo_intento <= ? "
+            "ORDER BY proximo_intento, id LIMIT ?",
+            (ahora, tamano)
+        ).fetchall()
+
+        uso = {}
+        lote = []
+        for mensaje in candidatos:
+            direcciones = _direcciones(json.loads(mensaje['params']))
+            for direccion in direcciones:
+                if direccion not in uso:
+                    fila = conexion.execute(
+                        "SELECT COUNT(*) AS enviados, MIN(m.enviado) AS primero "
+                        "FROM destinatarios d JOIN mensajes m ON m.id = d.mensaje_id "
+                        "WHERE d.direccion = ? AND m.enviado >= ?",
+                        (direccion, ahora - VENTANA_LIMITE)
+                    ).fetchone()
+                    uso[direccion] = [fila['enviados'], fila['primero'] or ahora]
+
+            bloqueadas = [d for d in direcciones if uso[d][0] >= LIMITE_POR_DESTINATARIO]
+            if bloqueadas:
+                conexion.execute(
+                    "UPDATE mensajes SET proximo_intento = ? WHERE id = ?",
+                    (max(uso[d][1] for d in bloqueadas) + VENTANA_LIMITE, mensaje['id'])
+                )
+                continue
+
+            for direccion in direcciones:
+                uso[direccion][0] += 1
+            lote.append(mensaje)
+
+        if lote:
+            conexion.execute(
+                f"UPDATE mensajes SET estado = 'enviando', reclamado = ? "
+                f"WHERE id IN ({','.join('?' * len(lote))})",
+                (ahora, *[m['id'] for m in lote])
+            )
+        conexion.execute("COMMIT")
+        return lote
+    except Exception:
+        conexion.execute("ROLLBACK")
+        raise
+    finally:
+        conexion.close()
+
+
+def _actualizar_registro(mensaje, enviado, error):
+    """Refleja el resultado final en la tabla de registro asociada (si la hay)"""
+    if not mensaje['registro_tabla'] or mensaje['registro_id'] is None:
+        return
+    try:
+        requests.patch(
+            f"{config.SUPABASE_URL}/rest/v1/{mensaje['registro_tabla']}?id=eq.{mensaje['registro_id']}",
+            json={
+                "estado": "ENVIADO" if enviado else "ERROR",
+                "email_enviado": enviado,
+                "error_envio": error
+            },
+            headers={**config.HEADERS, "Prefer": "return=minimal"},
+            timeout=15
+        )
+    except Exception as e:
+        logger.error(f"Error al actualizar {mensaje['registro_tabla']} {mensaje['registro_id']}: {str(e)}")
+
+
+def _marcar_enviado(mensaje, id_proveedor):
+    with closing(_conectar()) as conexion:
+        conexion.execute(
+            "UPDATE mensajes SET estado = 'enviado', enviado = ?, id_proveedor = ?, "
+            "intentos = intentos + 1, ultimo_error = NULL WHERE id = ?",
+            (time.time(), id_proveedor, mensaje['id'])
+        )
+    metricas.incrementar('emails_procesados_total', tipo=mensaje['tipo'], resultado='enviado')
+    _actualizar_registro(mensaje, True, None)
+
+
+def _marcar_fallo(mensaje, error):
+    """Programa el reintento con espera exponencial o da el mensaje por fallido"""
+    intentos = mensaje['intentos'] + 1
+    definitivo = intentos >= MAX_INTENTOS
+    espera = min(ESPERA_MAX_REINTENTO, ESPERA_BASE_REINTENTO * 2 ** (intentos - 1))
+
+    with closing(_conectar()) as conexion:
+        conexion.execute(
+            "UPDATE mensajes SET estado = ?, intentos = ?, proximo_intento = ?, ultimo_error = ? WHERE id = ?",
+            ('error' if definitivo else 'pendiente', intentos, time.time() + espera, error, mensaje['id'])
+        )
+
+    metricas.incrementar('emails_procesados_total', tipo=mensaje['tipo'],
+                         resultado='fallido' if definitivo else 'reintento')
+    if definitivo:
+        logger.error(f"❌ Email {mensaje['id']} ({mensaje['tipo']}) descartado tras {intentos} intentos: {error}")
+        _actualizar_registro(mensaje, False, error)
+    else:
+        logger.warning(f"Email {mensaje['id']} ({mensaje['tipo']}) falló (intento {intentos}), reintento en {espera}s: {error}")
+
+
+def _enviar_individual(proveedor, mensaje):
+    try:
+        _marcar_enviado(mensaje, proveedor.enviar(json.loads(mensaje['params']), mensaje['clave']))
+    except Exception as e:
+        _marcar_fallo(mensaje, f"{type(e).__name__}: {str(e)}")
+
+
+def _enviar_lote(lote):
+    proveedor = obtener_proveedor()
+
+    if len(lote) == 1 or not hasattr(proveedor, 'enviar_lote'):
+        for mensaje in lote:
+            _enviar_individual(proveedor, mensaje)
+        return
+
+    clave_lote = "lote:" + hashlib.sha256(
+        '|'.join(m['clave'] for m in lote).encode('utf-8')
+    ).hexdigest()[:32]
+    try:
+        ids = proveedor.enviar_lote([json.loads(m['params']) for m in lote], clave_lote)
+    except Exception as e:
+        # El lote se rechaza entero (ej: una dirección inválida): se reintenta
+        # mensaje a mensaje para que el fallo solo afecte al que lo provoca
+        logger.warning(f"Lote de {len(lote)} emails rechazado, se envían por separado: {str(e)}")
+        for mensaje in lote:
+            _enviar_individual(proveedor, mensaje)
+        return
+
+    for mensaje, id_proveedor in zip(lote, ids):
+        _marcar_enviado(mensaje, id_proveedor)
+
+
+def _limpiar_mensajes_antiguos():
+    with closing(_conectar()) as conexion:
+        conexion.execute(
+            "DELETE FROM mensajes WHERE estado IN ('enviado', 'error') AND creado < ?",
+            (time.time() - RETENCION_MENSAJES,)
+        )
+        conexion.execute(
+            "DELETE FROM destinatarios WHERE mensaje_id NOT IN (SELECT id FROM mensajes)"
+        )
+
+
+def procesar_pendientes(tamano_lote=TAMANO_LOTE):
+    """
+    Envía todos los mensajes listos de la bandeja
+
+    Returns:
+        Número de mensajes procesados (enviados o con fallo)
+    """
+    procesados = 0
+    while True:
+        lote = _reclamar_lote(tamano_lote)
+        if not lote:
+            break
+        _enviar_lote(lote)
+        procesados += len(lote)
+    return procesados
+
+
+def resumen():
+    """Número de mensajes por estado"""
+    with closing(_conectar()) as conexion:
+        filas = conexion.execute("SELECT estado, COUNT(*) AS total FROM mensajes GROUP BY estado").fetchall()
+    return {fila['estado']: fila['total'] for fila in filas}
+
+
+def _mensajes_por_estado():
+    # Todos los estados aparecen aunque no haya mensajes (series estables en Prometheus)
+    totales = {'pendiente': 0, 'enviando': 0, 'enviado': 0, 'error': 0}
+    totales.update(resumen())
+    return [({'estado': estado}, total) for estado, total in totales.items()]
+
+
+# La bandeja es compartida: el valor es global, no por worker
+metricas.gauge('emails_en_bandeja', "Mensajes de la bandeja de emails por estado", _mensajes_por_estado)
+
+
+# ============================================
+# HILO DE ENVÍO
+# ============================================
+
+_despertador = threading.Event()
+_lock_hilo = threading.Lock()
+_hilo = None
+_hilo_pid = None
+
+
+def _bucle_envio():
+    ultima_limpieza = 0.0
+    while True:
+        _despertador.clear()
+        try:
+            procesar_pendientes()
+            if time.time() - ultima_limpieza > 3600:
+                _limpiar_mensajes_antiguos()
+                ultima_limpieza = time.time()
+        except Exception as e:
+            logger.error(f"Error en el envío de la bandeja de emails: {type(e).__name__}: {str(e)}")
+        _despertador.wait(INTERVALO_SONDEO)
+
+
+def iniciar_envio():
+    """Arranca el hilo de envío de este proceso (una vez por proceso, también tras fork)"""
+    global _hilo, _hilo_pid
+    with _lock_hilo:
+        if _hilo is not None and _hilo.is_alive() and _hilo_pid == os.getpid():
+            return
+        _hilo = threading.Thread(target=_bucle_envio, name="email-outbox", daemon=True)
+        _hilo_pid = os.getpid()
+        _hilo.start()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(f"Procesados: {procesar_pendientes()}")
+    print(resumen())
@@ -1,10 +1,98 @@
 """
 Servicio para envío de emails con Resend
+
+Los emails se encolan en la bandeja de salida (services/email_outbox.py)
+y se envían en segundo plano.
 """
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import requests
-import resend
 from config import config
+from services import email_outbox
+
+
+# Columnas necesarias para construir los avisos
+SELECT_AVISOS = "identificacion,fecha_vencimiento_contrato,clientes(nombre_cliente,direccion)"
+
+
+def _get_equipos(filtros):
+    """Equipos que cumplen los filtros de una ventana de avisos (lista vacía si hay error)"""
+    response = requests.get(
+        f"{config.SUPABASE_URL}/rest/v1/equipos?select={SELECT_AVISOS}&{filtros}",
+        headers=config.HEADERS,
+        timeout=15
+    )
+    return response.json() if response.status_code == 200 else []
+
+
+def _datos_cliente(equipo):
+    """(nombre, dirección) del cliente embebido en el equipo"""
+    cliente = equipo.get('clientes', {})
+    if isinstance(cliente, list) and cliente:
+        cliente = cliente[0]
+    if not cliente:
+        return 'Sin nombre', 'Sin dirección'
+    return cliente.get('nombre_cliente', 'Sin nombre'), cliente.get('direccion', 'Sin dirección')
+
+
+def obtener_alertas_avisos(primer_aviso_ipo, segundo_aviso_ipo, dias_contrato, fecha_hoy=None):
+    """
+    Obtiene los equipos que generan aviso hoy, filtrando las fechas en el servidor.
+
+    Tres ventanas consultadas en paralelo (índices en ipo_proxima y
+    fecha_vencimiento_contrato, migración 018):
+    - IPO hace exactamente `primer_aviso_ipo` días
+    - IPO hace exactamente `segundo_aviso_ipo` días
+    - Contrato que vence entre hoy y hoy + `dias_contrato`
+
+    Returns:
+        tuple: (alertas primer aviso IPO, alertas segundo aviso IPO, alertas de contrato)
+    """
+    fecha_hoy = fecha_hoy or datetime.now().date()
+    fecha_primer = fecha_hoy - timedelta(days=primer_aviso_ipo)
+    fecha_segundo = fecha_hoy - timedelta(days=segundo_aviso_ipo)
+    fecha_limite_contrato = fecha_hoy + timedelta(days=dias_contrato)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futuro_primer = pool.submit(_get_equipos, f"ipo_proxima=eq.{fecha_primer.isoformat()}")
+        futuro_segundo = pool.submit(_get_equipos, f"ipo_proxima=eq.{fecha_segundo.isoformat()}")
+        futuro_contrato = pool.submit(
+            _get_equipos,
+            f"fecha_vencimiento_contrato=gte.{fecha_hoy.isoformat()}"
+            f"&fecha_vencimiento_contrato=lte.{fecha_limite_contrato.isoformat()}"
+            f"&order=fecha_vencimiento_contrato.asc"
+        )
+
+    def alerta_ipo(equipo, fecha_ipo, dias):
+        nombre, direccion = _datos_cliente(equipo)
+        return {
+            'cliente': nombre,
+            'direccion': direccion,
+            'identificacion': equipo.get('identificacion', 'N/A'),
+            'fecha': fecha_ipo.strftime('%d/%m/%Y'),
+            'dias_desde_ipo': dias
+        }
+
+    alertas_ipo_primer_aviso = [alerta_ipo(e, fecha_primer, primer_aviso_ipo) for e in futuro_primer.result()]
+    alertas_ipo_segundo_aviso = [alerta_ipo(e, fecha_segundo, segundo_aviso_ipo) for e in futuro_segundo.result()]
+
+    alertas_contrato = []
+    for equipo in futuro_contrato.result():
+        try:
+            fecha_contrato = datetime.strptime(equipo.get('fecha_vencimiento_contrato'), '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            continue
+
+        nombre, direccion = _datos_cliente(equipo)
+        alertas_contrato.append({
+            'cliente': nombre,
+            'direccion': direccion,
+            'identificacion': equipo.get('identificacion', 'N/A'),
+            'fecha': fecha_contrato.strftime('%d/%m/%Y'),
+            'dias_restantes': (fecha_contrato - fecha_hoy).days
+        })
+
+    return alertas_ipo_primer_aviso, alertas_ipo_segundo_aviso, alertas_contrato
 
 
 def enviar_avisos_email(aviso_config):
@@ -32,72 +120,11 @@ def enviar_avisos_email(aviso_config):
     segundo_aviso_ipo = aviso_config['segundo_aviso_despues_ipo']
     dias_contrato = aviso_config['dias_aviso_antes_contrato']
 
-    fecha_hoy = datetime.now().date()
-
-    # Obtener equipos con IPO próxima
-    equipos_response = requests.get(
-        f"{config.SUPABASE_URL}/rest/v1/equipos?select=*,clientes(nombre_cliente,direccion)&ipo_proxima=not.is.null",
-        headers=config.HEADERS
+    # Solo se descargan los equipos que generan aviso hoy
+    alertas_ipo_primer_aviso, alertas_ipo_segundo_aviso, alertas_contrato = obtener_alertas_avisos(
+        primer_aviso_ipo, segundo_aviso_ipo, dias_contrato
     )
 
-    alertas_ipo_primer_aviso = []
-    alertas_ipo_segundo_aviso = []
-    alertas_contrato = []
-
-    if equipos_response.status_code == 200:
-        equipos = equipos_response.json()
-
-        for equipo in equipos:
-            # Revisar IPOs - SOLO DESPUÉS de la fecha
-            if equipo.get('ipo_proxima'):
-                try:
-                    fecha_ipo = datetime.strptime(equipo['ipo_proxima'], '%Y-%m-%d').date()
-                    dias_desde_ipo = (fecha_hoy - fecha_ipo).days
-
-                    cliente = equipo.get('clientes', {})
-                    if isinstance(cliente, list) and cliente:
-                        cliente = cliente[0]
-
-                    equipo_data = {
-                        'cliente': cliente.get('nombre_cliente', 'Sin nombre') if cliente else 'Sin nombre',
-                        'direccion': cliente.get('direccion', 'Sin dirección') if cliente else 'Sin dirección',
-                        'identificacion': equipo.get('identificacion', 'N/A'),
-                        'fecha': fecha_ipo.strftime('%d/%m/%Y'),
-                        'dias_desde_ipo': dias_desde_ipo
-                    }
-
-                    # Primer aviso (ej: día 15)
-                    if dias_desde_ipo == primer_aviso_ipo:
-                        alertas_ipo_primer_aviso.append(equipo_data)
-
-                    # Segundo aviso (ej: día 30)
-                    if dias_desde_ipo == segundo_aviso_ipo:
-                        alertas_ipo_segundo_aviso.append(equipo_data)
-
-                except:
-                    pass
-
-            # Revisar contratos - X días ANTES del vencimiento
-            if equipo.get('fecha_vencimiento_contrato'):
-                try:
-                    fecha_contrato = datetime.strptime(equipo['fecha_vencimiento_contrato'], '%Y-%m-%d').date()
-                    dias_restantes = (fecha_contrato - fecha_hoy).days
-
-                    if 0 <= dias_restantes <= dias_contrato:
-                        cliente = equipo.get('clientes', {})
-                        if isinstance(cliente, list) and cliente:
-                            cliente = cliente[0]
-
-                        alertas_contrato.append({
-                            'cliente': cliente.get('nombre_cliente', 'Sin nombre') if cliente else 'Sin nombre',
-                            'direccion': cliente.get('direccion', 'Sin dirección') if cliente else 'Sin dirección',
-                            'identificacion': equipo.get('identificacion', 'N/A'),
-                            'fecha': fecha_contrato.strftime('%d/%m/%Y'),
-                            'dias_restantes': dias_restantes
-                        })
-                except:
-                    pass
-
     # Si no hay alertas, no enviar email
     if not alertas_ipo_primer_aviso and not alertas_ipo_segundo_aviso and not alertas_contrato:
         return "No hay avisos pendientes"
@@ -211,19 +238,23 @@ def enviar_avisos_email(aviso_config):
 
     total_ipos = len(alertas_ipo_primer_aviso) + len(alertas_ipo_segundo_aviso)
 
-    # Enviar email con Resend
-    try:
-        # Configurar API key
-        resend.api_key = config.RESEND_API_KEY
-
-        params = {
-            "from": config.EMAIL_FROM,
-            "to": emails_destino,
-            "subject": f"🔔 Avisos AscensorAlert - {total_ipos} IPOs y {len(alertas_contrato)} Contratos",
-            "html": html_content
-        }
+    params = {
+        "from": config.EMAIL_FROM,
+        "to": emails_destino,
+        "subject": f"🔔 Avisos AscensorAlert - {total_ipos} IPOs y {len(alertas_contrato)} Contratos",
+        "html": html_content
+    }
 
-        email = resend.Emails.send(params)
-        return f"Email enviado correctamente a {len(emails_destino)} destinatario(s): {total_ipos} IPOs, {len(alertas_contrato)} contratos"
+    # Encolar email: el mismo resumen no se envía dos veces el mismo día
+    try:
+        _, nuevo = email_outbox.encolar_email(
+            params,
+            tipo='avisos_ipo',
+            clave=email_outbox.clave_contenido(f"avisos_ipo:{datetime.now().date().isoformat()}", params)
+        )
     except Exception as e:
-        return f"Error al enviar email: {str(e)}"
+        return f"Error al encolar email: {str(e)}"
+
+    if not nuevo:
+        return "Los avisos de hoy ya se habían enviado a estos destinatarios"
+    return f"Email en cola para {len(emails_destino)} destinatario(s): {total_ipos} IPOs, {len(alertas_contrato)} contratos"
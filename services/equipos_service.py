@@ -0,0 +1,245 @@
+"""
+Servicio de Equipos - importación masiva desde Excel
+
+Alta y actualización de equipos a partir del Excel que genera
+`python gestionar_ascensores.py exportar`:
+- Filas con id_equipo: actualización del equipo existente
+- Filas sin id_equipo: equipo nuevo
+
+Se procesa por lotes: una consulta de comunidades y otra de equipos
+existentes por lote, las altas en un POST multi-fila (insert_many) y las
+actualizaciones en upserts por id agrupados por columnas (solo se escriben
+las columnas de la fila, como en un PATCH).
+
+Se ejecuta como trabajo en segundo plano desde /equipos/importar (con un
+`progreso` de services/importacion_jobs.ProgresoTrabajo) y desde la CLI
+`python gestionar_ascensores.py importar <archivo.xlsx>`.
+"""
+from datetime import datetime
+import logging
+
+import pandas as pd
+
+from services.supabase_client import db
+
+logger = logging.getLogger(__name__)
+
+# Filas por lote: una sola consulta de comunidades y de equipos por lote
+TAMANO_LOTE_IMPORTACION = 200
+
+# Timeout (segundos) de cada petición de escritura
+TIMEOUT_ESCRITURA = 30
+
+COLUMNAS_REQUERIDAS = ['id_comunidad', 'tipo_equipo']
+
+
+def validar_fecha(fecha_str):
+    """Convierte fecha a formato correcto o devuelve None"""
+    if pd.isna(fecha_str) or fecha_str == "" or fecha_str == "-":
+        return None
+
+    if isinstance(fecha_str, datetime):
+        return fecha_str.strftime('%Y-%m-%d')
+
+    fecha_str = str(fecha_str).strip()
+    for formato in ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y']:
+        try:
+            return datetime.strptime(fecha_str, formato).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def leer_excel_equipos(archivo_excel):
+    """
+    Lee y valida el Excel de equipos
+
+    Raises:
+        ValueError: si faltan columnas requeridas
+    """
+    df = pd.read_excel(archivo_excel)
+
+    columnas_faltantes = [col for col in COLUMNAS_REQUERIDAS if col not in df.columns]
+    if columnas_faltantes:
+        raise ValueError(f"Faltan columnas requeridas: {', '.join(columnas_faltantes)}")
+
+    return df
+
+
+def _texto_opcional(row, columna):
+    valor = row.get(columna)
+    if pd.isna(valor):
+        return None
+    return str(valor).strip()
+
+
+def _preparar_fila_equipo(row, fila_num):
+    """
+    Valida una fila del Excel y construye los datos del equipo
+
+    Returns:
+        tuple: (cliente_id, id_equipo o None, datos del equipo) o (None, None, mensaje de error)
+    """
+    # Determinar si es actualización o inserción
+    id_equipo = row.get('id_equipo')
+    es_actualizacion = not pd.isna(id_equipo) and str(id_equipo).strip() != ''
+
+    cliente_id = row.get('id_comunidad')
+    if pd.isna(cliente_id):
+        return None, None, f"Fila {fila_num}: ID de comunidad vacío"
+    try:
+        cliente_id = int(cliente_id)
+    except (ValueError, TypeError):
+        return None, None, f"Fila {fila_num}: ID de comunidad inválido ({cliente_id})"
+
+    tipo_equipo = row.get('tipo_equipo')
+    if pd.isna(tipo_equipo) or str(tipo_equipo).strip() == "":
+        return None, None, f"Fila {fila_num}: Tipo de equipo vacío"
+
+    if es_actualizacion:
+        try:
+            id_equipo = int(id_equipo)
+        except (ValueError, TypeError):
+            return None, None, f"Fila {fila_num}: ID de equipo inválido ({id_equipo})"
+    else:
+        id_equipo = None
+
+    equipo_data = {
+        "cliente_id": cliente_id,
+        "tipo_equipo": str(tipo_equipo).strip(),
+        "identificacion": _texto_opcional(row, 'identificacion'),
+        "rae": _texto_opcional(row, 'rae'),
+        "descripcion": _texto_opcional(row, 'observaciones'),
+        # Las fechas se envían siempre (None borra la fecha)
+        "ipo_proxima": validar_fecha(row.get('ipo_proxima')),
+        "fecha_vencimiento_contrato": validar_fecha(row.get('fecha_vencimiento_contrato'))
+    }
+
+    # Textos vacíos ('' o 'nan') no se envían; las celdas vacías (None) sí
+    equipo_data = {k: v for k, v in equipo_data.items() if v not in ('', 'nan')}
+
+    return cliente_id, id_equipo, equipo_data
+
+
+def _obtener_por_ids(tabla, ids, select):
+    """
+    Registros de una tabla cuyos ids están en el lote (una sola consulta)
+
+    Raises:
+        RuntimeError: si la consulta falla
+    """
+    if not ids:
+        return []
+    filas = db.get(tabla, select=select, filters={'id': f"in.({','.join(str(i) for i in sorted(ids))})"},
+                   timeout=TIMEOUT_ESCRITURA)
+    if filas is None:
+        raise RuntimeError(f"No se pudo consultar {tabla}")
+    return filas
+
+
+def _actualizar_equipos(actualizaciones):
+    """
+    Actualiza equipos existentes con upserts por id
+
+    Las filas se agrupan por columnas: cada upsert escribe solo las columnas
+    presentes, como el PATCH por fila al que sustituye.
+
+    Returns:
+        list: (fila_num, error) de las filas no actualizadas
+    """
+    grupos = {}
+    for fila_num, equipo in actualizaciones:
+        grupos.setdefault(tuple(sorted(equipo)), []).append((fila_num, equipo))
+
+    errores = []
+    for grupo in grupos.values():
+        filas = [equipo for _, equipo in grupo]
+        _, errores_lote = db.upsert('equipos', filas, on_conflict='id', returning=False,
+                                    batch_size=TAMANO_LOTE_IMPORTACION, timeout=TIMEOUT_ESCRITURA)
+        for inicio, error in errores_lote:
+            for fila_num, _ in grupo[inicio:inicio + TAMANO_LOTE_IMPORTACION]:
+                errores.append((fila_num, error))
+    return errores
+
+
+def procesar_equipos(df, progreso=None, tamano_lote=TAMANO_LOTE_IMPORTACION):
+    """
+    Inserta/actualiza en Supabase los equipos de un DataFrame, por lotes
+
+    Args:
+        df: DataFrame leído con leer_excel_equipos
+        progreso: ProgresoTrabajo opcional (ver services/importacion_jobs.py)
+        tamano_lote: Filas por lote
+
+    Returns:
+        dict: insertados, actualizados, errores, errores_detalle
+    """
+    stats = {'insertados': 0, 'actualizados': 0, 'errores': 0, 'errores_detalle': []}
+
+    def registrar_error(fila_num, mensaje):
+        stats['errores'] += 1
+        stats['errores_detalle'].append(mensaje)
+        if progreso:
+            progreso.error_fila(fila_num, mensaje)
+
+    if progreso:
+        progreso.total(len(df))
+
+    for inicio in range(0, len(df), tamano_lote):
+        lote = df.iloc[inicio:inicio + tamano_lote]
+
+        # Validar filas del lote
+        filas_validas = []
+        for idx, row in lote.iterrows():
+            fila_num = idx + 2  # +2 porque Excel empieza en 1 y tiene encabezado
+            cliente_id, id_equipo, resultado = _preparar_fila_equipo(row, fila_num)
+            if cliente_id is None:
+                registrar_error(fila_num, resultado)
+            else:
+                filas_validas.append((fila_num, cliente_id, id_equipo, resultado))
+
+        # Comunidades y equipos existentes del lote (una consulta de cada)
+        try:
+            comunidades = {c['id'] for c in _obtener_por_ids('clientes', {f[1] for f in filas_validas}, 'id')}
+            existentes = {e['id'] for e in _obtener_por_ids(
+                'equipos', {f[2] for f in filas_validas if f[2] is not None}, 'id')}
+        except Exception as e:
+            for fila_num, *_ in filas_validas:
+                registrar_error(fila_num, f"Fila {fila_num}: Excepción - {str(e)}")
+            filas_validas = []
+
+        nuevos = []
+        actualizaciones = []
+        for fila_num, cliente_id, id_equipo, equipo_data in filas_validas:
+            if cliente_id not in comunidades:
+                registrar_error(fila_num, f"Fila {fila_num}: Comunidad ID {cliente_id} no existe")
+            elif id_equipo is None:
+                nuevos.append((fila_num, equipo_data))
+            elif id_equipo not in existentes:
+                # El upsert lo crearía con ese id: se rechaza como hacía el PATCH
+                registrar_error(fila_num, f"Fila {fila_num}: Equipo ID {id_equipo} no existe")
+            else:
+                actualizaciones.append((fila_num, {'id': id_equipo, **equipo_data}))
+
+        if nuevos:
+            _, errores_insert = db.insert_many('equipos', [equipo for _, equipo in nuevos], returning=False,
+                                               batch_size=tamano_lote, timeout=TIMEOUT_ESCRITURA)
+            for indice, error in errores_insert:
+                fila_num = nuevos[indice][0]
+                registrar_error(fila_num, f"Fila {fila_num}: Error API INSERT - {error[:100]}")
+            stats['insertados'] += len(nuevos) - len(errores_insert)
+
+        if actualizaciones:
+            errores_update = _actualizar_equipos(actualizaciones)
+            for fila_num, error in errores_update:
+                registrar_error(fila_num, f"Fila {fila_num}: Error API UPDATE - {error[:100]}")
+            stats['actualizados'] += len(actualizaciones) - len(errores_update)
+
+        logger.info(f"Importación de equipos: {min(inicio + tamano_lote, len(df))}/{len(df)} filas "
+                    f"({stats['insertados']} nuevos, {stats['actualizados']} actualizados, "
+                    f"{stats['errores']} errores)")
+
+        if progreso:
+            progreso.avanzar(len(lote))
+
+    return stats
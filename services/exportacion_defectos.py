@@ -0,0 +1,238 @@
+"""
+Exportación a PDF de defectos pendientes
+
+- Caché en disco por filtros + versión de los datos (fn_version_defectos_pendientes,
+  migración 020) + fecha: descargas repetidas del mismo informe en el mismo
+  día no regeneran el PDF (los días restantes y la fecha del informe
+  cambian cada día)
+- Estilos de párrafo y de tabla creados una sola vez por proceso, en la
+  primera exportación: reportlab no se importa al arrancar la aplicación
+- El PDF se escribe directamente a fichero (escritura atómica) y se sirve
+  desde disco con send_file, sin copias en memoria
+- Los informes grandes se generan como trabajo en segundo plano
+  (services/importacion_jobs.py)
+
+La caché está en disco para que la compartan todos los workers de gunicorn.
+"""
+from datetime import date
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from xml.sax.saxutils import escape
+
+from services import defectos_service
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+DIRECTORIO_PDFS = os.environ.get(
+    "PDF_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "ascensoralert_pdfs")
+)
+
+# Defectos a partir de los cuales el PDF se genera en segundo plano
+UMBRAL_SEGUNDO_PLANO = 1500
+
+# Antigüedad a partir de la cual se eliminan PDFs de la caché
+RETENCION_PDFS = 24 * 3600
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'logo-fedes-ascensores.png')
+
+# ============================================
+# ESTILOS (creados una sola vez, en la primera exportación)
+# ============================================
+
+CABECERA_TABLA = ['Defecto', 'Calif.', 'Plazo', 'Límite', 'Días', 'Dirección', 'Población']
+
+_estilos_pdf = {}
+
+
+def _obtener_estilos():
+    """Estilos de reportlab (se importa aquí para no cargarlo en el arranque)"""
+    if not _estilos_pdf:
+        from reportlab.lib import colors
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.lib.units import cm
+        from reportlab.platypus import TableStyle
+
+        estilos = getSampleStyleSheet()
+        _estilos_pdf.update({
+            'titulo': estilos['Title'],
+            'maquina': estilos['Heading2'],
+            'celda': estilos['Normal'],
+            'anchos_columnas': [7*cm, 1.5*cm, 1.5*cm, 2*cm, 1.5*cm, 5*cm, 3*cm],
+            'tabla': TableStyle([
+                ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#003366')),
+                ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+                ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+                ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+                ('FONTSIZE', (0,0), (-1,0), 10),
+                ('BOTTOMPADDING', (0,0), (-1,0), 12),
+                ('BACKGROUND', (0,1), (-1,-1), colors.beige),
+                ('GRID', (0,0), (-1,-1), 1, colors.black),
+                ('VALIGN', (0,0), (-1,-1), 'TOP'),
+            ]),
+        })
+    return _estilos_pdf
+
+_lock_limpieza = threading.Lock()
+
+
+# ============================================
+# CACHÉ
+# ============================================
+
+def clave_exportacion(filtros, version, fecha):
+    """Clave de caché para unos filtros, una versión de los datos y una fecha (ISO)"""
+    contenido = json.dumps({'filtros': filtros, 'version': version, 'fecha': fecha}, sort_keys=True)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()[:32]
+
+
+def ruta_pdf(clave):
+    """
+    Ruta del PDF en caché (None si la clave no es válida)
+
+    La clave se usa como nombre de fichero: solo se aceptan claves hex.
+    """
+    if not clave or len(clave) != 32 or not all(c in '0123456789abcdef' for c in clave):
+        return None
+    return os.path.join(DIRECTORIO_PDFS, f"defectos_{clave}.pdf")
+
+
+def pdf_en_cache(clave):
+    """Ruta del PDF si ya está generado, o None"""
+    ruta = ruta_pdf(clave)
+    return ruta if ruta and os.path.exists(ruta) else None
+
+
+def _limpiar_pdfs_antiguos():
+    if not os.path.isdir(DIRECTORIO_PDFS) or not _lock_limpieza.acquire(blocking=False):
+        return
+    try:
+        limite = time.time() - RETENCION_PDFS
+        for nombre in os.listdir(DIRECTORIO_PDFS):
+            ruta = os.path.join(DIRECTORIO_PDFS, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+            except OSError:
+                pass
+    finally:
+        _lock_limpieza.release()
+
+
+# ============================================
+# GENERACIÓN
+# ============================================
+
+def _texto(valor):
+    return escape(str(valor)) if valor else ''
+
+
+def _filas_tabla(defectos, estilo_celda):
+    from reportlab.platypus import Paragraph
+
+    filas = [CABECERA_TABLA]
+    for defecto in defectos:
+        filas.append([
+            Paragraph(_texto(defecto.get('descripcion')), estilo_celda),
+            defecto.get('calificacion') or '',
+            f"{defecto.get('plazo_meses', '')}m",
+            defecto.get('fecha_limite', '')[:10] if defecto.get('fecha_limite') else '',
+            str(defecto.get('dias_restantes', '')),
+            Paragraph(_texto(defecto.get('direccion')), estilo_celda),
+            defecto.get('poblacion') or ''
+        ])
+    return filas
+
+
+def generar_pdf_defectos(filtros, clave, progreso=None):
+    """
+    Genera el PDF de defectos pendientes agrupado por máquina y lo guarda en caché
+
+    Args:
+        filtros: Filtros de defectos_service.leer_filtros
+        clave: Clave de caché (clave_exportacion)
+        progreso: ProgresoTrabajo opcional (trabajo en segundo plano)
+
+    Returns:
+        Ruta del PDF generado
+    """
+    _limpiar_pdfs_antiguos()
+    os.makedirs(DIRECTORIO_PDFS, exist_ok=True)
+
+    # Agrupar defectos por máquina (en orden de fecha límite)
+    defectos_por_maquina = {}
+    for lote in defectos_service.iterar_defectos_pendientes(filtros):
+        for defecto in lote:
+            defectos_por_maquina.setdefault(defecto.get('maquina') or 'Sin especificar', []).append(defecto)
+        if progreso:
+            progreso.avanzar(len(lote))
+
+    if progreso:
+        progreso.fase('Generando PDF')
+
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.units import cm
+    from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer, Image
+
+    estilos = _obtener_estilos()
+    elementos = []
+
+    if os.path.exists(LOGO_PATH):
+        elementos.append(Image(LOGO_PATH, width=4*cm, height=1.6*cm))
+        elementos.append(Spacer(1, 0.3*cm))
+
+    elementos.append(Paragraph("<b>LISTADO DE DEFECTOS PENDIENTES</b>", estilos['titulo']))
+    # Solo la fecha: el PDF se reutiliza durante todo el día (clave_exportacion)
+    fecha_hoy = date.today().strftime('%d/%m/%Y')
+    elementos.append(Paragraph(f"<i>Generado el: {fecha_hoy}</i>", estilos['celda']))
+    elementos.append(Spacer(1, 0.5*cm))
+
+    for maquina, defectos in defectos_por_maquina.items():
+        elementos.append(Paragraph(f"<b>MÁQUINA: {_texto(maquina)}</b>", estilos['maquina']))
+        elementos.append(Spacer(1, 0.2*cm))
+
+        tabla = Table(_filas_tabla(defectos, estilos['celda']), colWidths=estilos['anchos_columnas'], repeatRows=1)
+        tabla.setStyle(estilos['tabla'])
+        elementos.append(tabla)
+        elementos.append(Spacer(1, 0.5*cm))
+
+    # Escribir directamente al fichero final (temporal + rename)
+    ruta = ruta_pdf(clave)
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    doc = SimpleDocTemplate(
+        tmp,
+        pagesize=landscape(A4),
+        rightMargin=1*cm,
+        leftMargin=1*cm,
+        topMargin=1*cm,
+        bottomMargin=1*cm
+    )
+    try:
+        doc.build(elementos)
+        os.replace(tmp, ruta)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return ruta
+
+
+def preparar_exportacion(filtros):
+    """
+    Calcula la clave de caché y el tamaño del informe
+
+    Returns:
+        tuple: (clave, total de defectos). Si no se puede obtener la versión de
+               los datos, la clave es única (no se reutiliza) y el total None
+    """
+    version = defectos_service.obtener_version_pendientes(filtros)
+    hoy = date.today().isoformat()
+    if not version or not version.get('version'):
+        return clave_exportacion(filtros, f"sin-version-{time.time_ns()}", hoy), None
+    return clave_exportacion(filtros, version['version'], hoy), version.get('total')
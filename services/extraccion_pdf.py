@@ -0,0 +1,375 @@
+"""
+Extracción de descripciones de defectos de PDFs de presupuesto (FEDES)
+
+- Caché en disco por hash del contenido del PDF: volver a extraer el mismo
+  acta o presupuesto (o subirlo de nuevo) no vuelve a parsearlo
+- Expresiones regulares y listas de filtros compiladas una sola vez
+- Las páginas se reparten en un pool de procesos (pdfplumber es CPU-bound y
+  en hilos no escala por el GIL); PDFs cortos se procesan en el propio proceso
+- Tiempo por página disponible en el detalle de la extracción
+- pdfplumber se importa en la primera extracción, no al arrancar la aplicación
+
+La caché está en disco para que la compartan todos los workers de gunicorn.
+Las funciones que se ejecutan en el pool no escriben logs (el proceso hijo
+nace con fork y no debe tocar locks heredados).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+DIRECTORIO_EXTRACCIONES = os.environ.get(
+    "PDF_EXTRACCION_DIR",
+    os.path.join(tempfile.gettempdir(), "ascensoralert_extracciones")
+)
+
+# Cambiar al modificar las reglas de extracción (invalida la caché)
+VERSION_EXTRACTOR = 1
+
+# Procesos del pool de extracción
+MAX_PROCESOS = max(1, min(4, (os.cpu_count() or 1)))
+
+# PDFs con hasta estas páginas se procesan sin pool (no compensa el arranque)
+UMBRAL_PAGINAS_PARALELO = 3
+
+# Antigüedad a partir de la cual se eliminan extracciones de la caché
+RETENCION_EXTRACCIONES = 7 * 24 * 3600
+
+CONFIG_TABLAS = {
+    "vertical_strategy": "lines",
+    "horizontal_strategy": "lines",
+    "snap_tolerance": 3,
+}
+
+# Primer número (con o sin decimales): "1,00", "100", "1.300,00"
+RE_PRIMER_NUMERO = re.compile(r'\s+\d+[,\.]?\d*')
+# Números sueltos al final de la descripción
+RE_NUMEROS_FINALES = re.compile(r'\s+[\d\.,\s]+$')
+
+HEADERS_TABLA = ('Descripción', 'PRESUPUESTO', 'Cód.', 'Cant.', 'Precio', 'Total', '% Igic', 'INSTALACIÓN')
+HEADERS_TEXTO = ('Descripción', 'Cód.', 'Cant.', 'Precio', 'Total', 'INSTALACIÓN')
+PREFIJOS_DIRECCION_TABLA = ('C/', 'Calle', 'Avenida', 'Avda', 'c/', 'calle', 'C /')
+PREFIJOS_DIRECCION_TEXTO = ('C/', 'Calle', 'Avda')
+PALABRAS_INVALIDAS = ('NIF', 'CIF', 'Tel.', 'Tel', 'Email', '@', 'www', 'http',
+                      'GRAN CANARIA', 'LAS PALMAS', 'Municipio', 'Serie')
+
+_pool = None
+_pool_pid = None
+_lock_pool = threading.Lock()
+
+
+# ============================================
+# LIMPIEZA Y VALIDACIÓN
+# ============================================
+
+def _limpiar_descripcion(descripcion):
+    """Corta la descripción en el primer número (cantidades, precios)"""
+    match = RE_PRIMER_NUMERO.search(descripcion)
+    if match:
+        descripcion = descripcion[:match.start()].strip()
+    return RE_NUMEROS_FINALES.sub('', descripcion).strip()
+
+
+def _valida_tabla(descripcion):
+    """Validaciones de una descripción extraída de una tabla"""
+    if len(descripcion) < 10:
+        return False
+    if any(x in descripcion for x in HEADERS_TABLA):
+        return False
+    if descripcion.startswith(PREFIJOS_DIRECCION_TABLA):
+        return False
+
+    # Líneas cortas que son mayormente números (totales, impuestos: "7% 339,50 5.189,47")
+    palabras = descripcion.split()
+    if len(palabras) <= 4:
+        numeros = sum(1 for p in palabras if any(c.isdigit() for c in p) or '%' in p)
+        if numeros >= len(palabras) * 0.6:
+            return False
+
+    if not any(c.isalpha() for c in descripcion):
+        return False
+    if any(palabra in descripcion for palabra in PALABRAS_INVALIDAS):
+        return False
+    if len(palabras) < 3:
+        return False
+    # MAYÚSCULAS cortas: probablemente headers/títulos
+    if descripcion.isupper() and len(descripcion) < 30:
+        return False
+    return True
+
+
+def _valida_texto(descripcion):
+    """Validaciones de una descripción extraída del texto de la página"""
+    return (
+        len(descripcion) >= 10
+        and not any(x in descripcion for x in HEADERS_TEXTO)
+        and not descripcion.startswith(PREFIJOS_DIRECCION_TEXTO)
+        and any(c.isalpha() for c in descripcion)
+        and len(descripcion.split()) >= 3
+    )
+
+
+# ============================================
+# EXTRACCIÓN POR PÁGINA
+# ============================================
+
+def _columnas_tabla(table):
+    """Índices de las columnas Código y Descripción y fila donde empiezan los datos"""
+    for i, row in enumerate(table):
+        if not row:
+            continue
+        codigo_idx = descripcion_idx = None
+        for j, cell in enumerate(row):
+            cell_str = str(cell).strip().lower() if cell else ""
+            if 'cód' in cell_str or 'codigo' in cell_str:
+                codigo_idx = j
+            if 'descripción' in cell_str or 'descripcion' in cell_str:
+                descripcion_idx = j
+        if codigo_idx is not None and descripcion_idx is not None:
+            return codigo_idx, descripcion_idx, i + 1
+
+    # Sin header: primeras 2 columnas, saltando la primera fila
+    return 0, 1, 1
+
+
+def _descripciones_tabla(table):
+    codigo_idx, descripcion_idx, data_start = _columnas_tabla(table)
+    descripciones = []
+
+    for row in table[data_start:]:
+        if not row or len(row) <= max(codigo_idx, descripcion_idx):
+            continue
+
+        codigo = str(row[codigo_idx]).strip() if row[codigo_idx] else ""
+        descripcion_raw = str(row[descripcion_idx]).strip() if row[descripcion_idx] else ""
+
+        # Eliminar líneas "ORDEN:" pero mantener el resto
+        lineas = (linea.strip() for linea in descripcion_raw.split('\n'))
+        descripcion = _limpiar_descripcion(' '.join(l for l in lineas if l and not l.startswith('ORDEN:')))
+
+        if _valida_tabla(descripcion):
+            descripciones.append({'codigo': codigo, 'descripcion': descripcion})
+
+    return descripciones
+
+
+def _descripciones_texto(text):
+    descripciones = []
+
+    for line in text.split('\n'):
+        line = line.strip()
+        if len(line) < 10:
+            continue
+
+        # Líneas que empiezan con código numérico de 8-11 dígitos
+        parts = line.split(None, 1)
+        if len(parts) < 2 or not (parts[0].isdigit() and 8 <= len(parts[0]) <= 11):
+            continue
+
+        descripcion = _limpiar_descripcion(parts[1])
+        if _valida_texto(descripcion):
+            descripciones.append({'codigo': parts[0], 'descripcion': descripcion})
+
+    return descripciones
+
+
+def _extraer_pagina(page):
+    tables = page.extract_tables(table_settings=CONFIG_TABLAS)
+    if tables:
+        return [d for table in tables for d in _descripciones_tabla(table)]
+
+    # Sin tablas: extracción de texto
+    text = page.extract_text()
+    return _descripciones_texto(text) if text else []
+
+
+def _procesar_paginas(pdf_content, numeros_pagina):
+    """
+    Extrae las descripciones de un rango de páginas (se ejecuta en el pool)
+
+    Returns:
+        Lista de (número de página, descripciones, segundos)
+    """
+    import pdfplumber
+
+    resultados = []
+    with pdfplumber.open(io.BytesIO(pdf_content)) as pdf:
+        for num in numeros_pagina:
+            inicio = time.perf_counter()
+            page = pdf.pages[num]
+            descripciones = _extraer_pagina(page)
+            page.flush_cache()
+            resultados.append((num, descripciones, time.perf_counter() - inicio))
+    return resultados
+
+
+# ============================================
+# POOL DE PROCESOS
+# ============================================
+
+def _obtener_pool():
+    """Pool de procesos del worker actual (se recrea tras un fork de gunicorn)"""
+    global _pool, _pool_pid
+    with _lock_pool:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=MAX_PROCESOS)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _descartar_pool():
+    global _pool
+    with _lock_pool:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _procesar_en_paralelo(pdf_content, total_paginas):
+    # Páginas intercaladas: cada proceso recibe un reparto equilibrado
+    procesos = min(MAX_PROCESOS, total_paginas)
+    repartos = [list(range(i, total_paginas, procesos)) for i in range(procesos)]
+
+    try:
+        pool = _obtener_pool()
+        futuros = [pool.submit(_procesar_paginas, pdf_content, reparto) for reparto in repartos]
+        return [r for futuro in futuros for r in futuro.result()]
+    except BrokenProcessPool:
+        logger.warning("⚠️ Pool de extracción de PDF roto, procesando en el propio proceso")
+        _descartar_pool()
+        return _procesar_paginas(pdf_content, range(total_paginas))
+
+
+# ============================================
+# CACHÉ
+# ============================================
+
+def hash_pdf(pdf_content):
+    """Hash del contenido del PDF (clave de caché)"""
+    return hashlib.sha256(pdf_content).hexdigest()
+
+
+def _ruta_cache(clave):
+    return os.path.join(DIRECTORIO_EXTRACCIONES, f"v{VERSION_EXTRACTOR}_{clave}.json")
+
+
+def _leer_cache(clave):
+    try:
+        with open(_ruta_cache(clave), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _guardar_cache(clave, detalle):
+    """Escribe la extracción de forma atómica (fichero temporal + rename)"""
+    os.makedirs(DIRECTORIO_EXTRACCIONES, exist_ok=True)
+    ruta = _ruta_cache(clave)
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(detalle, f, ensure_ascii=False)
+    os.replace(tmp, ruta)
+
+
+def _limpiar_cache_antigua():
+    if not os.path.isdir(DIRECTORIO_EXTRACCIONES):
+        return
+    limite = time.time() - RETENCION_EXTRACCIONES
+    for nombre in os.listdir(DIRECTORIO_EXTRACCIONES):
+        ruta = os.path.join(DIRECTORIO_EXTRACCIONES, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError:
+            pass
+
+
+# ============================================
+# API
+# ============================================
+
+def extraer_descripciones_detalle(pdf_content):
+    """
+    Extrae las descripciones de la tabla del PDF de presupuesto, con caché
+
+    Returns:
+        dict con:
+            descripciones: lista de {codigo, descripcion}
+            paginas: lista de {pagina, descripciones, segundos} (tiempo por página)
+            segundos: tiempo total de la extracción original
+            hash: hash del contenido del PDF
+            cache: True si el resultado viene de la caché
+    """
+    clave = hash_pdf(pdf_content)
+
+    detalle = _leer_cache(clave)
+    if detalle is not None:
+        logger.info(f"📄 Extracción de PDF {clave[:12]} servida desde caché ({len(detalle['descripciones'])} descripciones)")
+        return {**detalle, 'cache': True}
+
+    import pdfplumber
+
+    inicio = time.perf_counter()
+    with pdfplumber.open(io.BytesIO(pdf_content)) as pdf:
+        total_paginas = len(pdf.pages)
+
+    if total_paginas <= UMBRAL_PAGINAS_PARALELO:
+        resultados = _procesar_paginas(pdf_content, range(total_paginas))
+    else:
+        resultados = _procesar_en_paralelo(pdf_content, total_paginas)
+
+    resultados.sort(key=lambda r: r[0])
+    detalle = {
+        'hash': clave,
+        'descripciones': [d for _, descripciones, _ in resultados for d in descripciones],
+        'paginas': [
+            {'pagina': num + 1, 'descripciones': len(descripciones), 'segundos': round(segundos, 3)}
+            for num, descripciones, segundos in resultados
+        ],
+        'segundos': round(time.perf_counter() - inicio, 3)
+    }
+
+    for pagina in detalle['paginas']:
+        logger.debug(f"   Página {pagina['pagina']}: {pagina['descripciones']} descripciones en {pagina['segundos']}s")
+    logger.info(
+        f"📄 PDF {clave[:12]} extraído: {len(detalle['descripciones'])} descripciones, "
+        f"{total_paginas} páginas en {detalle['segundos']}s"
+    )
+
+    _limpiar_cache_antigua()
+    _guardar_cache(clave, detalle)
+    return {**detalle, 'cache': False}
+
+
+def obtener_descripciones_extraidas(clave):
+    """
+    Descripciones de una extracción ya hecha (por hash del PDF)
+
+    Returns:
+        Lista de {codigo, descripcion} o None si no está en caché
+    """
+    if not clave or not all(c in '0123456789abcdef' for c in clave):
+        return None
+    detalle = _leer_cache(clave)
+    return detalle['descripciones'] if detalle is not None else None
+
+
+def extraer_descripciones_pdf(pdf_content):
+    """
+    Extrae las descripciones de la tabla del PDF de presupuesto FEDES.
+    Retorna una lista de diccionarios con: codigo, descripcion
+    """
+    return extraer_descripciones_detalle(pdf_content)['descripciones']
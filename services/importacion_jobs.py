@@ -0,0 +1,280 @@
+"""
+Trabajos de importación en segundo plano
+
+La subida se guarda en un fichero temporal y se devuelve un ID de trabajo
+inmediatamente. Un pool pequeño de hilos procesa el fichero por lotes y
+publica progreso, errores por fila y estadísticas finales.
+
+El estado de cada trabajo se persiste como JSON en disco (escritura atómica)
+para que cualquier worker de gunicorn pueda responder al endpoint de estado,
+no solo el que recibió la subida.
+
+También se usa para procesos largos de cartera sin fichero
+(re-análisis de recomendaciones).
+
+Trabajos terminados, su duración y la cola de cada worker se publican en
+/metrics (trabajos_total, trabajo_segundos, trabajos_en_cola).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from middleware.metricas import registro as metricas
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+DIRECTORIO_TRABAJOS = os.environ.get(
+    "IMPORT_JOBS_DIR",
+    os.path.join(tempfile.gettempdir(), "ascensoralert_importaciones")
+)
+
+# Importaciones simultáneas por proceso (no compiten con las peticiones web)
+MAX_TRABAJOS_CONCURRENTES = 2
+
+# Errores por fila que se guardan en el estado (el resto solo se cuentan)
+MAX_ERRORES_FILA = 200
+
+# Intervalo mínimo entre escrituras de progreso a disco (segundos)
+INTERVALO_GUARDADO = 0.5
+
+# Antigüedad a partir de la cual se eliminan trabajos terminados
+RETENCION_TRABAJOS = timedelta(hours=24)
+
+_executor = ThreadPoolExecutor(max_workers=MAX_TRABAJOS_CONCURRENTES, thread_name_prefix="importacion")
+
+# Trabajos de este proceso por estado (solo para /metrics)
+_en_cola = {'pendiente': 0, 'en_progreso': 0}
+_lock_cola = threading.Lock()
+
+
+def _mover_en_cola(origen, destino):
+    with _lock_cola:
+        if origen:
+            _en_cola[origen] -= 1
+        if destino:
+            _en_cola[destino] += 1
+
+
+def _profundidad_cola():
+    with _lock_cola:
+        return [({'estado': estado}, total) for estado, total in _en_cola.items()]
+
+
+metricas.gauge('trabajos_en_cola', "Trabajos en segundo plano pendientes o en ejecución",
+               _profundidad_cola, por_trabajador=True)
+
+
+# ============================================
+# PERSISTENCIA DEL ESTADO
+# ============================================
+
+def _ruta_estado(trabajo_id):
+    return os.path.join(DIRECTORIO_TRABAJOS, f"{trabajo_id}.json")
+
+
+def _guardar_estado(estado):
+    """Escribe el estado de forma atómica (fichero temporal + rename)"""
+    os.makedirs(DIRECTORIO_TRABAJOS, exist_ok=True)
+    ruta = _ruta_estado(estado['id'])
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, ensure_ascii=False, default=str)
+    os.replace(tmp, ruta)
+
+
+def obtener_trabajo(trabajo_id):
+    """
+    Obtiene el estado de un trabajo de importación
+
+    Returns:
+        Diccionario con el estado o None si no existe
+    """
+    # El ID se usa como nombre de fichero: solo se aceptan UUID hex
+    if not trabajo_id or not all(c in '0123456789abcdef' for c in trabajo_id):
+        return None
+    try:
+        with open(_ruta_estado(trabajo_id), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def obtener_estado_publico(trabajo_id):
+    """Estado del trabajo para el endpoint de consulta (sin rutas internas)"""
+    estado = obtener_trabajo(trabajo_id)
+    if estado is None:
+        return None
+    estado.pop('ruta_archivo', None)
+    return estado
+
+
+def _limpiar_trabajos_antiguos():
+    """Elimina estados y ficheros temporales de trabajos antiguos"""
+    if not os.path.isdir(DIRECTORIO_TRABAJOS):
+        return
+    limite = time.time() - RETENCION_TRABAJOS.total_seconds()
+    for nombre in os.listdir(DIRECTORIO_TRABAJOS):
+        ruta = os.path.join(DIRECTORIO_TRABAJOS, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError:
+            pass
+
+
+# ============================================
+# PROGRESO
+# ============================================
+
+class ProgresoTrabajo:
+    """Acumula el progreso de un trabajo y lo persiste con frecuencia limitada"""
+
+    def __init__(self, estado):
+        self.estado = estado
+        self._ultimo_guardado = 0.0
+        self._lock = threading.Lock()
+
+    def fase(self, mensaje):
+        """Actualiza el mensaje de la fase actual"""
+        with self._lock:
+            self.estado['mensaje'] = mensaje
+        self._guardar(forzar=True)
+
+    def total(self, total_filas):
+        """Fija el total de filas a procesar (si se conoce)"""
+        with self._lock:
+            self.estado['total'] = total_filas
+        self._guardar()
+
+    def avanzar(self, filas):
+        """Suma filas procesadas y recalcula el porcentaje"""
+        with self._lock:
+            self.estado['procesadas'] += filas
+            if self.estado.get('total'):
+                self.estado['progreso'] = min(99, int(self.estado['procesadas'] * 100 / self.estado['total']))
+        self._guardar()
+
+    def error_fila(self, fila, mensaje):
+        """Registra un error asociado a una fila del Excel"""
+        with self._lock:
+            self.estado['total_errores_fila'] += 1
+            if len(self.estado['errores_fila']) < MAX_ERRORES_FILA:
+                self.estado['errores_fila'].append({'fila': fila, 'error': mensaje})
+        self._guardar()
+
+    def _guardar(self, forzar=False):
+        ahora = time.monotonic()
+        if forzar or ahora - self._ultimo_guardado >= INTERVALO_GUARDADO:
+            self._ultimo_guardado = ahora
+            with self._lock:
+                self.estado['actualizado'] = datetime.now().isoformat()
+                _guardar_estado(self.estado)
+
+
+# ============================================
+# CICLO DE VIDA DEL TRABAJO
+# ============================================
+
+def crear_trabajo(tipo, archivo=None):
+    """
+    Guarda la subida en un fichero temporal y registra el trabajo
+
+    Args:
+        tipo: Tipo de trabajo (ej: "cartera_partes")
+        archivo: FileStorage de Flask con el Excel subido (None si el
+                 trabajo no procesa un fichero, ej: re-análisis)
+
+    Returns:
+        ID del trabajo (str)
+    """
+    _limpiar_trabajos_antiguos()
+    os.makedirs(DIRECTORIO_TRABAJOS, exist_ok=True)
+
+    trabajo_id = uuid.uuid4().hex
+    ruta_archivo = None
+    if archivo is not None:
+        extension = os.path.splitext(archivo.filename or '')[1].lower() or '.xlsx'
+        ruta_archivo = os.path.join(DIRECTORIO_TRABAJOS, f"{trabajo_id}{extension}")
+        archivo.save(ruta_archivo)
+
+    estado = {
+        'id': trabajo_id,
+        'tipo': tipo,
+        'archivo': archivo.filename if archivo is not None else None,
+        'ruta_archivo': ruta_archivo,
+        'estado': 'pendiente',
+        'mensaje': 'En cola',
+        'progreso': 0,
+        'procesadas': 0,
+        'total': None,
+        'errores_fila': [],
+        'total_errores_fila': 0,
+        'stats': {},
+        'error': None,
+        'creado': datetime.now().isoformat(),
+        'actualizado': datetime.now().isoformat(),
+        'finalizado': None
+    }
+    _guardar_estado(estado)
+    return trabajo_id
+
+
+def lanzar_trabajo(trabajo_id, funcion):
+    """
+    Encola la ejecución de un trabajo en el pool de importación
+
+    Args:
+        trabajo_id: ID devuelto por crear_trabajo
+        funcion: Callable(ruta_archivo, nombre_archivo, progreso) -> dict de stats
+                 (ruta y nombre son None en trabajos sin fichero)
+    """
+    _mover_en_cola(None, 'pendiente')
+    _executor.submit(_ejecutar, trabajo_id, funcion)
+
+
+def _ejecutar(trabajo_id, funcion):
+    _mover_en_cola('pendiente', 'en_progreso')
+    inicio = time.perf_counter()
+    estado = obtener_trabajo(trabajo_id)
+    if estado is None:
+        logger.error(f"Trabajo de importación {trabajo_id} no encontrado")
+        _mover_en_cola('en_progreso', None)
+        return
+
+    progreso = ProgresoTrabajo(estado)
+    estado['estado'] = 'en_progreso'
+    progreso.fase('Procesando archivo' if estado['archivo'] else 'Procesando')
+
+    try:
+        stats = funcion(estado['ruta_archivo'], estado['archivo'], progreso)
+        estado['stats'] = stats or {}
+        estado['estado'] = 'completado'
+        estado['progreso'] = 100
+        estado['mensaje'] = 'Completado'
+        logger.info(f"✅ Trabajo de importación {trabajo_id} ({estado['tipo']}) completado: {estado['stats']}")
+    except Exception as e:
+        estado['estado'] = 'error'
+        estado['error'] = f"{type(e).__name__}: {str(e)}"
+        estado['mensaje'] = 'Error al procesar'
+        logger.error(f"❌ Trabajo de importación {trabajo_id} ({estado['tipo']}) falló: {estado['error']}")
+    finally:
+        estado['finalizado'] = datetime.now().isoformat()
+        progreso._guardar(forzar=True)
+        if estado['ruta_archivo']:
+            try:
+                os.remove(estado['ruta_archivo'])
+            except OSError:
+                pass
+        _mover_en_cola('en_progreso', None)
+        metricas.incrementar('trabajos_total', tipo=estado['tipo'], estado=estado['estado'])
+        metricas.observar('trabajo_segundos', time.perf_counter() - inicio, tipo=estado['tipo'])
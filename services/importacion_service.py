@@ -0,0 +1,601 @@
+"""
+Servicio de importación masiva desde Excel (Cartera)
+
+Pipeline en streaming para partes de trabajo:
+- Lectura por bloques con openpyxl en modo read-only (memoria acotada)
+- Mapeo, parseo de fechas y detección de recomendaciones vectorizados
+- Inserción en lotes grandes con return=minimal en un pool pequeño de escritores
+
+Importación de instalaciones y máquinas de cartera.
+
+Todas las funciones de importación aceptan un objeto `progreso` opcional
+(ver services/importacion_jobs.ProgresoTrabajo) para ejecutarse como trabajo
+en segundo plano con progreso y errores por fila.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import logging
+import re
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+import requests
+from openpyxl import load_workbook
+
+from config import config
+from services.supabase_client import db
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# Filas leídas del Excel por bloque
+TAMANO_BLOQUE_LECTURA = 5000
+
+# Filas por POST a Supabase
+TAMANO_LOTE_INSERCION = 1000
+
+# Escritores concurrentes contra PostgREST
+ESCRITORES_CONCURRENTES = 4
+
+# Palabras clave para detectar recomendaciones en la resolución del parte
+PALABRAS_CLAVE_RECOMENDACION = [
+    # Recomendaciones explícitas
+    'RECOMENDACIÓN', 'RECOMENDACION', 'RECOMIENDO', 'RECOMENDAMOS',
+    'CONVENDRÍA', 'CONVIENE', 'SERÍA CONVENIENTE', 'SE RECOMIENDA',
+    'ACONSEJABLE', 'ACONSEJO', 'SUGERENCIA', 'SUGIERO',
+
+    # Indicadores de urgencia/importancia
+    'IMPORTANTE', 'URGENTE', 'NECESARIO', 'IMPRESCINDIBLE', 'CRÍTICO',
+    'PRIORITARIO', 'INMEDIATO',
+
+    # Acciones de mantenimiento/reparación
+    'CAMBIAR', 'SUSTITUIR', 'REEMPLAZAR', 'MODERNIZAR', 'ACTUALIZAR',
+    'REVISAR', 'REPARAR', 'ARREGLAR', 'RENOVAR', 'MEJORAR',
+
+    # Temporalidad
+    'PRÓXIMAMENTE', 'PROXIMAMENTE', 'PRONTO', 'EN BREVE',
+    'PRÓXIMA REVISIÓN', 'PROXIMA REVISION',
+
+    # Estados problemáticos
+    'NO FUNCIONA', 'NO OPERA', 'INOPERATIVO', 'INOPERANTE',
+    'FALLA', 'FALLO', 'DEFECTUOSO', 'AVERIADO', 'DETERIORADO',
+    'MAL ESTADO', 'DESGASTADO', 'ROTO', 'DAÑADO',
+
+    # Componentes críticos (cuando no funcionan = oportunidad)
+    'DISPOSITIVO NO', 'COMUNICACIÓN NO', 'BIDIRECCIONAL NO',
+    'CABINA NO', 'PUERTA NO', 'BOTONERA NO',
+
+    # Oportunidades de facturación
+    'FUERA DE CONTRATO', 'NO INCLUIDO', 'ADICIONAL',
+    'PRESUPUESTO', 'COTIZAR', 'COTIZACIÓN'
+]
+
+# Una sola alternancia compilada equivale a buscar cada palabra como subcadena
+PATRON_RECOMENDACION = re.compile('|'.join(re.escape(p) for p in PALABRAS_CLAVE_RECOMENDACION))
+
+# Columnas del Excel de partes que usa el importador
+COLUMNAS_PARTES = [
+    'PARTE', 'TIPO PARTE', 'CÓD. MÁQUINA', 'MÁQUINA', 'FECHA',
+    'CODIFICACIÓN ADICIONAL', 'RESOLUCIÓN'
+]
+
+
+# ============================================
+# LECTURA EN STREAMING
+# ============================================
+
+def leer_excel_por_bloques(fuente, tamano_bloque=TAMANO_BLOQUE_LECTURA):
+    """
+    Lee un Excel por bloques sin cargar el libro completo en memoria.
+
+    Args:
+        fuente: Ruta o file-like del Excel (.xlsx)
+        tamano_bloque: Filas por bloque
+
+    Yields:
+        DataFrame (dtype object) con las cabeceras de la primera fila e
+        índice igual al número de fila en Excel (la cabecera es la fila 1)
+    """
+    workbook = load_workbook(fuente, read_only=True, data_only=True)
+    try:
+        filas = workbook.active.iter_rows(values_only=True)
+        cabecera = next(filas, None)
+        if cabecera is None:
+            return
+        columnas = [str(c).strip() if c is not None else f'col_{i}' for i, c in enumerate(cabecera)]
+
+        bloque = []
+        primera_fila = 2
+        for fila in filas:
+            bloque.append(fila)
+            if len(bloque) >= tamano_bloque:
+                yield pd.DataFrame(bloque, columns=columnas, dtype=object,
+                                   index=range(primera_fila, primera_fila + len(bloque)))
+                primera_fila += len(bloque)
+                bloque = []
+
+        if bloque:
+            yield pd.DataFrame(bloque, columns=columnas, dtype=object,
+                               index=range(primera_fila, primera_fila + len(bloque)))
+    finally:
+        workbook.close()
+
+
+def contar_filas_excel(fuente, nombre_archivo=None):
+    """
+    Estima las filas de datos de un Excel sin leerlo entero (dimensión de la hoja).
+
+    Returns:
+        int o None si el fichero no declara su dimensión
+    """
+    if nombre_archivo and nombre_archivo.lower().endswith('.xls'):
+        return None
+    workbook = load_workbook(fuente, read_only=True)
+    try:
+        max_row = workbook.active.max_row
+        return max_row - 1 if max_row else None
+    finally:
+        workbook.close()
+
+
+def _leer_bloques(fuente, nombre_archivo, tamano_bloque):
+    """Bloques del Excel: streaming para .xlsx, pandas para .xls (formato binario)"""
+    if nombre_archivo and nombre_archivo.lower().endswith('.xls'):
+        df = pd.read_excel(fuente, dtype=object)
+        df.index = df.index + 2
+        for inicio in range(0, len(df), tamano_bloque):
+            yield df.iloc[inicio:inicio + tamano_bloque]
+    else:
+        yield from leer_excel_por_bloques(fuente, tamano_bloque)
+
+
+# ============================================
+# TRANSFORMACIÓN VECTORIZADA
+# ============================================
+
+def _texto_o_none(serie):
+    """Convierte una serie a texto conservando los nulos"""
+    return serie.astype(str).where(serie.notna())
+
+
+def _parsear_fechas(serie):
+    """
+    Parsea una columna de fechas de forma vectorizada.
+    Las celdas que no encajan con el formato inferido se reintentan
+    individualmente (format='mixed') solo sobre ese subconjunto.
+    """
+    fechas = pd.to_datetime(serie, errors='coerce')
+    pendientes = fechas.isna() & serie.notna()
+    if pendientes.any():
+        fechas[pendientes] = pd.to_datetime(serie[pendientes].astype(str), errors='coerce', format='mixed')
+    return fechas
+
+
+def detectar_recomendaciones(resoluciones):
+    """
+    Detecta recomendaciones en una serie de resoluciones.
+
+    Returns:
+        Serie booleana: True si el texto contiene alguna palabra clave
+    """
+    return resoluciones.fillna('').astype(str).str.upper().str.contains(PATRON_RECOMENDACION)
+
+
+def preparar_partes(df, mapeo_tipos, maquinas_map):
+    """
+    Transforma un bloque del Excel en registros de partes_trabajo.
+
+    Args:
+        df: DataFrame del bloque (columnas del Excel de partes)
+        mapeo_tipos: {TIPO_ORIGINAL_MAYÚSCULAS: tipo_normalizado}
+        maquinas_map: {identificador: maquina_id}
+
+    Returns:
+        tuple: (lista de registros, dict con contadores del bloque). El dict
+        incluye 'filas' (fila Excel de cada registro) y 'errores_fila'
+        (lista de (fila, motivo) de las filas descartadas).
+    """
+    df = df.reindex(columns=list(dict.fromkeys(list(df.columns) + COLUMNAS_PARTES)))
+    stats = {'total': len(df), 'sin_maquina': 0, 'errores': 0, 'recomendaciones_detectadas': 0,
+             'errores_fila': []}
+
+    # Validar columnas requeridas
+    validas = df['PARTE'].notna() & df['MÁQUINA'].notna()
+    stats['errores'] += int((~validas).sum())
+    stats['errores_fila'].extend((fila, 'PARTE o MÁQUINA vacío') for fila in df.index[~validas])
+    df = df[validas]
+
+    # Mapear máquina
+    identificadores = df['MÁQUINA'].astype(str).str.strip()
+    maquina_ids = pd.Series([maquinas_map.get(i) for i in identificadores], index=df.index, dtype=object)
+    stats['sin_maquina'] = int(maquina_ids.isna().sum())
+
+    # Parsear fecha (filas sin fecha válida se descartan)
+    fechas = _parsear_fechas(df['FECHA'])
+    con_fecha = fechas.notna()
+    stats['errores'] += int((~con_fecha).sum())
+    stats['errores_fila'].extend((fila, 'FECHA vacía o inválida') for fila in df.index[~con_fecha])
+    df = df[con_fecha]
+    identificadores = identificadores[con_fecha]
+    maquina_ids = maquina_ids[con_fecha]
+    fechas = fechas[con_fecha]
+
+    # Mapear tipo de parte
+    tipos_original = df['TIPO PARTE'].fillna('').astype(str).str.strip()
+    tipos_normalizado = tipos_original.str.upper().map(mapeo_tipos).fillna('OTRO')
+
+    # Detectar recomendaciones
+    resoluciones = _texto_o_none(df['RESOLUCIÓN'])
+    tiene_recomendacion = detectar_recomendaciones(df['RESOLUCIÓN'])
+    stats['recomendaciones_detectadas'] = int(tiene_recomendacion.sum())
+
+    partes = pd.DataFrame({
+        "numero_parte": df['PARTE'].astype(str),
+        "tipo_parte_original": tipos_original,
+        "codigo_maquina": _texto_o_none(df['CÓD. MÁQUINA']),
+        "maquina_texto": identificadores,
+        "fecha_parte": fechas.dt.strftime('%Y-%m-%dT%H:%M:%S'),
+        "codificacion_adicional": _texto_o_none(df['CODIFICACIÓN ADICIONAL']),
+        "resolucion": resoluciones,
+        "maquina_id": maquina_ids,
+        "tipo_parte_normalizado": tipos_normalizado,
+        "tiene_recomendacion": tiene_recomendacion,
+        "recomendaciones_extraidas": resoluciones.where(tiene_recomendacion),
+        "estado": "COMPLETADO",
+        "importado": True
+    }, dtype=object)
+
+    # Nulos de pandas -> None para que el JSON sea válido
+    partes = partes.replace({np.nan: None})
+    stats['filas'] = list(df.index)
+
+    return partes.to_dict('records'), stats
+
+
+# ============================================
+# CARGA DE CATÁLOGOS
+# ============================================
+
+def cargar_mapeo_tipos():
+    """Carga el mapeo tipo_original -> tipo_normalizado"""
+    response = requests.get(
+        f"{config.SUPABASE_URL}/rest/v1/tipos_parte_mapeo?select=tipo_original,tipo_normalizado",
+        headers=config.HEADERS,
+        timeout=30
+    )
+    mapeo_tipos = {}
+    if response.status_code == 200:
+        for row in response.json():
+            mapeo_tipos[row['tipo_original'].upper()] = row['tipo_normalizado']
+    return mapeo_tipos
+
+
+def cargar_maquinas():
+    """Carga el mapeo identificador -> id de maquinas_cartera"""
+    response = requests.get(
+        f"{config.SUPABASE_URL}/rest/v1/maquinas_cartera?select=id,identificador",
+        headers=config.HEADERS,
+        timeout=30
+    )
+    maquinas_map = {}
+    if response.status_code == 200:
+        for row in response.json():
+            maquinas_map[row['identificador']] = row['id']
+    return maquinas_map
+
+
+# ============================================
+# ESCRITURA CONCURRENTE
+# ============================================
+
+def _insertar_lote_partes(lote, filas):
+    """
+    Inserta un lote de partes ignorando duplicados por numero_parte.
+    Usa return=minimal para no recibir de vuelta las filas insertadas.
+
+    Returns:
+        tuple: (filas Excel del lote, None si se insertó o mensaje de error)
+    """
+    try:
+        response = requests.post(
+            f"{config.SUPABASE_URL}/rest/v1/partes_trabajo?on_conflict=numero_parte",
+            json=lote,
+            headers={**config.HEADERS, "Prefer": "return=minimal,resolution=ignore-duplicates"},
+            timeout=60
+        )
+        if response.status_code in [200, 201, 204]:
+            return filas, None
+        error = f"{response.status_code} - {response.text[:200]}"
+    except requests.exceptions.RequestException as e:
+        error = f"{type(e).__name__}: {str(e)}"
+    logger.error(f"Error insertando lote de {len(lote)} partes: {error}")
+    return filas, error
+
+
+def importar_partes_excel(fuente, nombre_archivo=None, progreso=None,
+                          tamano_bloque=TAMANO_BLOQUE_LECTURA,
+                          tamano_lote=TAMANO_LOTE_INSERCION,
+                          escritores=ESCRITORES_CONCURRENTES):
+    """
+    Importa partes de trabajo desde Excel en streaming.
+
+    Lee el libro por bloques, transforma cada bloque de forma vectorizada y
+    envía lotes de `tamano_lote` filas a un pool de `escritores` hilos. Como
+    máximo hay 2 x escritores lotes en vuelo, de modo que la memoria queda
+    acotada aunque el Excel tenga decenas de miles de filas.
+
+    Args:
+        fuente: Ruta o file-like del Excel
+        nombre_archivo: Nombre original (para detectar .xls)
+        progreso: ProgresoTrabajo opcional (filas procesadas y errores por fila)
+        tamano_bloque: Filas leídas por bloque
+        tamano_lote: Filas por POST
+        escritores: Hilos de escritura concurrentes
+
+    Returns:
+        dict: total, insertados, sin_maquina, errores, recomendaciones_detectadas
+              y maquinas_afectadas (set de ids)
+    """
+    mapeo_tipos = cargar_mapeo_tipos()
+    maquinas_map = cargar_maquinas()
+
+    stats = {
+        'total': 0,
+        'insertados': 0,
+        'duplicados': 0,
+        'sin_maquina': 0,
+        'errores': 0,
+        'recomendaciones_detectadas': 0,
+        'maquinas_afectadas': set()
+    }
+
+    def _recoger(futuros):
+        for futuro in futuros:
+            filas, error = futuro.result()
+            if error is None:
+                stats['insertados'] += len(filas)
+            else:
+                stats['errores'] += len(filas)
+                if progreso:
+                    progreso.error_fila(filas[0], f"Lote de {len(filas)} partes (filas {filas[0]}-{filas[-1]}) rechazado: {error}")
+
+    if progreso:
+        progreso.total(contar_filas_excel(fuente, nombre_archivo))
+        if hasattr(fuente, 'seek'):
+            fuente.seek(0)
+
+    en_vuelo = set()
+    with ThreadPoolExecutor(max_workers=escritores) as pool:
+        for bloque in _leer_bloques(fuente, nombre_archivo, tamano_bloque):
+            partes, stats_bloque = preparar_partes(bloque, mapeo_tipos, maquinas_map)
+            for clave in ('total', 'sin_maquina', 'errores', 'recomendaciones_detectadas'):
+                stats[clave] += stats_bloque[clave]
+            stats['maquinas_afectadas'].update(p['maquina_id'] for p in partes if p['maquina_id'])
+
+            if progreso:
+                for fila, motivo in stats_bloque['errores_fila']:
+                    progreso.error_fila(fila, motivo)
+
+            filas = stats_bloque['filas']
+            for inicio in range(0, len(partes), tamano_lote):
+                # Contrapresión: no encolar más de 2 lotes por escritor
+                if len(en_vuelo) >= escritores * 2:
+                    hechos, en_vuelo = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                    _recoger(hechos)
+                en_vuelo.add(pool.submit(_insertar_lote_partes,
+                                         partes[inicio:inicio + tamano_lote],
+                                         filas[inicio:inicio + tamano_lote]))
+
+            if progreso:
+                progreso.avanzar(len(bloque))
+
+        _recoger(wait(en_vuelo).done)
+
+    logger.info(f"Importación de partes: {stats['insertados']}/{stats['total']} insertados, {stats['errores']} errores")
+    return stats
+
+
+# ============================================
+# IMPORTACIÓN DE EQUIPOS (INSTALACIONES + MÁQUINAS)
+# ============================================
+
+# Municipios de Gran Canaria
+MUNICIPIOS_GC = [
+    'LAS PALMAS', 'TELDE', 'SANTA LUCIA', 'AGÜIMES', 'INGENIO',
+    'MOGAN', 'SAN BARTOLOME', 'SANTA BRIGIDA', 'ARUCAS', 'TEROR',
+    'GALDAR', 'AGAETE', 'VALLESECO', 'FIRGAS', 'MOYA',
+    'SANTA MARIA DE GUIA', 'VALSEQUILLO', 'VEGA DE SAN MATEO',
+    'TEJEDA', 'ALDEA DE SAN NICOLAS'
+]
+
+COLUMNAS_EQUIPOS_REQUERIDAS = ['cod_instalacion', 'instalacion', 'cod_maquina', 'maquina']
+
+# Registros por petición de upsert de instalaciones/máquinas
+TAMANO_LOTE_UPSERT = 500
+
+# Nombres por consulta al recuperar los ids de las instalaciones (longitud de URL)
+TAMANO_LOTE_NOMBRES = 50
+
+
+def _mapear_columnas_equipos(columnas):
+    """Mapeo de columnas (flexible con mayúsculas/minúsculas y acentos)"""
+    column_mapping = {}
+    for col in columnas:
+        col_lower = str(col).lower().strip()
+        if 'instalación' in col_lower or 'instalacion' in col_lower:
+            if 'cód' in col_lower or 'cod' in col_lower:
+                column_mapping[col] = 'cod_instalacion'
+            else:
+                column_mapping[col] = 'instalacion'
+        elif 'máquina' in col_lower or 'maquina' in col_lower:
+            if 'cód' in col_lower or 'cod' in col_lower:
+                column_mapping[col] = 'cod_maquina'
+            else:
+                column_mapping[col] = 'maquina'
+        elif 'tecnico' in col_lower or 'técnico' in col_lower:
+            column_mapping[col] = 'tecnico'
+    return column_mapping
+
+
+def _ids_instalaciones(nombres):
+    """
+    Ids de las instalaciones con esos nombres (filtro in.() por lotes)
+
+    Returns:
+        dict: nombre → id (sin los nombres cuya consulta falló)
+    """
+    instalaciones_map = {}
+    for inicio in range(0, len(nombres), TAMANO_LOTE_NOMBRES):
+        # Nombres entre comillas: pueden llevar comas y paréntesis
+        valores = ','.join(
+            '"' + nombre.replace('\\', '\\\\').replace('"', '\\"') + '"'
+            for nombre in nombres[inicio:inicio + TAMANO_LOTE_NOMBRES]
+        )
+        filas = db.get('instalaciones', select='id,nombre',
+                       filters={'nombre': urllib.parse.quote(f"in.({valores})")})
+        if filas is None:
+            logger.error(f"Error consultando ids de instalaciones (lote desde {inicio})")
+            continue
+        instalaciones_map.update({i['nombre']: i['id'] for i in filas})
+    return instalaciones_map
+
+
+def _datos_instalacion(texto):
+    """Nombre limpio (sin dirección tras el guion) y municipio de una instalación"""
+    nombre = texto.split(' - ')[0].strip() if ' - ' in texto else texto.strip()
+
+    texto_upper = texto.upper()
+    municipio = "Las Palmas de Gran Canaria"  # Default
+    for mun in MUNICIPIOS_GC:
+        if mun in texto_upper:
+            municipio = mun.title()
+            break
+
+    return nombre, municipio
+
+
+def importar_equipos_excel(fuente, nombre_archivo=None, progreso=None):
+    """
+    Importa instalaciones y máquinas de cartera desde Excel.
+
+    Usa upsert en bloque: las instalaciones se identifican por nombre (las
+    existentes se dejan como están, ignore-duplicates) y las máquinas por
+    identificador (las existentes se actualizan, merge-duplicates), así que
+    una recarga de miles de máquinas son unas pocas peticiones en lugar de
+    GET + POST por fila.
+
+    Args:
+        fuente: Ruta o file-like del Excel
+        nombre_archivo: Nombre original (solo informativo)
+        progreso: ProgresoTrabajo opcional (filas procesadas y errores por fila)
+
+    Returns:
+        dict: instalaciones_nuevas, instalaciones_existentes, maquinas_nuevas,
+              maquinas_existentes, errores
+
+    Raises:
+        ValueError: si faltan columnas requeridas
+    """
+    df = pd.read_excel(fuente)
+    df.index = df.index + 2  # Número de fila en Excel (cabecera = fila 1)
+
+    logger.info(f"Columnas en Excel: {list(df.columns)}")
+    logger.info(f"Total de filas: {len(df)}")
+
+    df.rename(columns=_mapear_columnas_equipos(df.columns), inplace=True)
+
+    missing = [col for col in COLUMNAS_EQUIPOS_REQUERIDAS if col not in df.columns]
+    if missing:
+        logger.error(f"Faltan columnas: {missing}. Columnas después de mapeo: {list(df.columns)}")
+        raise ValueError(
+            f"Faltan columnas requeridas: {', '.join(missing)}. "
+            f"Columnas encontradas en Excel: {', '.join(map(str, df.columns))}"
+        )
+
+    stats = {
+        'instalaciones_nuevas': 0,
+        'instalaciones_existentes': 0,
+        'maquinas_nuevas': 0,
+        'maquinas_existentes': 0,
+        'errores': 0
+    }
+
+    def error_fila(fila, mensaje):
+        stats['errores'] += 1
+        if progreso:
+            progreso.error_fila(fila, mensaje)
+
+    total_filas = len(df)
+    if progreso:
+        progreso.total(total_filas)
+        progreso.fase('Importando instalaciones')
+
+    # Instalaciones únicas por nombre limpio (la clave de conflicto)
+    validas = df['instalacion'].notna()
+    for fila in df.index[~validas]:
+        error_fila(fila, 'Instalación vacía')
+    df = df[validas]
+
+    datos = df['instalacion'].astype(str).map(_datos_instalacion)
+    df = df.assign(nombre_instalacion=datos.str[0], municipio=datos.str[1])
+    instalaciones = (df.drop_duplicates('nombre_instalacion')
+                       [['nombre_instalacion', 'municipio']]
+                       .rename(columns={'nombre_instalacion': 'nombre'})
+                       .to_dict('records'))
+
+    # Las existentes no se tocan (conservan su municipio): solo se crean las
+    # nuevas, que son las filas que devuelve el upsert con ignore-duplicates
+    creadas, errores = db.upsert('instalaciones', instalaciones, on_conflict='nombre',
+                                 batch_size=TAMANO_LOTE_UPSERT, ignore_duplicates=True)
+    for inicio, error in errores:
+        logger.error(f"Error en upsert de instalaciones (lote desde {inicio}): {error}")
+
+    instalaciones_map = _ids_instalaciones([i['nombre'] for i in instalaciones])
+    stats['instalaciones_nuevas'] = len(creadas)
+    stats['instalaciones_existentes'] = len(instalaciones_map) - len(creadas)
+
+    if progreso:
+        progreso.fase('Importando máquinas')
+
+    # Máquinas: una por identificador (si se repite, gana la última fila)
+    df = df.assign(instalacion_id=df['nombre_instalacion'].map(instalaciones_map))
+    sin_instalacion = df['instalacion_id'].isna() | df['maquina'].isna()
+    for fila in df.index[sin_instalacion]:
+        error_fila(fila, 'Máquina vacía o instalación no importada')
+    df = df[~sin_instalacion]
+
+    maquinas = pd.DataFrame({
+        'instalacion_id': df['instalacion_id'].astype(int),
+        'identificador': df['maquina'].astype(str).str.strip(),
+        'codigo_maquina': df['cod_maquina'].astype(str).str.strip().where(df['cod_maquina'].notna())
+    }, index=df.index).drop_duplicates('identificador', keep='last')
+    registros = maquinas.replace({np.nan: None}).to_dict('records')
+
+    antes = db.count_exact('maquinas_cartera')
+    _, errores = db.upsert('maquinas_cartera', registros, on_conflict='identificador',
+                           batch_size=TAMANO_LOTE_UPSERT, returning=False,
+                           parallel=ESCRITORES_CONCURRENTES)
+    despues = db.count_exact('maquinas_cartera')
+
+    filas_excel = list(maquinas.index)
+    maquinas_fallidas = 0
+    for inicio, error in errores:
+        lote = filas_excel[inicio:inicio + TAMANO_LOTE_UPSERT]
+        maquinas_fallidas += len(lote)
+        stats['errores'] += len(lote)
+        logger.error(f"Error en upsert de máquinas (lote desde {inicio}): {error}")
+        if progreso:
+            progreso.error_fila(lote[0], f"Lote de {len(lote)} máquinas (filas {lote[0]}-{lote[-1]}) rechazado: {error}")
+
+    if antes is not None and despues is not None:
+        stats['maquinas_nuevas'] = despues - antes
+        stats['maquinas_existentes'] = len(registros) - maquinas_fallidas - stats['maquinas_nuevas']
+
+    if progreso:
+        progreso.avanzar(total_filas)
+
+    logger.info(f"Importación de equipos: {stats}")
+    return stats
@@ -0,0 +1,154 @@
+"""
+Servicio de Inspecciones - consultas del dashboard
+
+Los contadores de defectos y la categoría de la segunda inspección se
+calculan en el servidor (migración 021):
+- Listados por sección desde v_inspecciones_dashboard (inspección + OCA +
+  contadores de defectos + categoria_segunda), paginados por keyset
+- Totales por categoría agregados en SQL (fn_resumen_inspecciones), con caché
+- Filtros (OCA, búsqueda por máquina) como filtros de PostgREST
+
+El coste del dashboard no depende del histórico de defectos.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from middleware.tiempos import propagar_traza
+from services.cache_service import get_resumen_inspecciones_cached
+from services.supabase_client import db
+
+# Inspecciones por página en cada sección del dashboard
+TAMANO_PAGINA_INSPECCIONES = 50
+
+# Secciones del dashboard: nombre -> (filtros de la vista, columna de orden, descendente)
+# Las secciones urgentes se ordenan por fecha límite (la más apremiante primero)
+SECCIONES_INSPECCIONES = {
+    'vencidas': ({'categoria_segunda': 'eq.vencidas'}, 'fecha_segunda_inspeccion', False),
+    'este-mes': ({'categoria_segunda': 'eq.este-mes'}, 'fecha_segunda_inspeccion', False),
+    'proximo-mes': ({'categoria_segunda': 'eq.proximo-mes'}, 'fecha_segunda_inspeccion', False),
+    'programadas': ({'categoria_segunda': 'in.(realizadas,pendiente,sin-fecha)'}, 'fecha_inspeccion', True)
+}
+
+# Categorías de fn_resumen_inspecciones que agrupa cada sección
+CATEGORIAS_SECCION = {
+    'vencidas': ('vencidas',),
+    'este-mes': ('este-mes',),
+    'proximo-mes': ('proximo-mes',),
+    'programadas': ('realizadas', 'pendiente', 'sin-fecha')
+}
+
+# Columnas que usa el dashboard
+SELECT_INSPECCIONES = (
+    "id,maquina,fecha_inspeccion,fecha_segunda_inspeccion,fecha_segunda_realizada,"
+    "oca_id,oca_nombre,categoria_segunda,dias_hasta_segunda,"
+    "defectos_total,defectos_pendientes,defectos_plazo_6,defectos_plazo_12"
+)
+
+
+def leer_filtros(args):
+    """Filtros del dashboard presentes en los parámetros de la petición"""
+    filtros = {}
+    oca = args.get('oca', '').strip()
+    if oca.isdigit():
+        filtros['oca'] = int(oca)
+    busqueda = args.get('q', '').strip()
+    if busqueda:
+        filtros['q'] = busqueda
+    return filtros
+
+
+def _condiciones(filtros):
+    condiciones = {}
+    if filtros.get('oca'):
+        condiciones['oca_id'] = f"eq.{filtros['oca']}"
+    if filtros.get('q'):
+        # '*' es el comodín de PostgREST en ilike
+        condiciones['maquina'] = 'ilike.' + quote(f"*{filtros['q'].replace('*', '')}*", safe='*')
+    return condiciones
+
+
+def cursor_inspeccion(inspeccion, columna):
+    """Cursor de paginación (fecha_id) a partir de la última inspección de una página"""
+    return f"{inspeccion[columna][:10]}_{inspeccion['id']}"
+
+
+def leer_cursor(cursor):
+    """
+    Interpreta un cursor generado por cursor_inspeccion
+
+    Returns:
+        tuple (fecha, id) o None si no es válido
+    """
+    try:
+        fecha, ultimo_id = (cursor or '').rsplit('_', 1)
+        if len(fecha) != 10 or fecha[4] != '-' or fecha[7] != '-':
+            return None
+        return fecha, int(ultimo_id)
+    except ValueError:
+        return None
+
+
+def obtener_pagina_inspecciones(seccion, filtros, desde=None, tamano=TAMANO_PAGINA_INSPECCIONES):
+    """
+    Página de inspecciones de una sección del dashboard
+
+    Args:
+        seccion: Clave de SECCIONES_INSPECCIONES
+        filtros: Filtros de leer_filtros
+        desde: Cursor (fecha, id) de la última inspección ya mostrada
+        tamano: Inspecciones por página
+
+    Returns:
+        tuple: (lista de inspecciones, cursor de la página siguiente o None)
+    """
+    condiciones_seccion, columna, descendente = SECCIONES_INSPECCIONES[seccion]
+    condiciones = dict(condiciones_seccion)
+    condiciones.update(_condiciones(filtros))
+
+    op = 'lt' if descendente else 'gt'
+    if desde:
+        fecha, ultimo_id = desde
+        condiciones['or'] = quote(f"({columna}.{op}.{fecha},and({columna}.eq.{fecha},id.{op}.{ultimo_id}))", safe='')
+
+    direccion = 'desc' if descendente else 'asc'
+    # Se pide una más para saber si hay página siguiente
+    inspecciones = db.get(
+        'v_inspecciones_dashboard',
+        select=SELECT_INSPECCIONES,
+        filters=condiciones,
+        order=f"{columna}.{direccion},id.{direccion}",
+        limit=tamano + 1,
+        timeout=15
+    ) or []
+
+    siguiente = cursor_inspeccion(inspecciones[tamano - 1], columna) if len(inspecciones) > tamano else None
+    return inspecciones[:tamano], siguiente
+
+
+def obtener_resumen_inspecciones(filtros):
+    """
+    Totales por sección del dashboard (con caché)
+
+    Returns:
+        dict {seccion: total}
+    """
+    resumen = get_resumen_inspecciones_cached(filtros.get('oca'), filtros.get('q')) or {}
+    return {
+        seccion: sum(resumen.get(categoria, 0) for categoria in categorias)
+        for seccion, categorias in CATEGORIAS_SECCION.items()
+    }
+
+
+def obtener_dashboard_inspecciones(filtros, tamano=TAMANO_PAGINA_INSPECCIONES):
+    """
+    Totales y primera página de cada sección, en paralelo
+
+    Returns:
+        tuple: (totales por sección, {seccion: (inspecciones, cursor siguiente)})
+    """
+    with ThreadPoolExecutor(max_workers=len(SECCIONES_INSPECCIONES) + 1) as pool:
+        futuro_resumen = pool.submit(propagar_traza(obtener_resumen_inspecciones), filtros)
+        futuros = {s: pool.submit(propagar_traza(obtener_pagina_inspecciones), s, filtros, None, tamano)
+                   for s in SECCIONES_INSPECCIONES}
+
+    return futuro_resumen.result(), {s: f.result() for s, f in futuros.items()}
@@ -0,0 +1,146 @@
+"""
+Servicio de re-análisis de recomendaciones (Cartera)
+
+Recalcula tiene_recomendacion / recomendaciones_extraidas de los partes de
+trabajo con las palabras clave actuales (las mismas que la importación):
+- Lectura paginada por id (keyset), sin el límite fijo de 10.000 partes
+- Detección vectorizada y diff contra los valores guardados
+- Solo se escriben los partes que cambian, en lotes, con una función SQL
+  (fn_actualizar_recomendaciones_partes, migración 017)
+"""
+import logging
+
+import pandas as pd
+
+from services.importacion_service import detectar_recomendaciones
+from services.supabase_client import db
+
+logger = logging.getLogger(__name__)
+
+# Partes leídos por página (Supabase limita a 1000 filas por respuesta)
+TAMANO_PAGINA_REANALISIS = 1000
+
+# Cambios enviados por llamada a la función SQL
+TAMANO_LOTE_CAMBIOS = 1000
+
+
+def calcular_cambios(partes):
+    """
+    Compara los flags calculados con los guardados.
+
+    Args:
+        partes: Lista de dicts con id, resolucion, tiene_recomendacion
+                y recomendaciones_extraidas
+
+    Returns:
+        tuple: (lista de cambios {id, tiene_recomendacion, recomendaciones_extraidas},
+                número de partes con recomendación)
+    """
+    df = pd.DataFrame(partes, columns=['id', 'resolucion', 'tiene_recomendacion', 'recomendaciones_extraidas'])
+
+    # Los partes sin resolución no se re-analizan (se conserva lo que tengan)
+    df = df[df['resolucion'].fillna('').astype(str) != '']
+
+    tiene = detectar_recomendaciones(df['resolucion'])
+    extraidas = df['resolucion'].astype(str).where(tiene)
+
+    guardado_tiene = df['tiene_recomendacion'].fillna(False).astype(bool)
+    guardado_extraidas = df['recomendaciones_extraidas']
+
+    distinto_texto = ~((extraidas.isna() & guardado_extraidas.isna()) | (extraidas == guardado_extraidas))
+    cambiados = (tiene != guardado_tiene) | distinto_texto
+
+    cambios = pd.DataFrame({
+        'id': df['id'][cambiados],
+        'tiene_recomendacion': tiene[cambiados],
+        'recomendaciones_extraidas': extraidas[cambiados]
+    }, dtype=object).where(lambda d: d.notna(), None)
+
+    return cambios.to_dict('records'), int(tiene.sum())
+
+
+def _aplicar_cambios(cambios):
+    """Aplica un lote de cambios en el servidor. Devuelve los partes actualizados o None si falla"""
+    return db.rpc('fn_actualizar_recomendaciones_partes', {'p_cambios': cambios}, timeout=60)
+
+
+def reanalizar_recomendaciones(progreso=None, tamano_pagina=TAMANO_PAGINA_REANALISIS,
+                               tamano_lote=TAMANO_LOTE_CAMBIOS):
+    """
+    Re-analiza todos los partes de trabajo y escribe solo los que cambian.
+
+    Args:
+        progreso: ProgresoTrabajo opcional (ver services/importacion_jobs.py)
+        tamano_pagina: Partes leídos por petición
+        tamano_lote: Cambios por llamada a la función SQL
+
+    Returns:
+        dict: analizados, cambios, actualizados, con_recomendacion, errores
+              y maquinas_afectadas (set de ids)
+    """
+    stats = {
+        'analizados': 0,
+        'cambios': 0,
+        'actualizados': 0,
+        'con_recomendacion': 0,
+        'errores': 0,
+        'maquinas_afectadas': set()
+    }
+
+    if progreso:
+        progreso.total(db.count_exact('partes_trabajo'))
+
+    pendientes = []
+
+    def enviar(lote):
+        actualizados = _aplicar_cambios(lote)
+        if actualizados is None:
+            stats['errores'] += len(lote)
+            if progreso:
+                progreso.error_fila(None, f"Lote de {len(lote)} partes (id {lote[0]['id']}-{lote[-1]['id']}) no actualizado")
+        else:
+            stats['actualizados'] += actualizados
+
+    ultimo_id = 0
+    while True:
+        partes = db.get(
+            'partes_trabajo',
+            select='id,maquina_id,resolucion,tiene_recomendacion,recomendaciones_extraidas',
+            filters={'id': f'gt.{ultimo_id}'},
+            order='id.asc',
+            limit=tamano_pagina,
+            timeout=30
+        )
+        if partes is None:
+            raise RuntimeError(f"Error al obtener partes de trabajo (desde id {ultimo_id})")
+        if not partes:
+            break
+
+        cambios, con_recomendacion = calcular_cambios(partes)
+        stats['analizados'] += len(partes)
+        stats['cambios'] += len(cambios)
+        stats['con_recomendacion'] += con_recomendacion
+
+        if cambios:
+            ids_cambiados = {c['id'] for c in cambios}
+            stats['maquinas_afectadas'].update(
+                p['maquina_id'] for p in partes if p['id'] in ids_cambiados and p.get('maquina_id')
+            )
+
+        pendientes.extend(cambios)
+        while len(pendientes) >= tamano_lote:
+            enviar(pendientes[:tamano_lote])
+            pendientes = pendientes[tamano_lote:]
+
+        if progreso:
+            progreso.avanzar(len(partes))
+
+        # Sin cortar en páginas incompletas: PostgREST puede limitar filas (max-rows)
+        ultimo_id = partes[-1]['id']
+
+    if pendientes:
+        enviar(pendientes)
+
+    logger.info(f"Re-análisis de recomendaciones: {stats['cambios']} cambios de {stats['analizados']} partes, "
+                f"{stats['actualizados']} actualizados, {stats['errores']} errores")
+    return stats
@@ -0,0 +1,261 @@
+"""
+Servicio de Seguimiento Comercial - tareas automáticas
+
+Reconciliación en bloque de las tareas automáticas de seguimiento_comercial_tareas:
+- IPO con 15 días o más (motivo 'ipo_15_dias')
+- Fin de contrato en 120 días o menos (motivo 'fin_contrato_120_dias')
+
+Las tareas existentes se cargan una sola vez y se comparan como conjuntos de
+cliente_id; las que faltan se insertan en una única petición.
+
+Se ejecuta:
+- En segundo plano tras guardar fechas de IPO o de fin de contrato
+- Periódicamente (como mucho una vez por INTERVALO_RECONCILIACION), lanzado
+  desde la vista de seguimiento sin bloquearla
+- Manualmente o con cron:
+    0 6 * * * cd /path/to/ascensoralert && python -m services.seguimiento_service
+"""
+from datetime import datetime, timedelta
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Días desde la IPO a partir de los cuales se crea la tarea
+DIAS_TAREA_IPO = 15
+
+# Días hasta el fin de contrato a partir de los cuales se crea la tarea
+DIAS_TAREA_FIN_CONTRATO = 120
+
+# Antigüedad máxima de la última reconciliación antes de relanzarla desde la vista
+INTERVALO_RECONCILIACION = timedelta(hours=1)
+
+# Fichero de bloqueo compartido por todos los workers (su mtime = última ejecución)
+ARCHIVO_CONTROL = os.path.join(tempfile.gettempdir(), "ascensoralert_reconciliacion_tareas.lock")
+
+
+# ============================================
+# LECTURA
+# ============================================
+
+def _get(path, timeout=15):
+    response = requests.get(f"{config.SUPABASE_URL}/rest/v1/{path}", headers=config.HEADERS, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def obtener_clientes_con_ipo(hoy):
+    """
+    Equipos con IPO agrupados por cliente (solo el más próximo)
+
+    Returns:
+        dict {cliente_id: {cliente_id, equipo_id, ipo_date, dias_desde_ipo, dias_hasta_ipo, rae, cliente}}
+    """
+    equipos_data = _get(
+        "equipos?select=id,ipo_proxima,rae,cliente_id,clientes(direccion,localidad,telefono,persona_contacto,empresa_mantenedora)&ipo_proxima=not.is.null"
+    )
+
+    clientes_con_ipo = {}
+    for equipo in equipos_data:
+        if not equipo.get('ipo_proxima'):
+            continue
+
+        try:
+            ipo_date = datetime.strptime(equipo['ipo_proxima'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            continue
+
+        dias_desde_ipo = (hoy - ipo_date).days
+        cliente_id = equipo['cliente_id']
+
+        # Solo guardar el equipo con IPO más reciente por cliente
+        if cliente_id not in clientes_con_ipo or dias_desde_ipo < clientes_con_ipo[cliente_id]['dias_desde_ipo']:
+            clientes_con_ipo[cliente_id] = {
+                'cliente_id': cliente_id,
+                'equipo_id': equipo['id'],
+                'ipo_date': ipo_date,
+                'dias_desde_ipo': dias_desde_ipo,
+                'dias_hasta_ipo': abs(dias_desde_ipo) if dias_desde_ipo < 0 else 0,
+                'rae': equipo.get('rae'),
+                'cliente': equipo.get('clientes') or {}
+            }
+
+    return clientes_con_ipo
+
+
+def obtener_clientes_con_fin_contrato(hoy):
+    """
+    Clientes con fecha de fin de contrato
+
+    Returns:
+        dict {cliente_id: {cliente_id, fecha_fin_contrato, dias_hasta_fin, cliente}}
+    """
+    clientes_data = _get(
+        "clientes?select=id,fecha_fin_contrato,direccion,localidad,telefono,persona_contacto,empresa_mantenedora&fecha_fin_contrato=not.is.null"
+    )
+
+    clientes_con_fin_contrato = {}
+    for cliente in clientes_data:
+        if not cliente.get('fecha_fin_contrato'):
+            continue
+
+        try:
+            fecha_fin = datetime.strptime(cliente['fecha_fin_contrato'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            continue
+
+        clientes_con_fin_contrato[cliente['id']] = {
+            'cliente_id': cliente['id'],
+            'fecha_fin_contrato': fecha_fin,
+            'dias_hasta_fin': (fecha_fin - hoy).days,
+            'cliente': cliente
+        }
+
+    return clientes_con_fin_contrato
+
+
+def obtener_clientes_con_tareas():
+    """
+    Clientes con tarea abierta y clientes con tareas descartadas, en una sola consulta
+
+    Returns:
+        tuple: (set de cliente_id con tarea abierta, set de cliente_id con tarea descartada)
+    """
+    tareas = _get(
+        "seguimiento_comercial_tareas?select=cliente_id,estado,tipo_cierre"
+        "&or=(estado.eq.abierta,and(estado.eq.cerrada,tipo_cierre.not.is.null))"
+    )
+
+    abiertas = {t['cliente_id'] for t in tareas if t['estado'] == 'abierta'}
+    descartadas = {t['cliente_id'] for t in tareas if t['estado'] == 'cerrada'}
+    return abiertas, descartadas
+
+
+# ============================================
+# RECONCILIACIÓN
+# ============================================
+
+def calcular_tareas_pendientes(clientes_con_ipo, clientes_con_fin_contrato, clientes_abiertos, clientes_descartados):
+    """
+    Tareas automáticas que faltan: solo clientes sin tareas abiertas ni descartadas
+
+    Returns:
+        Lista de tareas nuevas (como mucho una por cliente, la de IPO tiene prioridad)
+    """
+    excluidos = clientes_abiertos | clientes_descartados
+    nuevas = {}
+
+    for cliente_id, data in clientes_con_ipo.items():
+        if data['dias_desde_ipo'] >= DIAS_TAREA_IPO and cliente_id not in excluidos:
+            nuevas[cliente_id] = {
+                'cliente_id': cliente_id,
+                'equipo_id': data['equipo_id'],
+                'estado': 'abierta',
+                'motivo_creacion': 'ipo_15_dias',
+                'dias_desde_ipo': data['dias_desde_ipo'],
+                'creado_por': 'sistema'
+            }
+
+    for cliente_id, data in clientes_con_fin_contrato.items():
+        if 0 <= data['dias_hasta_fin'] <= DIAS_TAREA_FIN_CONTRATO and cliente_id not in excluidos and cliente_id not in nuevas:
+            nuevas[cliente_id] = {
+                'cliente_id': cliente_id,
+                'equipo_id': None,
+                'estado': 'abierta',
+                'motivo_creacion': 'fin_contrato_120_dias',
+                'dias_desde_ipo': None,
+                'creado_por': 'sistema'
+            }
+
+    return list(nuevas.values())
+
+
+def reconciliar_tareas_automaticas(hoy=None):
+    """
+    Crea en bloque las tareas automáticas que faltan
+
+    Returns:
+        dict: clientes_ipo, clientes_fin_contrato, tareas_creadas
+    """
+    hoy = hoy or datetime.now().date()
+
+    clientes_con_ipo = obtener_clientes_con_ipo(hoy)
+    clientes_con_fin_contrato = obtener_clientes_con_fin_contrato(hoy)
+    clientes_abiertos, clientes_descartados = obtener_clientes_con_tareas()
+
+    nuevas = calcular_tareas_pendientes(
+        clientes_con_ipo, clientes_con_fin_contrato, clientes_abiertos, clientes_descartados
+    )
+
+    if nuevas:
+        response = requests.post(
+            f"{config.SUPABASE_URL}/rest/v1/seguimiento_comercial_tareas",
+            json=nuevas,
+            headers={**config.HEADERS, "Prefer": "return=minimal"},
+            timeout=30
+        )
+        response.raise_for_status()
+
+    stats = {
+        'clientes_ipo': len(clientes_con_ipo),
+        'clientes_fin_contrato': len(clientes_con_fin_contrato),
+        'tareas_creadas': len(nuevas)
+    }
+    logger.info(f"Reconciliación de tareas de seguimiento: {stats}")
+    return stats
+
+
+def _reconciliar_con_bloqueo(esperar):
+    """
+    Ejecuta la reconciliación con un bloqueo de fichero entre workers
+
+    Args:
+        esperar: True espera a que termine otra ejecución en curso (los cambios
+                 recién guardados deben reflejarse); False la omite
+    """
+    with open(ARCHIVO_CONTROL, 'a') as control:
+        try:
+            fcntl.flock(control, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        try:
+            return reconciliar_tareas_automaticas()
+        except Exception as e:
+            logger.error(f"Error en reconciliación de tareas de seguimiento: {type(e).__name__}: {str(e)}")
+            return None
+        finally:
+            os.utime(ARCHIVO_CONTROL)
+            fcntl.flock(control, fcntl.LOCK_UN)
+
+
+def lanzar_reconciliacion():
+    """Lanza la reconciliación en segundo plano (tras guardar fechas de IPO o de contrato)"""
+    threading.Thread(target=_reconciliar_con_bloqueo, args=(True,), daemon=True).start()
+
+
+def reconciliar_si_caducada():
+    """Lanza la reconciliación en segundo plano si la última tiene más de INTERVALO_RECONCILIACION"""
+    try:
+        ultima = os.path.getmtime(ARCHIVO_CONTROL)
+    except OSError:
+        ultima = 0
+
+    if time.time() - ultima >= INTERVALO_RECONCILIACION.total_seconds():
+        # Marcar ya para que las vistas concurrentes no lancen otra
+        with open(ARCHIVO_CONTROL, 'a'):
+            os.utime(ARCHIVO_CONTROL)
+        threading.Thread(target=_reconciliar_con_bloqueo, args=(False,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(reconciliar_tareas_automaticas())
@@ -0,0 +1,228 @@
+"""
+Servicio de Storage - PDFs de inspecciones en Supabase Storage
+
+Los PDFs se guardan con nombre por contenido (inspecciones/<sha256>.pdf), y
+hay dos formas de subirlos:
+- Subida directa: el navegador calcula el hash, pide una URL de subida
+  firmada (crear_url_subida) y envía el PDF a Storage sin pasar por Flask;
+  después se confirma la subida y se guarda la URL pública
+- Fallback (formulario clásico): el fichero temporal de la petición se envía
+  a Storage en streaming, por bloques, sin leerlo entero en memoria
+
+Un PDF que ya está en Storage (subido otra vez, a esta u otra inspección)
+no se vuelve a transferir: solo se actualiza la URL.
+
+El hash de la subida directa lo declara el navegador, así que no se da por
+bueno: la URL firmada no permite sobrescribir (sin x-upsert) y al confirmar
+el servidor descarga el objeto y comprueba su sha256 (verificar_objeto). Un
+objeto cuyo contenido no coincide con su nombre se elimina.
+"""
+import hashlib
+import logging
+import re
+
+import requests
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Bucket público de PDFs (scripts/setup_storage_bucket.py)
+BUCKET_INSPECCIONES = "inspecciones-pdfs"
+CARPETA_INSPECCIONES = "inspecciones"
+
+# Bloque de lectura para calcular el hash del fichero
+TAMANO_BLOQUE = 1024 * 1024
+
+# Timeout (conexión, lectura) de la subida: actas escaneadas de varios MB
+TIMEOUT_SUBIDA = (10, 300)
+
+RE_HASH = re.compile(r'^[0-9a-f]{64}$')
+RE_URL_POR_CONTENIDO = re.compile(rf'/{BUCKET_INSPECCIONES}/{CARPETA_INSPECCIONES}/([0-9a-f]{{64}})\.pdf$')
+
+
+def hash_valido(valor):
+    """True si valor es un sha256 en hexadecimal"""
+    return bool(RE_HASH.match(valor or ''))
+
+
+def hash_stream(stream):
+    """
+    sha256 de un fichero leyendo por bloques (deja el puntero al inicio)
+    """
+    sha = hashlib.sha256()
+    stream.seek(0)
+    for bloque in iter(lambda: stream.read(TAMANO_BLOQUE), b''):
+        sha.update(bloque)
+    stream.seek(0)
+    return sha.hexdigest()
+
+
+def ruta_pdf_inspeccion(hash_pdf):
+    """Ruta del PDF dentro del bucket"""
+    return f"{CARPETA_INSPECCIONES}/{hash_pdf}.pdf"
+
+
+def url_publica(ruta):
+    """URL pública de un objeto del bucket"""
+    return f"{config.SUPABASE_URL}/storage/v1/object/public/{BUCKET_INSPECCIONES}/{ruta}"
+
+
+def hash_desde_url(url):
+    """
+    Hash del PDF a partir de su URL pública
+
+    Returns:
+        sha256 si la URL es de un PDF guardado por contenido, None si no
+        (PDFs antiguos guardados como inspeccion_<id>_<tipo>.pdf)
+    """
+    coincidencia = RE_URL_POR_CONTENIDO.search(url or '')
+    return coincidencia.group(1) if coincidencia else None
+
+
+def existe_objeto(ruta):
+    """True si el objeto ya está en el bucket"""
+    try:
+        response = requests.head(url_publica(ruta), timeout=10)
+        return response.status_code == 200
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo comprobar {ruta} en Storage: {type(e).__name__}: {str(e)}")
+        return False
+
+
+def hash_objeto(ruta):
+    """
+    sha256 del contenido de un objeto del bucket (descarga en streaming)
+
+    Returns:
+        sha256 en hexadecimal o None si no se pudo descargar
+    """
+    sha = hashlib.sha256()
+    try:
+        with requests.get(url_publica(ruta), stream=True, timeout=TIMEOUT_SUBIDA) as response:
+            if response.status_code != 200:
+                return None
+            for bloque in response.iter_content(TAMANO_BLOQUE):
+                sha.update(bloque)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo descargar {ruta} de Storage: {type(e).__name__}: {str(e)}")
+        return None
+    return sha.hexdigest()
+
+
+def eliminar_objeto(ruta):
+    """Elimina un objeto del bucket (True si se eliminó)"""
+    try:
+        response = requests.delete(
+            f"{config.SUPABASE_URL}/storage/v1/object/{BUCKET_INSPECCIONES}/{ruta}",
+            headers=config.STORAGE_HEADERS,
+            timeout=10
+        )
+        return response.ok
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo eliminar {ruta} de Storage: {type(e).__name__}: {str(e)}")
+        return False
+
+
+def verificar_objeto(hash_pdf):
+    """
+    Comprueba que el objeto guardado como <hash_pdf>.pdf tiene ese contenido
+
+    Un objeto que no coincide (subida firmada con un hash falso) se elimina
+    para que no lo reutilice ninguna inspección.
+
+    Returns:
+        tuple: (True/False, error o None)
+    """
+    ruta = ruta_pdf_inspeccion(hash_pdf)
+    hash_real = hash_objeto(ruta)
+    if hash_real is None:
+        return False, "El archivo no está en Storage"
+    if hash_real != hash_pdf:
+        logger.warning(f"⚠️ {ruta} no coincide con su contenido ({hash_real[:12]}): se elimina")
+        eliminar_objeto(ruta)
+        return False, "El contenido del archivo no coincide con su hash"
+    return True, None
+
+
+def crear_url_subida(ruta):
+    """
+    URL firmada para que el navegador suba el objeto directamente a Storage
+
+    La URL solo sirve para esta ruta, caduca a las 2 horas (Supabase) y no
+    permite sobrescribir un objeto existente.
+
+    Returns:
+        tuple: (url absoluta o None, error o None)
+    """
+    try:
+        response = requests.post(
+            f"{config.SUPABASE_URL}/storage/v1/object/upload/sign/{BUCKET_INSPECCIONES}/{ruta}",
+            headers=config.STORAGE_HEADERS,
+            timeout=10
+        )
+    except Exception as e:
+        return None, f"{type(e).__name__}: {str(e)}"
+
+    if not response.ok:
+        return None, f"{response.status_code} - {response.text[:200]}"
+
+    datos = response.json()
+    if datos.get('url'):
+        # Ruta relativa a /storage/v1: /object/upload/sign/<bucket>/<ruta>?token=...
+        return f"{config.SUPABASE_URL}/storage/v1{datos['url']}", None
+    if datos.get('token'):
+        return f"{config.SUPABASE_URL}/storage/v1/object/upload/sign/{BUCKET_INSPECCIONES}/{ruta}?token={datos['token']}", None
+    return None, "Respuesta de Storage sin URL firmada"
+
+
+def subir_stream(ruta, stream, content_type="application/pdf"):
+    """
+    Sube un fichero a Storage en streaming
+
+    requests envía el fichero por bloques a medida que lo lee (no lo carga
+    en memoria). x-upsert sobrescribe el objeto si ya existe, sin borrarlo
+    antes.
+
+    Returns:
+        tuple: (True/False, error o None)
+    """
+    stream.seek(0)
+    try:
+        response = requests.post(
+            f"{config.SUPABASE_URL}/storage/v1/object/{BUCKET_INSPECCIONES}/{ruta}",
+            data=stream,
+            headers={**config.STORAGE_HEADERS, "Content-Type": content_type, "x-upsert": "true"},
+            timeout=TIMEOUT_SUBIDA
+        )
+    except Exception as e:
+        return False, f"{type(e).__name__}: {str(e)}"
+
+    if response.status_code not in [200, 201]:
+        return False, f"{response.status_code} - {response.text[:200]}"
+    return True, None
+
+
+def subir_pdf_inspeccion(stream):
+    """
+    Sube un PDF de inspección (acta o presupuesto) deduplicando por contenido
+
+    Args:
+        stream: Fichero abierto en binario (p. ej. FileStorage.stream)
+
+    Returns:
+        tuple: (dict {url, hash, reutilizado} o None, error o None)
+    """
+    hash_pdf = hash_stream(stream)
+    ruta = ruta_pdf_inspeccion(hash_pdf)
+
+    # Solo se reutiliza un objeto existente si su contenido es el esperado;
+    # si no (subida firmada con un hash falso) se sobrescribe con este PDF
+    if existe_objeto(ruta) and hash_objeto(ruta) == hash_pdf:
+        logger.info(f"📄 PDF {hash_pdf[:12]} ya en Storage: no se vuelve a subir")
+        return {'url': url_publica(ruta), 'hash': hash_pdf, 'reutilizado': True}, None
+
+    ok, error = subir_stream(ruta, stream)
+    if not ok:
+        return None, error
+    return {'url': url_publica(ruta), 'hash': hash_pdf, 'reutilizado': False}, None
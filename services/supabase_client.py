@@ -1,8 +1,10 @@
 """
 Cliente simplificado para operaciones con Supabase
 """
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from config import config
+from middleware.tiempos import propagar_traza
 
 
 class SupabaseClient:
@@ -150,6 +152,149 @@ class SupabaseClient:
             print(f"❌ Excepción en DELETE {table}: {type(e).__name__}: {str(e)}")
             return False
 
+    def upsert(self, table, rows, on_conflict, batch_size=500, parallel=1,
+               returning=True, ignore_duplicates=False, timeout=30):
+        """
+        Inserta o actualiza registros en bloque (INSERT ... ON CONFLICT)
+
+        Cada lote es una sola petición POST con `on_conflict` y
+        `Prefer: resolution=merge-duplicates`: los registros que ya existen
+        (según la restricción UNIQUE de `on_conflict`) se actualizan con los
+        campos enviados, el resto se insertan.
+
+        Args:
+            table: Nombre de la tabla
+            rows: Lista de diccionarios (todos con las mismas claves)
+            on_conflict: Columna(s) con restricción UNIQUE (ej: "identificador")
+            batch_size: Registros por petición
+            parallel: Lotes enviados en paralelo (1 = secuencial)
+            returning: Devolver las filas resultantes (return=representation)
+            ignore_duplicates: No tocar los existentes (resolution=ignore-duplicates)
+            timeout: Timeout en segundos por lote
+
+        Returns:
+            tuple: (filas devueltas, lista de (índice del primer registro del lote, error))
+        """
+        url = f"{self.url}/rest/v1/{table}?on_conflict={on_conflict}"
+        resolution = "ignore-duplicates" if ignore_duplicates else "merge-duplicates"
+        headers = {
+            **self.headers,
+            "Prefer": f"resolution={resolution},return={'representation' if returning else 'minimal'}"
+        }
+
+        def enviar_lote(inicio):
+            lote = rows[inicio:inicio + batch_size]
+            try:
+                response = requests.post(url, json=lote, headers=headers, timeout=timeout)
+                if response.ok:
+                    return (response.json() if returning else []), None
+                print(f"⚠️ Error en UPSERT {table} (lote {inicio}-{inicio + len(lote) - 1}): {response.status_code}")
+                print(f"📄 Respuesta: {response.text[:200]}")
+                return [], f"{response.status_code} - {response.text[:200]}"
+            except Exception as e:
+                print(f"❌ Excepción en UPSERT {table}: {type(e).__name__}: {str(e)}")
+                return [], f"{type(e).__name__}: {str(e)}"
+
+        inicios = range(0, len(rows), batch_size)
+        if parallel > 1 and len(inicios) > 1:
+            with ThreadPoolExecutor(max_workers=parallel) as pool:
+                resultados = list(pool.map(propagar_traza(enviar_lote), inicios))
+        else:
+            resultados = [enviar_lote(inicio) for inicio in inicios]
+
+        filas = []
+        errores = []
+        for inicio, (filas_lote, error) in zip(inicios, resultados):
+            filas.extend(filas_lote)
+            if error:
+                errores.append((inicio, error))
+        return filas, errores
+
+    def insert_many(self, table, rows, batch_size=500, returning=True, timeout=30):
+        """
+        Inserta registros en bloque (un POST multi-fila por lote)
+
+        Un lote rechazado por PostgREST (4xx) falla entero sin insertar nada;
+        en ese caso se divide en mitades hasta aislar las filas con error, de
+        modo que el resto se inserta igualmente y cada error queda asociado a
+        su fila. Errores 5xx o de red no se reintentan (el lote podría haberse
+        insertado) y se reportan en todas las filas del lote.
+
+        Args:
+            table: Nombre de la tabla
+            rows: Lista de diccionarios (las claves ausentes toman el DEFAULT de la columna)
+            batch_size: Registros por petición
+            returning: Devolver las filas insertadas (return=representation)
+            timeout: Timeout en segundos por petición
+
+        Returns:
+            tuple: (filas insertadas, lista de (índice de la fila en rows, error))
+        """
+        # Columnas explícitas: las filas pueden traer claves distintas
+        columnas = list(dict.fromkeys(clave for fila in rows for clave in fila))
+        url = f"{self.url}/rest/v1/{table}?columns={','.join(columnas)}"
+        headers = {
+            **self.headers,
+            "Prefer": f"missing=default,return={'representation' if returning else 'minimal'}"
+        }
+
+        def enviar(inicio, fin):
+            lote = rows[inicio:fin]
+            try:
+                response = requests.post(url, json=lote, headers=headers, timeout=timeout)
+            except Exception as e:
+                # Sin respuesta no se sabe si el lote llegó a insertarse: no se reintenta
+                print(f"❌ Excepción en INSERT {table} (filas {inicio}-{fin - 1}): {type(e).__name__}: {str(e)}")
+                return [], [(i, f"{type(e).__name__}: {str(e)}") for i in range(inicio, fin)]
+
+            if response.ok:
+                return (response.json() if returning else []), []
+
+            error = f"{response.status_code} - {response.text[:200]}"
+            if len(lote) == 1 or response.status_code >= 500:
+                print(f"⚠️ Error en INSERT {table} (filas {inicio}-{fin - 1}): {error}")
+                return [], [(i, error) for i in range(inicio, fin)]
+
+            # Aislar las filas con error
+            medio = (inicio + fin) // 2
+            filas_a, errores_a = enviar(inicio, medio)
+            filas_b, errores_b = enviar(medio, fin)
+            return filas_a + filas_b, errores_a + errores_b
+
+        filas = []
+        errores = []
+        for inicio in range(0, len(rows), batch_size):
+            filas_lote, errores_lote = enviar(inicio, min(inicio + batch_size, len(rows)))
+            filas.extend(filas_lote)
+            errores.extend(errores_lote)
+        return filas, errores
+
+    def rpc(self, function, params=None, timeout=10):
+        """
+        Ejecuta una función de Postgres expuesta por PostgREST (/rpc)
+
+        Args:
+            function: Nombre de la función (ej: "fn_detalle_maquina_cartera")
+            params: Diccionario con los argumentos de la función
+            timeout: Timeout en segundos
+
+        Returns:
+            Resultado JSON de la función o None si hay error
+        """
+        url = f"{self.url}/rest/v1/rpc/{function}"
+
+        try:
+            response = requests.post(url, json=params or {}, headers=self.headers, timeout=timeout)
+            if response.ok:
+                return response.json()
+            else:
+                print(f"⚠️ Error en RPC {function}: {response.status_code}")
+                print(f"📄 Respuesta: {response.text[:200]}")
+                return None
+        except Exception as e:
+            print(f"❌ Excepción en RPC {function}: {type(e).__name__}: {str(e)}")
+            return None
+
     def count(self, table, filters=None, timeout=10):
         """
         Cuenta registros en una tabla
@@ -165,6 +310,38 @@ class SupabaseClient:
         result = self.get(table, select="id", filters=filters, timeout=timeout)
         return len(result) if result else 0
 
+    def count_exact(self, table, filters=None, timeout=10):
+        """
+        Cuenta registros en el servidor (Prefer: count=exact) sin descargar filas
+
+        Args:
+            table: Nombre de la tabla
+            filters: Diccionario de filtros opcionales
+            timeout: Timeout en segundos
+
+        Returns:
+            Número de registros o None si hay error
+        """
+        url = f"{self.url}/rest/v1/{table}?select=id"
+
+        if filters:
+            for key, value in filters.items():
+                url += f"&{key}={value}"
+
+        try:
+            response = requests.head(
+                url,
+                headers={**self.headers, "Prefer": "count=exact", "Range": "0-0"},
+                timeout=timeout
+            )
+            if response.ok:
+                return int(response.headers.get("Content-Range", "*/0").split("/")[-1])
+            print(f"⚠️ Error en COUNT {table}: {response.status_code}")
+            return None
+        except Exception as e:
+            print(f"❌ Excepción en COUNT {table}: {type(e).__name__}: {str(e)}")
+            return None
+
 
 # Instancia global del cliente
 db = SupabaseClient()
@@ -1,6 +1,14 @@
 """
 Helper para paginación consistente en toda la aplicación
+
+- Pagination / paginate_query: limit/offset con número de página
+- CursorPagination / paginate_query_cursor: por cursor (keyset), para
+  listados largos
 """
+import base64
+import json
+from urllib.parse import quote
+
 from flask import request
 
 
@@ -57,6 +65,21 @@ class Pagination:
         """Número de página siguiente (o None)"""
         return self.page + 1 if self.has_next else None
 
+    @property
+    def prev_query(self):
+        """Parámetro de URL para la página anterior (misma interfaz que CursorPagination)"""
+        return f"page={self.prev_page}" if self.has_prev else ""
+
+    @property
+    def next_query(self):
+        """Parámetro de URL para la página siguiente"""
+        return f"page={self.next_page}" if self.has_next else ""
+
+    @property
+    def last_query(self):
+        """Parámetro de URL para la última página"""
+        return f"page={self.total_pages}"
+
     def iter_pages(self, left_edge=2, left_current=2, right_current=3, right_edge=2):
         """
         Genera números de página para mostrar en UI
@@ -189,3 +212,292 @@ def paginate_query(query_url, headers, per_page_default=25, filters=None):
         return pagination, data
     else:
         return pagination, []
+
+
+# ============================================
+# PAGINACIÓN POR CURSOR (KEYSET)
+# ============================================
+# Con limit/offset la base de datos lee y descarta todas las filas
+# anteriores, y cada página pide además un count=exact (recorrido completo).
+# En modo cursor cada página filtra a partir de la última fila mostrada
+# (columna de orden + id, con gt/lt) y el total se estima una sola vez
+# (Prefer: count=estimated) y viaja en el cursor: la página N cuesta lo
+# mismo que la primera.
+
+def encode_cursor(data):
+    """Codifica el estado de un cursor en un token apto para URL"""
+    texto = json.dumps(data, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Decodifica un token de encode_cursor
+
+    Returns:
+        dict o None si el token no es válido (se muestra la primera página)
+    """
+    if not token:
+        return None
+    try:
+        texto = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        data = json.loads(texto)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(data, dict) or data.get('d') not in ('n', 'p'):
+        return None
+    return data
+
+
+class CursorPagination:
+    """
+    Paginación por cursor sobre (columna de orden, id)
+
+    El cursor guarda la dirección ('n' = filas después de la ancla,
+    'p' = filas antes), la ancla (valor de la columna de orden e id), el
+    número de página y el total estimado. Un cursor 'p' sin ancla es la
+    última página.
+
+    La columna de orden puede tener NULLs: se ordenan como en PostgreSQL
+    (primero en orden descendente, al final en ascendente) y el filtro los
+    incluye o los recorre por id según el lado de la ancla en el que queden.
+    """
+
+    def __init__(self, order_column, descending=True, per_page=25, cursor=None):
+        """
+        Args:
+            order_column: Columna de orden ('id' para ordenar solo por id)
+            descending: Orden descendente (más reciente primero)
+            per_page: Elementos por página
+            cursor: Token recibido en la petición (None = primera página)
+        """
+        self.order_column = order_column
+        self.descending = descending
+        self.per_page = max(1, per_page)
+
+        data = decode_cursor(cursor) or {}
+        self.direction = data.get('d')
+        self.anchor = (data.get('v'), data['i']) if 'i' in data else None
+        self.page = max(1, int(data.get('p', 1)))
+        self.total = data.get('t')
+        # Filas de la última página (cursor 'p' sin ancla)
+        self.last_rows = data.get('n')
+
+        self.has_prev = False
+        self.has_next = False
+        self.prev_cursor = None
+        self.next_cursor = None
+
+    @property
+    def limit(self):
+        """Filas a pedir: una más que las de la página para saber si hay otra"""
+        if self.direction == 'p' and self.anchor is None and self.last_rows:
+            return self.last_rows + 1
+        return self.per_page + 1
+
+    @property
+    def _reversed(self):
+        # Hacia atrás se consulta en orden inverso y se da la vuelta al resultado
+        return self.direction == 'p'
+
+    @property
+    def order(self):
+        """Parámetro order de PostgREST (columna de orden + id como desempate)"""
+        desc = self.descending != self._reversed
+        direccion = 'desc' if desc else 'asc'
+        if self.order_column == 'id':
+            return f"id.{direccion}"
+        return f"{self.order_column}.{direccion},id.{direccion}"
+
+    def filters(self):
+        """
+        Filtros de PostgREST que empiezan la página tras (o antes de) la ancla
+
+        Returns:
+            dict (vacío en la primera y la última página)
+        """
+        if self.anchor is None:
+            return {}
+        valor, ultimo_id = self.anchor
+        op = 'lt' if self.descending != self._reversed else 'gt'
+        if self.order_column == 'id':
+            return {'id': f"{op}.{ultimo_id}"}
+        columna = self.order_column
+        # PostgreSQL ordena los NULLs primero en desc (op 'lt') y al final en asc ('gt')
+        nulos_al_final = op == 'gt'
+        if valor is None:
+            # Ancla NULL: resto de NULLs por id y, si van primero, todas las filas con valor
+            nulos = f'{columna}.is.null,id.{op}.{ultimo_id}'
+            if nulos_al_final:
+                return {'and': quote(f'({nulos})', safe='')}
+            return {'or': quote(f'(and({nulos}),{columna}.not.is.null)', safe='')}
+        # Valores entre comillas: fechas con ':' o '+', textos con ','
+        valor = str(valor).replace('"', '\\"')
+        condiciones = f'{columna}.{op}."{valor}",and({columna}.eq."{valor}",id.{op}.{ultimo_id})'
+        if nulos_al_final:
+            condiciones += f',{columna}.is.null'
+        return {'or': quote(f'({condiciones})', safe='')}
+
+    def _cursor(self, direction, row, page):
+        data = {'d': direction, 'i': row['id'], 'p': page}
+        if self.order_column != 'id':
+            data['v'] = row[self.order_column]
+        if self.total is not None:
+            data['t'] = self.total
+        return encode_cursor(data)
+
+    def process(self, rows):
+        """
+        Recorta las filas pedidas (limit) a la página y calcula los cursores
+
+        Args:
+            rows: Filas devueltas por la query (con order, filters y limit)
+
+        Returns:
+            list: Filas de la página en el orden de presentación
+        """
+        page_size = self.limit - 1
+        extra = len(rows) > page_size
+        rows = rows[:page_size]
+
+        if self._reversed:
+            rows = rows[::-1]
+            self.has_prev = extra
+            # La última página (cursor 'p' sin ancla) no tiene siguiente
+            self.has_next = self.anchor is not None
+            if not extra:
+                self.page = 1
+        else:
+            self.has_prev = self.direction == 'n'
+            self.has_next = extra
+
+        if self.has_next and rows:
+            self.next_cursor = self._cursor('n', rows[-1], self.page + 1)
+        if self.has_prev and rows and self.page > 2:
+            self.prev_cursor = self._cursor('p', rows[0], self.page - 1)
+        # Página anterior = primera: sin cursor (prev_cursor None)
+        return rows
+
+    @property
+    def total_pages(self):
+        """Total de páginas según el total estimado (None si no se conoce)"""
+        if self.total is None:
+            return None
+        return max(1, (self.total + self.per_page - 1) // self.per_page, self.page)
+
+    @property
+    def last_cursor(self):
+        """Cursor de la última página (None si no se conoce el total)"""
+        if not self.total or self.total_pages <= 1:
+            return None
+        resto = self.total - (self.total_pages - 1) * self.per_page
+        return encode_cursor({
+            'd': 'p', 'p': self.total_pages, 't': self.total,
+            'n': resto if 0 < resto <= self.per_page else self.per_page
+        })
+
+    @property
+    def prev_query(self):
+        """Parámetro de URL para la página anterior ('' = primera página)"""
+        return f"cursor={self.prev_cursor}" if self.prev_cursor else ""
+
+    @property
+    def next_query(self):
+        """Parámetro de URL para la página siguiente"""
+        return f"cursor={self.next_cursor}" if self.next_cursor else ""
+
+    @property
+    def last_query(self):
+        """Parámetro de URL para la última página"""
+        cursor = self.last_cursor
+        return f"cursor={cursor}" if cursor else ""
+
+    def to_dict(self):
+        """Retorna diccionario con toda la info de paginación"""
+        return {
+            'page': self.page,
+            'per_page': self.per_page,
+            'total': self.total,
+            'total_pages': self.total_pages,
+            'has_prev': self.has_prev,
+            'has_next': self.has_next,
+            'prev_cursor': self.prev_cursor,
+            'next_cursor': self.next_cursor
+        }
+
+
+def get_cursor_pagination(order_column, descending=True, per_page_default=25):
+    """
+    Obtiene paginación por cursor desde request.args ('cursor' y 'per_page')
+
+    Returns:
+        CursorPagination
+    """
+    try:
+        per_page = int(request.args.get('per_page', per_page_default))
+    except (ValueError, TypeError):
+        per_page = per_page_default
+
+    return CursorPagination(order_column, descending, per_page, request.args.get('cursor'))
+
+
+def paginate_query_cursor(query_url, headers, order_column, descending=True,
+                          per_page_default=25, filters=None, count=True, timeout=10):
+    """
+    Como paginate_query, pero por cursor (keyset) y con total estimado
+
+    El total se pide (Prefer: count=estimated, en la misma query) solo en la
+    primera página; las siguientes lo reciben en el cursor.
+
+    Args:
+        query_url: URL base de Supabase con select (sin order ni paginación)
+        headers: Headers para la request
+        order_column: Columna de orden (admite NULLs; el id desempata)
+        descending: Orden descendente
+        per_page_default: Elementos por página por defecto
+        filters: Filtros adicionales para la query (dict)
+        count: Estimar el total de filas
+        timeout: Timeout en segundos
+
+    Returns:
+        tuple: (pagination, data) donde pagination es CursorPagination
+
+    Ejemplo:
+        pagination, visitas = paginate_query_cursor(
+            f"{SUPABASE_URL}/rest/v1/visitas_administradores?select=id,fecha_visita",
+            HEADERS,
+            order_column='fecha_visita'
+        )
+    """
+    import requests
+
+    pagination = get_cursor_pagination(order_column, descending, per_page_default)
+
+    url = query_url
+    for key, value in {**(filters or {}), **pagination.filters()}.items():
+        separator = '&' if '?' in url else '?'
+        url += f"{separator}{key}={value}"
+
+    separator = '&' if '?' in url else '?'
+    url += f"{separator}order={pagination.order}&limit={pagination.limit}"
+
+    contar = count and pagination.total is None
+    if contar:
+        headers = {**headers, "Prefer": "count=estimated"}
+
+    try:
+        response = requests.get(url, headers=headers, timeout=timeout)
+    except Exception as e:
+        print(f"❌ Excepción en paginación por cursor: {type(e).__name__}: {str(e)}")
+        return pagination, []
+
+    if response.status_code not in [200, 206]:
+        print(f"⚠️ Error en paginación por cursor: {response.status_code} - {response.text[:200]}")
+        return pagination, []
+
+    if contar:
+        # Format: "0-25/100" o "*/100"; "*" si no hay estimación
+        total_str = response.headers.get('Content-Range', '*/*').split('/')[-1]
+        pagination.total = int(total_str) if total_str.isdigit() else None
+
+    return pagination, pagination.process(response.json())
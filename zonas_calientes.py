@@ -11,6 +11,15 @@ from collections import defaultdict
 import json
 import math
 
+import numpy as np
+
+from almacen_edificios import (
+    AlmacenEdificios,
+    CATEGORIA_SIN_DATOS,
+    CATEGORIA_MODERNO,
+    CATEGORIA_ANTIGUO,
+    CATEGORIA_MUY_ANTIGUO,
+)
 from catastro_service import CatastroService
 from geocoding_service import GeocodingService
 
@@ -22,14 +31,18 @@ class EdificioCandidato:
     """Representa un edificio candidato a modernización"""
     referencia_catastral: str
     direccion: str
-    latitud: float
-    longitud: float
+    latitud: Optional[float]
+    longitud: Optional[float]
     anio_construccion: Optional[int]
     antiguedad: Optional[int]
     uso: str
     superficie: float
     score_modernizacion: float = 0.0
     categoria_antiguedad: str = ""
+    # Cruce con la cartera (cruce_cartera.IndiceCartera.cruzar)
+    estado_cartera: str = ""
+    empresa_mantenedora: Optional[str] = None
+    cartera_id: Optional[str] = None
 
 
 @dataclass
@@ -66,10 +79,21 @@ class DetectorZonasCalientes:
     PESO_ANTIGUO = 2.0
     PESO_MODERNO = 0.5
 
+    # Palabras clave de uso residencial (Catastro)
+    USOS_RESIDENCIALES = ['resid', 'viviend', 'almacen', '1-', '2-']
+
+    NOMBRES_CATEGORIA = {
+        CATEGORIA_SIN_DATOS: "Sin datos",
+        CATEGORIA_MODERNO: "Moderno (<30 años)",
+        CATEGORIA_ANTIGUO: "Antiguo (30-50 años)",
+        CATEGORIA_MUY_ANTIGUO: "Muy antiguo (>50 años)",
+    }
+
     def __init__(
         self,
         catastro_service: Optional[CatastroService] = None,
-        geocoding_service: Optional[GeocodingService] = None
+        geocoding_service: Optional[GeocodingService] = None,
+        almacen: Optional[AlmacenEdificios] = None
     ):
         """
         Inicializa el detector de zonas calientes.
@@ -77,9 +101,12 @@ class DetectorZonasCalientes:
         Args:
             catastro_service: Servicio de Catastro (se crea uno nuevo si no se proporciona)
             geocoding_service: Servicio de geocodificación (se crea uno nuevo si no se proporciona)
+            almacen: Almacén de edificios con índice espacial; acumula todos los
+                edificios de los análisis del detector (se crea uno si no se proporciona)
         """
         self.catastro = catastro_service or CatastroService()
         self.geocoding = geocoding_service or GeocodingService()
+        self.almacen = almacen or AlmacenEdificios()
 
     def analizar_zona_por_direcciones(
         self,
@@ -128,46 +155,9 @@ class DetectorZonasCalientes:
             )
             todos_inmuebles.extend(inmuebles)
 
-        # Eliminar duplicados por referencia catastral
-        inmuebles_unicos = {
-            inm['referencia_catastral']: inm
-            for inm in todos_inmuebles
-            if inm.get('referencia_catastral')
-        }
-
-        logger.info(f"Total de inmuebles únicos encontrados: {len(inmuebles_unicos)}")
-
-        # 4. Filtrar y clasificar edificios
-        edificios_candidatos = []
-        for datos in inmuebles_unicos.values():
-            # Filtrar residenciales si se requiere
-            if solo_residencial and not self._es_residencial(datos.get('uso', '')):
-                continue
-
-            # Calcular antigüedad
-            anio_construccion = datos.get('anio_construccion')
-            if anio_construccion:
-                antiguedad = self.ANIO_ACTUAL - anio_construccion
-                categoria = self._clasificar_antiguedad(antiguedad)
-                score = self._calcular_score_modernizacion(antiguedad)
-            else:
-                antiguedad = None
-                categoria = "Sin datos"
-                score = 0.0
-
-            edificio = EdificioCandidato(
-                referencia_catastral=datos.get('referencia_catastral', ''),
-                direccion=datos.get('direccion', ''),
-                latitud=datos.get('latitud', 0),
-                longitud=datos.get('longitud', 0),
-                anio_construccion=anio_construccion,
-                antiguedad=antiguedad,
-                uso=datos.get('uso', ''),
-                superficie=datos.get('superficie', 0),
-                score_modernizacion=score,
-                categoria_antiguedad=categoria
-            )
-            edificios_candidatos.append(edificio)
+        # 4. Filtrar y clasificar edificios (el almacén elimina duplicados
+        # por referencia catastral entre las semillas)
+        edificios_candidatos = self._procesar_inmuebles(todos_inmuebles, solo_residencial)
 
         # 5. Generar estadísticas
         zona = self._crear_zona_caliente(
@@ -188,7 +178,9 @@ class DetectorZonasCalientes:
         nombre_zona: str,
         ciudad: str = "Las Palmas de Gran Canaria",
         grid_size: int = 7,
-        solo_residencial: bool = True
+        solo_residencial: bool = True,
+        muestreo_adaptativo: bool = True,
+        presupuesto_consultas: Optional[int] = None
     ) -> ZonaCaliente:
         """
         Analiza una zona por su nombre (barrio, distrito, etc.).
@@ -196,8 +188,13 @@ class DetectorZonasCalientes:
         Args:
             nombre_zona: Nombre de la zona (ej: "Casablanca III")
             ciudad: Ciudad
-            grid_size: Tamaño de cuadrícula de muestreo
+            grid_size: Tamaño de cuadrícula de muestreo (con muestreo adaptativo
+                fija el presupuesto por defecto: grid_size², las mismas
+                consultas que la cuadrícula fija)
             solo_residencial: Si True, filtra solo inmuebles residenciales
+            muestreo_adaptativo: Si True, quadtree sobre el bbox (ver
+                _obtener_inmuebles_bbox); si False, cuadrícula fija
+            presupuesto_consultas: Máximo de puntos consultados al Catastro
 
         Returns:
             ZonaCaliente con el análisis
@@ -223,42 +220,12 @@ class DetectorZonasCalientes:
         logger.info(f"Área de zona: {zona_data['area_km2']:.2f} km², radio aproximado: {radio_metros}m")
 
         # Obtener datos del área
-        inmuebles = self.catastro.obtener_datos_area(
-            lat_centro=zona_data['latitud'],
-            lon_centro=zona_data['longitud'],
-            radio_metros=radio_metros,
-            grid_size=grid_size
+        inmuebles = self._obtener_inmuebles_bbox(
+            zona_data, radio_metros, grid_size, muestreo_adaptativo, presupuesto_consultas
         )
 
         # Procesar edificios
-        edificios_candidatos = []
-        for datos in inmuebles:
-            if solo_residencial and not self._es_residencial(datos.get('uso', '')):
-                continue
-
-            anio_construccion = datos.get('anio_construccion')
-            if anio_construccion:
-                antiguedad = self.ANIO_ACTUAL - anio_construccion
-                categoria = self._clasificar_antiguedad(antiguedad)
-                score = self._calcular_score_modernizacion(antiguedad)
-            else:
-                antiguedad = None
-                categoria = "Sin datos"
-                score = 0.0
-
-            edificio = EdificioCandidato(
-                referencia_catastral=datos.get('referencia_catastral', ''),
-                direccion=datos.get('direccion', ''),
-                latitud=datos.get('latitud', 0),
-                longitud=datos.get('longitud', 0),
-                anio_construccion=anio_construccion,
-                antiguedad=antiguedad,
-                uso=datos.get('uso', ''),
-                superficie=datos.get('superficie', 0),
-                score_modernizacion=score,
-                categoria_antiguedad=categoria
-            )
-            edificios_candidatos.append(edificio)
+        edificios_candidatos = self._procesar_inmuebles(inmuebles, solo_residencial)
 
         # Generar zona caliente
         zona = self._crear_zona_caliente(
@@ -276,7 +243,9 @@ class DetectorZonasCalientes:
         codigo_postal: str,
         ciudad: str = "Las Palmas de Gran Canaria",
         grid_size: int = 6,
-        solo_residencial: bool = True
+        solo_residencial: bool = True,
+        muestreo_adaptativo: bool = True,
+        presupuesto_consultas: Optional[int] = None
     ) -> ZonaCaliente:
         """
         Analiza una zona por su código postal.
@@ -284,8 +253,13 @@ class DetectorZonasCalientes:
         Args:
             codigo_postal: Código postal de 5 dígitos (ej: "35001")
             ciudad: Ciudad donde se encuentra el código postal
-            grid_size: Tamaño de cuadrícula de muestreo
+            grid_size: Tamaño de cuadrícula de muestreo (con muestreo adaptativo
+                fija el presupuesto por defecto: grid_size², las mismas
+                consultas que la cuadrícula fija)
             solo_residencial: Si True, filtra solo inmuebles residenciales
+            muestreo_adaptativo: Si True, quadtree sobre el bbox (ver
+                _obtener_inmuebles_bbox); si False, cuadrícula fija
+            presupuesto_consultas: Máximo de puntos consultados al Catastro
 
         Returns:
             ZonaCaliente con el análisis
@@ -314,42 +288,12 @@ class DetectorZonasCalientes:
         logger.info(f"CP {codigo_postal}: área {zona_data['area_km2']:.2f} km², radio aproximado: {radio_metros}m")
 
         # Obtener datos del área
-        inmuebles = self.catastro.obtener_datos_area(
-            lat_centro=zona_data['latitud'],
-            lon_centro=zona_data['longitud'],
-            radio_metros=radio_metros,
-            grid_size=grid_size
+        inmuebles = self._obtener_inmuebles_bbox(
+            zona_data, radio_metros, grid_size, muestreo_adaptativo, presupuesto_consultas
         )
 
         # Procesar edificios
-        edificios_candidatos = []
-        for datos in inmuebles:
-            if solo_residencial and not self._es_residencial(datos.get('uso', '')):
-                continue
-
-            anio_construccion = datos.get('anio_construccion')
-            if anio_construccion:
-                antiguedad = self.ANIO_ACTUAL - anio_construccion
-                categoria = self._clasificar_antiguedad(antiguedad)
-                score = self._calcular_score_modernizacion(antiguedad)
-            else:
-                antiguedad = None
-                categoria = "Sin datos"
-                score = 0.0
-
-            edificio = EdificioCandidato(
-                referencia_catastral=datos.get('referencia_catastral', ''),
-                direccion=datos.get('direccion', ''),
-                latitud=datos.get('latitud', 0),
-                longitud=datos.get('longitud', 0),
-                anio_construccion=anio_construccion,
-                antiguedad=antiguedad,
-                uso=datos.get('uso', ''),
-                superficie=datos.get('superficie', 0),
-                score_modernizacion=score,
-                categoria_antiguedad=categoria
-            )
-            edificios_candidatos.append(edificio)
+        edificios_candidatos = self._procesar_inmuebles(inmuebles, solo_residencial)
 
         # Generar zona caliente
         zona = self._crear_zona_caliente(
@@ -416,34 +360,7 @@ class DetectorZonasCalientes:
         )
 
         # Procesar edificios
-        edificios_candidatos = []
-        for datos in inmuebles:
-            if solo_residencial and not self._es_residencial(datos.get('uso', '')):
-                continue
-
-            anio_construccion = datos.get('anio_construccion')
-            if anio_construccion:
-                antiguedad = self.ANIO_ACTUAL - anio_construccion
-                categoria = self._clasificar_antiguedad(antiguedad)
-                score = self._calcular_score_modernizacion(antiguedad)
-            else:
-                antiguedad = None
-                categoria = "Sin datos"
-                score = 0.0
-
-            edificio = EdificioCandidato(
-                referencia_catastral=datos.get('referencia_catastral', ''),
-                direccion=datos.get('direccion', ''),
-                latitud=datos.get('latitud', 0),
-                longitud=datos.get('longitud', 0),
-                anio_construccion=anio_construccion,
-                antiguedad=antiguedad,
-                uso=datos.get('uso', ''),
-                superficie=datos.get('superficie', 0),
-                score_modernizacion=score,
-                categoria_antiguedad=categoria
-            )
-            edificios_candidatos.append(edificio)
+        edificios_candidatos = self._procesar_inmuebles(inmuebles, solo_residencial)
 
         # Generar zona caliente
         zona = self._crear_zona_caliente(
@@ -456,6 +373,46 @@ class DetectorZonasCalientes:
 
         return zona
 
+    def _obtener_inmuebles_bbox(
+        self,
+        zona_data: Dict,
+        radio_metros: int,
+        grid_size: int,
+        muestreo_adaptativo: bool,
+        presupuesto_consultas: Optional[int]
+    ) -> List[Dict]:
+        """
+        Inmuebles del Catastro en el bbox de una zona geocodificada.
+
+        Con muestreo adaptativo se refinan solo las celdas donde aparecen
+        parcelas nuevas: los barrios densos se muestrean más y el mar, el
+        puerto o los parques casi no gastan consultas.
+
+        Args:
+            zona_data: Resultado de GeocodingService.geocodificar_zona
+            radio_metros: Radio aproximado del bbox (cuadrícula fija)
+            grid_size: Lado de la cuadrícula fija / base del presupuesto
+            muestreo_adaptativo: Quadtree (True) o cuadrícula fija (False)
+            presupuesto_consultas: Máximo de puntos (por defecto grid_size², como la cuadrícula fija)
+
+        Returns:
+            Lista de inmuebles únicos por referencia catastral
+        """
+        if not muestreo_adaptativo:
+            return self.catastro.obtener_datos_area(
+                lat_centro=zona_data['latitud'],
+                lon_centro=zona_data['longitud'],
+                radio_metros=radio_metros,
+                grid_size=grid_size
+            )
+
+        lat_min, lat_max, lon_min, lon_max = [float(x) for x in zona_data['bbox']]
+        return self.catastro.obtener_datos_bbox_adaptativo(
+            lat_min, lat_max, lon_min, lon_max,
+            presupuesto_consultas=presupuesto_consultas or grid_size * grid_size,
+            grid_inicial=max(3, grid_size // 2)
+        )
+
     def comparar_zonas(self, zonas: List[ZonaCaliente]) -> List[ZonaCaliente]:
         """
         Compara y ordena zonas por potencial de modernización.
@@ -466,34 +423,130 @@ class DetectorZonasCalientes:
         Returns:
             Lista de zonas ordenadas por score (mayor a menor)
         """
-        return sorted(zonas, key=lambda z: z.score_total, reverse=True)
-
-    def _clasificar_antiguedad(self, antiguedad: int) -> str:
-        """Clasifica un edificio según su antigüedad"""
-        if antiguedad >= self.UMBRAL_MUY_ANTIGUO:
-            return "Muy antiguo (>50 años)"
-        elif antiguedad >= self.UMBRAL_ANTIGUO:
-            return "Antiguo (30-50 años)"
-        else:
-            return "Moderno (<30 años)"
+        scores = np.array([z.score_total for z in zonas], dtype=np.float64)
+        return [zonas[i] for i in np.argsort(-scores, kind='stable')]
 
-    def _calcular_score_modernizacion(self, antiguedad: int) -> float:
+    def _procesar_inmuebles(self, inmuebles: List[Dict], solo_residencial: bool) -> List[EdificioCandidato]:
         """
-        Calcula score de oportunidad de modernización.
-        Más antiguo = mayor score.
+        Añade los inmuebles al almacén y los clasifica de forma vectorizada.
+
+        Args:
+            inmuebles: Datos de CatastroService (puede haber duplicados)
+            solo_residencial: Si True, filtra solo inmuebles residenciales
+
+        Returns:
+            Edificios candidatos únicos por referencia catastral
         """
-        if antiguedad >= self.UMBRAL_MUY_ANTIGUO:
-            return self.PESO_MUY_ANTIGUO
-        elif antiguedad >= self.UMBRAL_ANTIGUO:
-            return self.PESO_ANTIGUO
-        else:
-            return self.PESO_MODERNO
+        indices = self.almacen.agregar(inmuebles)
+        logger.info(f"Total de inmuebles únicos encontrados: {len(indices)}")
+        if solo_residencial and len(indices):
+            indices = indices[self.almacen.mascara_uso(self.USOS_RESIDENCIALES, indices)]
+        return self._edificios_desde_almacen(indices)
+
+    def _edificios_desde_almacen(self, indices: np.ndarray) -> List[EdificioCandidato]:
+        """EdificioCandidato de unas filas del almacén, con categoría y score vectorizados"""
+        if len(indices) == 0:
+            return []
+
+        antiguedades = self.almacen.antiguedades(self.ANIO_ACTUAL, indices)
+        categorias = self.almacen.categorias(
+            self.ANIO_ACTUAL, self.UMBRAL_MUY_ANTIGUO, self.UMBRAL_ANTIGUO, indices
+        )
+        scores = self.almacen.scores(categorias, {
+            CATEGORIA_MUY_ANTIGUO: self.PESO_MUY_ANTIGUO,
+            CATEGORIA_ANTIGUO: self.PESO_ANTIGUO,
+            CATEGORIA_MODERNO: self.PESO_MODERNO,
+        })
+
+        columnas = self.almacen.columnas(indices)
+        return [
+            EdificioCandidato(
+                referencia_catastral=ref,
+                direccion=direccion,
+                latitud=None if np.isnan(lat) else float(lat),
+                longitud=None if np.isnan(lon) else float(lon),
+                anio_construccion=int(anio) or None,
+                antiguedad=None if np.isnan(antiguedad) else int(antiguedad),
+                uso=uso,
+                superficie=float(superficie),
+                score_modernizacion=float(score),
+                categoria_antiguedad=self.NOMBRES_CATEGORIA[int(categoria)]
+            )
+            for ref, direccion, lat, lon, anio, uso, superficie, antiguedad, score, categoria in zip(
+                columnas['referencia_catastral'], columnas['direccion'], columnas['latitud'],
+                columnas['longitud'], columnas['anio'], columnas['uso'], columnas['superficie'],
+                antiguedades, scores, categorias
+            )
+        ]
+
+    def edificios_en_radio(
+        self,
+        latitud: float,
+        longitud: float,
+        radio_metros: float,
+        solo_residencial: bool = True
+    ) -> List[EdificioCandidato]:
+        """
+        Edificios ya analizados a menos de radio_metros de un punto
+        (consulta local sobre el almacén, sin llamar al Catastro).
 
-    def _es_residencial(self, uso: str) -> bool:
-        """Determina si un inmueble es residencial"""
-        uso_lower = uso.lower()
-        residencial_keywords = ['resid', 'viviend', 'almacen', '1-', '2-']
-        return any(kw in uso_lower for kw in residencial_keywords)
+        Returns:
+            Edificios ordenados por distancia
+        """
+        indices = self.almacen.en_radio(latitud, longitud, radio_metros)
+        if solo_residencial and len(indices):
+            indices = indices[self.almacen.mascara_uso(self.USOS_RESIDENCIALES, indices)]
+        return self._edificios_desde_almacen(indices)
+
+    def edificios_cerca_de(
+        self,
+        puntos: List[Tuple[float, float]],
+        radio_metros: float,
+        solo_residencial: bool = True
+    ) -> List[EdificioCandidato]:
+        """
+        Edificios ya analizados a menos de radio_metros de alguno de los puntos,
+        p. ej. las coordenadas de nuestras instalaciones.
+        """
+        indices = self.almacen.cerca_de(puntos, radio_metros)
+        if solo_residencial and len(indices):
+            indices = indices[self.almacen.mascara_uso(self.USOS_RESIDENCIALES, indices)]
+        return self._edificios_desde_almacen(indices)
+
+    def solapamiento_zonas(self, zona_a: ZonaCaliente, zona_b: ZonaCaliente) -> List[str]:
+        """Referencias catastrales presentes en las dos zonas"""
+        comunes = self.almacen.solapamiento(
+            np.unique(self.almacen.indices_de(e.referencia_catastral for e in zona_a.edificios)),
+            np.unique(self.almacen.indices_de(e.referencia_catastral for e in zona_b.edificios))
+        )
+        return [self.almacen.referencias[i] for i in comunes]
+
+    def mapa_calor(self, zonas: Optional[List[ZonaCaliente]] = None, tamano_celda_metros: float = 200) -> List[Dict]:
+        """
+        Mapa de calor del score de modernización por celdas.
+
+        Args:
+            zonas: Zonas a incluir (por defecto todos los edificios del almacén)
+            tamano_celda_metros: Lado de la celda
+
+        Returns:
+            Lista de {'latitud', 'longitud', 'edificios', 'valor'} (valor = score sumado)
+        """
+        if zonas is None:
+            indices = np.arange(len(self.almacen))
+        else:
+            indices = np.unique(self.almacen.indices_de(
+                e.referencia_catastral for z in zonas for e in z.edificios
+            ))
+        categorias = self.almacen.categorias(
+            self.ANIO_ACTUAL, self.UMBRAL_MUY_ANTIGUO, self.UMBRAL_ANTIGUO, indices
+        )
+        scores = self.almacen.scores(categorias, {
+            CATEGORIA_MUY_ANTIGUO: self.PESO_MUY_ANTIGUO,
+            CATEGORIA_ANTIGUO: self.PESO_ANTIGUO,
+            CATEGORIA_MODERNO: self.PESO_MODERNO,
+        })
+        return self.almacen.mapa_calor(scores, indices, tamano_celda_metros)
 
     def _crear_zona_caliente(
         self,
@@ -592,7 +645,9 @@ class DetectorZonasCalientes:
                     'categoria': e.categoria_antiguedad,
                     'score': round(e.score_modernizacion, 2),
                     'uso': e.uso,
-                    'superficie': e.superficie
+                    'superficie': e.superficie,
+                    'estado_cartera': e.estado_cartera,
+                    'empresa_mantenedora': e.empresa_mantenedora
                 }
                 for e in zona.edificios
             ],
@@ -628,7 +683,9 @@ class DetectorZonasCalientes:
                 'Categoría',
                 'Score Modernización',
                 'Uso',
-                'Superficie (m²)'
+                'Superficie (m²)',
+                'Estado Cartera',
+                'Empresa Mantenedora'
             ])
 
             # Datos
@@ -643,7 +700,9 @@ class DetectorZonasCalientes:
                     e.categoria_antiguedad,
                     round(e.score_modernizacion, 2),
                     e.uso,
-                    e.superficie
+                    e.superficie,
+                    e.estado_cartera,
+                    e.empresa_mantenedora or ''
                 ])
 
         logger.info(f"Datos exportados a CSV: {ruta_archivo}")